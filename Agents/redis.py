@@ -1,27 +1,47 @@
-import redis
-import json
 import time
 from datetime import datetime
+import redis_indexed_list
+from cache_serializers import cache_serializer
 from config import REDIS_CONFIG
+from heavy_hitters import HeavyHitters
+from redis_pool import get_redis_client
+from text_normalizer import popularity_key, search_tokens
 
 # Redis连接 - 使用专门的数据库存储智能推荐
-redis_client = redis.Redis(
-    host=REDIS_CONFIG['host'], 
-    port=REDIS_CONFIG['port'], 
-    db=REDIS_CONFIG['agents_db'], 
-    decode_responses=True
-)
+redis_client = get_redis_client(REDIS_CONFIG['agents_db'])
+# 读取序列化后的二进制详情数据
+binary_redis_client = get_redis_client(REDIS_CONFIG['agents_db'], decode_responses=False)
 
 class RecommendationCache:
     """智能推荐缓存管理类"""
     
     # Redis键前缀定义
-    USER_RECOMMENDATIONS_PREFIX = "user_recommendations:"  # 用户推荐历史键前缀
+    USER_RECOMMENDATIONS_PREFIX = "user_recommendations:"  # 用户推荐历史键前缀（ZSET，成员为推荐ID）
+    USER_RECOMMENDATION_SUMMARIES_PREFIX = "user_recommendation_summaries:"  # 用户推荐摘要键前缀（HASH）
+    USER_RECOMMENDATION_STATS_PREFIX = "user_recommendation_stats:"  # 用户推荐统计键前缀（HASH）
+    USER_RECOMMENDATION_TOKENS_PREFIX = "user_recommendation_tokens:"  # 用户推荐倒排索引键前缀
+    STAT_FIELDS = ('requirement_length', 'recommendation_length', 'product_count')  # 摘要中累计到统计键的字段
     RECOMMENDATION_DETAIL_PREFIX = "recommendation_detail:"  # 推荐详情键前缀
-    POPULAR_REQUIREMENTS_KEY = "popular_requirements"  # 热门需求键
+    POPULAR_REQUIREMENTS_KEY = "popular_requirements"  # 热门需求键前缀
+    POPULAR_REQUIREMENTS = HeavyHitters(POPULAR_REQUIREMENTS_KEY, top_k=50)  # 热门需求统计（按小时衰减）
     USER_PREFERENCES_PREFIX = "user_preferences:"  # 用户偏好键前缀
     RECOMMENDATION_STATS_KEY = "recommendation_stats"  # 推荐统计键
     
+    @classmethod
+    def _list_keys(cls, user_id=None, session_id=None):
+        """用户推荐列表键、摘要键和统计键"""
+        owner = user_id or session_id or 'anonymous'
+        return (
+            f"{cls.USER_RECOMMENDATIONS_PREFIX}{owner}",
+            f"{cls.USER_RECOMMENDATION_SUMMARIES_PREFIX}{owner}",
+            f"{cls.USER_RECOMMENDATION_STATS_PREFIX}{owner}"
+        )
+    
+    @classmethod
+    def _token_prefix(cls, user_id=None, session_id=None):
+        """用户推荐倒排索引键前缀"""
+        return f"{cls.USER_RECOMMENDATION_TOKENS_PREFIX}{user_id or session_id or 'anonymous'}"
+    
     @classmethod
     def save_recommendation(cls, user_id, requirement, recommendation_text, products=None, session_id=None):
         """
@@ -39,7 +59,7 @@ class RecommendationCache:
         """
         try:
             # 生成推荐记录ID
-            recommendation_id = f"rec_{int(time.time() * 1000)}"
+            recommendation_id = redis_indexed_list.new_record_id('rec')
             current_time = datetime.now()
             timestamp = int(time.time())
             
@@ -58,47 +78,63 @@ class RecommendationCache:
                 'product_count': len(products) if products else 0
             }
             
+            # 详情、推荐列表、热门需求和统计的写入放在一个MULTI事务中，一次往返原子执行
+            pipe = redis_client.pipeline(transaction=True)
+            
             # 保存推荐详情
             detail_key = f"{cls.RECOMMENDATION_DETAIL_PREFIX}{recommendation_id}"
-            redis_client.setex(
+            pipe.setex(
                 detail_key,
                 REDIS_CONFIG['default_expire'],
-                json.dumps(recommendation_data,ensure_ascii= False)
+                cache_serializer.dumps(recommendation_data)
             )
             
-            # 添加到用户推荐列表（使用ZSET按时间排序）
-            list_key = f"{cls.USER_RECOMMENDATIONS_PREFIX}{user_id or session_id or 'anonymous'}"
+            # 添加到用户推荐列表：ZSET保存推荐ID（时间戳作为分数），摘要存入HASH
+            list_key, summaries_key, stats_key = cls._list_keys(user_id, session_id)
             
-            # 推荐简要信息，用于列表显示
+            # 推荐简要信息，用于列表显示；长度和商品数同时累计到用户推荐统计
             recommendation_summary = {
                 'recommendation_id': recommendation_id,
                 'requirement': requirement[:50] + "..." if len(requirement) > 50 else requirement,
                 'product_count': len(products) if products else 0,
                 'timestamp': timestamp,
-                'created_at': current_time.isoformat()
+                'created_at': current_time.isoformat(),
+                'requirement_length': len(requirement),
+                'recommendation_length': len(recommendation_text)
             }
             
-            # 使用ZADD添加到有序集合，时间戳作为分数
-            redis_client.zadd(
+            # 只保留最近的N条推荐，并设置列表过期时间
+            redis_indexed_list.append(
+                pipe,
                 list_key,
-                {json.dumps(recommendation_summary): timestamp}
+                summaries_key,
+                stats_key,
+                recommendation_id,
+                recommendation_summary,
+                timestamp,
+                REDIS_CONFIG['max_recommendations'],
+                REDIS_CONFIG['default_expire'],
+                cls.STAT_FIELDS
             )
             
-            # 只保留最近的N条推荐
-            redis_client.zremrangebyrank(
-                list_key, 
-                0, 
-                -(REDIS_CONFIG['max_recommendations'] + 1)
+            # 需求分词后加入用户的倒排索引，用于搜索推荐记录
+            redis_indexed_list.index_tokens(
+                pipe,
+                cls._token_prefix(user_id, session_id),
+                recommendation_id,
+                timestamp,
+                search_tokens(requirement),
+                REDIS_CONFIG['max_recommendations'],
+                REDIS_CONFIG['default_expire']
             )
             
-            # 设置用户推荐列表过期时间
-            redis_client.expire(list_key, REDIS_CONFIG['default_expire'])
-            
             # 更新热门需求统计
-            cls._update_popular_requirements(requirement)
+            cls._update_popular_requirements(requirement, pipe=pipe)
             
             # 更新推荐统计
-            cls._update_recommendation_stats()
+            cls._update_recommendation_stats(pipe=pipe)
+            
+            pipe.execute()
             
             print(f"智能推荐已保存: {recommendation_id}")
             return recommendation_id
@@ -120,10 +156,10 @@ class RecommendationCache:
         """
         try:
             detail_key = f"{cls.RECOMMENDATION_DETAIL_PREFIX}{recommendation_id}"
-            cached_data = redis_client.get(detail_key)
+            cached_data = binary_redis_client.get(detail_key)
             
             if cached_data:
-                return json.loads(cached_data)
+                return cache_serializer.loads(cached_data)
             return None
             
         except Exception as e:
@@ -144,20 +180,10 @@ class RecommendationCache:
             list: 推荐历史列表
         """
         try:
-            list_key = f"{cls.USER_RECOMMENDATIONS_PREFIX}{user_id or session_id or 'anonymous'}"
-            
-            # 按时间倒序获取推荐列表
-            recommendations = redis_client.zrevrange(list_key, 0, limit - 1)
+            list_key, summaries_key, stats_key = cls._list_keys(user_id, session_id)
             
-            recommendation_list = []
-            for rec_data in recommendations:
-                try:
-                    rec_info = json.loads(rec_data)
-                    recommendation_list.append(rec_info)
-                except json.JSONDecodeError:
-                    continue
-            
-            return recommendation_list
+            # 按时间倒序获取推荐ID，再从摘要HASH中批量读取摘要
+            return redis_indexed_list.read(redis_client, list_key, summaries_key, limit)
             
         except Exception as e:
             print(f"获取用户推荐历史失败: {str(e)}")
@@ -186,7 +212,7 @@ class RecommendationCache:
             redis_client.setex(
                 prefs_key,
                 REDIS_CONFIG['default_expire'],
-                json.dumps(preferences)
+                cache_serializer.dumps(preferences)
             )
             
             print(f"用户偏好已保存: {user_id}")
@@ -209,10 +235,10 @@ class RecommendationCache:
         """
         try:
             prefs_key = f"{cls.USER_PREFERENCES_PREFIX}{user_id}"
-            cached_data = redis_client.get(prefs_key)
+            cached_data = binary_redis_client.get(prefs_key)
             
             if cached_data:
-                return json.loads(cached_data)
+                return cache_serializer.loads(cached_data)
             return None
             
         except Exception as e:
@@ -220,25 +246,26 @@ class RecommendationCache:
             return None
     
     @classmethod
-    def _update_popular_requirements(cls, requirement):
+    def _update_popular_requirements(cls, requirement, pipe=None):
         """
         更新热门需求统计（私有方法）
         
         Args:
             requirement: 用户需求
+            pipe: 调用方的pipeline，传入时只追加命令、由调用方执行
         """
         try:
-            # 简化需求描述（去除标点符号，转为小写）
-            simplified_requirement = requirement.lower().strip()[:50]
-            
-            # 使用ZSET存储热门需求，分数为出现次数
-            redis_client.zincrby(cls.POPULAR_REQUIREMENTS_KEY, 1, simplified_requirement)
+            # 规范化、去标点和停用词，同一需求的不同说法计为同一个需求
+            requirement_key = popularity_key(requirement)
+            own_pipe = pipe is None
+            if own_pipe:
+                pipe = redis_client.pipeline(transaction=True)
             
-            # 只保留前50个热门需求
-            redis_client.zremrangebyrank(cls.POPULAR_REQUIREMENTS_KEY, 0, -51)
+            # Count-Min Sketch计数并维护本小时的前50个热门需求
+            cls.POPULAR_REQUIREMENTS.track(pipe, requirement_key, label=requirement.strip()[:100])
             
-            # 设置过期时间（30天）
-            redis_client.expire(cls.POPULAR_REQUIREMENTS_KEY, 30 * 24 * 3600)
+            if own_pipe:
+                pipe.execute()
             
         except Exception as e:
             print(f"更新热门需求失败: {str(e)}")
@@ -252,22 +279,17 @@ class RecommendationCache:
             limit: 返回数量限制
             
         Returns:
-            list: 热门需求列表，按热度排序
+            list: 热门需求列表，按最近24小时衰减加权后的次数排序
         """
         try:
-            # 按分数倒序获取热门需求
-            popular_requirements = redis_client.zrevrange(
-                cls.POPULAR_REQUIREMENTS_KEY, 
-                0, 
-                limit - 1,
-                withscores=True
-            )
+            popular_requirements = cls.POPULAR_REQUIREMENTS.top(redis_client, limit)
             
             requirements_list = []
-            for requirement, score in popular_requirements:
+            for entry in popular_requirements:
                 requirements_list.append({
-                    'requirement': requirement,
-                    'count': int(score)
+                    'requirement': entry['label'],
+                    'key': entry['item'],
+                    'count': entry['score']
                 })
             
             return requirements_list
@@ -277,23 +299,33 @@ class RecommendationCache:
             return []
     
     @classmethod
-    def _update_recommendation_stats(cls):
+    def _update_recommendation_stats(cls, pipe=None):
         """
         更新推荐统计信息（私有方法）
+        
+        Args:
+            pipe: 调用方的pipeline，传入时只追加命令、由调用方执行
         """
         try:
+            own_pipe = pipe is None
+            if own_pipe:
+                pipe = redis_client.pipeline(transaction=True)
+            
             # 增加总推荐数量
-            redis_client.hincrby(cls.RECOMMENDATION_STATS_KEY, "total_recommendations", 1)
+            pipe.hincrby(cls.RECOMMENDATION_STATS_KEY, "total_recommendations", 1)
             
             # 更新今日推荐数量
             today = datetime.now().strftime('%Y-%m-%d')
-            redis_client.hincrby(cls.RECOMMENDATION_STATS_KEY, f"daily_{today}", 1)
+            pipe.hincrby(cls.RECOMMENDATION_STATS_KEY, f"daily_{today}", 1)
             
             # 更新最后推荐时间
-            redis_client.hset(cls.RECOMMENDATION_STATS_KEY, "last_recommendation", datetime.now().isoformat())
+            pipe.hset(cls.RECOMMENDATION_STATS_KEY, "last_recommendation", datetime.now().isoformat())
             
             # 设置过期时间（30天）
-            redis_client.expire(cls.RECOMMENDATION_STATS_KEY, 30 * 24 * 3600)
+            pipe.expire(cls.RECOMMENDATION_STATS_KEY, 30 * 24 * 3600)
+            
+            if own_pipe:
+                pipe.execute()
             
         except Exception as e:
             print(f"更新推荐统计失败: {str(e)}")
@@ -349,25 +381,19 @@ class RecommendationCache:
             list: 匹配的推荐记录
         """
         try:
-            # 获取用户所有推荐
-            recommendations = cls.get_user_recommendations(user_id, session_id, 50)
-            
             if not keyword:
-                return recommendations[:limit]
-            
-            # 简单的关键词匹配
-            matched_recommendations = []
-            keyword_lower = keyword.lower()
+                return cls.get_user_recommendations(user_id, session_id, limit)
             
-            for rec in recommendations:
-                if (keyword_lower in rec.get('requirement', '').lower() and 
-                    len(matched_recommendations) < limit):
-                    matched_recommendations.append(rec)
-                
-                if len(matched_recommendations) >= limit:
-                    break
-            
-            return matched_recommendations
+            # 关键词分词后与倒排索引求交集，返回包含全部词的推荐记录，按时间倒序
+            list_key, summaries_key, _ = cls._list_keys(user_id, session_id)
+            return redis_indexed_list.search(
+                redis_client,
+                list_key,
+                summaries_key,
+                cls._token_prefix(user_id, session_id),
+                search_tokens(keyword),
+                limit
+            )
             
         except Exception as e:
             print(f"搜索推荐记录失败: {str(e)}")
@@ -387,22 +413,13 @@ class RecommendationCache:
             bool: 删除是否成功
         """
         try:
-            # 删除推荐详情
-            detail_key = f"{cls.RECOMMENDATION_DETAIL_PREFIX}{recommendation_id}"
-            redis_client.delete(detail_key)
+            list_key, summaries_key, stats_key = cls._list_keys(user_id, session_id)
             
-            # 从用户推荐列表中移除（需要遍历找到匹配的记录）
-            list_key = f"{cls.USER_RECOMMENDATIONS_PREFIX}{user_id or session_id or 'anonymous'}"
-            recommendations = redis_client.zrange(list_key, 0, -1)
-            
-            for rec_data in recommendations:
-                try:
-                    rec_info = json.loads(rec_data)
-                    if rec_info.get('recommendation_id') == recommendation_id:
-                        redis_client.zrem(list_key, rec_data)
-                        break
-                except json.JSONDecodeError:
-                    continue
+            # 删除推荐详情，并按推荐ID从列表和摘要中移除，一次往返
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.unlink(f"{cls.RECOMMENDATION_DETAIL_PREFIX}{recommendation_id}")
+            redis_indexed_list.remove(pipe, list_key, summaries_key, stats_key, recommendation_id, cls.STAT_FIELDS)
+            pipe.execute()
             
             print(f"推荐记录已删除: {recommendation_id}")
             return True
@@ -424,26 +441,17 @@ class RecommendationCache:
             bool: 清空是否成功
         """
         try:
-            list_key = f"{cls.USER_RECOMMENDATIONS_PREFIX}{user_id or session_id or 'anonymous'}"
-            
-            # 获取所有推荐ID并删除详情
-            recommendations = redis_client.zrange(list_key, 0, -1)
-            for rec_data in recommendations:
-                try:
-                    rec_info = json.loads(rec_data)
-                    recommendation_id = rec_info.get('recommendation_id')
-                    if recommendation_id:
-                        detail_key = f"{cls.RECOMMENDATION_DETAIL_PREFIX}{recommendation_id}"
-                        redis_client.delete(detail_key)
-                except json.JSONDecodeError:
-                    continue
-            
-            # 删除推荐列表
-            redis_client.delete(list_key)
-            
-            # 清除用户偏好
+            list_key, summaries_key, stats_key = cls._list_keys(user_id, session_id)
             prefs_key = f"{cls.USER_PREFERENCES_PREFIX}{user_id or session_id or 'anonymous'}"
-            redis_client.delete(prefs_key)
+            
+            # 只读取推荐ID和索引词，详情、列表、摘要、统计、倒排索引和用户偏好批量UNLINK
+            recommendation_ids = redis_indexed_list.member_ids(redis_client, list_key)
+            detail_keys = [f"{cls.RECOMMENDATION_DETAIL_PREFIX}{recommendation_id}" for recommendation_id in recommendation_ids]
+            token_keys = redis_indexed_list.token_index_keys(redis_client, cls._token_prefix(user_id, session_id))
+            
+            pipe = redis_client.pipeline(transaction=False)
+            redis_indexed_list.unlink(pipe, detail_keys + token_keys + [list_key, summaries_key, stats_key, prefs_key])
+            pipe.execute()
             
             print(f"用户推荐记录已清空: {user_id or session_id or 'anonymous'}")
             return True
@@ -465,37 +473,18 @@ class RecommendationCache:
             dict: 统计信息
         """
         try:
-            list_key = f"{cls.USER_RECOMMENDATIONS_PREFIX}{user_id or session_id or 'anonymous'}"
-            
-            # 获取推荐数量
-            total_recommendations = redis_client.zcard(list_key)
-            
-            # 获取最近的推荐
-            recent_recommendations = redis_client.zrevrange(list_key, 0, 9)
-            
-            # 统计详细信息
-            total_requirements = 0
-            total_responses = 0
-            total_products = 0
-            
-            for rec_data in recent_recommendations:
-                try:
-                    rec_info = json.loads(rec_data)
-                    recommendation_id = rec_info.get('recommendation_id')
-                    if recommendation_id:
-                        detail = cls.get_recommendation_detail(recommendation_id)
-                        if detail:
-                            total_requirements += detail.get('requirement_length', 0)
-                            total_responses += detail.get('recommendation_length', 0)
-                            total_products += detail.get('product_count', 0)
-                except json.JSONDecodeError:
-                    continue
+            list_key, _, stats_key = cls._list_keys(user_id, session_id)
+            
+            # 推荐数量和各项累计值在保存/删除时已更新，一次往返读取
+            total_recommendations, totals = redis_indexed_list.stats(
+                redis_client, list_key, stats_key, cls.STAT_FIELDS
+            )
             
             return {
                 'total_recommendations': total_recommendations,
-                'total_requirement_chars': total_requirements,
-                'total_response_chars': total_responses,
-                'total_recommended_products': total_products,
+                'total_requirement_chars': totals['requirement_length'],
+                'total_response_chars': totals['recommendation_length'],
+                'total_recommended_products': totals['product_count'],
                 'user_id': user_id or session_id or 'anonymous'
             }
             
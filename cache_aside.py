@@ -0,0 +1,163 @@
+"""
+防击穿的旁路缓存（cache-aside）
+- 单飞锁：缓存缺失或需要刷新时，只有拿到锁（SET NX PX）的请求重新计算，其他请求不访问数据库
+- 提前刷新（XFetch）：临近过期时按概率提前重新计算，计算越慢、越接近过期，提前的概率越大
+- 过期后仍可用（stale-while-revalidate）：逻辑过期后在 stale_ttl 内继续返回旧值，同时由一个请求刷新
+
+缓存值连同计算耗时和逻辑过期时间一起序列化保存，Redis中的物理过期时间为 ttl + stale_ttl。
+Redis不可用时直接计算并返回，不影响业务。
+"""
+import logging
+import math
+import random
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+from cache_serializers import cache_serializer
+from config import REDIS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 只删除自己持有的锁
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class CacheAside:
+    """带单飞锁和提前刷新的旁路缓存"""
+
+    LOCK_SUFFIX = ":lock"
+
+    def __init__(self, client, ttl: int, stale_ttl: int = None, beta: float = None,
+                 lock_timeout_ms: int = None, wait_seconds: float = None, poll_seconds: float = 0.05,
+                 default: Optional[Callable] = None):
+        """
+        Args:
+            client: decode_responses=False 的Redis客户端
+            ttl: 逻辑过期秒数
+            stale_ttl: 逻辑过期后仍可返回旧值的秒数
+            beta: XFetch 提前刷新系数，越大越倾向提前刷新，0 表示不提前
+            lock_timeout_ms: 刷新锁的最长持有时间，应大于一次计算的耗时
+            wait_seconds: 缓存缺失且未拿到锁时，等待其他请求写入缓存的最长时间
+            poll_seconds: 等待期间检查缓存的间隔
+            default: 序列化无法直接处理的对象时使用的转换函数
+        """
+        config = REDIS_CONFIG['cache_aside']
+        self.client = client
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl if stale_ttl is not None else config['stale_ttl']
+        self.beta = beta if beta is not None else config['beta']
+        self.lock_timeout_ms = lock_timeout_ms or config['lock_timeout_ms']
+        self.wait_seconds = wait_seconds if wait_seconds is not None else config['wait_seconds']
+        self.poll_seconds = poll_seconds
+        self.default = default
+
+    def _read(self, key: str) -> Optional[dict]:
+        """读取缓存条目 {'value', 'delta', 'expires_at'}，缺失或格式不符时返回None"""
+        data = self.client.get(key)
+        if not data:
+            return None
+        entry = cache_serializer.loads(data)
+        if not isinstance(entry, dict) or 'expires_at' not in entry:
+            # 引入本模块之前写入的旧格式缓存，视为缺失
+            return None
+        return entry
+
+    def _should_refresh(self, entry: dict, now: float) -> bool:
+        """XFetch：now - delta × beta × ln(rand) 越过逻辑过期时间时刷新"""
+        return now - entry['delta'] * self.beta * math.log(1.0 - random.random()) >= entry['expires_at']
+
+    def _acquire(self, key: str) -> Optional[str]:
+        token = uuid.uuid4().hex
+        if self.client.set(f"{key}{self.LOCK_SUFFIX}", token, nx=True, px=self.lock_timeout_ms):
+            return token
+        return None
+
+    def _release(self, key: str, token: str):
+        try:
+            self.client.eval(RELEASE_LOCK_SCRIPT, 1, f"{key}{self.LOCK_SUFFIX}", token)
+        except Exception as e:
+            logger.warning(f"释放缓存刷新锁失败 {key}: {e}")
+
+    def _compute_and_store(self, key: str, compute: Callable[[], Any]) -> Any:
+        start = time.time()
+        value = compute()
+        self.set(key, value, delta=time.time() - start)
+        return value
+
+    def set(self, key: str, value: Any, delta: float = 0.0) -> bool:
+        """写入缓存
+
+        Args:
+            delta: 计算该值的耗时（秒），用于 XFetch 提前刷新
+        """
+        try:
+            entry = {'value': value, 'delta': delta, 'expires_at': time.time() + self.ttl}
+            self.client.set(
+                key,
+                cache_serializer.dumps(entry, default=self.default),
+                ex=self.ttl + self.stale_ttl
+            )
+            return True
+        except Exception as e:
+            logger.warning(f"写入缓存失败 {key}: {e}")
+            return False
+
+    def peek(self, key: str) -> Any:
+        """只读取缓存值（包括已逻辑过期的旧值），不触发计算"""
+        try:
+            entry = self._read(key)
+        except Exception as e:
+            logger.warning(f"读取缓存失败 {key}: {e}")
+            return None
+        return entry['value'] if entry else None
+
+    def get(self, key: str, compute: Callable[[], Any]) -> Any:
+        """读取缓存，缺失或需要刷新时由单个请求调用 compute 重新计算"""
+        try:
+            entry = self._read(key)
+        except Exception as e:
+            logger.warning(f"读取缓存失败 {key}: {e}")
+            return compute()
+
+        if entry is not None and not self._should_refresh(entry, time.time()):
+            return entry['value']
+
+        try:
+            token = self._acquire(key)
+        except Exception as e:
+            logger.warning(f"获取缓存刷新锁失败 {key}: {e}")
+            return entry['value'] if entry is not None else compute()
+
+        if token is not None:
+            try:
+                return self._compute_and_store(key, compute)
+            finally:
+                self._release(key, token)
+
+        # 其他请求正在刷新：有旧值时直接返回旧值
+        if entry is not None:
+            return entry['value']
+
+        # 缓存缺失：等待持有锁的请求写入，超时后自行计算（不写入缓存）
+        deadline = time.time() + self.wait_seconds
+        while time.time() < deadline:
+            time.sleep(self.poll_seconds)
+            value = self.peek(key)
+            if value is not None:
+                return value
+        return compute()
+
+    def invalidate(self, key: str) -> bool:
+        """删除缓存"""
+        try:
+            self.client.unlink(key)
+            return True
+        except Exception as e:
+            logger.warning(f"删除缓存失败 {key}: {e}")
+            return False
@@ -0,0 +1,153 @@
+"""
+缓存值序列化
+各缓存模块写入Redis的详情类数据（对话详情、推荐详情、商品详情等）通过 cache_serializer 编码为紧凑的二进制格式，
+超过阈值的数据再压缩。序列化库和压缩算法可配置（REDIS_CONFIG['serialization']），未安装时自动降级。
+
+编码格式：
+    第1字节  格式版本（FORMAT_VERSION）
+    第2字节  高4位为序列化器编号，低4位为压缩算法编号
+    其余     序列化（及压缩）后的数据
+
+旧版本写入的是JSON文本，首字节不会是版本号，读取时按JSON解析，新旧数据可以共存。
+读取二进制数据需要使用 decode_responses=False 的Redis客户端。
+"""
+import json
+import logging
+import zlib
+from typing import Any, Callable, Optional, Union
+
+from config import REDIS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+FORMAT_VERSION = 1
+
+SERIALIZER_IDS = {'json': 0, 'orjson': 1, 'msgpack': 2}
+COMPRESSION_IDS = {'none': 0, 'zlib': 1, 'zstd': 2}
+
+
+def available_serializers():
+    """当前环境可用的序列化器"""
+    names = ['json']
+    if orjson is not None:
+        names.append('orjson')
+    if msgpack is not None:
+        names.append('msgpack')
+    return names
+
+
+def available_compressions():
+    """当前环境可用的压缩算法"""
+    names = ['none', 'zlib']
+    if zstandard is not None:
+        names.append('zstd')
+    return names
+
+
+class CacheSerializer:
+    """带版本头的缓存值序列化器"""
+
+    def __init__(self, serializer: str = 'msgpack', compression: str = 'zstd',
+                 compress_threshold: int = 1024, compress_level: int = 3):
+        """
+        Args:
+            serializer: msgpack / orjson / json，未安装时依次降级
+            compression: zstd / zlib / none，zstandard 未安装时降级为 zlib
+            compress_threshold: 序列化后超过该字节数才压缩
+            compress_level: 压缩级别
+        """
+        if serializer not in SERIALIZER_IDS:
+            raise ValueError(f"未知的序列化器: {serializer}")
+        if compression not in COMPRESSION_IDS:
+            raise ValueError(f"未知的压缩算法: {compression}")
+
+        if serializer not in available_serializers():
+            fallback = 'orjson' if orjson is not None else 'json'
+            logger.warning(f"序列化器 {serializer} 未安装，降级为 {fallback}")
+            serializer = fallback
+        if compression not in available_compressions():
+            logger.warning(f"压缩算法 {compression} 未安装，降级为 zlib")
+            compression = 'zlib'
+
+        self.serializer = serializer
+        self.compression = compression
+        self.compress_threshold = compress_threshold
+        self.compress_level = compress_level
+
+    @classmethod
+    def from_config(cls) -> 'CacheSerializer':
+        return cls(**REDIS_CONFIG['serialization'])
+
+    def _serialize(self, value: Any, default: Optional[Callable]) -> bytes:
+        if self.serializer == 'msgpack':
+            return msgpack.packb(value, use_bin_type=True, default=default)
+        if self.serializer == 'orjson':
+            return orjson.dumps(value, default=default, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=default).encode('utf-8')
+
+    def _compress(self, data: bytes) -> bytes:
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=self.compress_level).compress(data)
+        return zlib.compress(data, self.compress_level)
+
+    def dumps(self, value: Any, default: Optional[Callable] = None) -> bytes:
+        """
+        编码缓存值
+
+        Args:
+            value: 可JSON化的数据
+            default: 无法直接序列化的对象的转换函数（如 DjangoJSONEncoder().default）
+        """
+        data = self._serialize(value, default)
+        compression = 'none'
+        if self.compression != 'none' and len(data) > self.compress_threshold:
+            compressed = self._compress(data)
+            if len(compressed) < len(data):
+                data, compression = compressed, self.compression
+
+        header = bytes((FORMAT_VERSION, SERIALIZER_IDS[self.serializer] << 4 | COMPRESSION_IDS[compression]))
+        return header + data
+
+    @staticmethod
+    def loads(data: Union[bytes, str]) -> Any:
+        """解码缓存值，兼容旧版本的JSON文本"""
+        if isinstance(data, str):
+            return json.loads(data)
+        if len(data) < 2 or data[0] != FORMAT_VERSION:
+            return json.loads(data)
+
+        serializer_id, compression_id = data[1] >> 4, data[1] & 0x0F
+        payload = data[2:]
+        if compression_id == COMPRESSION_IDS['zlib']:
+            payload = zlib.decompress(payload)
+        elif compression_id == COMPRESSION_IDS['zstd']:
+            if zstandard is None:
+                raise RuntimeError("缓存数据使用zstd压缩，但未安装zstandard")
+            payload = zstandard.ZstdDecompressor().decompress(payload)
+
+        if serializer_id == SERIALIZER_IDS['msgpack']:
+            if msgpack is None:
+                raise RuntimeError("缓存数据使用msgpack编码，但未安装msgpack")
+            return msgpack.unpackb(payload, raw=False)
+        if serializer_id == SERIALIZER_IDS['orjson']:
+            return orjson.loads(payload) if orjson is not None else json.loads(payload)
+        return json.loads(payload)
+
+
+# 全局序列化器实例
+cache_serializer = CacheSerializer.from_config()
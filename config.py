@@ -16,6 +16,13 @@ API_CONFIG = {
     'embedding_model': "text-embedding-v3",
 }
 
+# 各嵌入模型的默认输出维度，用于校验ES向量字段配置
+EMBEDDING_MODEL_DIMS = {
+    'text-embedding-v1': 1536,
+    'text-embedding-v2': 1536,
+    'text-embedding-v3': 1024,
+}
+
 # Agent配置
 AGENT_CONFIG = {
     'max_iterations': 10,  # 增加最大迭代次数
@@ -30,6 +37,13 @@ RAG_CONFIG = {
     'retriever_k': 5,
     'vector_store_path': "./chroma_product_knowledge",
     'enable_external_db': False,  # 默认禁用外部数据库
+    'batch_max_questions': 20,  # 批量问答接口单次最多问题数
+    'batch_max_concurrency': 4,  # 批量问答时同时进行的大模型生成数量
+    'query_embedding_cache_size': 10000,  # 进程内缓存的问题向量数量
+    'query_embedding_cache_ttl': 7 * 24 * 3600,  # Redis中问题向量的过期时间
+    'popular_questions_by_cluster': True,  # ES后端下热门问题按问题聚类（意图）统计，否则按规范化问题文本
+    'answer_cache_ttl': 1800,  # 热门问题预热答案的过期时间
+    'answer_cache_warmup_size': 20,  # 预热答案的热门问题数量
 }
 
 # 数据库配置
@@ -54,11 +68,58 @@ API_ENDPOINTS = {
 REDIS_CONFIG = {
     'host': 'localhost',
     'port': 6379,
+    'password': None,
+    'product_db': 0,  # 商品缓存数据库
+    'users_db': 1,    # 用户行为缓存数据库
     'rag_db': 2,      # RAG对话存储数据库
     'agents_db': 3,   # 智能推荐存储数据库
+    # 连接池（见 redis_pool.py），每个逻辑库一个池
+    'pool': {
+        'max_connections': 50,  # 每个池的最大连接数，用尽时等待 pool_timeout 秒
+        'pool_timeout': 2,
+        'socket_timeout': 3,  # 读写超时，需大于阻塞命令（如 XREADGROUP BLOCK）的阻塞时间
+        'socket_connect_timeout': 1,
+        'health_check_interval': 30,  # 连接空闲超过该秒数后使用前先PING
+        'retries': 2,  # 连接错误/超时的重试次数
+        'backoff_base': 0.05,  # 指数退避的初始等待秒数
+        'backoff_cap': 0.5,  # 指数退避的最大等待秒数
+    },
     'default_expire': 7 * 24 * 3600,  # 默认过期时间：7天
     'max_conversations': 50,  # 每个用户最多保存的对话数量
     'max_recommendations': 20,  # 每个用户最多保存的推荐记录数量
+    # 缓存值序列化（见 cache_serializers.py），依赖未安装时自动降级为 orjson/json、zlib
+    'serialization': {
+        'serializer': 'msgpack',  # msgpack / orjson / json
+        'compression': 'zstd',  # zstd / zlib / none
+        'compress_threshold': 1024,  # 序列化后超过该字节数才压缩
+        'compress_level': 3,
+    },
+    # 热门问题/需求统计（见 heavy_hitters.py），按小时分桶、指数衰减合并
+    'heavy_hitters': {
+        'width': 1024,  # Count-Min Sketch 每行计数器数，每个桶占用 width × depth × 4 字节
+        'depth': 4,
+        'bucket_seconds': 3600,
+        'window_buckets': 24,  # 查询时合并最近24小时
+        'half_life_buckets': 6,  # 6小时前的流量权重减半
+    },
+    # 旁路缓存防击穿（见 cache_aside.py）：单飞锁 + 提前刷新 + 过期后短时间内返回旧值
+    'cache_aside': {
+        'stale_ttl': 300,  # 逻辑过期后仍可返回旧值的秒数
+        'beta': 1.0,  # XFetch 提前刷新系数，0 表示不提前刷新
+        'lock_timeout_ms': 10000,  # 刷新锁最长持有时间，应大于一次重新计算的耗时
+        'wait_seconds': 2.0,  # 冷启动未拿到锁时等待其他请求写入缓存的最长时间
+    },
+}
+
+# 索引同步配置：模型变更事件写入Redis Stream，由 run_index_sync 消费后增量更新各索引与缓存
+INDEX_SYNC_CONFIG = {
+    'enabled': True,  # 关闭后信号不再写入变更事件
+    'stream': 'index_sync:events',  # 存放在 REDIS_CONFIG['rag_db']
+    'group': 'index_sync',
+    'stream_maxlen': 100000,  # Stream近似保留的最大事件数
+    'debounce_seconds': 2,  # 同一商品在该时间内没有新事件才执行同步，合并连续编辑
+    'max_delay_seconds': 30,  # 持续编辑时，距首个事件超过该时间也强制同步
+    'claim_idle_seconds': 300,  # 未确认超过该时间的事件（消费者崩溃或同步失败）会被重新领取
 }
 
 # Elasticsearch配置
@@ -76,7 +137,43 @@ ELASTICSEARCH_CONFIG = {
         'products': 'rag_products_index',
         'knowledge': 'rag_knowledge_index',
         'conversations': 'rag_conversations_index'
-    }
+    },
+    # 向量字段配置，dims需与嵌入模型输出维度一致（启动时校验）
+    'vector': {
+        'dims': 1024,  # text-embedding-v3 默认输出1024维
+        'similarity': 'cosine',
+        'index_options': {
+            'type': 'int8_hnsw',  # 可选: hnsw, int8_hnsw, flat, int8_flat
+            'm': 16,
+            'ef_construction': 100,
+        },
+        'num_candidates': 100,  # kNN搜索时每个分片的候选数量，不小于k
+    },
+    # 异步客户端（AsyncElasticsearchService）连接池
+    'async_pool': {
+        'connections_per_node': 20,  # 每个节点的最大并发连接数，按异步worker的并发请求量设置
+        'request_timeout': 10,
+    },
+    # 对话索引分区：通过写别名写入按月（或按天）创建的分区索引，按大小/时间滚动，超期删除
+    'conversation_partitions': {
+        'prefix': 'rag_conversations',  # 分区索引名前缀，分区名如 rag_conversations-2025.09-000001
+        'date_format': 'yyyy.MM',  # 分区名中的日期格式，按天分区用 yyyy.MM.dd
+        'rollover_max_age': '30d',
+        'rollover_max_primary_shard_size': '5gb',
+        'retention_days': 180,  # 超过该天数的分区被删除
+        'compact_after_days': 30,  # 超过该天数的分区合并段并设为只读
+        'recent_partitions': 3,  # 相似问题默认只检索最近N个分区
+    },
+    # 相似问题聚类：问题向量按余弦相似度在线聚类，相似问题查询只检索聚类中心表
+    'question_clusters': {
+        'assign_threshold': 0.88,  # 与最近中心相似度不低于该值时并入该聚类，否则新建聚类
+        'min_similarity': 0.6,  # 相似问题查询返回的聚类最低相似度
+        'refine_iterations': 2,  # 离线重建时在单遍聚类后追加的k-means细化轮数
+        'max_phrasings': 20,  # 每个聚类保留的高频原始问法数量
+        'max_clusters': 5000,  # 聚类数量上限，达到上限后增量聚类不再新建聚类，等待离线重建
+    },
+    # 文本字段额外使用的分词插件：None 或 'jieba'（需安装 elasticsearch-analysis-jieba）
+    'analysis_plugin': None,
 }
 
 # 系统配置
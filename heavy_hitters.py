@@ -0,0 +1,139 @@
+"""
+热门条目统计（Heavy Hitters）
+按小时分桶，每个桶包含：
+- {前缀}:cms:{桶号}  STRING  Count-Min Sketch，depth × width 个 u32 计数器（BITFIELD）
+- {前缀}:top:{桶号}  ZSET    该小时估计次数最高的 top_k 个条目，分数为 Count-Min 估计值
+- {前缀}:labels:{桶号} HASH   top_k 条目 -> 展示文本（条目是规范化键或聚类ID时，保存一条原始问法）
+
+新条目即使暂时进不了 top_k，计数也保留在 Sketch 中，估计值超过当前最低分时即可替换进入，
+不会像固定容量ZSET那样一出现就被截断。查询时把最近 window_buckets 个桶按指数衰减加权合并，
+旧流量的权重随时间下降，每个统计项占用的内存固定。
+"""
+import hashlib
+import time
+from typing import Dict, List
+
+from config import REDIS_CONFIG
+
+# 计数并维护该小时的 top_k；KEYS: Sketch键、top键、展示文本键；ARGV: 条目、top_k、过期秒数、展示文本、各行计数器下标
+TRACK_SCRIPT = """
+local cms_key, top_key, labels_key = KEYS[1], KEYS[2], KEYS[3]
+local item, top_k, ttl, label = ARGV[1], tonumber(ARGV[2]), tonumber(ARGV[3]), ARGV[4]
+local ops = {'OVERFLOW', 'SAT'}
+for i = 5, #ARGV do
+    table.insert(ops, 'INCRBY')
+    table.insert(ops, 'u32')
+    table.insert(ops, '#' .. ARGV[i])
+    table.insert(ops, 1)
+end
+local counts = redis.call('BITFIELD', cms_key, unpack(ops))
+local estimate = counts[1]
+for i = 2, #counts do
+    if counts[i] < estimate then
+        estimate = counts[i]
+    end
+end
+local admitted = false
+if redis.call('ZSCORE', top_key, item) or redis.call('ZCARD', top_key) < top_k then
+    admitted = true
+else
+    local lowest = redis.call('ZRANGE', top_key, 0, 0, 'WITHSCORES')
+    if estimate > tonumber(lowest[2]) then
+        redis.call('ZREM', top_key, lowest[1])
+        redis.call('HDEL', labels_key, lowest[1])
+        admitted = true
+    end
+end
+if admitted then
+    redis.call('ZADD', top_key, estimate, item)
+    if label ~= '' then
+        redis.call('HSET', labels_key, item, label)
+    end
+end
+redis.call('EXPIRE', cms_key, ttl)
+redis.call('EXPIRE', top_key, ttl)
+redis.call('EXPIRE', labels_key, ttl)
+return estimate
+"""
+
+
+class HeavyHitters:
+    """带时间衰减的热门条目统计"""
+
+    def __init__(self, prefix: str, top_k: int, width: int = None, depth: int = None,
+                 bucket_seconds: int = None, window_buckets: int = None, half_life_buckets: float = None):
+        """
+        Args:
+            prefix: Redis键前缀
+            top_k: 每个桶保留的热门条目数
+            width/depth: Count-Min Sketch 每行计数器数和行数
+            bucket_seconds: 每个桶的时长
+            window_buckets: 查询时合并的桶数
+            half_life_buckets: 权重减半所经过的桶数
+        """
+        config = REDIS_CONFIG['heavy_hitters']
+        self.prefix = prefix
+        self.top_k = top_k
+        self.width = width or config['width']
+        self.depth = depth or config['depth']
+        self.bucket_seconds = bucket_seconds or config['bucket_seconds']
+        self.window_buckets = window_buckets or config['window_buckets']
+        self.half_life_buckets = half_life_buckets or config['half_life_buckets']
+
+    def _bucket(self, now: float = None) -> int:
+        return int((now if now is not None else time.time()) // self.bucket_seconds)
+
+    def _keys(self, bucket: int):
+        return f"{self.prefix}:cms:{bucket}", f"{self.prefix}:top:{bucket}", f"{self.prefix}:labels:{bucket}"
+
+    def _positions(self, item: str) -> List[int]:
+        """条目在每一行中的计数器下标（双重哈希），按 u32 计数器编号"""
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [row * self.width + (h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def track(self, pipe, item: str, label: str = '', now: float = None):
+        """在pipeline中记录一次出现
+
+        Args:
+            item: 统计的条目（如规范化后的问题键）
+            label: 条目进入 top_k 时保存的展示文本，为空时展示条目本身
+        """
+        keys = self._keys(self._bucket(now))
+        ttl = self.bucket_seconds * (self.window_buckets + 1)
+        pipe.eval(TRACK_SCRIPT, 3, *keys, item, self.top_k, ttl, label or '', *self._positions(item))
+
+    def weights(self, now: float = None) -> Dict[str, float]:
+        """最近 window_buckets 个桶的 top键 -> 衰减权重（当前桶为1）"""
+        current = self._bucket(now)
+        decay = 0.5 ** (1 / self.half_life_buckets)
+        return {self._keys(current - age)[1]: decay ** age for age in range(self.window_buckets)}
+
+    def top(self, client, limit: int, now: float = None) -> List[Dict]:
+        """按衰减加权后的次数返回最热门的 limit 个条目
+
+        ZUNION 合并各桶，展示文本按从新到旧的桶查找，共两次往返。
+        """
+        weights = self.weights(now)
+        merged = client.zunion(weights, withscores=True)
+        merged.sort(key=lambda pair: pair[1], reverse=True)
+        merged = merged[:limit]
+        if not merged:
+            return []
+
+        items = [item for item, _ in merged]
+        current = self._bucket(now)
+        pipe = client.pipeline(transaction=False)
+        for age in range(self.window_buckets):
+            pipe.hmget(self._keys(current - age)[2], items)
+        labels = {}
+        for bucket_labels in pipe.execute():
+            for item, label in zip(items, bucket_labels):
+                if label and item not in labels:
+                    labels[item] = label
+
+        return [
+            {'item': item, 'label': labels.get(item, item), 'score': round(score, 2)}
+            for item, score in merged
+        ]
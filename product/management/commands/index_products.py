@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from product.search import ProductSearchIndex
+
+class Command(BaseCommand):
+    help = '同步商品数据到Elasticsearch商品索引（默认按updated_at增量同步）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='全量构建：写入新版本索引后原子切换别名',
+        )
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='增量同步的起始时间（ISO格式），默认取索引中最新的updated_at',
+        )
+        parser.add_argument(
+            '--prune',
+            action='store_true',
+            help='增量同步后遍历索引，删除数据库中已不存在的商品（变更事件丢失时补偿）',
+        )
+
+    def handle(self, *args, **options):
+        if options['full']:
+            self.stdout.write('开始全量构建商品索引...')
+            result = ProductSearchIndex.full_build()
+            if result['success']:
+                self.stdout.write(
+                    self.style.SUCCESS(f'商品索引构建成功: {result["actual_count"]} 条 -> {result["index"]}')
+                )
+            else:
+                self.stdout.write(self.style.ERROR(f'商品索引构建失败: {result.get("error")}'))
+            return
+        
+        self.stdout.write('开始增量同步商品索引...')
+        result = ProductSearchIndex.incremental_update(since=options.get('since'), prune=options['prune'])
+        if result['success']:
+            self.stdout.write(
+                self.style.SUCCESS(f'商品索引增量同步成功: 写入 {result["indexed"]} 条，删除 {result["deleted"]} 条 (since={result["since"]})')
+            )
+        else:
+            self.stdout.write(self.style.ERROR(f'商品索引增量同步失败: {result.get("error")}'))
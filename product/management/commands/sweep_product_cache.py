@@ -0,0 +1,22 @@
+"""
+Django管理命令：回收旧代数的商品详情缓存键
+用法: python manage.py sweep_product_cache [--batch-size 500] [--pause 0.01]
+
+清空全部商品缓存（ProductCache.clear_product_cache）只切换代数，旧代数的键由后台线程回收；
+进程在回收完成前退出时，可用本命令补充回收，也可定期执行。
+"""
+from django.core.management.base import BaseCommand
+
+from product.redis import ProductCache
+
+
+class Command(BaseCommand):
+    help = '分批 SCAN + UNLINK 回收旧代数的商品详情缓存键'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ProductCache.SWEEP_BATCH_SIZE, help='每批SCAN的键数')
+        parser.add_argument('--pause', type=float, default=ProductCache.SWEEP_PAUSE_SECONDS, help='批次之间暂停的秒数')
+
+    def handle(self, *args, **options):
+        removed = ProductCache.sweep_stale_details(options['batch_size'], options['pause'])
+        self.stdout.write(self.style.SUCCESS(f"✅ 已回收 {removed} 个旧商品详情缓存键"))
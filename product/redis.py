@@ -1,52 +1,94 @@
-import redis
-import json
+import threading
+import time
 from django.conf import settings
 from django.core.serializers.json import DjangoJSONEncoder
 from .models import Products
+from cache_aside import CacheAside
+from cache_serializers import cache_serializer
+from config import REDIS_CONFIG
+from redis_pool import get_redis_client
 
 # Redis连接
-redis_client = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
+redis_client = get_redis_client(REDIS_CONFIG['product_db'])
+# 读取序列化后的二进制缓存数据
+binary_redis_client = get_redis_client(REDIS_CONFIG['product_db'], decode_responses=False)
+
+# 商品数据中Decimal、日期等类型的转换
+_json_default = DjangoJSONEncoder().default
+
+# 热门商品列表：逻辑过期30分钟，单个请求重新查询，其他请求返回旧值或等待
+hot_products_cache = CacheAside(binary_redis_client, ttl=1800, default=_json_default)
 
 class ProductCache:
-    """商品缓存管理类"""
+    """商品缓存管理类
+    
+    商品详情键为 product_detail:{代数}:{商品ID}。清空全部商品缓存时只把代数加1，
+    旧代数的键不再被读取，由后台清理线程（或 sweep_product_cache 命令）SCAN + UNLINK 分批回收，
+    不使用 KEYS 或一次性大批量 DELETE 阻塞Redis。
+    """
     
     HOT_PRODUCTS_KEY = "hot_products"  # 热门商品缓存键
     PRODUCT_DETAIL_PREFIX = "product_detail:"  # 商品详情缓存键前缀
+    GENERATION_KEY = "product_cache:generation"  # 商品详情缓存代数
+    GENERATION_CACHE_SECONDS = 1  # 进程内缓存代数的时间，其他进程清空缓存后最多延迟该时间生效
+    SWEEP_BATCH_SIZE = 500  # 每批SCAN/UNLINK的键数
+    SWEEP_PAUSE_SECONDS = 0.01  # 批次之间的间隔，给其他客户端让出Redis
+    
+    _generation = {'value': None, 'expires_at': 0}
+    _sweeper = None
+    _sweeper_lock = threading.Lock()
+    
+    @staticmethod
+    def product_data(product):
+        """商品缓存数据"""
+        return {
+            'id': product.id,
+            'product_id': product.product_id,
+            'name': product.name,
+            'price': float(product.price),
+            'category': product.category,
+            'brand': product.brand,
+            'specifications': product.specifications,
+            'description': product.description,
+            'stock': product.stock,
+            'is_hot': product.is_hot,
+            'updated_at': product.updated_at.isoformat()
+        }
+    
+    @classmethod
+    def _current_generation(cls):
+        """当前商品详情缓存代数（进程内缓存 GENERATION_CACHE_SECONDS 秒）"""
+        if time.time() < cls._generation['expires_at']:
+            return cls._generation['value']
+        value = int(redis_client.get(cls.GENERATION_KEY) or 0)
+        cls._generation = {'value': value, 'expires_at': time.time() + cls.GENERATION_CACHE_SECONDS}
+        return value
+    
+    @classmethod
+    def _detail_key(cls, product_id):
+        return f"{cls.PRODUCT_DETAIL_PREFIX}{cls._current_generation()}:{product_id}"
+    
+    @classmethod
+    def _load_hot_products(cls):
+        """从数据库查询热门商品，同时缓存单个商品详情（只由拿到刷新锁的请求执行）"""
+        hot_products = Products.objects.filter(is_hot=True).order_by('-updated_at')[:20]
+        
+        products_data = []
+        for product in hot_products:
+            product_data = cls.product_data(product)
+            products_data.append(product_data)
+            
+            # 同时缓存单个商品详情，过期时间1小时
+            cls.set_product_detail(product.product_id, product_data, expire=3600)
+        return products_data
     
     @classmethod
     def init_hot_products(cls):
-        """项目启动时预热热门商品到Redis"""
+        """项目启动或热门商品变更时重建热门商品缓存"""
         try:
-            # 获取所有热门商品
-            hot_products = Products.objects.filter(is_hot=True).order_by('-updated_at')[:20]
-            
-            # 构建商品数据
-            products_data = []
-            for product in hot_products:
-                product_data = {
-                    'id': product.id,
-                    'product_id': product.product_id,
-                    'name': product.name,
-                    'price': float(product.price),
-                    'category': product.category,
-                    'brand': product.brand,
-                    'specifications': product.specifications,
-                    'description': product.description,
-                    'stock': product.stock,
-                    'is_hot': product.is_hot,
-                    'updated_at': product.updated_at.isoformat()
-                }
-                products_data.append(product_data)
-                
-                # 同时缓存单个商品详情，过期时间1小时
-                cls.set_product_detail(product.product_id, product_data, expire=3600)
-            
-            # 将热门商品列表存入Redis，过期时间30分钟
-            redis_client.setex(
-                cls.HOT_PRODUCTS_KEY, 
-                1800,  # 30分钟
-                json.dumps(products_data, cls=DjangoJSONEncoder)
-            )
+            products_data = cls._load_hot_products()
+            if not hot_products_cache.set(cls.HOT_PRODUCTS_KEY, products_data):
+                return False
             
             print(f"已预热 {len(products_data)} 个热门商品到Redis")
             return True
@@ -57,21 +99,13 @@ class ProductCache:
     
     @classmethod
     def get_hot_products(cls):
-        """获取热门商品，优先从Redis获取"""
+        """获取热门商品，优先从Redis获取
+        
+        缓存缺失或临近过期时只有一个请求查询数据库，其他请求返回旧值或等待其写入，
+        避免过期瞬间所有请求同时查询数据库并重写商品详情。
+        """
         try:
-            # 尝试从Redis获取
-            cached_data = redis_client.get(cls.HOT_PRODUCTS_KEY)
-            if cached_data:
-                return json.loads(cached_data)
-            
-            # Redis中没有，从数据库获取并缓存
-            cls.init_hot_products()
-            cached_data = redis_client.get(cls.HOT_PRODUCTS_KEY)
-            if cached_data:
-                return json.loads(cached_data)
-            
-            return []
-            
+            return hot_products_cache.get(cls.HOT_PRODUCTS_KEY, cls._load_hot_products) or []
         except Exception as e:
             print(f"获取热门商品失败: {str(e)}")
             return []
@@ -80,11 +114,11 @@ class ProductCache:
     def set_product_detail(cls, product_id, product_data, expire=3600):
         """缓存商品详情"""
         try:
-            key = f"{cls.PRODUCT_DETAIL_PREFIX}{product_id}"
+            key = cls._detail_key(product_id)
             redis_client.setex(
                 key,
                 expire,
-                json.dumps(product_data, cls=DjangoJSONEncoder)
+                cache_serializer.dumps(product_data, default=_json_default)
             )
             return True
         except Exception as e:
@@ -95,10 +129,10 @@ class ProductCache:
     def get_product_detail(cls, product_id):
         """获取商品详情，优先从Redis获取"""
         try:
-            key = f"{cls.PRODUCT_DETAIL_PREFIX}{product_id}"
-            cached_data = redis_client.get(key)
+            key = cls._detail_key(product_id)
+            cached_data = binary_redis_client.get(key)
             if cached_data:
-                return json.loads(cached_data)
+                return cache_serializer.loads(cached_data)
             return None
         except Exception as e:
             print(f"获取商品详情失败: {str(e)}")
@@ -110,18 +144,105 @@ class ProductCache:
         try:
             if product_id:
                 # 清除指定商品缓存
-                key = f"{cls.PRODUCT_DETAIL_PREFIX}{product_id}"
-                redis_client.delete(key)
+                redis_client.unlink(cls._detail_key(product_id))
             else:
-                # 清除所有商品相关缓存
-                redis_client.delete(cls.HOT_PRODUCTS_KEY)
-                # 清除所有商品详情缓存
-                pattern = f"{cls.PRODUCT_DETAIL_PREFIX}*"
-                keys = redis_client.keys(pattern)
-                if keys:
-                    redis_client.delete(*keys)
+                # 清除所有商品相关缓存：热门列表直接删除，商品详情切换到新的代数
+                pipe = redis_client.pipeline(transaction=True)
+                pipe.unlink(cls.HOT_PRODUCTS_KEY)
+                pipe.incr(cls.GENERATION_KEY)
+                generation = pipe.execute()[1]
+                cls._generation = {'value': generation, 'expires_at': time.time() + cls.GENERATION_CACHE_SECONDS}
+                
+                # 旧代数的商品详情在后台分批回收
+                cls.start_sweeper()
             return True
         except Exception as e:
             print(f"清除缓存失败: {str(e)}")
             return False
-
+    
+    @classmethod
+    def _in_hot_products(cls, product_id):
+        """商品是否在已缓存的热门商品列表中"""
+        products_data = hot_products_cache.peek(cls.HOT_PRODUCTS_KEY)
+        if not products_data:
+            return False
+        return any(item['product_id'] == product_id for item in products_data)
+    
+    @classmethod
+    def refresh_product(cls, product):
+        """商品变更后刷新缓存：覆盖商品详情，涉及热门商品时重建热门列表"""
+        try:
+            cls.set_product_detail(product.product_id, cls.product_data(product), expire=3600)
+            if product.is_hot or cls._in_hot_products(product.product_id):
+                return cls.init_hot_products()
+            return True
+        except Exception as e:
+            print(f"刷新商品缓存失败: {str(e)}")
+            return False
+    
+    @classmethod
+    def remove_product(cls, product_id):
+        """商品删除后清除缓存，涉及热门商品时重建热门列表"""
+        try:
+            in_hot_products = cls._in_hot_products(product_id)
+            cls.clear_product_cache(product_id)
+            if in_hot_products:
+                return cls.init_hot_products()
+            return True
+        except Exception as e:
+            print(f"清除商品缓存失败: {str(e)}")
+            return False
+    
+    @classmethod
+    def _key_generation(cls, key):
+        """商品详情键的代数，不带代数的旧格式键返回-1"""
+        generation, separator, _ = key[len(cls.PRODUCT_DETAIL_PREFIX):].partition(':')
+        return int(generation) if separator and generation.isdigit() else -1
+    
+    @classmethod
+    def sweep_stale_details(cls, batch_size=None, pause=None):
+        """
+        回收旧代数（及旧格式）的商品详情键
+        
+        SCAN 每批最多 batch_size 个键，只 UNLINK 代数小于当前代数的键，批次之间暂停 pause 秒。
+        
+        Returns:
+            int: 回收的键数量
+        """
+        batch_size = batch_size or cls.SWEEP_BATCH_SIZE
+        pause = cls.SWEEP_PAUSE_SECONDS if pause is None else pause
+        removed = 0
+        cursor = 0
+        while True:
+            cursor, keys = redis_client.scan(cursor, match=f"{cls.PRODUCT_DETAIL_PREFIX}*", count=batch_size)
+            # 在SCAN之后读取代数：代数只增不减，小于它的键一定已过期；
+            # 清理期间再次清空缓存时，新代数（及之后写入的）键都不会被误删
+            generation = int(redis_client.get(cls.GENERATION_KEY) or 0)
+            stale = [key for key in keys if cls._key_generation(key) < generation]
+            if stale:
+                removed += redis_client.unlink(*stale)
+            if cursor == 0:
+                break
+            time.sleep(pause)
+        return removed
+    
+    @classmethod
+    def _run_sweeper(cls):
+        try:
+            removed = cls.sweep_stale_details()
+            print(f"已回收 {removed} 个旧商品详情缓存")
+        except Exception as e:
+            print(f"回收旧商品详情缓存失败: {str(e)}")
+        finally:
+            with cls._sweeper_lock:
+                cls._sweeper = None
+    
+    @classmethod
+    def start_sweeper(cls):
+        """在后台线程中回收旧代数的商品详情键；已有清理线程在运行时不重复启动"""
+        with cls._sweeper_lock:
+            if cls._sweeper is not None:
+                return False
+            cls._sweeper = threading.Thread(target=cls._run_sweeper, name='product-cache-sweeper', daemon=True)
+            cls._sweeper.start()
+            return True
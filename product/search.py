@@ -0,0 +1,253 @@
+"""
+商品搜索索引
+把Products（连同ProductKnowledge属性）同步到Elasticsearch商品索引，并提供相关性搜索
+"""
+import logging
+
+from elasticsearch.helpers import scan
+from rag.elasticsearch_service import es_service
+from rag.models import ProductKnowledge
+from config import ELASTICSEARCH_CONFIG
+from .models import Products
+
+logger = logging.getLogger(__name__)
+
+
+class ProductSearchUnavailable(Exception):
+    """ES商品搜索不可用，调用方应回退到MySQL查询"""
+
+
+class ProductSearchIndex:
+    """商品搜索索引管理类
+    
+    文档ID与MySQL主键一致；商品知识和规格参数作为nested的attributes写入。
+    """
+    
+    INDEX_NAME = ELASTICSEARCH_CONFIG['indices']['products']
+    BATCH_SIZE = 200
+    # 文本字段查询时展开为n-gram子字段，品牌、分类为keyword字段直接匹配
+    TEXT_FIELDS = ["name^3", "description"]
+    KEYWORD_FIELDS = ["brand^2", "category^2"]
+    
+    @classmethod
+    def build_document(cls, product, knowledge_items):
+        """构建商品文档"""
+        attributes = [
+            {'name': item.attribute, 'value': item.value, 'source': 'knowledge'}
+            for item in knowledge_items
+        ]
+        for name, value in (product.specifications or {}).items():
+            attributes.append({'name': str(name), 'value': str(value), 'source': 'specification'})
+        
+        return {
+            'id': product.id,
+            'product_id': product.product_id,
+            'name': product.name,
+            'brand': product.brand,
+            'category': product.category,
+            'price': float(product.price),
+            'stock': product.stock,
+            'is_hot': product.is_hot,
+            'specifications': product.specifications,
+            'description': product.description or '',
+            'attributes': attributes,
+            'tags': ['hot'] if product.is_hot else [],
+            'updated_at': product.updated_at.isoformat()
+        }
+    
+    @classmethod
+    def _index_queryset(cls, index_name, queryset):
+        """按主键keyset分页把商品写入指定索引，返回成功写入的文档数"""
+        indexed = 0
+        last_id = 0
+        while True:
+            products = list(queryset.filter(id__gt=last_id).order_by('id')[:cls.BATCH_SIZE])
+            if not products:
+                break
+            
+            # 一次查询取出本批商品的全部知识
+            knowledge_by_product = {}
+            for item in ProductKnowledge.objects.filter(product__in=products):
+                knowledge_by_product.setdefault(item.product_id, []).append(item)
+            
+            documents = [
+                cls.build_document(product, knowledge_by_product.get(product.id, []))
+                for product in products
+            ]
+            result = es_service.bulk_index_documents(index_name=index_name, documents=documents)
+            if not result['success']:
+                raise RuntimeError(result.get('error', '批量索引失败'))
+            
+            indexed += result['success_count']
+            last_id = products[-1].id
+        return indexed
+    
+    @classmethod
+    def full_build(cls):
+        """全量构建商品索引
+        
+        在新版本索引中构建并原子切换别名，构建期间搜索不受影响。
+        索引需先通过 init_elasticsearch --index products 创建。
+        """
+        if not es_service.is_available():
+            return {'success': False, 'error': 'ES不可用'}
+        if not es_service.client.indices.exists(index=cls.INDEX_NAME):
+            return {'success': False, 'error': f'索引 {cls.INDEX_NAME} 不存在，请先执行 init_elasticsearch --index products'}
+        
+        queryset = Products.objects.all()
+        result = es_service.rebuild_index(
+            alias=cls.INDEX_NAME,
+            populate=lambda index_name: cls._index_queryset(index_name, queryset)
+        )
+        if result['success']:
+            logger.info(f"商品索引全量构建完成: {result['actual_count']} 条 -> {result['index']}")
+        return result
+    
+    @classmethod
+    def delete_missing(cls):
+        """删除索引中数据库已不存在的商品，返回删除数量
+        
+        只读取文档ID（不取 _source），按批与数据库主键比对；需要遍历整个索引，
+        开销与商品总数相关，只在 index_products --prune 时执行。
+        """
+        stale_pks = []
+        
+        def collect_stale(pks):
+            existing = set(Products.objects.filter(pk__in=pks).values_list('pk', flat=True))
+            stale_pks.extend(pk for pk in pks if pk not in existing)
+        
+        batch = []
+        for hit in scan(es_service.client, index=cls.INDEX_NAME, _source=False, size=cls.BATCH_SIZE):
+            batch.append(int(hit['_id']))
+            if len(batch) >= cls.BATCH_SIZE:
+                collect_stale(batch)
+                batch = []
+        if batch:
+            collect_stale(batch)
+        
+        if stale_pks:
+            result = es_service.delete_by_query(cls.INDEX_NAME, {"ids": {"values": [str(pk) for pk in stale_pks]}})
+            if not result['success']:
+                raise RuntimeError(result.get('error', '删除已下架商品失败'))
+        return len(stale_pks)
+    
+    @classmethod
+    def incremental_update(cls, since=None, prune=False):
+        """增量同步 updated_at 不早于 since 的商品
+        
+        since 为空时取索引中已有文档的最大 updated_at，无需额外记录同步位置。
+        商品删除由变更事件（rag.index_sync）同步到索引；prune 为True时额外遍历索引，
+        删除数据库中已不存在的商品，用于事件丢失后的补偿。
+        """
+        if not es_service.is_available():
+            return {'success': False, 'error': 'ES不可用'}
+        
+        try:
+            if since is None:
+                since = cls.last_indexed_update()
+            
+            queryset = Products.objects.all()
+            if since:
+                # 使用 >= 避免同一时间戳的多次更新被漏掉，重复写入是幂等的
+                queryset = queryset.filter(updated_at__gte=since)
+            
+            indexed = cls._index_queryset(cls.INDEX_NAME, queryset)
+            deleted = cls.delete_missing() if prune else 0
+            logger.info(f"商品索引增量同步完成: 写入 {indexed} 条，删除 {deleted} 条 (since={since})")
+            return {'success': True, 'indexed': indexed, 'deleted': deleted, 'since': since}
+        except Exception as e:
+            logger.error(f"商品索引增量同步失败: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    @classmethod
+    def index_products(cls, product_pks):
+        """按主键重新写入指定商品（变更同步使用），返回写入数量"""
+        return cls._index_queryset(cls.INDEX_NAME, Products.objects.filter(pk__in=product_pks))
+    
+    @classmethod
+    def delete_products(cls, product_pks):
+        """从索引中删除指定主键的商品"""
+        return all(es_service.delete_document(cls.INDEX_NAME, str(pk)) for pk in product_pks)
+    
+    @classmethod
+    def last_indexed_update(cls):
+        """索引中最新的 updated_at（ISO字符串），索引为空时返回None"""
+        result = es_service.client.search(
+            index=cls.INDEX_NAME,
+            size=0,
+            aggs={"last_update": {"max": {"field": "updated_at"}}}
+        )
+        return result['aggregations']['last_update'].get('value_as_string')
+    
+    @classmethod
+    def search(cls, query='', category='', brand='', page=1, page_size=12):
+        """按相关性搜索商品
+        
+        关键词同时匹配商品字段和nested属性值；分类、品牌作为过滤条件不参与评分。
+        无关键词时按更新时间倒序。ES不可用或查询出错时抛出 ProductSearchUnavailable。
+        
+        Returns:
+            dict: products（与MySQL分页结果字段一致）和 total_count
+        """
+        if not es_service.is_available():
+            raise ProductSearchUnavailable('ES不可用')
+        
+        filters = []
+        if category:
+            filters.append({"term": {"category": category}})
+        if brand:
+            filters.append({"term": {"brand": brand}})
+        
+        bool_query = {"filter": filters}
+        sort = None
+        if query:
+            bool_query["should"] = [
+                {
+                    "multi_match": {
+                        "query": query,
+                        "fields": es_service.ngram_fields(cls.TEXT_FIELDS, prefix_fields=['name']) + cls.KEYWORD_FIELDS,
+                        "type": "best_fields",
+                        "minimum_should_match": "2<75%"
+                    }
+                },
+                {
+                    "nested": {
+                        "path": "attributes",
+                        "query": {"match": {"attributes.value.bigram": query}},
+                        "score_mode": "max"
+                    }
+                }
+            ]
+            bool_query["minimum_should_match"] = 1
+        else:
+            sort = [{"updated_at": {"order": "desc"}}]
+        
+        result = es_service.search_documents(
+            index_name=cls.INDEX_NAME,
+            query={"bool": bool_query},
+            size=page_size,
+            from_=(page - 1) * page_size,
+            sort=sort
+        )
+        if 'error' in result:
+            raise ProductSearchUnavailable(result['error'])
+        
+        products = []
+        for hit in result['hits']:
+            source = hit['source']
+            products.append({
+                'id': source['id'],
+                'product_id': source['product_id'],
+                'name': source['name'],
+                'price': source['price'],
+                'category': source['category'],
+                'brand': source['brand'],
+                'specifications': source.get('specifications', {}),
+                'description': source.get('description'),
+                'stock': source.get('stock'),
+                'is_hot': source.get('is_hot', False),
+                'updated_at': source.get('updated_at'),
+                'score': hit['score']
+            })
+        
+        return {'products': products, 'total_count': result['total']}
@@ -1,3 +1,212 @@
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+from rest_framework.test import APIRequestFactory
+
+from config import ELASTICSEARCH_CONFIG
+from rag.models import ProductKnowledge
+from .models import Products
+from .redis import ProductCache
+from .search import ProductSearchIndex, ProductSearchUnavailable
+
+
+class ProductSearchIndexTests(TestCase):
+    """ProductSearchIndex 针对内存版ES替身的测试"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from rag.elasticsearch_service import ElasticsearchService
+        from rag.fake_elasticsearch import FakeElasticsearchServer
+        from rag.management.commands.init_elasticsearch import Command as InitElasticsearchCommand
+
+        cls.server = FakeElasticsearchServer().start()
+        cls.service = ElasticsearchService(config=cls.server.client_config(ELASTICSEARCH_CONFIG))
+        cls.definition = InitElasticsearchCommand()._get_index_configs()['products']
+        cls.patcher = mock.patch('product.search.es_service', cls.service)
+        cls.patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.patcher.stop()
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.assertTrue(self.service.ensure_aliased_index(
+            ProductSearchIndex.INDEX_NAME, self.definition['mapping'], self.definition['settings']
+        ))
+        self.huawei = Products.objects.create(
+            product_id='P001', name='华为Mate60', price=5999, category='手机', brand='华为',
+            specifications={'内存': '12GB'}, description='卫星通话', stock=10, is_hot=True
+        )
+        self.xiaomi = Products.objects.create(
+            product_id='P002', name='小米14', price=3999, category='手机', brand='小米',
+            description='徕卡影像', stock=20
+        )
+        self.tablet = Products.objects.create(
+            product_id='P003', name='华为MatePad', price=2999, category='平板', brand='华为', stock=5
+        )
+        ProductKnowledge.objects.create(product=self.xiaomi, attribute='续航', value='续航持久一整天')
+
+    def tearDown(self):
+        for index_name in self.service.get_alias_indices(ProductSearchIndex.INDEX_NAME):
+            self.service.client.indices.delete(index=index_name)
+
+    def search_ids(self, **kwargs):
+        return [product['product_id'] for product in ProductSearchIndex.search(**kwargs)['products']]
+
+    def test_full_build_switches_alias_to_new_index(self):
+        result = ProductSearchIndex.full_build()
+        self.assertTrue(result['success'])
+        self.assertEqual(result['actual_count'], 3)
+        self.assertEqual(self.service.get_alias_indices(ProductSearchIndex.INDEX_NAME), [result['index']])
+
+        document = self.service.get_document(ProductSearchIndex.INDEX_NAME, str(self.xiaomi.pk))
+        self.assertIn({'name': '续航', 'value': '续航持久一整天', 'source': 'knowledge'}, document['attributes'])
+
+    def test_incremental_update_indexes_changes_and_prunes_deleted_products_on_request(self):
+        ProductSearchIndex.full_build()
+        since = self.xiaomi.updated_at
+        self.xiaomi.name = '小米14 Pro'
+        self.xiaomi.save()
+        tablet_pk = self.tablet.pk
+        self.tablet.delete()
+
+        # 删除由变更事件同步，普通增量同步不遍历整个索引
+        result = ProductSearchIndex.incremental_update(since=since)
+        self.assertTrue(result['success'])
+        self.assertEqual((result['indexed'], result['deleted']), (1, 0))
+        self.assertIsNotNone(self.service.get_document(ProductSearchIndex.INDEX_NAME, str(tablet_pk)))
+
+        result = ProductSearchIndex.incremental_update(since=since, prune=True)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['deleted'], 1)
+        self.assertIsNone(self.service.get_document(ProductSearchIndex.INDEX_NAME, str(tablet_pk)))
+        self.assertEqual(self.service.get_document(ProductSearchIndex.INDEX_NAME, str(self.xiaomi.pk))['name'], '小米14 Pro')
+        self.assertEqual(self.search_ids(query='华为'), ['P001'])
+
+    def test_search_matches_attributes_and_filters_by_brand(self):
+        ProductSearchIndex.full_build()
+        self.assertEqual(self.search_ids(query='续航'), ['P002'])
+        self.assertEqual(sorted(self.search_ids(brand='华为')), ['P001', 'P003'])
+        self.assertEqual(self.search_ids(query='华为', category='平板'), ['P003'])
+        self.assertEqual(ProductSearchIndex.search(page_size=2)['total_count'], 3)
+
+    def test_search_raises_when_elasticsearch_unavailable(self):
+        with mock.patch.object(self.service, 'is_available', return_value=False):
+            with self.assertRaises(ProductSearchUnavailable):
+                ProductSearchIndex.search(query='华为')
+
+    def test_list_view_falls_back_to_mysql(self):
+        from .views import ProductListView
+
+        request = APIRequestFactory().get('/products/', {'search_mode': 'es', 'search': '华为'})
+        with mock.patch.object(ProductSearchIndex, 'search', side_effect=ProductSearchUnavailable('ES不可用')):
+            response = ProductListView.as_view()(request)
+        self.assertEqual(response.data['data']['search_mode'], 'mysql')
+        self.assertEqual(
+            sorted(product['product_id'] for product in response.data['data']['products']), ['P001', 'P003']
+        )
+
+
+class _StubKeyClient:
+    """只实现 get/incr/scan/unlink 的内存Redis，on_scan 在每次SCAN返回前调用
+
+    SCAN 在游标为0时对键做快照，之后按快照分批返回，与Redis一样保证遍历期间一直存在的键都会返回。
+    """
+
+    def __init__(self, data=None, on_scan=None):
+        self.data = dict(data or {})
+        self.on_scan = on_scan
+        self.scans = 0
+        self.snapshot = []
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key) or 0) + 1)
+        return int(self.data[key])
+
+    def setex(self, key, seconds, value):
+        self.data[key] = value
+
+    def scan(self, cursor, match=None, count=10):
+        if cursor == 0:
+            prefix = match.rstrip('*')
+            self.snapshot = sorted(key for key in self.data if key.startswith(prefix))
+        batch = self.snapshot[cursor:cursor + count]
+        self.scans += 1
+        if self.on_scan:
+            batch = self.on_scan(self, batch)
+        next_cursor = cursor + count
+        return (next_cursor if next_cursor < len(self.snapshot) else 0), batch
+
+    def unlink(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+
+class ProductCacheSweeperTests(SimpleTestCase):
+    """旧代数商品详情缓存的回收"""
+
+    cache = ProductCache
+
+    def sweep(self, client, **kwargs):
+        with mock.patch('product.redis.redis_client', client):
+            return self.cache.sweep_stale_details(batch_size=2, pause=0, **kwargs)
+
+    def test_removes_old_generations_and_legacy_keys(self):
+        client = _StubKeyClient({
+            ProductCache.GENERATION_KEY: '2',
+            'product_detail:0:P001': 'a',
+            'product_detail:1:P001': 'b',
+            'product_detail:P002': 'legacy',
+            'product_detail:2:P001': 'c',
+            'product_detail:2:P003': 'd',
+        })
+        self.assertEqual(self.sweep(client), 3)
+        self.assertEqual(
+            sorted(key for key in client.data if key.startswith('product_detail:')),
+            ['product_detail:2:P001', 'product_detail:2:P003']
+        )
+        self.assertGreater(client.scans, 1)
+
+    def test_keeps_keys_written_after_generation_changes_mid_sweep(self):
+        def clear_during_first_scan(client, batch):
+            # 清理进行中再次清空缓存，新代数的键写入后恰好出现在本批SCAN结果中
+            if client.scans == 1:
+                client.incr(ProductCache.GENERATION_KEY)
+                client.data['product_detail:2:P001'] = 'new'
+                batch = batch + ['product_detail:2:P001']
+            return batch
+
+        client = _StubKeyClient({
+            ProductCache.GENERATION_KEY: '1',
+            'product_detail:0:P001': 'a',
+            'product_detail:1:P001': 'b',
+            'product_detail:1:P002': 'c',
+        }, on_scan=clear_during_first_scan)
+        self.assertEqual(self.sweep(client), 3)
+        self.assertEqual(
+            sorted(key for key in client.data if key.startswith('product_detail:')), ['product_detail:2:P001']
+        )
+
+    def test_start_sweeper_runs_one_thread_at_a_time(self):
+        started = mock.Mock()
+        release = threading.Event()
+
+        def slow_sweep():
+            started()
+            release.wait(5)
+            return 0
+
+        with mock.patch.object(self.cache, 'sweep_stale_details', side_effect=slow_sweep):
+            self.assertTrue(self.cache.start_sweeper())
+            sweeper = self.cache._sweeper
+            self.assertFalse(self.cache.start_sweeper())
+            release.set()
+            sweeper.join(5)
+        started.assert_called_once_with()
+        self.assertIsNone(self.cache._sweeper)
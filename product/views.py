@@ -6,13 +6,20 @@ from django.core.paginator import Paginator
 from django.db.models import Q
 from .models import Products
 from .redis import ProductCache
+from .search import ProductSearchIndex, ProductSearchUnavailable
 import json
+import logging
+
+logger = logging.getLogger(__name__)
 
 class ProductListView(APIView):
     """商品列表API"""
     
     def get(self, request):
-        """获取商品列表，支持分页和搜索"""
+        """获取商品列表，支持分页和搜索
+        
+        search_mode=es 时使用ES商品索引做相关性搜索，ES不可用时自动回退到MySQL。
+        """
         try:
             # 获取查询参数
             page = int(request.GET.get('page', 1))
@@ -20,6 +27,38 @@ class ProductListView(APIView):
             search = request.GET.get('search', '')
             category = request.GET.get('category', '')
             brand = request.GET.get('brand', '')
+            search_mode = request.GET.get('search_mode', 'mysql')  # mysql 或 es
+            
+            # ES模式：按相关性排序的商品索引搜索，ES不可用时回退到MySQL
+            if search_mode == 'es':
+                try:
+                    es_result = ProductSearchIndex.search(
+                        query=search,
+                        category=category,
+                        brand=brand,
+                        page=page,
+                        page_size=page_size
+                    )
+                    total_count = es_result['total_count']
+                    total_pages = max(1, -(-total_count // page_size))
+                    
+                    return Response({
+                        'code': 200,
+                        'message': '获取成功',
+                        'data': {
+                            'products': es_result['products'],
+                            'pagination': {
+                                'current_page': page,
+                                'total_pages': total_pages,
+                                'total_count': total_count,
+                                'has_next': page < total_pages,
+                                'has_previous': page > 1
+                            },
+                            'search_mode': 'es'
+                        }
+                    })
+                except ProductSearchUnavailable as e:
+                    logger.warning(f"ES商品搜索不可用，回退到MySQL: {e}")
             
             # 构建查询条件
             queryset = Products.objects.all()
@@ -71,7 +110,8 @@ class ProductListView(APIView):
                         'total_count': paginator.count,
                         'has_next': page_obj.has_next(),
                         'has_previous': page_obj.has_previous()
-                    }
+                    },
+                    'search_mode': 'mysql'
                 }
             })
             
@@ -98,6 +98,58 @@ class ProductRAGSystem:
             self.vector_store = None
             self.retriever = None
     
+    def _knowledge_document(self, item):
+        """把一条商品知识构建为Document"""
+        # 构建文档内容
+        content = f"""
+                商品名称: {item.product.name}
+                商品品牌: {item.product.brand}
+                商品分类: {item.product.category}
+                属性: {item.attribute}
+                属性值: {item.value}
+                详细描述: {item.source_text or ''}
+                """
+        
+        # 创建Document对象
+        return Document(
+            page_content=content.strip(),
+            metadata={
+                'product_id': item.product.product_id,
+                'product_name': item.product.name,
+                'brand': item.product.brand,
+                'category': item.product.category,
+                'attribute': item.attribute,
+                'knowledge_id': item.id
+            }
+        )
+    
+    def sync_product_knowledge(self, product_id):
+        """增量同步单个商品的知识：删除该商品已有的文档块后按数据库当前内容重新写入"""
+        try:
+            if self.vector_store is None:
+                self._setup_vector_store()
+                if self.vector_store is None:
+                    return {'success': False, 'error': '向量存储不可用'}
+            
+            existing = self.vector_store.get(where={'product_id': product_id}, include=[])
+            if existing['ids']:
+                self.vector_store.delete(ids=existing['ids'])
+            
+            knowledge_items = ProductKnowledge.objects.select_related('product').filter(
+                product__product_id=product_id
+            )
+            split_docs = self.text_splitter.split_documents(
+                [self._knowledge_document(item) for item in knowledge_items]
+            )
+            if split_docs:
+                self.vector_store.add_documents(split_docs)
+            
+            return {'success': True, 'deleted': len(existing['ids']), 'added': len(split_docs)}
+            
+        except Exception as e:
+            print(f"同步商品知识失败: {str(e)}")
+            return {'success': False, 'error': str(e)}
+    
     def load_product_knowledge_from_db(self):
         """从数据库加载商品知识"""
         try:
@@ -107,29 +159,7 @@ class ProductRAGSystem:
             knowledge_items = ProductKnowledge.objects.select_related('product').all()
             
             for item in knowledge_items:
-                # 构建文档内容
-                content = f"""
-                商品名称: {item.product.name}
-                商品品牌: {item.product.brand}
-                商品分类: {item.product.category}
-                属性: {item.attribute}
-                属性值: {item.value}
-                详细描述: {item.source_text or ''}
-                """
-                
-                # 创建Document对象
-                doc = Document(
-                    page_content=content.strip(),
-                    metadata={
-                        'product_id': item.product.product_id,
-                        'product_name': item.product.name,
-                        'brand': item.product.brand,
-                        'category': item.product.category,
-                        'attribute': item.attribute,
-                        'knowledge_id': item.id
-                    }
-                )
-                documents.append(doc)
+                documents.append(self._knowledge_document(item))
             
             print(f"从数据库加载了 {len(documents)} 个商品知识文档")
             return documents
@@ -368,6 +398,71 @@ class ProductRAGSystem:
                 'success': False
             }
     
+    def ask_questions(self, questions, return_source=True, max_concurrency=4):
+        """
+        批量问答接口
+        
+        所有问题一次 embed_documents 向量化、一次Chroma查询检索，大模型生成按 max_concurrency 并发。
+        
+        Returns:
+            list: 与 questions 一一对应、结构同 ask_question 的结果
+        """
+        try:
+            if not self.is_initialized or self.vector_store is None:
+                print("向量数据库未初始化，正在初始化...")
+                if not self.initialize_vector_store(force_reload=True):
+                    return [{
+                        'answer': '抱歉，知识库初始化失败，无法回答问题。请联系管理员检查系统状态。',
+                        'sources': [],
+                        'success': False
+                    } for _ in questions]
+            
+            # 一次请求得到全部问题向量，一次查询取回每个问题的前5个文档
+            question_vectors = self.embeddings_model.embed_documents(questions)
+            result = self.vector_store._collection.query(
+                query_embeddings=question_vectors,
+                n_results=5,
+                include=['documents', 'metadatas']
+            )
+            retrieved = [
+                [Document(page_content=content, metadata=metadata or {}) for content, metadata in zip(contents, metadatas)]
+                for contents, metadatas in zip(result['documents'], result['metadatas'])
+            ]
+            
+        except Exception as e:
+            print(f"批量检索失败: {str(e)}")
+            return [{
+                'answer': f'抱歉，处理问题时出现错误: {str(e)}。请稍后重试或联系管理员。',
+                'sources': [],
+                'success': False
+            } for _ in questions]
+        
+        chain = self.prompt_template | self.llm | StrOutputParser()
+        answers = chain.batch(
+            [{'context': docs, 'question': question} for question, docs in zip(questions, retrieved)],
+            config={'max_concurrency': max_concurrency},
+            return_exceptions=True
+        )
+        
+        results = []
+        for docs, answer in zip(retrieved, answers):
+            if isinstance(answer, Exception):
+                results.append({
+                    'answer': f'抱歉，处理问题时出现错误: {str(answer)}。请稍后重试或联系管理员。',
+                    'sources': [],
+                    'success': False
+                })
+                continue
+            
+            result = {'answer': answer, 'success': True, 'sources': []}
+            if return_source:
+                result['sources'] = [{
+                    'content': doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
+                    'metadata': doc.metadata
+                } for doc in docs[:3]]
+            results.append(result)
+        return results
+    
     def get_similar_questions(self, question, limit=5):
         """获取相似问题"""
         try:
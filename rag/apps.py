@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class RagConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'rag'
+
+    def ready(self):
+        # 注册模型变更信号，同步索引与缓存
+        from . import signals  # noqa: F401
@@ -0,0 +1,37 @@
+"""
+基准测试辅助函数
+供 bench_* 管理命令统计延迟分位数
+"""
+import math
+import time
+from typing import Callable, Dict, List
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """计算分位数（最近秩法），values 为空时返回0"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize_latencies(latencies_ms: List[float]) -> Dict[str, float]:
+    """汇总延迟样本（毫秒）"""
+    if not latencies_ms:
+        return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    return {
+        'count': len(latencies_ms),
+        'mean': sum(latencies_ms) / len(latencies_ms),
+        'p50': percentile(latencies_ms, 50),
+        'p95': percentile(latencies_ms, 95),
+        'p99': percentile(latencies_ms, 99),
+        'max': max(latencies_ms),
+    }
+
+
+def time_call(func: Callable, *args, **kwargs):
+    """执行一次调用，返回 (结果, 耗时毫秒)"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
@@ -0,0 +1,268 @@
+"""
+对话索引分区管理
+对话通过写别名写入由索引模板创建的时间分区索引，按大小/时间滚动，超期分区删除或压缩
+"""
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from .elasticsearch_service import es_service
+from config import ELASTICSEARCH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationPartitions:
+    """对话索引分区管理类
+    
+    - 写别名 ELASTICSEARCH_CONFIG['indices']['conversations'] 指向最新分区（is_write_index）
+    - 分区名 {prefix}-{日期}-{序号}，由索引模板提供映射，并挂载ILM策略自动滚动和删除
+    - 读取时可只检索最近N个分区，控制kNN检索范围
+    """
+    
+    ALIAS = ELASTICSEARCH_CONFIG['indices']['conversations']
+    CONFIG = ELASTICSEARCH_CONFIG['conversation_partitions']
+    TEMPLATE_NAME = f"{CONFIG['prefix']}_template"
+    POLICY_NAME = f"{CONFIG['prefix']}_policy"
+    PARTITION_CACHE_SECONDS = 60
+    
+    _partition_cache = {'expires_at': 0, 'partitions': []}
+    
+    @classmethod
+    def _partition_pattern(cls) -> str:
+        return f"{cls.CONFIG['prefix']}-*"
+    
+    @classmethod
+    def _bootstrap_name(cls) -> str:
+        """带日期数学表达式的首个分区名，滚动时ES会按当前日期生成新分区名"""
+        date_unit = 'd' if cls.CONFIG['date_format'].endswith('dd') else 'M'
+        return f"<{cls.CONFIG['prefix']}-{{now/{date_unit}{{{cls.CONFIG['date_format']}}}}}-000001>"
+    
+    @classmethod
+    def _rollover_conditions(cls) -> Dict:
+        return {
+            "max_age": cls.CONFIG['rollover_max_age'],
+            "max_primary_shard_size": cls.CONFIG['rollover_max_primary_shard_size']
+        }
+    
+    @classmethod
+    def setup(cls, mapping: Dict, settings: Dict) -> bool:
+        """创建/更新ILM策略和索引模板，并在需要时建立首个分区
+        
+        已有的旧对话索引（同名物理索引或 _vN 版本索引）会通过 _reindex
+        迁移到首个分区，核对数量无误后才在一次别名操作中完成切换并删除旧索引；
+        任何一步失败都删除新建的首个分区，旧索引保持不变，下次可重新执行。
+        旧文档的 question_vector 按旧模型维度生成，与模板映射不兼容，迁移时去掉，
+        这些对话仍可按文本检索，但不再参与相似问题的kNN检索。
+        """
+        if not es_service.is_available():
+            return False
+        
+        first_partition = None
+        try:
+            es_service.client.ilm.put_lifecycle(
+                name=cls.POLICY_NAME,
+                policy={
+                    "phases": {
+                        "hot": {
+                            "actions": {"rollover": cls._rollover_conditions()}
+                        },
+                        "warm": {
+                            "min_age": f"{cls.CONFIG['compact_after_days']}d",
+                            "actions": {
+                                "forcemerge": {"max_num_segments": 1},
+                                "readonly": {}
+                            }
+                        },
+                        "delete": {
+                            "min_age": f"{cls.CONFIG['retention_days']}d",
+                            "actions": {"delete": {}}
+                        }
+                    }
+                }
+            )
+            
+            template_settings = dict(settings)
+            template_settings["index.lifecycle.name"] = cls.POLICY_NAME
+            template_settings["index.lifecycle.rollover_alias"] = cls.ALIAS
+            es_service.client.indices.put_index_template(
+                name=cls.TEMPLATE_NAME,
+                index_patterns=[cls._partition_pattern()],
+                template={"settings": template_settings, "mappings": mapping},
+                priority=100
+            )
+            logger.info(f"对话分区模板 {cls.TEMPLATE_NAME} 已更新")
+            
+            current = es_service.get_alias_indices(cls.ALIAS)
+            if current and all(name.startswith(f"{cls.CONFIG['prefix']}-") for name in current):
+                return True
+            
+            # 首个分区，映射由模板提供
+            first_partition = es_service.client.indices.create(index=cls._bootstrap_name())['index']
+            
+            if es_service.client.indices.exists(index=cls.ALIAS):
+                cls._migrate_legacy(first_partition)
+            
+            if not es_service.switch_alias(cls.ALIAS, first_partition, delete_old=True):
+                raise RuntimeError(f"切换别名 {cls.ALIAS} 失败")
+            cls._partition_cache['expires_at'] = 0
+            return True
+            
+        except Exception as e:
+            logger.error(f"初始化对话分区失败: {e}")
+            if first_partition:
+                try:
+                    es_service.client.indices.delete(index=first_partition, ignore_unavailable=True)
+                except Exception as delete_error:
+                    logger.error(f"删除首个分区 {first_partition} 失败: {delete_error}")
+            return False
+    
+    @classmethod
+    def _migrate_legacy(cls, first_partition: str):
+        """把旧对话索引复制到首个分区，去掉旧维度的 question_vector；失败或数量不符时抛出异常"""
+        expected_count = es_service.client.count(index=cls.ALIAS)['count']
+        result = es_service.client.reindex(
+            source={"index": cls.ALIAS},
+            dest={"index": first_partition},
+            script={"source": "ctx._source.remove('question_vector')", "lang": "painless"},
+            wait_for_completion=True,
+            refresh=True
+        )
+        if result.get('failures'):
+            raise RuntimeError(f"迁移旧对话失败: {result['failures'][:3]}")
+        if result.get('created') != expected_count:
+            raise RuntimeError(
+                f"迁移旧对话数量不匹配，预期 {expected_count}，实际 {result.get('created')}，别名未切换"
+            )
+        logger.info(f"旧对话索引 {expected_count} 条数据已迁移到 {first_partition}")
+    
+    @classmethod
+    def rollover(cls, force: bool = False) -> Dict:
+        """按配置的大小/时间条件滚动写别名，force 为True时无条件滚动"""
+        if not es_service.is_available():
+            return {'rolled_over': False, 'error': 'ES不可用'}
+        
+        try:
+            kwargs = {} if force else {'conditions': cls._rollover_conditions()}
+            result = es_service.client.indices.rollover(alias=cls.ALIAS, **kwargs)
+            cls._partition_cache['expires_at'] = 0
+            return {
+                'rolled_over': result['rolled_over'],
+                'old_index': result['old_index'],
+                'new_index': result['new_index']
+            }
+        except Exception as e:
+            logger.error(f"对话分区滚动失败: {e}")
+            return {'rolled_over': False, 'error': str(e)}
+    
+    @classmethod
+    def list_partitions(cls) -> List[Dict]:
+        """列出所有分区，按创建时间升序"""
+        if not es_service.is_available():
+            return []
+        
+        result = es_service.client.cat.indices(
+            index=cls._partition_pattern(),
+            h="index,creation.date,docs.count,store.size",
+            format="json",
+            bytes="b"
+        )
+        partitions = [
+            {
+                'index': row['index'],
+                'created_at': datetime.fromtimestamp(int(row['creation.date']) / 1000, tz=timezone.utc),
+                'docs': int(row.get('docs.count') or 0),
+                'size_bytes': int(row.get('store.size') or 0)
+            }
+            for row in result
+        ]
+        return sorted(partitions, key=lambda partition: partition['created_at'])
+    
+    @classmethod
+    def _cached_partitions(cls) -> List[str]:
+        """按创建时间升序的分区名，缓存 PARTITION_CACHE_SECONDS 秒"""
+        if time.time() >= cls._partition_cache['expires_at']:
+            cls._partition_cache['partitions'] = [p['index'] for p in cls.list_partitions()]
+            cls._partition_cache['expires_at'] = time.time() + cls.PARTITION_CACHE_SECONDS
+        return cls._partition_cache['partitions']
+    
+    @classmethod
+    def partition_count(cls) -> int:
+        """现有分区数量，获取失败时返回0"""
+        try:
+            return len(cls._cached_partitions())
+        except Exception as e:
+            logger.warning(f"获取对话分区失败: {e}")
+            return 0
+    
+    @classmethod
+    def _segment_count(cls, index_name: str) -> int:
+        """索引主分片的段数"""
+        stats = es_service.client.indices.stats(index=index_name, metric='segments')
+        return stats['indices'][index_name]['primaries']['segments']['count']
+    
+    @classmethod
+    def recent_indices(cls, count: int = None) -> str:
+        """最近N个分区组成的逗号分隔索引名，用于限定检索范围
+        
+        分区列表缓存 PARTITION_CACHE_SECONDS 秒；没有分区信息时返回写别名（检索全部）。
+        """
+        count = count or cls.CONFIG['recent_partitions']
+        try:
+            partitions = cls._cached_partitions()
+            if partitions:
+                return ",".join(partitions[-count:])
+        except Exception as e:
+            logger.warning(f"获取对话分区失败，检索全部分区: {e}")
+        return cls.ALIAS
+    
+    @classmethod
+    def apply_retention(cls, retention_days: int = None, compact_after_days: int = None,
+                        dry_run: bool = False) -> Dict:
+        """删除超期分区，压缩（合并段+只读）较旧分区
+        
+        用于未启用ILM的集群或需要立即执行的场景；当前写入分区永远不会被处理，
+        已合并为单个段的分区不再重复合并。
+        """
+        retention_days = retention_days or cls.CONFIG['retention_days']
+        compact_after_days = compact_after_days or cls.CONFIG['compact_after_days']
+        report = {'deleted': [], 'compacted': []}
+        if not es_service.is_available():
+            return report
+        
+        write_indices = set(es_service.get_alias_indices(cls.ALIAS)[-1:])
+        try:
+            alias_info = es_service.client.indices.get_alias(name=cls.ALIAS)
+            write_indices = {
+                name for name, info in alias_info.items()
+                if info['aliases'][cls.ALIAS].get('is_write_index')
+            } or write_indices
+        except Exception as e:
+            logger.warning(f"获取写入分区失败: {e}")
+        
+        now = datetime.now(tz=timezone.utc)
+        for partition in cls.list_partitions():
+            if partition['index'] in write_indices:
+                continue
+            
+            age_days = (now - partition['created_at']).days
+            if age_days >= retention_days:
+                report['deleted'].append(partition['index'])
+                if not dry_run:
+                    es_service.client.indices.delete(index=partition['index'], ignore_unavailable=True)
+            elif age_days >= compact_after_days:
+                if cls._segment_count(partition['index']) <= 1:
+                    continue
+                report['compacted'].append(partition['index'])
+                if not dry_run:
+                    es_service.client.indices.forcemerge(
+                        index=partition['index'], max_num_segments=1, wait_for_completion=True
+                    )
+                    es_service.client.indices.put_settings(
+                        index=partition['index'],
+                        settings={"index": {"blocks": {"write": True}}}
+                    )
+        
+        cls._partition_cache['expires_at'] = 0
+        return report
@@ -0,0 +1,273 @@
+"""
+Elasticsearch异步服务封装类
+基于 AsyncElasticsearch，供异步视图在等待ES响应时不占用工作线程，
+并可与向量化等其他I/O并发执行
+"""
+import asyncio
+import logging
+import uuid
+import weakref
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from elasticsearch import AsyncElasticsearch
+from elasticsearch.exceptions import NotFoundError
+from config import ELASTICSEARCH_CONFIG, SYSTEM_CONFIG
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+
+def _format_search_result(result: Dict) -> Dict:
+    """把ES搜索响应整理为与 ElasticsearchService 一致的结构"""
+    hits = []
+    for hit in result['hits']['hits']:
+        hits.append({
+            'id': hit['_id'],
+            'score': hit['_score'],
+            'source': hit['_source']
+        })
+
+    return {
+        'hits': hits,
+        'total': result['hits']['total']['value'],
+        'took': result['took'],
+        'max_score': result['hits']['max_score']
+    }
+
+
+class AsyncElasticsearchService:
+    """Elasticsearch异步服务封装类
+
+    与 ElasticsearchService 的查询/读写接口保持一致（方法均为协程），索引管理仍使用同步服务。
+    客户端在首次使用时按事件循环创建，同一事件循环内的请求共享一个连接池，
+    池大小取 config['async_pool']['connections_per_node']；在ASGI部署下每个worker只有
+    一个事件循环，连接池在请求之间复用。WSGI部署下Django为每个异步视图请求新建事件循环，
+    调用方须在请求结束时 await close()，否则每个请求都会遗留一个未关闭的连接池。
+    """
+
+    def __init__(self, config: Dict = None):
+        """初始化配置，不立即建立连接
+
+        Args:
+            config: ES连接配置，默认使用 ELASTICSEARCH_CONFIG
+        """
+        self.config = config or ELASTICSEARCH_CONFIG
+        self.enabled = SYSTEM_CONFIG.get('use_elasticsearch', True)
+        # 事件循环 -> 客户端；事件循环结束后对应条目自动释放
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _create_client(self) -> AsyncElasticsearch:
+        """创建异步客户端"""
+        pool_config = self.config.get('async_pool', {})
+        options = {
+            'request_timeout': pool_config.get('request_timeout', self.config['timeout']),
+            'max_retries': self.config['max_retries'],
+            'retry_on_timeout': True,
+            'connections_per_node': pool_config.get('connections_per_node', 10)
+        }
+
+        if self.config.get('use_ssl', False):
+            url = f"https://{self.config['host']}:{self.config['port']}"
+            if self.config.get('username'):
+                options['basic_auth'] = (self.config.get('username'), self.config.get('password'))
+            options['verify_certs'] = self.config.get('verify_certs', False)
+            options['ssl_show_warn'] = False
+        else:
+            url = f"http://{self.config['host']}:{self.config['port']}"
+
+        return AsyncElasticsearch([url], **options)
+
+    @property
+    def client(self) -> Optional[AsyncElasticsearch]:
+        """当前事件循环对应的客户端"""
+        if not self.enabled:
+            return None
+
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._create_client()
+            self._clients[loop] = client
+        return client
+
+    async def close(self):
+        """关闭当前事件循环的客户端及其连接池"""
+        try:
+            loop = asyncio.get_running_loop()
+            client = self._clients.pop(loop, None)
+            if client is not None:
+                await client.close()
+        except Exception as e:
+            logger.warning(f"关闭异步ES客户端失败: {e}")
+
+    async def is_available(self) -> bool:
+        """检查ES服务是否可用"""
+        if not self.enabled:
+            return False
+        try:
+            return await self.client.ping()
+        except Exception:
+            return False
+
+    async def search_documents(self, index_name: str, query: Dict, size: int = 10,
+                               from_: int = 0, sort: List = None, min_score: float = None) -> Dict:
+        """搜索文档"""
+        if not self.enabled:
+            return {'hits': [], 'total': 0, 'took': 0}
+
+        try:
+            body = {
+                'query': query,
+                'size': size,
+                'from': from_
+            }
+
+            if sort:
+                body['sort'] = sort
+            if min_score is not None:
+                body['min_score'] = min_score
+
+            result = await self.client.search(index=index_name, body=body)
+            return _format_search_result(result)
+
+        except Exception as e:
+            logger.error(f"异步搜索失败: {e}")
+            return {'hits': [], 'total': 0, 'took': 0, 'error': str(e)}
+
+    async def multi_match_search(self, index_name: str, query_text: str, fields: List[str],
+                                 size: int = 10, min_score: float = 0.1, fuzziness: str = None,
+                                 minimum_should_match: str = None) -> Dict:
+        """多字段匹配搜索，参数含义同 ElasticsearchService.multi_match_search"""
+        multi_match = {
+            "query": query_text,
+            "fields": fields,
+            "type": "best_fields"
+        }
+        if fuzziness:
+            multi_match["fuzziness"] = fuzziness
+        if minimum_should_match:
+            multi_match["minimum_should_match"] = minimum_should_match
+
+        return await self.search_documents(
+            index_name, {"multi_match": multi_match}, size=size, min_score=min_score
+        )
+
+    async def semantic_search(self, index_name: str, vector: List[float],
+                              vector_field: str = "embedding", size: int = 10,
+                              filter_query: Dict = None, num_candidates: int = None) -> Dict:
+        """语义向量搜索，参数含义同 ElasticsearchService.semantic_search"""
+        if not self.enabled:
+            return {'hits': [], 'total': 0, 'took': 0}
+
+        try:
+            if num_candidates is None:
+                num_candidates = self.config.get('vector', {}).get('num_candidates', size * 2)
+
+            body = {
+                "knn": {
+                    "field": vector_field,
+                    "query_vector": vector,
+                    "k": size,
+                    "num_candidates": max(num_candidates, size)
+                },
+                "size": size
+            }
+
+            if filter_query:
+                body["query"] = filter_query
+
+            result = await self.client.search(index=index_name, body=body)
+            return _format_search_result(result)
+
+        except Exception as e:
+            logger.warning(f"异步kNN搜索失败，回退到普通搜索: {e}")
+            fallback_query = filter_query or {"match_all": {}}
+            return await self.search_documents(index_name, fallback_query, size=size)
+
+    async def hybrid_search(self, index_name: str, query_text: str, fields: List[str],
+                            vector: List[float], vector_field: str = "embedding", size: int = 10,
+                            minimum_should_match: str = None) -> Dict:
+        """混合检索：并发执行kNN向量搜索和全文搜索
+
+        Returns:
+            Dict: {'semantic': 向量搜索结果, 'text': 全文搜索结果}，由调用方合并排序
+        """
+        semantic_results, text_results = await asyncio.gather(
+            self.semantic_search(index_name, vector, vector_field=vector_field, size=size),
+            self.multi_match_search(
+                index_name, query_text, fields, size=size,
+                minimum_should_match=minimum_should_match
+            )
+        )
+        return {'semantic': semantic_results, 'text': text_results}
+
+    async def get_document(self, index_name: str, doc_id: str) -> Optional[Dict]:
+        """获取单个文档"""
+        if not self.enabled:
+            return None
+
+        try:
+            result = await self.client.get(index=index_name, id=doc_id)
+            return result['_source']
+        except NotFoundError:
+            return None
+        except Exception as e:
+            logger.error(f"异步获取文档失败: {e}")
+            return None
+
+    async def bulk_index_documents(self, index_name: str, documents: List[Dict]) -> Dict:
+        """批量索引文档，文档中的 'id' 作为 _id（与 ElasticsearchService 一致）"""
+        if not self.enabled:
+            return {'success': False, 'error': 'ES不可用'}
+
+        try:
+            actions = []
+            indexed_at = datetime.now().isoformat()
+            for doc in documents:
+                doc_id = doc.get('id') or str(uuid.uuid4())
+                doc_data = doc.copy()
+                doc_data['indexed_at'] = indexed_at
+                actions.append({"index": {"_index": index_name, "_id": doc_id}})
+                actions.append(doc_data)
+
+            result = await self.client.bulk(body=actions)
+
+            success_count = 0
+            errors = []
+            for item in result['items']:
+                if 'index' in item:
+                    if item['index'].get('status') in [200, 201]:
+                        success_count += 1
+                    else:
+                        errors.append(item['index'])
+
+            logger.info(f"异步批量索引完成: 成功{success_count}, 失败{len(errors)}")
+
+            return {
+                'success': True,
+                'total': len(documents),
+                'success_count': success_count,
+                'error_count': len(errors),
+                'errors': errors
+            }
+
+        except Exception as e:
+            logger.error(f"异步批量索引失败: {e}")
+            return {'success': False, 'error': str(e)}
+
+    async def count_documents(self, index_name: str, query: Dict = None) -> int:
+        """统计文档数量"""
+        if not self.enabled:
+            return 0
+
+        try:
+            body = {'query': query} if query else None
+            result = await self.client.count(index=index_name, body=body)
+            return result['count']
+        except Exception as e:
+            logger.error(f"异步统计文档失败: {e}")
+            return 0
+
+# 单例实例（首次使用时才建立连接）
+async_es_service = AsyncElasticsearchService()
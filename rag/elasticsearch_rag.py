@@ -2,6 +2,7 @@
 基于Elasticsearch的增强RAG系统
 集成向量搜索和全文搜索功能
 """
+import asyncio
 import logging
 from typing import Dict, List, Any, Optional
 from langchain_community.embeddings import DashScopeEmbeddings
@@ -9,14 +10,21 @@ from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import PromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from elasticsearch.helpers import scan
+import base64
+import hashlib
 import json
 import uuid
 from datetime import datetime
 
 from .elasticsearch_service import es_service
+from .elasticsearch_async_service import async_es_service
+from .embedding_cache import QueryEmbeddingCache
+from .conversation_partitions import ConversationPartitions
+from .question_clusters import QuestionClusters
 from .models import ProductKnowledge
 from product.models import Products
-from config import API_CONFIG, RAG_CONFIG, ELASTICSEARCH_CONFIG
+from config import API_CONFIG, RAG_CONFIG, ELASTICSEARCH_CONFIG, EMBEDDING_MODEL_DIMS
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -39,6 +47,9 @@ class ElasticsearchRAGSystem:
             dashscope_api_key=API_CONFIG['embedding_api_key']
         )
         
+        # 问题向量缓存（进程内LRU + Redis），只用于用户问题
+        self.query_embeddings = QueryEmbeddingCache(self.embeddings_model)
+        
         # 文本分割器
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=RAG_CONFIG['chunk_size'],
@@ -48,6 +59,9 @@ class ElasticsearchRAGSystem:
         # 索引配置
         self.indices = ELASTICSEARCH_CONFIG['indices']
         
+        # 校验向量维度配置与嵌入模型、现有索引是否一致
+        self._validate_vector_config()
+        
         # 提示模板
         self.prompt_template = PromptTemplate.from_template("""
 你是一个专业的商品知识问答助手。请根据以下检索到的知识库信息，准确回答用户问题。
@@ -69,6 +83,37 @@ class ElasticsearchRAGSystem:
         self.rag_chain = None
         self._setup_rag_chain()
     
+    def _validate_vector_config(self) -> bool:
+        """启动时校验向量维度
+        
+        维度不一致时kNN查询和写入都会失败，这里提前记录错误，
+        提示修改 ELASTICSEARCH_CONFIG['vector'] 或重建索引。
+        """
+        configured_dims = ELASTICSEARCH_CONFIG['vector']['dims']
+        model = API_CONFIG['embedding_model']
+        valid = True
+        
+        model_dims = EMBEDDING_MODEL_DIMS.get(model)
+        if model_dims is None:
+            logger.warning(f"未知嵌入模型 {model}，跳过向量维度校验")
+        elif model_dims != configured_dims:
+            logger.error(
+                f"向量维度配置错误: 嵌入模型 {model} 输出 {model_dims} 维，"
+                f"ELASTICSEARCH_CONFIG['vector']['dims'] 为 {configured_dims}"
+            )
+            valid = False
+        
+        for index_key, vector_field in (('knowledge', 'content_vector'), ('conversations', 'question_vector')):
+            index_dims = es_service.get_vector_dims(self.indices[index_key], vector_field)
+            if index_dims is not None and index_dims != configured_dims:
+                logger.error(
+                    f"索引 {self.indices[index_key]} 的 {vector_field} 为 {index_dims} 维，"
+                    f"与配置的 {configured_dims} 维不一致，请以 force_reload 重新初始化知识索引"
+                )
+                valid = False
+        
+        return valid
+    
     def _setup_rag_chain(self):
         """设置RAG链"""
         try:
@@ -93,7 +138,7 @@ class ElasticsearchRAGSystem:
         """检索相关上下文"""
         try:
             # 生成问题向量
-            question_vector = self.embeddings_model.embed_query(question)
+            question_vector = self.query_embeddings.embed_query(question)
             
             # 1. 向量搜索（语义相似度）
             semantic_results = es_service.semantic_search(
@@ -107,7 +152,7 @@ class ElasticsearchRAGSystem:
             text_results = es_service.multi_match_search(
                 index_name=self.indices['knowledge'],
                 query_text=question,
-                fields=['value^2', 'source_text', 'product_name'],
+                fields=self._knowledge_text_fields(),
                 size=top_k
             )
             
@@ -117,22 +162,170 @@ class ElasticsearchRAGSystem:
                 text_results['hits']
             )
             
-            # 构建上下文
-            context_parts = []
-            for i, result in enumerate(all_results[:top_k]):
-                source = result['source']
-                context_parts.append(
-                    f"知识{i+1}：商品：{source.get('product_name', 'N/A')} "
-                    f"| 属性：{source.get('attribute', 'N/A')} "
-                    f"| 内容：{source.get('value', 'N/A')}"
-                )
-            
-            return "\n".join(context_parts) if context_parts else "未找到相关信息"
+            return self._format_context(all_results[:top_k])
             
         except Exception as e:
             logger.error(f"检索上下文失败: {e}")
             return "检索失败"
     
+    def _format_context(self, results: List) -> str:
+        """把检索结果拼接为提示词上下文"""
+        context_parts = []
+        for i, result in enumerate(results):
+            source = result['source']
+            context_parts.append(
+                f"知识{i+1}：商品：{source.get('product_name', 'N/A')} "
+                f"| 属性：{source.get('attribute', 'N/A')} "
+                f"| 内容：{source.get('value', 'N/A')}"
+            )
+        
+        return "\n".join(context_parts) if context_parts else "未找到相关信息"
+    
+    async def aretrieve(self, question: str, top_k: int = 5) -> List:
+        """异步检索：问题向量化与全文检索并发执行，拿到向量后再做kNN检索，返回合并后的结果"""
+        text_task = asyncio.ensure_future(
+            async_es_service.multi_match_search(
+                index_name=self.indices['knowledge'],
+                query_text=question,
+                fields=self._knowledge_text_fields(),
+                size=top_k
+            )
+        )
+        try:
+            question_vector = await self.query_embeddings.aembed_query(question)
+        except Exception:
+            text_task.cancel()
+            raise
+        
+        semantic_results = await async_es_service.semantic_search(
+            index_name=self.indices['knowledge'],
+            vector=question_vector,
+            vector_field="content_vector",
+            size=top_k
+        )
+        text_results = await text_task
+        
+        return self._merge_search_results(semantic_results['hits'], text_results['hits'])[:top_k]
+    
+    async def aask_question(self, question: str, return_source: bool = False) -> Dict:
+        """异步处理用户问题，返回结构同 ask_question
+        
+        检索结果同时用于生成上下文和返回来源，不再为来源单独检索一次。
+        """
+        try:
+            results = await self.aretrieve(question)
+            
+            chain = self.prompt_template | self.llm | StrOutputParser()
+            answer = await chain.ainvoke({
+                "context": self._format_context(results),
+                "question": question
+            })
+            
+            sources = self._format_sources(results[:3]) if return_source else []
+            
+            return {
+                'success': True,
+                'answer': answer,
+                'sources': sources
+            }
+            
+        except Exception as e:
+            logger.error(f"异步问答处理失败: {e}")
+            return {
+                'success': False,
+                'answer': f'处理问题时发生错误: {str(e)}',
+                'sources': []
+            }
+    
+    def batch_retrieve(self, questions: List[str], top_k: int = 5) -> List[List]:
+        """批量检索：未缓存的问题一次 embed_documents 生成向量，kNN与全文检索合并为一次 _msearch
+        
+        Returns:
+            List[List]: 与 questions 一一对应的合并检索结果
+        """
+        question_vectors = self.query_embeddings.embed_queries(questions)
+        num_candidates = ELASTICSEARCH_CONFIG['vector'].get('num_candidates', top_k * 2)
+        
+        bodies = []
+        for question, vector in zip(questions, question_vectors):
+            bodies.append({
+                "knn": {
+                    "field": "content_vector",
+                    "query_vector": vector,
+                    "k": top_k,
+                    "num_candidates": max(num_candidates, top_k)
+                },
+                "size": top_k
+            })
+            bodies.append({
+                "query": {
+                    "multi_match": {
+                        "query": question,
+                        "fields": self._knowledge_text_fields(),
+                        "type": "best_fields"
+                    }
+                },
+                "size": top_k,
+                "min_score": 0.1
+            })
+        
+        responses = es_service.multi_search(self.indices['knowledge'], bodies)
+        return [
+            self._merge_search_results(semantic['hits'], text['hits'])[:top_k]
+            for semantic, text in zip(responses[::2], responses[1::2])
+        ]
+    
+    def ask_questions(self, questions: List[str], return_source: bool = False,
+                      max_concurrency: int = None) -> List[Dict]:
+        """批量处理问题，返回与 questions 一一对应、结构同 ask_question 的结果
+        
+        检索合并为一次向量化和一次 _msearch，大模型生成按 max_concurrency 并发执行，
+        单个问题生成失败不影响其他问题。
+        """
+        if not es_service.is_available():
+            return [{
+                'success': False,
+                'answer': 'Elasticsearch服务不可用，无法处理问题',
+                'sources': []
+            } for _ in questions]
+        
+        try:
+            retrieved = self.batch_retrieve(questions)
+        except Exception as e:
+            logger.error(f"批量检索失败: {e}")
+            return [{
+                'success': False,
+                'answer': f'处理问题时发生错误: {str(e)}',
+                'sources': []
+            } for _ in questions]
+        
+        chain = self.prompt_template | self.llm | StrOutputParser()
+        answers = chain.batch(
+            [
+                {"context": self._format_context(results), "question": question}
+                for question, results in zip(questions, retrieved)
+            ],
+            config={"max_concurrency": max_concurrency or RAG_CONFIG['batch_max_concurrency']},
+            return_exceptions=True
+        )
+        
+        outputs = []
+        for question, results, answer in zip(questions, retrieved, answers):
+            if isinstance(answer, Exception):
+                logger.error(f"批量问答中问题生成失败: {question[:50]} - {answer}")
+                outputs.append({
+                    'success': False,
+                    'answer': f'处理问题时发生错误: {str(answer)}',
+                    'sources': []
+                })
+                continue
+            outputs.append({
+                'success': True,
+                'answer': answer,
+                'sources': self._format_sources(results[:3]) if return_source else []
+            })
+        return outputs
+    
     def _merge_search_results(self, semantic_results: List, text_results: List) -> List:
         """合并搜索结果并去重"""
         merged = {}
@@ -191,7 +384,7 @@ class ElasticsearchRAGSystem:
             sources = []
             if return_source:
                 # 重新检索获取源信息
-                question_vector = self.embeddings_model.embed_query(question)
+                question_vector = self.query_embeddings.embed_query(question)
                 search_results = es_service.semantic_search(
                     index_name=self.indices['knowledge'],
                     vector=question_vector,
@@ -199,20 +392,7 @@ class ElasticsearchRAGSystem:
                     size=3
                 )
                 
-                for result in search_results['hits']:
-                    source_data = result['source']
-                    sources.append({
-                        'source': f"{source_data.get('product_name', 'N/A')} - {source_data.get('attribute', 'N/A')}",
-                        'content': source_data.get('value', 'N/A'),
-                        'score': result['score'],
-                        'metadata': {
-                            'product_name': source_data.get('product_name', 'N/A'),
-                            'brand': source_data.get('brand', 'N/A'),
-                            'category': source_data.get('parent_category', 'N/A'),
-                            'attribute': source_data.get('attribute', 'N/A'),
-                            'product_id': source_data.get('product_id', 'N/A')
-                        }
-                    })
+                sources = self._format_sources(search_results['hits'])
             
             return {
                 'success': True,
@@ -228,6 +408,166 @@ class ElasticsearchRAGSystem:
                 'sources': []
             }
     
+    def _format_sources(self, hits: List) -> List[Dict]:
+        """把检索命中整理为回答来源列表"""
+        sources = []
+        for result in hits:
+            source_data = result['source']
+            sources.append({
+                'source': f"{source_data.get('product_name', 'N/A')} - {source_data.get('attribute', 'N/A')}",
+                'content': source_data.get('value', 'N/A'),
+                'score': result['score'],
+                'metadata': {
+                    'product_name': source_data.get('product_name', 'N/A'),
+                    'brand': source_data.get('brand', 'N/A'),
+                    'category': source_data.get('parent_category', 'N/A'),
+                    'attribute': source_data.get('attribute', 'N/A'),
+                    'product_id': source_data.get('product_id', 'N/A')
+                }
+            })
+        return sources
+    
+    # 知识搜索分面：字段 -> 返回的桶数量
+    FACET_FIELDS = {'category': 20, 'brand': 20, 'attribute': 30}
+    
+    # 知识全文检索的基础字段，查询时展开为n-gram子字段
+    KNOWLEDGE_TEXT_FIELDS = ['value^2', 'source_text', 'product_name']
+    
+    def _knowledge_text_fields(self) -> List[str]:
+        """知识全文检索实际查询的n-gram子字段"""
+        return es_service.ngram_fields(self.KNOWLEDGE_TEXT_FIELDS, prefix_fields=['product_name'])
+    
+    def _build_knowledge_query(self, query: str) -> Dict:
+        """知识库全文检索查询
+        
+        在二元组子字段上做精确词项匹配，不使用 fuzziness 扩展；
+        短查询要求全部词项命中，较长查询至少命中75%。
+        """
+        return {
+            "multi_match": {
+                "query": query,
+                "fields": self._knowledge_text_fields(),
+                "type": "best_fields",
+                "minimum_should_match": "2<75%"
+            }
+        }
+    
+    def _format_knowledge_hit(self, hit: Dict) -> Dict:
+        """把ES命中转换为知识搜索结果"""
+        source = hit['source']
+        return {
+            'id': hit['id'],
+            'product_id': source.get('product_id', 'N/A'),
+            'product_name': source.get('product_name', 'N/A'),
+            'brand': source.get('brand', 'N/A'),
+            'category': source.get('category', 'N/A'),
+            'attribute': source.get('attribute', 'N/A'),
+            'value': source.get('value', 'N/A'),
+            'score': hit['score']
+        }
+    
+    # 知识分页排序：相关性倒序，knowledge_id 唯一，保证不用PIT时 search_after 也有全序
+    KNOWLEDGE_PAGE_SORT = [{'_score': {'order': 'desc'}}, {'knowledge_id': {'order': 'asc'}}]
+    
+    # 首页不带PIT，翻页时才打开；这时游标里的 sort 值还没有 _shard_doc，
+    # 用最大值补齐，knowledge_id 相同的只有上一页最后一条本身，会被正确跳过
+    _SHARD_DOC_MAX = 2 ** 63 - 1
+    
+    @staticmethod
+    def _encode_cursor(pit_id: Optional[str], search_after: List) -> str:
+        """把PIT和search_after编码为不透明游标，首页生成的游标 pit 为None"""
+        payload = json.dumps({'pit': pit_id, 'after': search_after}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+    
+    @staticmethod
+    def _decode_cursor(cursor: str) -> Dict:
+        payload = base64.urlsafe_b64decode(cursor.encode('ascii'))
+        data = json.loads(payload)
+        return {'pit': data['pit'], 'after': data['after']}
+    
+    def search_knowledge_page(self, query: str, filter_by_category: str = None,
+                              filter_by_brand: str = None, filter_by_attribute: str = None,
+                              size: int = 10, cursor: str = None) -> Dict:
+        """分面分页搜索知识库
+        
+        首页（无游标）是一次普通搜索，在同一请求中返回命中、总数和 category/brand/attribute 分面，
+        不打开PIT；大部分搜索只看首页，不会在服务端留下等待过期的PIT。
+        第一次按游标翻页时才打开PIT，之后的页通过游标中的 PIT + search_after 翻页，不再重复计算分面。
+        过滤条件放在 post_filter 中，分面计数不受已选过滤条件影响。
+        
+        Returns:
+            dict: results/total/facets/next_cursor，最后一页 next_cursor 为None
+        """
+        empty = {'results': [], 'total': 0, 'facets': {}, 'next_cursor': None}
+        if not es_service.is_available():
+            return empty
+        
+        try:
+            pit_id, search_after, aggs = None, None, None
+            if cursor:
+                state = self._decode_cursor(cursor)
+                pit_id, search_after = state['pit'], state['after']
+                if not pit_id:
+                    pit_id = es_service.open_point_in_time(self.indices['knowledge'])
+                    if not pit_id:
+                        return empty
+                    search_after = search_after + [self._SHARD_DOC_MAX]
+            else:
+                aggs = {
+                    field: {"terms": {"field": field, "size": bucket_size}}
+                    for field, bucket_size in self.FACET_FIELDS.items()
+                }
+            
+            filters = []
+            if filter_by_category:
+                filters.append({"term": {"category": filter_by_category}})
+            if filter_by_brand:
+                filters.append({"term": {"brand": filter_by_brand}})
+            if filter_by_attribute:
+                filters.append({"term": {"attribute": filter_by_attribute}})
+            
+            result = es_service.search_page(
+                pit_id=pit_id,
+                index_name=self.indices['knowledge'],
+                query=self._build_knowledge_query(query),
+                size=size,
+                search_after=search_after,
+                aggs=aggs,
+                post_filter={"bool": {"filter": filters}} if filters else None,
+                sort=self.KNOWLEDGE_PAGE_SORT
+            )
+            if 'error' in result:
+                if pit_id:
+                    es_service.close_point_in_time(pit_id)
+                return empty
+            
+            hits = result['hits']
+            next_cursor = None
+            if len(hits) == size and hits[-1].get('sort'):
+                next_cursor = self._encode_cursor(result['pit_id'], hits[-1]['sort'])
+            elif result['pit_id']:
+                # 已到最后一页，及时释放PIT
+                es_service.close_point_in_time(result['pit_id'])
+            
+            facets = {
+                field: [
+                    {'value': bucket['key'], 'count': bucket['doc_count']}
+                    for bucket in agg.get('buckets', [])
+                ]
+                for field, agg in result['aggregations'].items()
+            }
+            
+            return {
+                'results': [self._format_knowledge_hit(hit) for hit in hits],
+                'total': result['total'],
+                'facets': facets,
+                'next_cursor': next_cursor
+            }
+            
+        except Exception as e:
+            logger.error(f"分面搜索知识库失败: {e}")
+            return empty
+    
     def search_knowledge(self, query: str, filter_by_category: str = None, 
                         filter_by_brand: str = None, size: int = 10) -> List[Dict]:
         """搜索知识库"""
@@ -238,16 +578,7 @@ class ElasticsearchRAGSystem:
             # 构建搜索查询
             search_query = {
                 "bool": {
-                    "must": [
-                        {
-                            "multi_match": {
-                                "query": query,
-                                "fields": ["value^2", "source_text", "product_name"],
-                                "type": "best_fields",
-                                "fuzziness": "AUTO"
-                            }
-                        }
-                    ]
+                    "must": [self._build_knowledge_query(query)]
                 }
             }
             
@@ -269,21 +600,7 @@ class ElasticsearchRAGSystem:
             )
             
             # 格式化结果
-            formatted_results = []
-            for hit in results['hits']:
-                source = hit['source']
-                formatted_results.append({
-                    'id': hit['id'],
-                    'product_id': source.get('product_id', 'N/A'),
-                    'product_name': source.get('product_name', 'N/A'),
-                    'brand': source.get('brand', 'N/A'),
-                    'category': source.get('category', 'N/A'),
-                    'attribute': source.get('attribute', 'N/A'),
-                    'value': source.get('value', 'N/A'),
-                    'score': hit['score']
-                })
-            
-            return formatted_results
+            return [self._format_knowledge_hit(hit) for hit in results['hits']]
             
         except Exception as e:
             logger.error(f"搜索知识库失败: {e}")
@@ -303,34 +620,83 @@ class ElasticsearchRAGSystem:
                 logger.info("没有找到商品知识数据")
                 return True
             
-            # 批量索引文档
+            knowledge_alias = self.indices['knowledge']
+            
+            # 已索引文档的内容哈希；重建时若向量维度未变，连同向量一起读取以便复用
+            reuse_vectors = force_reload and (
+                es_service.get_vector_dims(knowledge_alias, 'content_vector') == ELASTICSEARCH_CONFIG['vector']['dims']
+            )
+            indexed = self._load_indexed_content(knowledge_alias, with_vectors=reuse_vectors)
+            
+            # 只有嵌入文本变化（或新增）的知识才重新生成向量
             documents = []
+            metadata_updates = {}
+            embedded_count = 0
             for item in knowledge_items:
-                # 生成内容向量
-                content_text = f"{item.attribute} {item.value} {item.source_text}"
-                content_vector = self.embeddings_model.embed_query(content_text)
+                doc = self._knowledge_document(item, item.product)
+                previous = indexed.get(doc['id'])
+                unchanged = previous is not None and previous.get('content_hash') == doc['content_hash']
                 
-                doc = {
-                    'id': f"knowledge_{item.id}",
-                    'knowledge_id': item.id,
-                    'product_id': item.product.product_id,
-                    'product_name': item.product.name,
-                    'brand': item.product.brand,
-                    'category': item.product.category,
-                    'attribute': item.attribute,
-                    'value': item.value,
-                    'source_text': item.source_text,
-                    'content_vector': content_vector,
-                    'created_at': item.created_at.isoformat() if hasattr(item, 'created_at') else None
-                }
+                if unchanged and not force_reload:
+                    metadata_updates[doc['id']] = {k: v for k, v in doc.items() if k != 'id'}
+                    continue
+                
+                if unchanged and previous.get('content_vector'):
+                    doc['content_vector'] = previous['content_vector']
+                else:
+                    doc['content_vector'] = self.embeddings_model.embed_query(
+                        self._content_text(item.attribute, item.value, item.source_text)
+                    )
+                    embedded_count += 1
                 documents.append(doc)
             
-            # 批量索引
-            result = es_service.bulk_index_documents(
-                index_name=self.indices['knowledge'],
-                documents=documents
+            logger.info(
+                f"知识共 {knowledge_items.count()} 条，重新向量化 {embedded_count} 条，"
+                f"仅更新元数据 {len(metadata_updates)} 条"
             )
             
+            # 强制重载：写入新版本索引，校验数量后原子切换别名，期间查询不受影响
+            if force_reload and es_service.client.indices.exists(index=knowledge_alias):
+                bulk_results = {}
+                
+                def populate(new_index):
+                    bulk_results['result'] = es_service.bulk_index_documents(
+                        index_name=new_index,
+                        documents=documents
+                    )
+                    return len(documents)
+                
+                # 沿用现有索引结构，但向量字段按当前配置重建（维度/量化参数可能已调整）
+                definition = es_service.get_index_definition(knowledge_alias) or {}
+                mapping = definition.get('mapping')
+                if mapping:
+                    mapping.setdefault('properties', {})['content_vector'] = es_service.vector_field_mapping()
+                
+                rebuild_result = es_service.rebuild_index(
+                    alias=knowledge_alias,
+                    populate=populate,
+                    mapping=mapping,
+                    settings=definition.get('settings')
+                )
+                if not rebuild_result['success']:
+                    logger.error(f"重建知识索引失败: {rebuild_result.get('error')}")
+                    return False
+                
+                result = bulk_results['result']
+                logger.info(f"知识索引已切换到 {rebuild_result['index']}")
+            else:
+                # 增量写入正在提供查询的索引，保持常规刷新（不进入批量导入模式）；内容未变的只做局部更新
+                result = es_service.bulk_index_documents(
+                    index_name=knowledge_alias,
+                    documents=documents
+                ) if documents else {'success': True, 'success_count': 0}
+                update_result = es_service.bulk_update_documents(knowledge_alias, metadata_updates)
+                if not update_result['success']:
+                    result = update_result
+                elif result['success']:
+                    result['success_count'] += update_result['success_count']
+                logger.info(f"知识索引重新向量化写入 {len(documents)} 条，局部更新 {len(metadata_updates)} 条")
+            
             if result['success']:
                 logger.info(f"成功索引 {result['success_count']} 条知识记录")
                 return True
@@ -342,8 +708,122 @@ class ElasticsearchRAGSystem:
             logger.error(f"索引商品知识失败: {e}")
             return False
     
+    @staticmethod
+    def _content_text(attribute: str, value: str, source_text: str) -> str:
+        """知识向量化所用的文本"""
+        return f"{attribute} {value} {source_text or ''}"
+    
+    @classmethod
+    def _content_hash(cls, attribute: str, value: str, source_text: str) -> str:
+        """向量化文本的哈希，用于判断是否需要重新生成向量"""
+        return hashlib.sha1(cls._content_text(attribute, value, source_text).encode('utf-8')).hexdigest()
+    
+    @classmethod
+    def _knowledge_document(cls, knowledge_item, product) -> Dict:
+        """知识文档（不含向量），product 的名称/品牌/分类作为冗余字段写入"""
+        return {
+            'id': f"knowledge_{knowledge_item.id}",
+            'knowledge_id': knowledge_item.id,
+            'product_id': product.product_id,
+            'product_name': product.name,
+            'brand': product.brand,
+            'category': product.category,
+            'attribute': knowledge_item.attribute,
+            'value': knowledge_item.value,
+            'source_text': knowledge_item.source_text,
+            'content_hash': cls._content_hash(
+                knowledge_item.attribute, knowledge_item.value, knowledge_item.source_text
+            ),
+            'created_at': knowledge_item.created_at.isoformat() if hasattr(knowledge_item, 'created_at') else None
+        }
+    
+    def _load_indexed_content(self, index_name: str, with_vectors: bool = False,
+                              query: Dict = None) -> Dict[str, Dict]:
+        """读取已索引知识的 content_hash（可选连同向量），返回 {文档ID: _source}"""
+        if not es_service.client.indices.exists(index=index_name):
+            return {}
+        
+        fields = ['content_hash', 'content_vector'] if with_vectors else ['content_hash']
+        return {
+            hit['_id']: hit['_source']
+            for hit in scan(
+                es_service.client, index=index_name, _source=fields, size=1000,
+                query={"query": query} if query else None
+            )
+        }
+    
+    def sync_product_knowledge(self, product_id: str) -> Dict:
+        """按数据库中的当前内容增量同步单个商品的全部知识文档
+        
+        嵌入文本变化或新增的知识重新向量化，其余只局部更新冗余字段，数据库中已删除的知识从索引删除。
+        商品本身已删除时删除该商品的全部知识文档。
+        """
+        knowledge_alias = self.indices['knowledge']
+        knowledge_items = list(
+            ProductKnowledge.objects.select_related('product').filter(product__product_id=product_id)
+        )
+        indexed = self._load_indexed_content(knowledge_alias, query={"term": {"product_id": product_id}})
+        
+        documents = []
+        metadata_updates = {}
+        for item in knowledge_items:
+            doc = self._knowledge_document(item, item.product)
+            if indexed.get(doc['id'], {}).get('content_hash') == doc['content_hash']:
+                metadata_updates[doc['id']] = {k: v for k, v in doc.items() if k != 'id'}
+            else:
+                documents.append(doc)
+        
+        if documents:
+            vectors = self.embeddings_model.embed_documents([
+                self._content_text(doc['attribute'], doc['value'], doc['source_text']) for doc in documents
+            ])
+            for doc, vector in zip(documents, vectors):
+                doc['content_vector'] = vector
+            result = es_service.bulk_index_documents(knowledge_alias, documents)
+            if not result['success'] or result['error_count']:
+                return {'success': False, 'error': result.get('error') or result['errors'][:3]}
+        
+        result = es_service.bulk_update_documents(knowledge_alias, metadata_updates)
+        if not result['success'] or result['error_count']:
+            return {'success': False, 'error': result.get('error') or result['errors'][:3]}
+        
+        stale_ids = set(indexed) - {f"knowledge_{item.id}" for item in knowledge_items}
+        for doc_id in stale_ids:
+            if not es_service.delete_document(knowledge_alias, doc_id):
+                return {'success': False, 'error': f'删除知识文档 {doc_id} 失败'}
+        
+        return {
+            'success': True,
+            'embedded': len(documents),
+            'updated': len(metadata_updates),
+            'deleted': len(stale_ids)
+        }
+    
+    def sync_product_metadata(self, product) -> Dict:
+        """商品改名/改品牌/改分类后，同步所有知识文档中的冗余字段
+        
+        通过 update_by_query 在服务端按 product_id 修改，值未变化的文档为noop，不重新向量化。
+        """
+        result = es_service.update_by_query(
+            index_name=self.indices['knowledge'],
+            query={"term": {"product_id": product.product_id}},
+            fields={
+                'product_name': product.name,
+                'brand': product.brand,
+                'category': product.category
+            }
+        )
+        if result.get('version_conflicts'):
+            logger.warning(
+                f"同步商品 {product.product_id} 元数据重试后仍有 {result['version_conflicts']} 条文档版本冲突"
+            )
+        return result
+    
     def update_knowledge(self, product_id: str, attribute: str, value: str, source_text: str = "") -> bool:
-        """更新知识库"""
+        """更新知识库
+        
+        嵌入文本（属性、值、原文）未变化时只对ES文档做局部更新，不重新生成向量。
+        """
         try:
             # 更新数据库
             product = Products.objects.get(product_id=product_id)
@@ -363,25 +843,22 @@ class ElasticsearchRAGSystem:
             
             # 更新Elasticsearch索引
             if es_service.is_available():
-                content_text = f"{attribute} {value} {source_text}"
-                content_vector = self.embeddings_model.embed_query(content_text)
+                doc = self._knowledge_document(knowledge_item, product)
+                doc_id = doc.pop('id')
                 
-                doc = {
-                    'knowledge_id': knowledge_item.id,
-                    'product_id': product_id,
-                    'product_name': product.name,
-                    'brand': product.brand,
-                    'category': product.category,
-                    'attribute': attribute,
-                    'value': value,
-                    'source_text': source_text,
-                    'content_vector': content_vector,
-                    'created_at': datetime.now().isoformat()
-                }
+                indexed = es_service.get_document(
+                    self.indices['knowledge'], doc_id, source_includes=['content_hash']
+                )
+                if indexed and indexed.get('content_hash') == doc['content_hash']:
+                    return es_service.update_document(self.indices['knowledge'], doc_id, doc)
                 
-                es_service.index_document(
+                doc['content_vector'] = self.embeddings_model.embed_query(
+                    self._content_text(attribute, value, source_text)
+                )
+                doc['created_at'] = doc['created_at'] or datetime.now().isoformat()
+                return es_service.index_document(
                     index_name=self.indices['knowledge'],
-                    doc_id=f"knowledge_{knowledge_item.id}",
+                    doc_id=doc_id,
                     document=doc
                 )
             
@@ -391,18 +868,33 @@ class ElasticsearchRAGSystem:
             logger.error(f"更新知识库失败: {e}")
             return False
     
-    def get_similar_questions(self, question: str, limit: int = 5) -> List[str]:
-        """获取相似问题"""
+    def get_similar_questions(self, question: str, limit: int = 5,
+                              recent_partitions: Optional[int] = None) -> List[str]:
+        """获取相似问题
+        
+        未指定 recent_partitions 时优先查询问题聚类中心表（见 QuestionClusters），返回各聚类的规范问法；
+        指定 recent_partitions 或聚类表为空时在对话索引中做kNN：只在最近 recent_partitions 个
+        对话分区中检索（未指定时取配置值），传 0 检索全部分区。
+        """
         try:
+            # 生成问题向量
+            question_vector = self.query_embeddings.embed_query(question)
+            
+            if recent_partitions is None and not QuestionClusters.is_empty():
+                clusters = QuestionClusters.similar(question_vector, limit=limit, exclude=question.strip())
+                return [cluster['question'] for cluster in clusters]
+            
             if not es_service.is_available():
                 return []
             
-            # 生成问题向量
-            question_vector = self.embeddings_model.embed_query(question)
+            if recent_partitions == 0:
+                search_index = self.indices['conversations']
+            else:
+                search_index = ConversationPartitions.recent_indices(recent_partitions)
             
             # 在对话索引中搜索相似问题
             results = es_service.semantic_search(
-                index_name=self.indices['conversations'],
+                index_name=search_index,
                 vector=question_vector,
                 vector_field="question_vector",
                 size=limit * 2  # 获取更多结果用于去重
@@ -430,6 +922,23 @@ class ElasticsearchRAGSystem:
             logger.error(f"获取相似问题失败: {e}")
             return []
     
+    def question_cluster_id(self, question: str) -> Optional[int]:
+        """问题所属的聚类ID（与最近聚类中心的相似度达到归类阈值），用于按意图统计热门问题
+        
+        问题向量在问答时已生成，这里通常命中问题向量缓存。
+        """
+        try:
+            if not RAG_CONFIG['popular_questions_by_cluster'] or QuestionClusters.is_empty():
+                return None
+            question_vector = self.query_embeddings.embed_query(question)
+            clusters = QuestionClusters.similar(
+                question_vector, limit=1, min_similarity=QuestionClusters.CONFIG['assign_threshold']
+            )
+            return clusters[0]['cluster_id'] if clusters else None
+        except Exception as e:
+            logger.warning(f"查询问题聚类失败: {e}")
+            return None
+    
     def index_conversation(self, conversation_id: str, user_id: str, question: str, 
                           answer: str, sources: List[Dict], session_id: str = None) -> bool:
         """索引对话记录"""
@@ -438,7 +947,7 @@ class ElasticsearchRAGSystem:
                 return False
             
             # 生成问题向量
-            question_vector = self.embeddings_model.embed_query(question)
+            question_vector = self.query_embeddings.embed_query(question)
             
             doc = {
                 'conversation_id': conversation_id,
@@ -451,12 +960,17 @@ class ElasticsearchRAGSystem:
                 'created_at': datetime.now().isoformat()
             }
             
-            return es_service.index_document(
+            indexed = es_service.index_document(
                 index_name=self.indices['conversations'],
                 doc_id=conversation_id,
                 document=doc
             )
             
+            # 增量更新问题聚类
+            if indexed:
+                QuestionClusters.add_question(question, question_vector)
+            return indexed
+            
         except Exception as e:
             logger.error(f"索引对话失败: {e}")
             return False
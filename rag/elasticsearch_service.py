@@ -3,7 +3,10 @@ Elasticsearch服务封装类
 提供统一的搜索、索引和管理接口
 """
 import logging
-from typing import Dict, List, Any, Optional, Union
+import re
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Any, Optional, Union, Callable
 from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import ConnectionError, NotFoundError, RequestError
 from config import ELASTICSEARCH_CONFIG, SYSTEM_CONFIG
@@ -15,11 +18,19 @@ from datetime import datetime
 logger = logging.getLogger(__name__)
 
 class ElasticsearchService:
-    """Elasticsearch服务封装类"""
+    """Elasticsearch服务封装类
     
-    def __init__(self):
-        """初始化ES连接"""
-        self.config = ELASTICSEARCH_CONFIG
+    config['indices'] 中的名称均作为读写别名使用，实际数据存放在
+    {别名}_v{N} 版本索引中，所有查询都经过别名读取。
+    """
+    
+    def __init__(self, config: Dict = None):
+        """初始化ES连接
+        
+        Args:
+            config: ES连接配置，默认使用 ELASTICSEARCH_CONFIG（测试中可指向 FakeElasticsearchServer）
+        """
+        self.config = config or ELASTICSEARCH_CONFIG
         self.enabled = SYSTEM_CONFIG.get('use_elasticsearch', True)
         self.client = None
         
@@ -160,6 +171,234 @@ class ElasticsearchService:
             logger.error(f"删除索引失败: {e}")
             return False
     
+    def get_alias_indices(self, alias: str) -> List[str]:
+        """获取别名当前指向的物理索引列表"""
+        if not self.is_available():
+            return []
+        
+        try:
+            if not self.client.indices.exists_alias(name=alias):
+                return []
+            result = self.client.indices.get_alias(name=alias)
+            return sorted(result.keys())
+        except NotFoundError:
+            return []
+        except Exception as e:
+            logger.error(f"获取别名 {alias} 失败: {e}")
+            return []
+    
+    def next_versioned_index(self, alias: str) -> str:
+        """计算别名下一个版本的物理索引名，格式为 {alias}_v{N}"""
+        pattern = re.compile(rf"^{re.escape(alias)}_v(\d+)$")
+        latest = 0
+        try:
+            existing = self.client.indices.get(index=f"{alias}_v*", ignore_unavailable=True)
+            for name in existing.keys():
+                match = pattern.match(name)
+                if match:
+                    latest = max(latest, int(match.group(1)))
+        except Exception as e:
+            logger.warning(f"获取 {alias} 已有版本失败: {e}")
+        return f"{alias}_v{latest + 1}"
+    
+    def switch_alias(self, alias: str, new_index: str, delete_old: bool = False) -> bool:
+        """原子地把读写别名切换到新索引
+        
+        同一个 update_aliases 请求中完成移除旧指向和添加新指向，查询方不会看到
+        空窗期。若存在与别名同名的旧物理索引（别名机制上线前创建的），
+        也在同一请求中通过 remove_index 一并删除。
+        """
+        if not self.is_available():
+            return False
+        
+        try:
+            old_indices = [name for name in self.get_alias_indices(alias) if name != new_index]
+            actions = [{"remove": {"index": name, "alias": alias}} for name in old_indices]
+            
+            legacy_index = (
+                self.client.indices.exists(index=alias)
+                and not self.client.indices.exists_alias(name=alias)
+            )
+            if legacy_index:
+                actions.append({"remove_index": {"index": alias}})
+            
+            actions.append({"add": {"index": new_index, "alias": alias, "is_write_index": True}})
+            self.client.indices.update_aliases(actions=actions)
+            logger.info(f"别名 {alias} 已切换到 {new_index}")
+            
+            if delete_old:
+                for name in old_indices:
+                    self.client.indices.delete(index=name, ignore_unavailable=True)
+                    logger.info(f"已删除旧版本索引: {name}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"切换别名 {alias} 失败: {e}")
+            return False
+    
+    def ensure_aliased_index(self, alias: str, mapping: Dict, settings: Dict = None) -> bool:
+        """确保别名存在；首次创建时建立 {alias}_v1 并指向它
+        
+        与别名同名的旧物理索引保持原样，直到下一次重建时再被替换。
+        """
+        if not self.is_available():
+            return False
+        
+        try:
+            if self.client.indices.exists(index=alias):
+                logger.info(f"索引或别名 {alias} 已存在")
+                return True
+            
+            index_name = self.next_versioned_index(alias)
+            if not self.create_index(index_name, mapping, settings):
+                return False
+            return self.switch_alias(alias, index_name)
+            
+        except Exception as e:
+            logger.error(f"创建别名索引 {alias} 失败: {e}")
+            return False
+    
+    def get_index_definition(self, alias: str) -> Optional[Dict]:
+        """读取别名当前指向索引的mapping和分析器设置，用于按原结构重建"""
+        if not self.is_available():
+            return None
+        
+        try:
+            mappings = self.client.indices.get_mapping(index=alias)
+            settings = self.client.indices.get_settings(index=alias)
+            index_name = next(iter(mappings.keys()))
+            index_settings = settings[index_name]['settings']['index']
+            
+            copied_settings = {
+                "number_of_shards": int(index_settings.get('number_of_shards', 1)),
+                "number_of_replicas": int(index_settings.get('number_of_replicas', 0)),
+            }
+            if 'analysis' in index_settings:
+                copied_settings['analysis'] = index_settings['analysis']
+            
+            return {
+                'mapping': mappings[index_name]['mappings'],
+                'settings': copied_settings
+            }
+        except Exception as e:
+            logger.error(f"读取索引定义 {alias} 失败: {e}")
+            return None
+    
+    def rebuild_index(self, alias: str, populate: Callable[[str], int], mapping: Dict = None,
+                      settings: Dict = None, delete_old: bool = True, bulk_tuning: bool = True) -> Dict:
+        """零停机重建索引
+        
+        流程：
+        1. 新建 {alias}_v{N}
+        2. 在 bulk_load 中调用 populate(index_name) 写入数据，返回期望的文档数
+        3. 校验文档数，一致后原子切换别名；不一致则删除新索引，别名保持不变
+        
+        mapping/settings 为空时沿用别名当前索引的定义。
+        bulk_load 只用于尚未挂到别名上的新索引，不影响正在提供查询的索引；
+        bulk_tuning=False 时按常规刷新写入，用于对比导入吞吐量。
+        """
+        if not self.is_available():
+            return {'success': False, 'error': 'ES不可用'}
+        
+        if mapping is None:
+            definition = self.get_index_definition(alias)
+            if not definition:
+                return {'success': False, 'error': f'无法获取 {alias} 的索引定义'}
+            mapping = definition['mapping']
+            settings = settings or definition['settings']
+        
+        new_index = self.next_versioned_index(alias)
+        try:
+            if not self.create_index(new_index, mapping, settings):
+                return {'success': False, 'error': f'创建索引 {new_index} 失败'}
+            
+            with self.bulk_load(new_index) if bulk_tuning else nullcontext():
+                expected_count = populate(new_index)
+            
+            self.client.indices.refresh(index=new_index)
+            actual_count = self.client.count(index=new_index)['count']
+            if expected_count is not None and actual_count != expected_count:
+                self.client.indices.delete(index=new_index, ignore_unavailable=True)
+                return {
+                    'success': False,
+                    'index': new_index,
+                    'expected_count': expected_count,
+                    'actual_count': actual_count,
+                    'error': f'文档数量不匹配，预期 {expected_count}，实际 {actual_count}，别名未切换'
+                }
+            
+            if not self.switch_alias(alias, new_index, delete_old=delete_old):
+                self.client.indices.delete(index=new_index, ignore_unavailable=True)
+                return {'success': False, 'index': new_index, 'error': f'切换别名 {alias} 失败'}
+            
+            return {
+                'success': True,
+                'index': new_index,
+                'expected_count': expected_count,
+                'actual_count': actual_count
+            }
+            
+        except Exception as e:
+            logger.error(f"重建索引 {alias} 失败: {e}")
+            try:
+                self.client.indices.delete(index=new_index, ignore_unavailable=True)
+            except Exception:
+                pass
+            return {'success': False, 'index': new_index, 'error': str(e)}
+    
+    @contextmanager
+    def bulk_load(self, index_name: str, max_num_segments: int = 1):
+        """批量导入调优上下文
+        
+        进入时把 refresh_interval 设为 -1、number_of_replicas 设为 0；
+        退出时恢复原有设置，强制合并段并只刷新一次。
+        yield 出的字典在退出后包含各阶段耗时，便于统计吞吐量。
+        """
+        timings = {}
+        if not self.is_available():
+            yield timings
+            return
+        
+        original = self._get_dynamic_settings(index_name)
+        self.client.indices.put_settings(
+            index=index_name,
+            settings={"index": {"refresh_interval": "-1", "number_of_replicas": 0}}
+        )
+        logger.info(f"索引 {index_name} 进入批量导入模式，原设置: {original}")
+        
+        load_start = time.time()
+        try:
+            yield timings
+        finally:
+            timings['load_seconds'] = time.time() - load_start
+            finalize_start = time.time()
+            try:
+                # 未显式设置的项恢复为None，即回到ES默认值
+                self.client.indices.put_settings(index=index_name, settings={"index": original})
+                self.client.indices.forcemerge(
+                    index=index_name,
+                    max_num_segments=max_num_segments,
+                    wait_for_completion=True
+                )
+                self.client.indices.refresh(index=index_name)
+            except Exception as e:
+                logger.error(f"恢复索引 {index_name} 设置失败: {e}")
+            timings['finalize_seconds'] = time.time() - finalize_start
+            logger.info(
+                f"索引 {index_name} 批量导入结束: 导入 {timings['load_seconds']:.2f}s, "
+                f"恢复与合并 {timings['finalize_seconds']:.2f}s"
+            )
+    
+    def _get_dynamic_settings(self, index_name: str) -> Dict:
+        """读取批量导入会修改的动态设置，未显式设置的项返回None"""
+        result = self.client.indices.get_settings(index=index_name)
+        # 别名可能对应多个索引，以第一个为准
+        index_settings = next(iter(result.values()))['settings']['index']
+        return {
+            "refresh_interval": index_settings.get('refresh_interval'),
+            "number_of_replicas": index_settings.get('number_of_replicas')
+        }
+    
     def index_document(self, index_name: str, doc_id: str, document: Dict) -> bool:
         """索引单个文档"""
         if not self.is_available():
@@ -240,7 +479,7 @@ class ElasticsearchService:
             return {'success': False, 'error': str(e)}
     
     def search_documents(self, index_name: str, query: Dict, size: int = 10, 
-                        from_: int = 0, sort: List = None) -> Dict:
+                        from_: int = 0, sort: List = None, min_score: float = None) -> Dict:
         """搜索文档"""
         if not self.is_available():
             return {'hits': [], 'total': 0, 'took': 0}
@@ -254,70 +493,245 @@ class ElasticsearchService:
             
             if sort:
                 body['sort'] = sort
+            if min_score is not None:
+                body['min_score'] = min_score
             
             result = self.client.search(index=index_name, body=body)
+            return self._format_search_result(result)
+            
+        except Exception as e:
+            logger.error(f"搜索失败: {e}")
+            return {'hits': [], 'total': 0, 'took': 0, 'error': str(e)}
+    
+    @staticmethod
+    def _format_search_result(result: Dict) -> Dict:
+        """格式化搜索响应"""
+        hits = []
+        for hit in result['hits']['hits']:
+            hits.append({
+                'id': hit['_id'],
+                'score': hit['_score'],
+                'source': hit['_source']
+            })
+        
+        return {
+            'hits': hits,
+            'total': result['hits']['total']['value'],
+            'took': result['took'],
+            'max_score': result['hits']['max_score']
+        }
+    
+    def multi_search(self, index_name: str, bodies: List[Dict]) -> List[Dict]:
+        """在一次 _msearch 请求中执行多个搜索
+        
+        Args:
+            index_name: 索引名或别名
+            bodies: 搜索请求体列表（query/knn/size等）
+        
+        Returns:
+            List[Dict]: 与 bodies 一一对应、结构同 search_documents 的结果；单个搜索失败时该项带 'error'
+        """
+        if not self.is_available():
+            return [{'hits': [], 'total': 0, 'took': 0} for _ in bodies]
+        if not bodies:
+            return []
+        
+        try:
+            searches = []
+            for body in bodies:
+                searches.append({'index': index_name})
+                searches.append(body)
+            
+            result = self.client.msearch(searches=searches)
+            
+            responses = []
+            for response in result['responses']:
+                if 'error' in response:
+                    logger.error(f"批量搜索中的子查询失败: {response['error']}")
+                    responses.append({'hits': [], 'total': 0, 'took': 0, 'error': str(response['error'])})
+                else:
+                    responses.append(self._format_search_result(response))
+            return responses
+            
+        except Exception as e:
+            logger.error(f"批量搜索失败: {e}")
+            return [{'hits': [], 'total': 0, 'took': 0, 'error': str(e)} for _ in bodies]
+    
+    def open_point_in_time(self, index_name: str, keep_alive: str = "1m") -> Optional[str]:
+        """打开时间点（PIT），分页期间看到一致的索引快照"""
+        if not self.is_available():
+            return None
+        
+        try:
+            result = self.client.open_point_in_time(index=index_name, keep_alive=keep_alive)
+            return result['id']
+        except Exception as e:
+            logger.error(f"打开PIT失败: {e}")
+            return None
+    
+    def close_point_in_time(self, pit_id: str) -> bool:
+        """关闭时间点，释放服务端资源"""
+        if not self.is_available() or not pit_id:
+            return False
+        
+        try:
+            self.client.close_point_in_time(id=pit_id)
+            return True
+        except NotFoundError:
+            return True
+        except Exception as e:
+            logger.warning(f"关闭PIT失败: {e}")
+            return False
+    
+    def search_page(self, pit_id: Optional[str], query: Dict, size: int = 10, search_after: List = None,
+                    aggs: Dict = None, post_filter: Dict = None, keep_alive: str = "1m",
+                    index_name: str = None, sort: List = None) -> Dict:
+        """基于PIT + search_after 的分页搜索
+        
+        同一请求中可以带上聚合（首页取分面）。默认按相关性倒序，PIT会自动追加
+        _shard_doc 作为唯一的tiebreaker，最后一条命中的 sort 值即下一页的 search_after。
+        pit_id 为None时直接搜索 index_name，不占用服务端的PIT资源。
+        """
+        if not self.is_available():
+            return {'hits': [], 'total': 0, 'took': 0, 'aggregations': {}, 'pit_id': pit_id}
+        
+        try:
+            body = {
+                'query': query,
+                'size': size,
+                'sort': sort or [{'_score': {'order': 'desc'}}],
+                'track_total_hits': True
+            }
+            if pit_id:
+                body['pit'] = {'id': pit_id, 'keep_alive': keep_alive}
+            if search_after:
+                body['search_after'] = search_after
+            if aggs:
+                body['aggs'] = aggs
+            if post_filter:
+                body['post_filter'] = post_filter
+            
+            result = self.client.search(body=body) if pit_id else self.client.search(index=index_name, body=body)
             
-            # 格式化结果
             hits = []
             for hit in result['hits']['hits']:
                 hits.append({
                     'id': hit['_id'],
                     'score': hit['_score'],
-                    'source': hit['_source']
+                    'source': hit['_source'],
+                    'sort': hit.get('sort')
                 })
             
             return {
                 'hits': hits,
                 'total': result['hits']['total']['value'],
                 'took': result['took'],
-                'max_score': result['hits']['max_score']
+                'aggregations': result.get('aggregations', {}),
+                # PIT id 可能在每次搜索后更新，后续请求应使用最新值
+                'pit_id': result.get('pit_id', pit_id)
             }
             
         except Exception as e:
-            logger.error(f"搜索失败: {e}")
-            return {'hits': [], 'total': 0, 'took': 0, 'error': str(e)}
+            logger.error(f"分页搜索失败: {e}")
+            return {'hits': [], 'total': 0, 'took': 0, 'aggregations': {}, 'pit_id': pit_id, 'error': str(e)}
     
     def multi_match_search(self, index_name: str, query_text: str, fields: List[str], 
-                          size: int = 10, min_score: float = 0.1) -> Dict:
-        """多字段匹配搜索"""
-        search_query = {
-            "bool": {
-                "must": [
-                    {
-                        "multi_match": {
-                            "query": query_text,
-                            "fields": fields,
-                            "type": "best_fields",
-                            "fuzziness": "AUTO"
-                        }
-                    }
-                ],
-                "filter": [
-                    {
-                        "range": {
-                            "_score": {
-                                "gte": min_score
-                            }
-                        }
-                    }
-                ]
-            }
+                          size: int = 10, min_score: float = 0.1, fuzziness: str = None,
+                          minimum_should_match: str = None) -> Dict:
+        """多字段匹配搜索
+        
+        默认不做模糊扩展，配合 ngram_fields() 在n-gram子字段上做精确词项匹配；
+        需要旧的模糊查询时显式传入 fuzziness="AUTO"。
+        """
+        multi_match = {
+            "query": query_text,
+            "fields": fields,
+            "type": "best_fields"
         }
+        if fuzziness:
+            multi_match["fuzziness"] = fuzziness
+        if minimum_should_match:
+            multi_match["minimum_should_match"] = minimum_should_match
+        
+        return self.search_documents(
+            index_name, {"multi_match": multi_match}, size=size, min_score=min_score
+        )
+    
+    def ngram_fields(self, fields: List[str], prefix_fields: List[str] = ()) -> List[str]:
+        """把基础字段展开为n-gram子字段，保留权重
         
-        return self.search_documents(index_name, search_query, size=size)
+        例如 ["value^2", "product_name"] -> ["value.bigram^2", "product_name.bigram"]；
+        prefix_fields 中的字段额外加入 .prefix 子字段，启用jieba插件时加入 .jieba 子字段。
+        """
+        use_jieba = self.config.get('analysis_plugin') == 'jieba'
+        expanded = []
+        for field in fields:
+            name, _, boost = field.partition('^')
+            suffix = f"^{boost}" if boost else ""
+            expanded.append(f"{name}.bigram{suffix}")
+            if name in prefix_fields:
+                expanded.append(f"{name}.prefix{suffix}")
+            if use_jieba:
+                expanded.append(f"{name}.jieba{suffix}")
+        return expanded
+    
+    def vector_field_mapping(self, vector_config: Dict = None) -> Dict:
+        """根据 config['vector'] 生成 dense_vector 字段映射"""
+        vector_config = vector_config or self.config['vector']
+        mapping = {
+            "type": "dense_vector",
+            "dims": vector_config['dims'],
+            "index": True,
+            "similarity": vector_config.get('similarity', 'cosine')
+        }
+        index_options = {
+            key: value
+            for key, value in vector_config.get('index_options', {}).items()
+            if value is not None
+        }
+        # flat类索引不接受HNSW图参数
+        if index_options.get('type', '').endswith('flat'):
+            index_options.pop('m', None)
+            index_options.pop('ef_construction', None)
+        if index_options:
+            mapping["index_options"] = index_options
+        return mapping
+    
+    def get_vector_dims(self, index_name: str, vector_field: str) -> Optional[int]:
+        """读取索引中向量字段的实际维度，索引或字段不存在时返回None"""
+        if not self.is_available():
+            return None
+        
+        try:
+            result = self.client.indices.get_field_mapping(index=index_name, fields=vector_field)
+            for index_mapping in result.values():
+                field = index_mapping.get('mappings', {}).get(vector_field)
+                if field:
+                    leaf_name = vector_field.split('.')[-1]
+                    return field['mapping'][leaf_name].get('dims')
+            return None
+        except Exception as e:
+            logger.warning(f"读取向量字段 {index_name}.{vector_field} 映射失败: {e}")
+            return None
     
     def semantic_search(self, index_name: str, vector: List[float], 
                        vector_field: str = "embedding", size: int = 10,
-                       filter_query: Dict = None) -> Dict:
-        """语义向量搜索"""
+                       filter_query: Dict = None, num_candidates: int = None) -> Dict:
+        """语义向量搜索
+        
+        num_candidates 为空时取 config['vector']['num_candidates']，且不小于 size。
+        """
         try:
+            if num_candidates is None:
+                num_candidates = self.config.get('vector', {}).get('num_candidates', size * 2)
+            
             # 使用正确的kNN搜索格式
             body = {
                 "knn": {
                     "field": vector_field,
                     "query_vector": vector,
                     "k": size,
-                    "num_candidates": size * 2
+                    "num_candidates": max(num_candidates, size)
                 },
                 "size": size
             }
@@ -351,13 +765,13 @@ class ElasticsearchService:
             fallback_query = filter_query or {"match_all": {}}
             return self.search_documents(index_name, fallback_query, size=size)
     
-    def get_document(self, index_name: str, doc_id: str) -> Optional[Dict]:
-        """获取单个文档"""
+    def get_document(self, index_name: str, doc_id: str, source_includes: List[str] = None) -> Optional[Dict]:
+        """获取单个文档，source_includes 指定只返回的字段（如跳过向量字段）"""
         if not self.is_available():
             return None
         
         try:
-            result = self.client.get(index=index_name, id=doc_id)
+            result = self.client.get(index=index_name, id=doc_id, source_includes=source_includes)
             return result['_source']
         except NotFoundError:
             return None
@@ -365,6 +779,147 @@ class ElasticsearchService:
             logger.error(f"获取文档失败: {e}")
             return None
     
+    def update_document(self, index_name: str, doc_id: str, partial: Dict) -> bool:
+        """局部更新文档，只修改 partial 中的字段；字段值未变化时ES按noop处理，不产生新版本"""
+        if not self.is_available():
+            return False
+        
+        try:
+            partial = dict(partial, indexed_at=datetime.now().isoformat())
+            result = self.client.update(
+                index=index_name,
+                id=doc_id,
+                doc=partial,
+                retry_on_conflict=3
+            )
+            return result['result'] in ['updated', 'noop']
+        except NotFoundError:
+            logger.info(f"文档不存在，无法局部更新: {doc_id}")
+            return False
+        except Exception as e:
+            logger.error(f"局部更新文档失败: {e}")
+            return False
+    
+    def bulk_update_documents(self, index_name: str, updates: Dict[str, Dict]) -> Dict:
+        """批量局部更新，updates 为 {文档ID: 需要修改的字段}，返回结构同 bulk_index_documents"""
+        if not self.is_available():
+            return {'success': False, 'error': 'ES不可用'}
+        if not updates:
+            return {'success': True, 'total': 0, 'success_count': 0, 'error_count': 0, 'errors': []}
+        
+        try:
+            indexed_at = datetime.now().isoformat()
+            actions = []
+            for doc_id, partial in updates.items():
+                actions.append({"update": {"_index": index_name, "_id": doc_id, "retry_on_conflict": 3}})
+                actions.append({"doc": dict(partial, indexed_at=indexed_at)})
+            
+            result = self.client.bulk(body=actions)
+            
+            success_count = 0
+            errors = []
+            for item in result['items']:
+                if item['update'].get('status') in [200, 201]:
+                    success_count += 1
+                else:
+                    errors.append(item['update'])
+            
+            logger.info(f"批量局部更新完成: 成功{success_count}, 失败{len(errors)}")
+            return {
+                'success': True,
+                'total': len(updates),
+                'success_count': success_count,
+                'error_count': len(errors),
+                'errors': errors
+            }
+            
+        except Exception as e:
+            logger.error(f"批量局部更新失败: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    # 把 params.fields 中的字段写入 _source，全部未变化时标记为noop，不重写文档
+    SET_FIELDS_SCRIPT = (
+        "boolean changed = false; "
+        "for (entry in params.fields.entrySet()) { "
+        "if (ctx._source[entry.getKey()] != entry.getValue()) { "
+        "ctx._source[entry.getKey()] = entry.getValue(); changed = true; } } "
+        "if (!changed) { ctx.op = 'noop'; }"
+    )
+    
+    def update_by_query(self, index_name: str, query: Dict, fields: Dict, conflict_retries: int = 3,
+                        retry_delay: float = 0.2) -> Dict:
+        """把匹配 query 的所有文档的 fields 字段设为给定值（服务端执行，不传输文档）
+        
+        有版本冲突时整体重试（已是目标值的文档为noop），最多 conflict_retries 次；
+        重试后仍有冲突视为失败，调用方应保留任务稍后再试。
+        
+        Returns:
+            Dict: success、updated（实际修改数）、noops（值未变化数）、version_conflicts（最后一次的冲突数）
+        """
+        if not self.is_available():
+            return {'success': False, 'error': 'ES不可用'}
+        
+        try:
+            updated = noops = 0
+            for attempt in range(conflict_retries + 1):
+                if attempt:
+                    time.sleep(retry_delay * attempt)
+                result = self.client.update_by_query(
+                    index=index_name,
+                    query=query,
+                    script={
+                        "source": self.SET_FIELDS_SCRIPT,
+                        "lang": "painless",
+                        "params": {"fields": fields}
+                    },
+                    conflicts="proceed",
+                    refresh=True,
+                    wait_for_completion=True
+                )
+                updated += result.get('updated', 0)
+                noops += result.get('noops', 0)
+                version_conflicts = result.get('version_conflicts', 0)
+                if result.get('failures') or not version_conflicts or attempt == conflict_retries:
+                    break
+                logger.warning(f"按查询更新 {index_name} 有 {version_conflicts} 条版本冲突，第 {attempt + 1} 次重试")
+            
+            response = {
+                'success': not result.get('failures') and not version_conflicts,
+                'updated': updated,
+                'noops': noops,
+                'version_conflicts': version_conflicts,
+                'failures': result.get('failures', [])
+            }
+            if version_conflicts:
+                response['error'] = f"重试后仍有 {version_conflicts} 条文档版本冲突"
+            return response
+        except Exception as e:
+            logger.error(f"按查询更新失败: {e}")
+            return {'success': False, 'error': str(e)}
+    
+    def delete_by_query(self, index_name: str, query: Dict) -> Dict:
+        """删除匹配 query 的所有文档"""
+        if not self.is_available():
+            return {'success': False, 'error': 'ES不可用'}
+        
+        try:
+            result = self.client.delete_by_query(
+                index=index_name,
+                query=query,
+                conflicts="proceed",
+                refresh=True
+            )
+            return {
+                'success': not result.get('failures'),
+                'deleted': result.get('deleted', 0),
+                'failures': result.get('failures', [])
+            }
+        except NotFoundError:
+            return {'success': True, 'deleted': 0, 'failures': []}
+        except Exception as e:
+            logger.error(f"按查询删除失败: {e}")
+            return {'success': False, 'error': str(e)}
+    
     def delete_document(self, index_name: str, doc_id: str) -> bool:
         """删除文档"""
         if not self.is_available():
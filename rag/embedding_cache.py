@@ -0,0 +1,246 @@
+"""
+问题向量缓存
+在嵌入模型前加两级缓存：进程内LRU + Redis共享缓存，热门问题不再调用嵌入接口。
+缓存键为规范化后的问题文本 + 模型名 + 维度，向量以 float16 字节存入Redis。
+只用于用户问题（查询向量），知识文档的向量化不经过缓存。
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from asgiref.sync import sync_to_async
+
+from config import API_CONFIG, ELASTICSEARCH_CONFIG, REDIS_CONFIG, RAG_CONFIG
+from redis_pool import get_redis_client
+from text_normalizer import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# 向量以字节存储，使用不解码响应的连接
+redis_client = get_redis_client(REDIS_CONFIG['rag_db'], decode_responses=False)
+
+
+def normalize_question(question: str) -> str:
+    """规范化问题文本：全角转半角、去首尾空白、合并空白、小写"""
+    return normalize_text(question)
+
+
+class QueryEmbeddingCache:
+    """问题向量两级缓存
+
+    Redis 结构（rag_db）：
+    - query_embedding:{模型}:{维度}:{sha1}  STRING float16向量字节，带过期时间
+    - query_embedding:stats                 HASH 各进程定期累加的命中统计
+
+    统计在进程内计数，每 STATS_FLUSH_SECONDS 秒合并写入Redis一次，查询路径上不额外访问Redis。
+    """
+
+    KEY_PREFIX = "query_embedding:"
+    STATS_KEY = f"{KEY_PREFIX}stats"
+    STATS_FIELDS = ('local_hits', 'redis_hits', 'misses')
+    STATS_FLUSH_SECONDS = 10
+
+    def __init__(self, embeddings_model, model_name: str = None, dims: int = None,
+                 max_size: int = None, ttl: int = None):
+        """
+        Args:
+            embeddings_model: LangChain嵌入模型
+            model_name: 模型名，参与缓存键，默认取 API_CONFIG['embedding_model']
+            dims: 向量维度，参与缓存键，默认取 ELASTICSEARCH_CONFIG['vector']['dims']
+            max_size: 进程内LRU最多缓存的问题数
+            ttl: Redis缓存过期秒数
+        """
+        self.embeddings_model = embeddings_model
+        self.model_name = model_name or API_CONFIG['embedding_model']
+        self.dims = dims or ELASTICSEARCH_CONFIG['vector']['dims']
+        self.max_size = max_size or RAG_CONFIG['query_embedding_cache_size']
+        self.ttl = ttl or RAG_CONFIG['query_embedding_cache_ttl']
+
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(self.STATS_FIELDS, 0)
+        self._pending_stats = dict.fromkeys(self.STATS_FIELDS, 0)
+        self._last_flush = time.time()
+
+    def _key(self, normalized: str) -> str:
+        digest = hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+        return f"{self.KEY_PREFIX}{self.model_name}:{self.dims}:{digest}"
+
+    @staticmethod
+    def _encode(vector: List[float]) -> bytes:
+        return np.asarray(vector, dtype=np.float16).tobytes()
+
+    @staticmethod
+    def _decode(data: bytes) -> List[float]:
+        return np.frombuffer(data, dtype=np.float16).astype(np.float32).tolist()
+
+    def _count(self, field: str, amount: int = 1):
+        with self._lock:
+            self._stats[field] += amount
+            self._pending_stats[field] += amount
+
+    def _take_pending_stats(self) -> Optional[Dict[str, int]]:
+        """距上次写入超过 STATS_FLUSH_SECONDS 时取出待写入的统计，否则返回None"""
+        with self._lock:
+            if time.time() - self._last_flush < self.STATS_FLUSH_SECONDS:
+                return None
+            pending = self._pending_stats
+            self._pending_stats = dict.fromkeys(self.STATS_FIELDS, 0)
+            self._last_flush = time.time()
+        return pending
+
+    def _flush_stats(self):
+        pending = self._take_pending_stats()
+        if pending:
+            self._write_stats(pending)
+
+    def _write_stats(self, pending: Dict[str, int]):
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for name, value in pending.items():
+                if value:
+                    pipe.hincrby(self.STATS_KEY, name, value)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"写入问题向量缓存统计失败: {e}")
+
+    def _get_local(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            vector = self._local.get(key)
+            if vector is not None:
+                self._local.move_to_end(key)
+            return vector
+
+    def _set_local(self, key: str, vector: List[float]):
+        with self._lock:
+            self._local[key] = vector
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_size:
+                self._local.popitem(last=False)
+
+    def _lookup(self, questions: List[str]) -> Dict[str, Optional[List[float]]]:
+        """按缓存键查找进程内缓存和Redis，返回 {缓存键: 向量或None}"""
+        found = {}
+        remote_keys = []
+        for question in questions:
+            key = self._key(normalize_question(question))
+            if key in found:
+                continue
+            vector = self._get_local(key)
+            found[key] = vector
+            if vector is None:
+                remote_keys.append(key)
+        self._count('local_hits', len(found) - len(remote_keys))
+
+        if remote_keys:
+            try:
+                values = redis_client.mget(remote_keys)
+            except Exception as e:
+                logger.warning(f"读取问题向量缓存失败: {e}")
+                values = [None] * len(remote_keys)
+            redis_hits = 0
+            for key, data in zip(remote_keys, values):
+                if data:
+                    found[key] = self._decode(data)
+                    self._set_local(key, found[key])
+                    redis_hits += 1
+            self._count('redis_hits', redis_hits)
+            self._count('misses', len(remote_keys) - redis_hits)
+        self._flush_stats()
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]):
+        """写入新生成的向量；进程内缓存保存原始精度，Redis保存float16"""
+        for key, vector in vectors.items():
+            self._set_local(key, vector)
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key, vector in vectors.items():
+                pipe.setex(key, self.ttl, self._encode(vector))
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"写入问题向量缓存失败: {e}")
+
+    def embed_query(self, question: str) -> List[float]:
+        """获取单个问题的向量"""
+        return self.embed_queries([question])[0]
+
+    def embed_queries(self, questions: List[str]) -> List[List[float]]:
+        """批量获取问题向量
+
+        只有一个问题未命中时调用 embed_query；多个未命中的问题合并为一次 embed_documents 调用。
+        """
+        found = self._lookup(questions)
+        keys = [self._key(normalize_question(question)) for question in questions]
+
+        missing = {}
+        for question, key in zip(questions, keys):
+            if found[key] is None and key not in missing:
+                missing[key] = question
+        if len(missing) == 1:
+            key, question = next(iter(missing.items()))
+            generated = {key: self.embeddings_model.embed_query(question)}
+            self._store(generated)
+            found.update(generated)
+        elif missing:
+            vectors = self.embeddings_model.embed_documents(list(missing.values()))
+            generated = dict(zip(missing.keys(), vectors))
+            self._store(generated)
+            found.update(generated)
+
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, question: str) -> List[float]:
+        """异步获取单个问题的向量；缓存命中时不调用嵌入接口
+
+        进程内缓存直接读取，Redis读写在线程池中执行，不阻塞事件循环。
+        """
+        key = self._key(normalize_question(question))
+        vector = self._get_local(key)
+        if vector is not None:
+            self._count('local_hits')
+            pending = self._take_pending_stats()
+            if pending:
+                await sync_to_async(self._write_stats, thread_sensitive=False)(pending)
+            return vector
+
+        vector = (await sync_to_async(self._lookup, thread_sensitive=False)([question]))[key]
+        if vector is None:
+            vector = await self.embeddings_model.aembed_query(question)
+            await sync_to_async(self._store, thread_sensitive=False)({key: vector})
+        return vector
+
+    def stats(self) -> Dict:
+        """命中统计：当前进程与全部进程（Redis累计）"""
+        with self._lock:
+            process_stats = dict(self._stats)
+            local_size = len(self._local)
+
+        try:
+            raw = redis_client.hgetall(self.STATS_KEY)
+            cluster_stats = {field: int(raw.get(field.encode(), 0)) for field in self.STATS_FIELDS}
+        except Exception as e:
+            logger.warning(f"读取问题向量缓存统计失败: {e}")
+            cluster_stats = None
+
+        def with_rates(counts):
+            total = sum(counts.values())
+            return {
+                **counts,
+                'total': total,
+                'hit_rate': round((counts['local_hits'] + counts['redis_hits']) / total, 4) if total else 0.0,
+                'local_hit_rate': round(counts['local_hits'] / total, 4) if total else 0.0
+            }
+
+        return {
+            'model': self.model_name,
+            'dims': self.dims,
+            'local_size': local_size,
+            'local_max_size': self.max_size,
+            'process': with_rates(process_stats),
+            'all_processes': with_rates(cluster_stats) if cluster_stats is not None else None
+        }
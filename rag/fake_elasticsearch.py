@@ -0,0 +1,1684 @@
+"""
+内存版Elasticsearch替身
+在进程内以HTTP服务的形式实现本项目用到的ES API子集，数据只保存在内存中，
+用于在没有ES集群的环境下做集成测试和离线压测。
+
+支持的接口：
+- 集群：ping/info、_cat/indices、ILM策略、索引模板
+- 索引：创建（含日期数学索引名、模板）、删除、存在判断、mapping/settings、别名、rollover、
+  refresh/forcemerge（只统计段数）、stats（含文档数、存储大小、段数）、_reindex（可用脚本移除字段）
+- 文档：index/create/get/delete/_update、_bulk、_update_by_query、_delete_by_query
+- 查询：_search/_msearch/_count，支持 match_all、match、match_phrase、multi_match、term、terms、range、
+  exists、ids、bool、nested、script_score（向量相似度函数）、顶层 knn，以及 terms/max/min/avg/sum/
+  value_count 聚合、post_filter、排序、min_score、PIT + search_after、scroll
+
+文本用简化分析器处理：英文/数字按词切分并转小写，中文输出单字和相邻二元组；
+.bigram/.prefix/.keyword/.jieba 子字段按其类型解析到源字段。倒排索引用于候选文档筛选和
+BM25打分所需的统计，向量按字段保存后暴力计算相似度。
+
+用法:
+    server = FakeElasticsearchServer(port=0).start()
+    service = ElasticsearchService(config={**ELASTICSEARCH_CONFIG, 'host': '127.0.0.1',
+                                           'port': server.port, 'use_ssl': False})
+    ...
+    server.stop()
+或者 python manage.py run_fake_elasticsearch --port 9200
+"""
+import copy
+import fnmatch
+import functools
+import json
+import logging
+import math
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+# 文本子字段：由源字段值派生，不单独存在于 _source 中
+TEXT_SUBFIELDS = {'bigram', 'prefix', 'jieba'}
+
+_WORD_PATTERN = re.compile(r"[a-z0-9]+|[㐀-鿿]")
+_DATE_MATH_PATTERN = re.compile(r"\{now(?:/([yMwdhHm]))?(?:\{([^}]*)\})?\}")
+_SCRIPT_VECTOR_PATTERN = re.compile(r"(cosineSimilarity|dotProduct|l2norm)\(params\.(\w+),\s*'([^']+)'\)")
+
+
+class FakeElasticsearchError(Exception):
+    """以ES错误格式返回给客户端的异常"""
+
+    def __init__(self, status: int, error_type: str, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.error_type = error_type
+        self.reason = reason
+
+    def to_response(self) -> Dict:
+        return {
+            "error": {
+                "root_cause": [{"type": self.error_type, "reason": self.reason}],
+                "type": self.error_type,
+                "reason": self.reason
+            },
+            "status": self.status
+        }
+
+
+def _index_not_found(name: str) -> FakeElasticsearchError:
+    return FakeElasticsearchError(404, "index_not_found_exception", f"no such index [{name}]")
+
+
+def analyze(text, bigrams: bool = True, unigrams: bool = True) -> List[str]:
+    """简化分析器：英文/数字按词切分并转小写，中文输出单字和/或相邻二元组
+
+    只输出二元组时，孤立的单个汉字仍作为单字输出（与 cjk_bigram 过滤器一致）。
+    """
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    tokens = []
+    cjk_runs = []
+    previous_end = None
+    for match in _WORD_PATTERN.finditer(text):
+        token = match.group()
+        if len(token) == 1 and token >= '㐀':
+            if cjk_runs and previous_end == match.start():
+                cjk_runs[-1].append(token)
+            else:
+                cjk_runs.append([token])
+            previous_end = match.end()
+        else:
+            tokens.append(token)
+            previous_end = None
+
+    for run in cjk_runs:
+        if unigrams or len(run) == 1:
+            tokens.extend(run)
+        if bigrams:
+            tokens.extend(first + second for first, second in zip(run, run[1:]))
+    return tokens
+
+
+def _prefix_words(text) -> List[str]:
+    return re.findall(r"\w+", unicodedata.normalize('NFKC', str(text)).lower())
+
+
+def _get_values(source, path: str) -> List:
+    """按点分路径取出所有叶子值，途经的列表会被展开"""
+    values = [source]
+    for part in path.split('.'):
+        next_values = []
+        for value in values:
+            if isinstance(value, list):
+                candidates = value
+            else:
+                candidates = [value]
+            for candidate in candidates:
+                if isinstance(candidate, dict) and part in candidate:
+                    next_values.append(candidate[part])
+        values = next_values
+    flattened = []
+    for value in values:
+        if isinstance(value, list) and not (value and all(isinstance(v, (int, float)) for v in value)):
+            flattened.extend(v for v in value if v is not None)
+        elif value is not None:
+            flattened.append(value)
+    return flattened
+
+
+def _expand_dotted(settings: Dict) -> Dict:
+    """把 "index.refresh_interval" 形式的键展开为嵌套字典，并去掉顶层 index 层级"""
+    expanded = {}
+    for key, value in (settings or {}).items():
+        target = expanded
+        parts = key.split('.')
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        if isinstance(value, dict) and isinstance(target.get(parts[-1]), dict):
+            target[parts[-1]].update(value)
+        else:
+            target[parts[-1]] = value
+    if isinstance(expanded.get('index'), dict):
+        index_settings = expanded.pop('index')
+        index_settings.update(expanded)
+        expanded = index_settings
+    return expanded
+
+
+def _settings_value(value):
+    """ES以字符串返回设置项的标量值"""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return value
+
+
+def _parse_minimum_should_match(spec, clause_count: int) -> int:
+    """解析 minimum_should_match，支持整数、百分比和 "2<75%" 组合形式"""
+    if spec is None or clause_count == 0:
+        return min(1, clause_count)
+    spec = str(spec).strip()
+    if '<' in spec:
+        threshold, _, rest = spec.partition('<')
+        if clause_count <= int(threshold):
+            return clause_count
+        spec = rest
+    if spec.endswith('%'):
+        percent = int(spec[:-1])
+        required = int(clause_count * abs(percent) / 100)
+        required = clause_count - required if percent < 0 else required
+    else:
+        required = int(spec)
+        required = clause_count + required if required < 0 else required
+    return max(1, min(clause_count, required))
+
+
+def _parse_time_value(value: str) -> float:
+    """把 30d/12h/5m/10s 等时间值转换为秒"""
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    match = re.fullmatch(r"(\d+)(ms|s|m|h|d)", str(value))
+    if not match:
+        raise FakeElasticsearchError(400, "illegal_argument_exception", f"failed to parse time value [{value}]")
+    return int(match.group(1)) * units[match.group(2)]
+
+
+def _parse_byte_size(value: str) -> int:
+    units = {'b': 1, 'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3, 'tb': 1024 ** 4}
+    match = re.fullmatch(r"(\d+)(b|kb|mb|gb|tb)", str(value).lower())
+    if not match:
+        raise FakeElasticsearchError(400, "illegal_argument_exception", f"failed to parse size [{value}]")
+    return int(match.group(1)) * units[match.group(2)]
+
+
+def _resolve_date_math(name: str) -> str:
+    """解析 <prefix-{now/M{yyyy.MM}}-000001> 形式的日期数学索引名"""
+    if not (name.startswith('<') and name.endswith('>')):
+        return name
+
+    def replace(match):
+        java_format = match.group(2) or 'yyyy.MM.dd'
+        python_format = (
+            java_format.replace('yyyy', '%Y').replace('MM', '%m').replace('dd', '%d')
+            .replace('HH', '%H').replace('mm', '%M')
+        )
+        return datetime.now(tz=timezone.utc).strftime(python_format)
+
+    return _DATE_MATH_PATTERN.sub(replace, name[1:-1])
+
+
+def _compare_values(left, right) -> int:
+    """比较两个字段值，数值按数值比较，其余按字符串比较；None 排在最后"""
+    if left is None and right is None:
+        return 0
+    if left is None:
+        return 1
+    if right is None:
+        return -1
+    try:
+        left_number, right_number = float(left), float(right)
+        return (left_number > right_number) - (left_number < right_number)
+    except (TypeError, ValueError):
+        left_text, right_text = str(left), str(right)
+        return (left_text > right_text) - (left_text < right_text)
+
+
+def _vector_similarity(similarity: str, left: List[float], right: List[float]) -> float:
+    """按 dense_vector 的 similarity 计算ES中的kNN得分"""
+    dot = sum(a * b for a, b in zip(left, right))
+    if similarity == 'l2_norm':
+        distance = sum((a - b) ** 2 for a, b in zip(left, right))
+        return 1 / (1 + distance)
+    if similarity in ('dot_product', 'max_inner_product'):
+        return (1 + dot) / 2
+    norm = math.sqrt(sum(a * a for a in left)) * math.sqrt(sum(b * b for b in right))
+    cosine = dot / norm if norm else 0.0
+    return (1 + cosine) / 2
+
+
+class FakeIndex:
+    """单个内存索引：文档、mapping/settings、倒排索引和向量"""
+
+    def __init__(self, name: str, mappings: Dict = None, settings: Dict = None, provided_name: str = None):
+        self.name = name
+        self.mappings = copy.deepcopy(mappings or {})
+        self.mappings.setdefault('properties', {})
+        self.created_at = int(time.time() * 1000)
+        self.settings = {
+            "number_of_shards": "1",
+            "number_of_replicas": "1",
+            "uuid": uuid.uuid4().hex[:22],
+            "creation_date": str(self.created_at),
+            "provided_name": provided_name or name
+        }
+        self.put_settings(settings)
+        self.docs: Dict[str, Dict] = {}
+        self.seq_nos: Dict[str, int] = {}
+        self.versions: Dict[str, int] = {}
+        self.next_seq_no = 0
+        # 字段 -> 词项 -> {文档ID: 词频}
+        self.postings = defaultdict(lambda: defaultdict(dict))
+        # 字段 -> {文档ID: 词项数}
+        self.field_lengths = defaultdict(dict)
+        # 模拟段数：写入后第一次refresh前的变更算作一个新段，forcemerge 合并为一个段
+        self.segment_count = 0
+        self.pending_segment = False
+
+    def put_settings(self, settings: Dict):
+        for key, value in _expand_dotted(settings).items():
+            if value is None:
+                self.settings.pop(key, None)
+            elif isinstance(value, dict) and isinstance(self.settings.get(key), dict):
+                self.settings[key].update(copy.deepcopy(value))
+            elif isinstance(value, dict):
+                self.settings[key] = copy.deepcopy(value)
+            else:
+                self.settings[key] = _settings_value(value)
+
+    # ---------- mapping ----------
+
+    def field_mapping(self, path: str) -> Tuple[Optional[Dict], str]:
+        """查找字段映射，返回 (映射, 源字段路径)；子字段返回子字段映射和其所属源字段"""
+        node = self.mappings
+        parts = path.split('.')
+        for position, part in enumerate(parts):
+            properties = node.get('properties', {})
+            if part in properties:
+                node = properties[part]
+                continue
+            if part in node.get('fields', {}) and position == len(parts) - 1:
+                return node['fields'][part], '.'.join(parts[:position])
+            break
+        else:
+            return node, path
+
+        # 未映射字段：去掉已知的子字段后缀
+        if len(parts) > 1 and (parts[-1] in TEXT_SUBFIELDS or parts[-1] == 'keyword'):
+            source_path = '.'.join(parts[:-1])
+            return ({"type": "keyword"} if parts[-1] == 'keyword' else {"type": "text"}), source_path
+        return None, path
+
+    def field_kind(self, path: str) -> Tuple[str, str]:
+        """字段的查询方式: text/bigram/prefix/keyword/vector/other，以及对应的源字段路径"""
+        mapping, source_path = self.field_mapping(path)
+        if mapping is None:
+            return 'text', source_path
+        field_type = mapping.get('type', 'object')
+        if field_type == 'text':
+            analyzer = mapping.get('analyzer', '')
+            if 'prefix' in analyzer:
+                return 'prefix', source_path
+            if 'bigram' in analyzer:
+                return 'bigram', source_path
+            return 'text', source_path
+        if field_type in ('keyword', 'constant_keyword', 'wildcard'):
+            return 'keyword', source_path
+        if field_type == 'dense_vector':
+            return 'vector', source_path
+        return 'other', source_path
+
+    def _text_paths(self, source, prefix: str = '') -> List[str]:
+        """文档中需要进入倒排索引的字符串字段路径"""
+        paths = []
+        if isinstance(source, list):
+            for item in source:
+                paths.extend(self._text_paths(item, prefix))
+            return paths
+        if not isinstance(source, dict):
+            return [prefix] if isinstance(source, str) and prefix else []
+        for key, value in source.items():
+            path = f"{prefix}.{key}" if prefix else key
+            mapping, _ = self.field_mapping(path)
+            if mapping is not None and mapping.get('enabled') is False:
+                continue
+            if mapping is not None and mapping.get('type') in ('keyword', 'dense_vector'):
+                continue
+            paths.extend(self._text_paths(value, path))
+        return paths
+
+    # ---------- 文档 ----------
+
+    def put(self, doc_id: str, source: Dict) -> str:
+        result = 'updated' if doc_id in self.docs else 'created'
+        if doc_id in self.docs:
+            self._unindex(doc_id)
+        self.docs[doc_id] = copy.deepcopy(source)
+        self.seq_nos[doc_id] = self.next_seq_no
+        self.next_seq_no += 1
+        self.versions[doc_id] = self.versions.get(doc_id, 0) + 1
+        self._index(doc_id)
+        self._write()
+        return result
+
+    def remove(self, doc_id: str) -> bool:
+        if doc_id not in self.docs:
+            return False
+        self._unindex(doc_id)
+        del self.docs[doc_id]
+        self.versions[doc_id] = self.versions.get(doc_id, 0) + 1
+        self._write()
+        return True
+
+    def _write(self):
+        if not self.pending_segment:
+            self.segment_count += 1
+            self.pending_segment = True
+
+    def refresh(self):
+        self.pending_segment = False
+
+    def force_merge(self, max_num_segments: int = 1):
+        self.pending_segment = False
+        self.segment_count = min(self.segment_count, max(1, max_num_segments))
+
+    def _index(self, doc_id: str):
+        source = self.docs[doc_id]
+        for path in set(self._text_paths(source)):
+            counts = Counter()
+            for value in _get_values(source, path):
+                counts.update(analyze(value))
+            for token, frequency in counts.items():
+                self.postings[path][token][doc_id] = frequency
+            self.field_lengths[path][doc_id] = sum(counts.values())
+
+    def _unindex(self, doc_id: str):
+        for path, lengths in self.field_lengths.items():
+            if lengths.pop(doc_id, None) is None:
+                continue
+            for token_postings in self.postings[path].values():
+                token_postings.pop(doc_id, None)
+
+    def size_in_bytes(self) -> int:
+        return sum(len(json.dumps(source, ensure_ascii=False).encode('utf-8')) for source in self.docs.values())
+
+    # ---------- 打分 ----------
+
+    def bm25(self, path: str, token: str, frequency: int, doc_id: str) -> float:
+        document_count = max(len(self.field_lengths.get(path, {})), 1)
+        document_frequency = len(self.postings[path].get(token, {})) if path in self.postings else 0
+        idf = math.log(1 + (document_count - document_frequency + 0.5) / (document_frequency + 0.5))
+        lengths = self.field_lengths.get(path, {})
+        average_length = (sum(lengths.values()) / len(lengths)) if lengths else 1.0
+        length = lengths.get(doc_id, average_length)
+        k1, b = 1.2, 0.75
+        return idf * frequency * (k1 + 1) / (frequency + k1 * (1 - b + b * length / max(average_length, 1e-9)))
+
+
+class _QueryEvaluator:
+    """在一个索引上执行查询：倒排索引筛选候选文档，再逐文档判断并打分"""
+
+    def __init__(self, index: FakeIndex):
+        self.index = index
+
+    # ---------- 候选集 ----------
+
+    def candidates(self, query: Dict) -> Optional[set]:
+        """根据倒排索引估算可能命中的文档集合，无法估算时返回None（全部文档）"""
+        if not query:
+            return None
+        query_type, body = next(iter(query.items()))
+        if query_type in ('match', 'match_phrase'):
+            field, options = next(iter(body.items()))
+            text = options.get('query') if isinstance(options, dict) else options
+            return self._token_candidates([field], text)
+        if query_type == 'multi_match':
+            return self._token_candidates(
+                [field.split('^')[0] for field in body.get('fields', [])], body.get('query', '')
+            )
+        if query_type == 'ids':
+            return set(body.get('values', []))
+        if query_type == 'bool':
+            required = [self.candidates(clause) for clause in
+                        self._clauses(body, 'must') + self._clauses(body, 'filter')]
+            required = [candidates for candidates in required if candidates is not None]
+            if required:
+                return set.intersection(*required)
+            should = self._clauses(body, 'should')
+            if should and self._minimum_should(body) >= 1:
+                should_candidates = [self.candidates(clause) for clause in should]
+                if all(candidates is not None for candidates in should_candidates):
+                    return set().union(*should_candidates)
+        return None
+
+    def _token_candidates(self, fields: List[str], text) -> Optional[set]:
+        candidates = set()
+        for field in fields:
+            kind, source_path = self.index.field_kind(field)
+            if kind not in ('text', 'bigram') or source_path not in self.index.postings:
+                return None
+            postings = self.index.postings[source_path]
+            for token in analyze(text):
+                candidates.update(postings.get(token, {}).keys())
+        return candidates
+
+    # ---------- 单文档判断 ----------
+
+    @staticmethod
+    def _clauses(body: Dict, occur: str) -> List[Dict]:
+        clauses = body.get(occur, [])
+        return clauses if isinstance(clauses, list) else [clauses]
+
+    def _minimum_should(self, body: Dict) -> int:
+        should = self._clauses(body, 'should')
+        if 'minimum_should_match' in body:
+            return _parse_minimum_should_match(body['minimum_should_match'], len(should))
+        has_required = self._clauses(body, 'must') or self._clauses(body, 'filter')
+        return 0 if has_required else min(1, len(should))
+
+    def score(self, query: Dict, doc_id: str, source: Dict) -> Optional[float]:
+        """文档命中时返回得分，否则返回None"""
+        if not query:
+            return 1.0
+        query_type, body = next(iter(query.items()))
+        handler = getattr(self, f"_score_{query_type}", None)
+        if handler is None:
+            raise FakeElasticsearchError(400, "parsing_exception", f"unknown query [{query_type}]")
+        return handler(body, doc_id, source)
+
+    def _score_match_all(self, body, doc_id, source):
+        return float(body.get('boost', 1.0)) if isinstance(body, dict) else 1.0
+
+    def _score_match_none(self, body, doc_id, source):
+        return None
+
+    def _score_ids(self, body, doc_id, source):
+        return 1.0 if doc_id in body.get('values', []) else None
+
+    def _score_match(self, body, doc_id, source, operator_default='or'):
+        field, options = next(iter(body.items()))
+        if not isinstance(options, dict):
+            options = {'query': options}
+        minimum = options.get('minimum_should_match')
+        if str(options.get('operator', operator_default)).lower() == 'and':
+            minimum = '100%'
+        score = self._match_field(field, options['query'], minimum, doc_id, source)
+        return None if score is None else score * float(options.get('boost', 1.0))
+
+    def _score_match_phrase(self, body, doc_id, source):
+        return self._score_match(body, doc_id, source, operator_default='and')
+
+    def _score_multi_match(self, body, doc_id, source):
+        scores = []
+        for field in body.get('fields', []):
+            name, _, boost = field.partition('^')
+            minimum = body.get('minimum_should_match')
+            if str(body.get('operator', 'or')).lower() == 'and':
+                minimum = '100%'
+            score = self._match_field(name, body.get('query', ''), minimum, doc_id, source)
+            if score is not None:
+                scores.append(score * float(boost or 1.0))
+        if not scores:
+            return None
+        combined = sum(scores) if body.get('type') == 'most_fields' else max(scores)
+        return combined * float(body.get('boost', 1.0))
+
+    def _match_field(self, field: str, text, minimum_should_match, doc_id, source) -> Optional[float]:
+        kind, source_path = self.index.field_kind(field)
+        values = _get_values(source, source_path)
+        if not values:
+            return None
+
+        if kind in ('keyword', 'other'):
+            return 1.0 if any(_compare_values(value, text) == 0 for value in values) else None
+
+        if kind == 'prefix':
+            words = [word for value in values for word in _prefix_words(value)]
+            terms = str(text).lower().split()
+            matched = [term for term in terms if any(word.startswith(term) for word in words)]
+            if not terms or len(matched) < _parse_minimum_should_match(minimum_should_match, len(terms)):
+                return None
+            return float(len(matched))
+
+        query_tokens = list(dict.fromkeys(analyze(text, unigrams=(kind != 'bigram'))))
+        document_tokens = Counter()
+        for value in values:
+            document_tokens.update(analyze(value))
+        matched = [token for token in query_tokens if token in document_tokens]
+        if not query_tokens or not matched:
+            return None
+        if len(matched) < _parse_minimum_should_match(minimum_should_match, len(query_tokens)):
+            return None
+        return sum(self.index.bm25(source_path, token, document_tokens[token], doc_id) for token in matched)
+
+    def _term_matches(self, field: str, expected, source) -> bool:
+        kind, source_path = self.index.field_kind(field)
+        values = _get_values(source, source_path)
+        if kind in ('text', 'bigram', 'prefix'):
+            return any(str(expected).lower() in analyze(value) for value in values)
+        for value in values:
+            if isinstance(value, bool) or isinstance(expected, bool):
+                if str(value).lower() == str(expected).lower():
+                    return True
+            elif _compare_values(value, expected) == 0:
+                return True
+        return False
+
+    def _score_term(self, body, doc_id, source):
+        field, options = next(iter(body.items()))
+        expected = options.get('value') if isinstance(options, dict) else options
+        if not self._term_matches(field, expected, source):
+            return None
+        return float(options.get('boost', 1.0)) if isinstance(options, dict) else 1.0
+
+    def _score_terms(self, body, doc_id, source):
+        boost = float(body.get('boost', 1.0))
+        field, expected_values = next((k, v) for k, v in body.items() if k != 'boost')
+        if any(self._term_matches(field, expected, source) for expected in expected_values):
+            return boost
+        return None
+
+    def _score_range(self, body, doc_id, source):
+        field, bounds = next(iter(body.items()))
+        _, source_path = self.index.field_kind(field)
+        checks = {
+            'gt': lambda c: c > 0, 'gte': lambda c: c >= 0,
+            'lt': lambda c: c < 0, 'lte': lambda c: c <= 0
+        }
+        for value in _get_values(source, source_path):
+            if all(checks[op](_compare_values(value, bound)) for op, bound in bounds.items() if op in checks):
+                return float(bounds.get('boost', 1.0))
+        return None
+
+    def _score_exists(self, body, doc_id, source):
+        _, source_path = self.index.field_kind(body['field'])
+        return 1.0 if _get_values(source, source_path) else None
+
+    def _score_bool(self, body, doc_id, source):
+        total = 0.0
+        for clause in self._clauses(body, 'must'):
+            score = self.score(clause, doc_id, source)
+            if score is None:
+                return None
+            total += score
+        for clause in self._clauses(body, 'filter'):
+            if self.score(clause, doc_id, source) is None:
+                return None
+        for clause in self._clauses(body, 'must_not'):
+            if self.score(clause, doc_id, source) is not None:
+                return None
+        matched_should = 0
+        for clause in self._clauses(body, 'should'):
+            score = self.score(clause, doc_id, source)
+            if score is not None:
+                matched_should += 1
+                total += score
+        if matched_should < self._minimum_should(body):
+            return None
+        return total * float(body.get('boost', 1.0))
+
+    def _score_constant_score(self, body, doc_id, source):
+        if self.score(body['filter'], doc_id, source) is None:
+            return None
+        return float(body.get('boost', 1.0))
+
+    def _score_nested(self, body, doc_id, source):
+        """在 path 下的每个嵌套对象上分别执行查询，按 score_mode 合并"""
+        path = body['path']
+        objects = _get_values(source, path)
+        scores = []
+        for nested_object in objects:
+            nested_source = {}
+            target = nested_source
+            parts = path.split('.')
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = nested_object
+            score = self.score(body['query'], doc_id, nested_source)
+            if score is not None:
+                scores.append(score)
+        if not scores:
+            return None
+        mode = body.get('score_mode', 'avg')
+        if mode == 'max':
+            return max(scores)
+        if mode == 'min':
+            return min(scores)
+        if mode == 'sum':
+            return sum(scores)
+        if mode == 'none':
+            return 0.0
+        return sum(scores) / len(scores)
+
+    def _score_script_score(self, body, doc_id, source):
+        """只支持 cosineSimilarity/dotProduct/l2norm(params.x, 'field') [+ 常数] 形式的脚本"""
+        if self.score(body.get('query', {"match_all": {}}), doc_id, source) is None:
+            return None
+        script = body['script']
+        script_source = script['source'] if isinstance(script, dict) else script
+        match = _SCRIPT_VECTOR_PATTERN.search(script_source)
+        if not match:
+            raise FakeElasticsearchError(400, "script_exception", f"unsupported script [{script_source}]")
+        function, param, field = match.groups()
+        query_vector = script.get('params', {})[param]
+        values = _get_values(source, field)
+        if not values:
+            return None
+        vector = values[0]
+        if function == 'cosineSimilarity':
+            norm = math.sqrt(sum(a * a for a in vector)) * math.sqrt(sum(b * b for b in query_vector))
+            value = sum(a * b for a, b in zip(vector, query_vector)) / norm if norm else 0.0
+        elif function == 'dotProduct':
+            value = sum(a * b for a, b in zip(vector, query_vector))
+        else:
+            value = math.sqrt(sum((a - b) ** 2 for a, b in zip(vector, query_vector)))
+        constant = re.search(r"\+\s*([\d.]+)", script_source[match.end():])
+        return value + (float(constant.group(1)) if constant else 0.0)
+
+    def matching(self, query: Dict) -> Dict[str, float]:
+        """执行查询，返回 {文档ID: 得分}"""
+        candidates = self.candidates(query)
+        doc_ids = self.index.docs.keys() if candidates is None else [
+            doc_id for doc_id in candidates if doc_id in self.index.docs
+        ]
+        matches = {}
+        for doc_id in doc_ids:
+            score = self.score(query, doc_id, self.index.docs[doc_id])
+            if score is not None:
+                matches[doc_id] = score
+        return matches
+
+    def knn(self, knn: Dict) -> Dict[str, float]:
+        """暴力计算向量相似度，返回前k个 {文档ID: 得分}"""
+        field = knn['field']
+        mapping, _ = self.index.field_mapping(field)
+        similarity = (mapping or {}).get('similarity', 'cosine')
+        query_vector = knn['query_vector']
+        allowed = None
+        if knn.get('filter'):
+            filters = knn['filter'] if isinstance(knn['filter'], list) else [knn['filter']]
+            allowed = set(self.matching({"bool": {"filter": filters}}).keys())
+
+        scored = []
+        for doc_id, source in self.index.docs.items():
+            if allowed is not None and doc_id not in allowed:
+                continue
+            values = _get_values(source, field)
+            if values and isinstance(values[0], list):
+                scored.append((_vector_similarity(similarity, query_vector, values[0]), doc_id))
+        scored.sort(key=lambda item: -item[0])
+        return {doc_id: score for score, doc_id in scored[:knn.get('k', 10)]}
+
+
+class FakeElasticsearchStore:
+    """全部索引、别名、模板、PIT和scroll状态，所有操作在一把锁内完成"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.indices: Dict[str, FakeIndex] = {}
+        # 别名 -> {索引名: {'is_write_index': bool}}
+        self.aliases: Dict[str, Dict[str, Dict]] = {}
+        self.templates: Dict[str, Dict] = {}
+        self.ilm_policies: Dict[str, Dict] = {}
+        self.point_in_times: Dict[str, List[str]] = {}
+        self.scrolls: Dict[str, List[Dict]] = {}
+
+    # ---------- 名称解析 ----------
+
+    def resolve(self, expression: str, allow_missing: bool = False) -> List[str]:
+        """把逗号分隔的索引/别名/通配符表达式解析为索引名列表"""
+        names = []
+        for part in (expression or '_all').split(','):
+            part = _resolve_date_math(part.strip())
+            if part in ('_all', '*'):
+                names.extend(self.indices.keys())
+            elif '*' in part:
+                names.extend(name for name in self.indices if fnmatch.fnmatch(name, part))
+                for alias, members in self.aliases.items():
+                    if fnmatch.fnmatch(alias, part):
+                        names.extend(members.keys())
+            elif part in self.indices:
+                names.append(part)
+            elif part in self.aliases:
+                names.extend(self.aliases[part].keys())
+            elif not allow_missing:
+                raise _index_not_found(part)
+        return list(dict.fromkeys(names))
+
+    def write_index(self, name: str, auto_create: bool = True) -> FakeIndex:
+        """写入目标：索引本身，或别名的写索引；不存在时自动创建"""
+        name = _resolve_date_math(name)
+        if name in self.indices:
+            return self.indices[name]
+        if name in self.aliases:
+            members = self.aliases[name]
+            writers = [index for index, options in members.items() if options.get('is_write_index')]
+            if not writers and len(members) == 1:
+                writers = list(members)
+            if len(writers) != 1:
+                raise FakeElasticsearchError(
+                    400, "illegal_argument_exception",
+                    f"no write index is defined for alias [{name}]"
+                )
+            return self.indices[writers[0]]
+        if not auto_create:
+            raise _index_not_found(name)
+        self.create_index(name, {})
+        return self.indices[name]
+
+    # ---------- 索引管理 ----------
+
+    def create_index(self, name: str, body: Dict) -> Dict:
+        provided_name = name
+        name = _resolve_date_math(name)
+        if name in self.indices or name in self.aliases:
+            raise FakeElasticsearchError(
+                400, "resource_already_exists_exception", f"index [{name}] already exists"
+            )
+
+        mappings, settings = {}, {}
+        matching_templates = [
+            template for template in self.templates.values()
+            if any(fnmatch.fnmatch(name, pattern) for pattern in template.get('index_patterns', []))
+        ]
+        if matching_templates:
+            template = max(matching_templates, key=lambda t: t.get('priority', 0)).get('template', {})
+            mappings = copy.deepcopy(template.get('mappings', {}))
+            settings = copy.deepcopy(template.get('settings', {}))
+            for alias, options in template.get('aliases', {}).items():
+                self.aliases.setdefault(alias, {})[name] = dict(options)
+
+        mappings = {**mappings, **(body.get('mappings') or {})}
+        settings = {**_expand_dotted(settings), **_expand_dotted(body.get('settings'))}
+        self.indices[name] = FakeIndex(
+            name, mappings, settings, provided_name if provided_name != name else None
+        )
+        for alias, options in (body.get('aliases') or {}).items():
+            self.aliases.setdefault(alias, {})[name] = dict(options or {})
+        return {"acknowledged": True, "shards_acknowledged": True, "index": name}
+
+    def delete_index(self, expression: str, ignore_unavailable: bool = False) -> Dict:
+        for part in expression.split(','):
+            if part in self.aliases and part not in self.indices:
+                raise FakeElasticsearchError(
+                    400, "illegal_argument_exception",
+                    f"The provided expression [{part}] matches an alias, specify the corresponding concrete indices instead."
+                )
+        for name in self.resolve(expression, allow_missing=ignore_unavailable):
+            self.indices.pop(name, None)
+            for members in self.aliases.values():
+                members.pop(name, None)
+        self.aliases = {alias: members for alias, members in self.aliases.items() if members}
+        return {"acknowledged": True}
+
+    def update_aliases(self, actions: List[Dict]) -> Dict:
+        """在副本上执行全部动作，全部成功后一次性生效"""
+        aliases = copy.deepcopy(self.aliases)
+        removed_indices = []
+        for action in actions:
+            action_type, options = next(iter(action.items()))
+            indices = options.get('indices') or [options.get('index')]
+            if action_type == 'remove_index':
+                for name in indices:
+                    if name not in self.indices:
+                        raise _index_not_found(name)
+                    removed_indices.append(name)
+                continue
+            names = options.get('aliases') or [options.get('alias')]
+            for index_name in indices:
+                if index_name not in self.indices:
+                    raise _index_not_found(index_name)
+                for alias in names:
+                    if action_type == 'add':
+                        if alias in self.indices and alias not in removed_indices:
+                            raise FakeElasticsearchError(
+                                400, "invalid_alias_name_exception",
+                                f"Invalid alias name [{alias}]: an index or data stream exists with the same name as the alias"
+                            )
+                        member_options = {}
+                        if 'is_write_index' in options:
+                            member_options['is_write_index'] = options['is_write_index']
+                        aliases.setdefault(alias, {})[index_name] = member_options
+                    elif action_type == 'remove':
+                        if index_name not in aliases.get(alias, {}):
+                            raise FakeElasticsearchError(
+                                404, "aliases_not_found_exception", f"aliases [{alias}] missing"
+                            )
+                        aliases[alias].pop(index_name)
+        for name in removed_indices:
+            self.indices.pop(name, None)
+            for members in aliases.values():
+                members.pop(name, None)
+        self.aliases = {alias: members for alias, members in aliases.items() if members}
+        return {"acknowledged": True}
+
+    def get_aliases(self, name: str = None, index_expression: str = None) -> Dict:
+        indices = self.resolve(index_expression) if index_expression else list(self.indices)
+        result = {}
+        for alias, members in self.aliases.items():
+            if name and not any(fnmatch.fnmatch(alias, pattern) for pattern in name.split(',')):
+                continue
+            for index_name, options in members.items():
+                if index_name in indices:
+                    result.setdefault(index_name, {"aliases": {}})["aliases"][alias] = dict(options)
+        if name and not result:
+            raise FakeElasticsearchError(404, "aliases_not_found_exception", f"alias [{name}] missing")
+        return result
+
+    def rollover(self, alias: str, body: Dict) -> Dict:
+        if alias not in self.aliases:
+            raise FakeElasticsearchError(400, "illegal_argument_exception", f"rollover target [{alias}] does not exist")
+        old_index = self.write_index(alias, auto_create=False)
+        conditions = (body or {}).get('conditions') or {}
+
+        age_seconds = time.time() - old_index.created_at / 1000
+        size = old_index.size_in_bytes()
+        results = {}
+        for condition, value in conditions.items():
+            if condition == 'max_age':
+                results[f"[max_age: {value}]"] = age_seconds >= _parse_time_value(value)
+            elif condition == 'max_docs':
+                results[f"[max_docs: {value}]"] = len(old_index.docs) >= int(value)
+            elif condition in ('max_size', 'max_primary_shard_size'):
+                results[f"[{condition}: {value}]"] = size >= _parse_byte_size(value)
+            elif condition in ('max_primary_shard_docs',):
+                results[f"[{condition}: {value}]"] = len(old_index.docs) >= int(value)
+        rolled_over = not conditions or any(results.values())
+
+        provided_name = old_index.settings.get('provided_name', old_index.name)
+        match = re.search(r"-(\d+)(>?)$", provided_name)
+        if not match:
+            raise FakeElasticsearchError(
+                400, "illegal_argument_exception",
+                f"index name [{old_index.name}] does not match pattern '^.*-\\d+$'"
+            )
+        counter = str(int(match.group(1)) + 1).zfill(len(match.group(1)))
+        new_provided = provided_name[:match.start()] + f"-{counter}{match.group(2)}"
+        new_index = _resolve_date_math(new_provided)
+
+        if rolled_over:
+            self.create_index(new_provided, {})
+            for index_name in self.aliases[alias]:
+                self.aliases[alias][index_name]['is_write_index'] = False
+            self.aliases[alias][new_index] = {'is_write_index': True}
+        return {
+            "acknowledged": rolled_over,
+            "shards_acknowledged": rolled_over,
+            "old_index": old_index.name,
+            "new_index": new_index,
+            "rolled_over": rolled_over,
+            "dry_run": False,
+            "conditions": results
+        }
+
+    # ---------- 文档 ----------
+
+    def get_document(self, expression: str, doc_id: str, source_includes: List[str] = None) -> Dict:
+        for name in self.resolve(expression):
+            index = self.indices[name]
+            if doc_id in index.docs:
+                source = copy.deepcopy(index.docs[doc_id])
+                if source_includes:
+                    source = {
+                        key: value for key, value in source.items()
+                        if any(key == field.split('.')[0] or fnmatch.fnmatch(key, field) for field in source_includes)
+                    }
+                return {
+                    "_index": name, "_id": doc_id, "_version": index.versions[doc_id],
+                    "_seq_no": index.seq_nos[doc_id], "_primary_term": 1,
+                    "found": True, "_source": source
+                }
+        raise FakeElasticsearchError(404, "not_found", f"[{doc_id}] not found")
+
+    def write_document(self, index_name: str, doc_id: Optional[str], source: Dict,
+                       op_type: str = 'index') -> Dict:
+        index = self.write_index(index_name)
+        doc_id = doc_id or uuid.uuid4().hex[:20]
+        if op_type == 'create' and doc_id in index.docs:
+            raise FakeElasticsearchError(
+                409, "version_conflict_engine_exception", f"[{doc_id}]: version conflict, document already exists"
+            )
+        result = index.put(doc_id, source)
+        return self._write_result(index, doc_id, result, 201 if result == 'created' else 200)
+
+    def update_document(self, index_name: str, doc_id: str, body: Dict) -> Dict:
+        index = self.write_index(index_name)
+        if doc_id not in index.docs:
+            if body.get('doc_as_upsert'):
+                return self.write_document(index.name, doc_id, body.get('doc', {}))
+            if 'upsert' in body:
+                return self.write_document(index.name, doc_id, body['upsert'])
+            raise FakeElasticsearchError(404, "document_missing_exception", f"[{doc_id}]: document missing")
+        merged = self._merge(copy.deepcopy(index.docs[doc_id]), body.get('doc', {}))
+        if merged == index.docs[doc_id] and body.get('detect_noop', True):
+            return self._write_result(index, doc_id, 'noop', 200)
+        index.put(doc_id, merged)
+        return self._write_result(index, doc_id, 'updated', 200)
+
+    def _merge(self, target: Dict, changes: Dict) -> Dict:
+        for key, value in changes.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                self._merge(target[key], value)
+            else:
+                target[key] = copy.deepcopy(value)
+        return target
+
+    def delete_document(self, index_name: str, doc_id: str) -> Dict:
+        index = self.write_index(index_name, auto_create=False)
+        if not index.remove(doc_id):
+            return {**self._write_result(index, doc_id, 'not_found', 404), "_status": 404}
+        return self._write_result(index, doc_id, 'deleted', 200)
+
+    @staticmethod
+    def _write_result(index: FakeIndex, doc_id: str, result: str, status: int) -> Dict:
+        return {
+            "_index": index.name, "_id": doc_id, "_version": index.versions.get(doc_id, 1),
+            "result": result, "_shards": {"total": 1, "successful": 1, "failed": 0},
+            "_seq_no": index.seq_nos.get(doc_id, 0), "_primary_term": 1, "status": status
+        }
+
+    def bulk(self, lines: List[Dict], default_index: str = None) -> Dict:
+        start = time.time()
+        items = []
+        position = 0
+        while position < len(lines):
+            action, meta = next(iter(lines[position].items()))
+            position += 1
+            index_name = meta.get('_index', default_index)
+            # ES把数字形式的 _id 按字符串保存
+            doc_id = str(meta['_id']) if meta.get('_id') is not None else None
+            try:
+                if action in ('index', 'create'):
+                    source = lines[position]
+                    position += 1
+                    result = self.write_document(index_name, doc_id, source, op_type=action)
+                elif action == 'update':
+                    body = lines[position]
+                    position += 1
+                    result = self.update_document(index_name, doc_id, body)
+                elif action == 'delete':
+                    result = self.delete_document(index_name, doc_id)
+                    result.pop('_status', None)
+                else:
+                    raise FakeElasticsearchError(400, "illegal_argument_exception", f"unknown action [{action}]")
+                items.append({action: result})
+            except FakeElasticsearchError as e:
+                items.append({action: {
+                    "_index": index_name, "_id": doc_id, "status": e.status,
+                    "error": {"type": e.error_type, "reason": e.reason}
+                }})
+        return {
+            "took": int((time.time() - start) * 1000),
+            "errors": any('error' in item[next(iter(item))] for item in items),
+            "items": items
+        }
+
+    # ---------- 查询 ----------
+
+    def search(self, expression: Optional[str], body: Dict, params: Dict) -> Dict:
+        start = time.time()
+        body = dict(body or {})
+        if '_source' in params and '_source' not in body:
+            body['_source'] = False if params['_source'] == 'false' else params['_source'].split(',')
+        pit = body.get('pit')
+        if pit:
+            if pit['id'] not in self.point_in_times:
+                raise FakeElasticsearchError(404, "search_context_missing_exception", "No search context found for PIT")
+            index_names = self.point_in_times[pit['id']]
+        else:
+            index_names = self.resolve(expression)
+
+        size = int(params.get('size', body.get('size', 10)))
+        from_ = int(params.get('from', body.get('from', 0)))
+        query = body.get('query')
+        knn_clauses = body.get('knn') or []
+        if isinstance(knn_clauses, dict):
+            knn_clauses = [knn_clauses]
+
+        scored = {}
+        for name in index_names:
+            evaluator = _QueryEvaluator(self.indices[name])
+            if query is not None or not knn_clauses:
+                for doc_id, score in evaluator.matching(query or {"match_all": {}}).items():
+                    scored[(name, doc_id)] = score
+            for knn in knn_clauses:
+                for doc_id, score in evaluator.knn(knn).items():
+                    boost = float(knn.get('boost', 1.0))
+                    scored[(name, doc_id)] = scored.get((name, doc_id), 0.0) + score * boost
+
+        if knn_clauses:
+            # 多个索引各自取前k后再整体取前k
+            k = max(knn.get('k', 10) for knn in knn_clauses)
+            if query is None:
+                scored = dict(sorted(scored.items(), key=lambda item: -item[1])[:k])
+
+        if 'min_score' in body:
+            scored = {key: score for key, score in scored.items() if score >= body['min_score']}
+
+        aggregations = self._aggregate(body.get('aggs') or body.get('aggregations') or {}, scored)
+
+        if body.get('post_filter'):
+            post_filtered = {}
+            for (name, doc_id), score in scored.items():
+                evaluator = _QueryEvaluator(self.indices[name])
+                if evaluator.score(body['post_filter'], doc_id, self.indices[name].docs[doc_id]) is not None:
+                    post_filtered[(name, doc_id)] = score
+            scored = post_filtered
+
+        total = len(scored)
+        hits = self._sorted_hits(scored, body.get('sort'), with_tiebreaker=bool(pit))
+        if body.get('search_after'):
+            orders = self._sort_orders(body.get('sort'), bool(pit))
+            hits = [hit for hit in hits if self._compare_sort(hit['sort'], body['search_after'], orders) > 0]
+
+        scroll = params.get('scroll')
+        page = hits[from_:from_ + size] if not scroll else hits[:size]
+        result_hits = [self._format_hit(hit, body, explicit_sort=bool(body.get('sort')) or bool(pit)) for hit in page]
+
+        response = {
+            "took": int((time.time() - start) * 1000),
+            "timed_out": False,
+            "_shards": {"total": len(index_names), "successful": len(index_names), "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": total, "relation": "eq"},
+                "max_score": max((hit['_score'] for hit in result_hits if hit['_score'] is not None), default=None),
+                "hits": result_hits
+            }
+        }
+        if aggregations:
+            response['aggregations'] = aggregations
+        if pit:
+            response['pit_id'] = pit['id']
+        if scroll:
+            scroll_id = uuid.uuid4().hex
+            self.scrolls[scroll_id] = {
+                'size': size,
+                'hits': [self._format_hit(hit, body, False) for hit in hits[size:]]
+            }
+            response['_scroll_id'] = scroll_id
+        return response
+
+    def msearch(self, default_index: Optional[str], lines: List[Dict]) -> Dict:
+        start = time.time()
+        responses = []
+        for header, body in zip(lines[::2], lines[1::2]):
+            try:
+                responses.append({**self.search(header.get('index', default_index), body, {}), "status": 200})
+            except FakeElasticsearchError as e:
+                responses.append({**e.to_response(), "status": e.status})
+        return {"took": int((time.time() - start) * 1000), "responses": responses}
+
+    def scroll(self, scroll_id: str) -> Dict:
+        if scroll_id not in self.scrolls:
+            raise FakeElasticsearchError(404, "search_context_missing_exception", f"No search context found for id [{scroll_id}]")
+        context = self.scrolls[scroll_id]
+        page, context['hits'] = context['hits'][:context['size']], context['hits'][context['size']:]
+        return {
+            "_scroll_id": scroll_id, "took": 0, "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(page), "relation": "eq"}, "max_score": None, "hits": page}
+        }
+
+    def count(self, expression: Optional[str], body: Dict) -> Dict:
+        query = (body or {}).get('query') or {"match_all": {}}
+        count = sum(
+            len(_QueryEvaluator(self.indices[name]).matching(query)) for name in self.resolve(expression)
+        )
+        return {"count": count, "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0}}
+
+    @staticmethod
+    def _sort_orders(sort, with_tiebreaker: bool) -> List[Tuple[str, str]]:
+        orders = []
+        for clause in sort or [{"_score": {"order": "desc"}}]:
+            if isinstance(clause, str):
+                orders.append((clause, 'desc' if clause == '_score' else 'asc'))
+            else:
+                field, options = next(iter(clause.items()))
+                order = options.get('order') if isinstance(options, dict) else options
+                orders.append((field, order or ('desc' if field == '_score' else 'asc')))
+        if with_tiebreaker and not any(field == '_shard_doc' for field, _ in orders):
+            orders.append(('_shard_doc', 'asc'))
+        return orders
+
+    @staticmethod
+    def _compare_sort(left: List, right: List, orders: List[Tuple[str, str]]) -> int:
+        for (_, order), left_value, right_value in zip(orders, left, right):
+            result = _compare_values(left_value, right_value)
+            if result:
+                return -result if order == 'desc' and left_value is not None and right_value is not None else result
+        return 0
+
+    def _sorted_hits(self, scored: Dict, sort, with_tiebreaker: bool) -> List[Dict]:
+        orders = self._sort_orders(sort, with_tiebreaker)
+        hits = []
+        for (name, doc_id), score in scored.items():
+            index = self.indices[name]
+            sort_values = []
+            for field, _ in orders:
+                if field == '_score':
+                    sort_values.append(score)
+                elif field == '_shard_doc':
+                    sort_values.append(index.seq_nos[doc_id])
+                elif field == '_doc':
+                    sort_values.append(index.seq_nos[doc_id])
+                else:
+                    _, source_path = index.field_kind(field)
+                    values = _get_values(index.docs[doc_id], source_path)
+                    sort_values.append(values[0] if values else None)
+            hits.append({'index': name, 'id': doc_id, 'score': score, 'sort': sort_values})
+        hits.sort(key=functools.cmp_to_key(
+            lambda a, b: self._compare_sort(a['sort'], b['sort'], orders)
+            or _compare_values(self.indices[a['index']].seq_nos[a['id']], self.indices[b['index']].seq_nos[b['id']])
+        ))
+        return hits
+
+    def _format_hit(self, hit: Dict, body: Dict, explicit_sort: bool) -> Dict:
+        source = self.indices[hit['index']].docs[hit['id']]
+        formatted = {"_index": hit['index'], "_id": hit['id'], "_score": hit['score']}
+        source_filter = body.get('_source', True)
+        if source_filter is not False:
+            if isinstance(source_filter, dict):
+                source_filter = source_filter.get('includes', True)
+            if isinstance(source_filter, str):
+                source_filter = [source_filter]
+            if isinstance(source_filter, list):
+                formatted['_source'] = {
+                    key: copy.deepcopy(value) for key, value in source.items()
+                    if any(key == field.split('.')[0] or fnmatch.fnmatch(key, field) for field in source_filter)
+                }
+            else:
+                formatted['_source'] = copy.deepcopy(source)
+        if explicit_sort:
+            formatted['sort'] = hit['sort']
+            if body.get('sort') and not any(
+                (clause == '_score' or (isinstance(clause, dict) and '_score' in clause)) for clause in body['sort']
+            ):
+                formatted['_score'] = None
+        return formatted
+
+    def _aggregate(self, aggs: Dict, scored: Dict) -> Dict:
+        results = {}
+        for agg_name, definition in aggs.items():
+            agg_type, options = next((k, v) for k, v in definition.items() if k not in ('aggs', 'aggregations'))
+            values = []
+            for name, doc_id in scored:
+                index = self.indices[name]
+                _, source_path = index.field_kind(options['field'])
+                values.extend(_get_values(index.docs[doc_id], source_path))
+
+            if agg_type == 'terms':
+                counts = Counter(values)
+                buckets = sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+                size = options.get('size', 10)
+                results[agg_name] = {
+                    "doc_count_error_upper_bound": 0,
+                    "sum_other_doc_count": sum(count for _, count in buckets[size:]),
+                    "buckets": [{"key": key, "doc_count": count} for key, count in buckets[:size]]
+                }
+            elif agg_type in ('max', 'min'):
+                chosen = None
+                for value in values:
+                    if chosen is None or (_compare_values(value, chosen) > 0) == (agg_type == 'max') \
+                            and _compare_values(value, chosen) != 0:
+                        chosen = value
+                results[agg_name] = self._metric_value(chosen)
+            elif agg_type in ('avg', 'sum'):
+                numbers = [float(value) for value in values]
+                if agg_type == 'sum':
+                    results[agg_name] = {"value": sum(numbers)}
+                else:
+                    results[agg_name] = {"value": sum(numbers) / len(numbers) if numbers else None}
+            elif agg_type == 'value_count':
+                results[agg_name] = {"value": len(values)}
+            else:
+                raise FakeElasticsearchError(400, "parsing_exception", f"unknown aggregation type [{agg_type}]")
+        return results
+
+    @staticmethod
+    def _metric_value(value) -> Dict:
+        """数值直接返回；日期字符串按ES的格式返回毫秒值和 value_as_string"""
+        if value is None:
+            return {"value": None}
+        try:
+            return {"value": float(value)}
+        except (TypeError, ValueError):
+            pass
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=timezone.utc)
+            return {
+                "value": parsed.timestamp() * 1000,
+                "value_as_string": parsed.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.') +
+                f"{parsed.microsecond // 1000:03d}Z"
+            }
+        except ValueError:
+            return {"value": None, "value_as_string": str(value)}
+
+    # ---------- 其他 ----------
+
+    def reindex(self, body: Dict) -> Dict:
+        start = time.time()
+        source = body['source']
+        query = source.get('query') or {"match_all": {}}
+        removed_fields = self._removed_fields(body.get('script'))
+        created = updated = 0
+        for name in self.resolve(source['index'] if isinstance(source['index'], str) else ','.join(source['index'])):
+            index = self.indices[name]
+            for doc_id in list(_QueryEvaluator(index).matching(query)):
+                doc = {key: value for key, value in index.docs[doc_id].items() if key not in removed_fields}
+                result = self.write_document(body['dest']['index'], doc_id, doc)
+                if result['result'] == 'created':
+                    created += 1
+                else:
+                    updated += 1
+        return {
+            "took": int((time.time() - start) * 1000), "timed_out": False,
+            "total": created + updated, "created": created, "updated": updated, "deleted": 0,
+            "batches": 1, "version_conflicts": 0, "noops": 0, "failures": []
+        }
+
+    # _reindex 支持的脚本形式：ctx._source.remove('X') 语句序列
+    _REMOVE_PATTERN = re.compile(r"ctx\._source\.remove\(['\"](\w+)['\"]\)")
+
+    def _removed_fields(self, script) -> set:
+        if not script:
+            return set()
+        source = script if isinstance(script, str) else script.get('source', '')
+        statements = [statement.strip() for statement in source.split(';') if statement.strip()]
+        fields = set()
+        for statement in statements:
+            match = self._REMOVE_PATTERN.fullmatch(statement)
+            if not match:
+                raise FakeElasticsearchError(400, "script_exception", f"unsupported script: {source}")
+            fields.add(match.group(1))
+        return fields
+
+    # 支持的脚本形式：ctx._source.X = params.Y 语句序列，或遍历 params.fields 逐个赋值
+    _ASSIGNMENT_PATTERN = re.compile(r"ctx\._source(?:\.(\w+)|\[['\"](\w+)['\"]\])\s*=\s*params\.(\w+)")
+
+    def update_by_query(self, expression: str, body: Dict) -> Dict:
+        start = time.time()
+        body = body or {}
+        query = body.get('query') or {"match_all": {}}
+        script = body.get('script') or {}
+        if isinstance(script, str):
+            script = {"source": script}
+        params = script.get('params', {})
+        source = script.get('source', '')
+
+        if 'params.fields' in source:
+            changes = dict(params.get('fields', {}))
+        else:
+            changes = {}
+            for match in self._ASSIGNMENT_PATTERN.finditer(source):
+                field = match.group(1) or match.group(2)
+                changes[field] = params.get(match.group(3))
+            if source.strip() and not changes:
+                raise FakeElasticsearchError(400, "script_exception", f"unsupported script: {source}")
+
+        updated = noops = total = 0
+        for name in self.resolve(expression):
+            index = self.indices[name]
+            for doc_id in list(_QueryEvaluator(index).matching(query)):
+                total += 1
+                merged = dict(copy.deepcopy(index.docs[doc_id]), **copy.deepcopy(changes))
+                if merged == index.docs[doc_id]:
+                    noops += 1
+                    continue
+                index.put(doc_id, merged)
+                updated += 1
+        return {
+            "took": int((time.time() - start) * 1000), "timed_out": False,
+            "total": total, "updated": updated, "deleted": 0, "batches": 1,
+            "version_conflicts": 0, "noops": noops, "failures": []
+        }
+
+    def delete_by_query(self, expression: str, body: Dict) -> Dict:
+        start = time.time()
+        query = (body or {}).get('query') or {"match_all": {}}
+        deleted = 0
+        for name in self.resolve(expression):
+            index = self.indices[name]
+            for doc_id in list(_QueryEvaluator(index).matching(query)):
+                if index.remove(doc_id):
+                    deleted += 1
+        return {
+            "took": int((time.time() - start) * 1000), "timed_out": False,
+            "total": deleted, "deleted": deleted, "batches": 1,
+            "version_conflicts": 0, "noops": 0, "failures": []
+        }
+
+    def open_point_in_time(self, expression: str) -> Dict:
+        pit_id = uuid.uuid4().hex
+        self.point_in_times[pit_id] = self.resolve(expression)
+        return {"id": pit_id}
+
+    def close_point_in_time(self, pit_id: str) -> Dict:
+        if self.point_in_times.pop(pit_id, None) is None:
+            raise FakeElasticsearchError(404, "search_context_missing_exception", "No search context found for PIT")
+        return {"succeeded": True, "num_freed": 1}
+
+    def cat_indices(self, expression: Optional[str], columns: Optional[str]) -> List[Dict]:
+        rows = []
+        for name in sorted(self.resolve(expression or '*', allow_missing=True)):
+            index = self.indices[name]
+            row = {
+                "health": "green", "status": "open", "index": name, "uuid": index.settings['uuid'],
+                "pri": "1", "rep": index.settings.get('number_of_replicas', '1'),
+                "docs.count": str(len(index.docs)), "docs.deleted": "0",
+                "creation.date": str(index.created_at),
+                "store.size": str(index.size_in_bytes()), "pri.store.size": str(index.size_in_bytes())
+            }
+            if columns:
+                row = {column: row.get(column) for column in columns.split(',')}
+            rows.append(row)
+        return rows
+
+    def stats(self, expression: Optional[str]) -> Dict:
+        indices = {}
+        for name in self.resolve(expression):
+            index = self.indices[name]
+            totals = {
+                "docs": {"count": len(index.docs), "deleted": 0},
+                "store": {"size_in_bytes": index.size_in_bytes()},
+                "segments": {"count": index.segment_count}
+            }
+            indices[name] = {"uuid": index.settings['uuid'], "primaries": totals, "total": totals}
+        all_totals = {
+            "docs": {"count": sum(i['total']['docs']['count'] for i in indices.values()), "deleted": 0},
+            "store": {"size_in_bytes": sum(i['total']['store']['size_in_bytes'] for i in indices.values())}
+        }
+        return {"_all": {"primaries": all_totals, "total": all_totals}, "indices": indices}
+
+
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    """把HTTP请求路由到 FakeElasticsearchStore"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeElasticsearch/8.15.0"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    @property
+    def store(self) -> FakeElasticsearchStore:
+        return self.server.store
+
+    def do_HEAD(self):
+        self._dispatch('HEAD')
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_PUT(self):
+        self._dispatch('PUT')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _send(self, status: int, payload=None):
+        body = json.dumps(payload if payload is not None else {}, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        # elasticsearch-py 8 会校验该响应头
+        self.send_header("X-Elastic-Product", "Elasticsearch")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _read_body(self, ndjson: bool):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if not raw.strip():
+            return [] if ndjson else {}
+        text = raw.decode('utf-8')
+        if ndjson:
+            return [json.loads(line) for line in text.splitlines() if line.strip()]
+        return json.loads(text)
+
+    def _dispatch(self, method: str):
+        url = urlsplit(self.path)
+        segments = [unquote(segment) for segment in url.path.split('/') if segment]
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            body = self._read_body(ndjson=bool(segments) and segments[-1] in ('_bulk', '_msearch'))
+            with self.store.lock:
+                status, payload = self._route(method, segments, params, body)
+            self._send(status, payload)
+        except FakeElasticsearchError as e:
+            self._send(e.status, e.to_response())
+        except (KeyError, ValueError, TypeError, StopIteration) as e:
+            logger.exception("fake elasticsearch request failed")
+            self._send(400, FakeElasticsearchError(400, "parsing_exception", repr(e)).to_response())
+
+    def _refresh_or_merge(self, action: str, index_name: Optional[str], params: Dict) -> Tuple[int, object]:
+        for name in self.store.resolve(index_name):
+            if action == '_forcemerge':
+                self.store.indices[name].force_merge(int(params.get('max_num_segments', 1)))
+            else:
+                self.store.indices[name].refresh()
+        return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+
+    def _route(self, method: str, segments: List[str], params: Dict, body) -> Tuple[int, object]:
+        store = self.store
+        flag = lambda name: str(params.get(name, 'false')).lower() == 'true'
+
+        if not segments:
+            return 200, {
+                "name": "fake-node", "cluster_name": "fake-elasticsearch",
+                "version": {"number": "8.15.0", "build_flavor": "default"},
+                "tagline": "You Know, for Search"
+            }
+
+        head = segments[0]
+        if head == '_bulk':
+            return 200, store.bulk(body)
+        if head == '_msearch':
+            return 200, store.msearch(None, body)
+        if head == '_search' and len(segments) == 2 and segments[1] == 'scroll':
+            if method == 'DELETE':
+                scroll_ids = body.get('scroll_id', [])
+                for scroll_id in scroll_ids if isinstance(scroll_ids, list) else [scroll_ids]:
+                    store.scrolls.pop(scroll_id, None)
+                return 200, {"succeeded": True, "num_freed": 1}
+            return 200, store.scroll(body.get('scroll_id') or params.get('scroll_id'))
+        if head == '_search':
+            return 200, store.search(None, body, params)
+        if head == '_count':
+            return 200, store.count(None, body)
+        if head == '_pit':
+            return 200, store.close_point_in_time(body['id'])
+        if head == '_aliases':
+            return 200, store.update_aliases(body.get('actions', []))
+        if head == '_alias':
+            name = segments[1] if len(segments) > 1 else None
+            if method == 'HEAD':
+                exists = name is not None and any(
+                    fnmatch.fnmatch(alias, pattern) for alias in store.aliases for pattern in name.split(',')
+                )
+                return (200 if exists else 404), {}
+            return 200, store.get_aliases(name)
+        if head == '_reindex':
+            return 200, store.reindex(body)
+        if head == '_ilm':
+            name = segments[2]
+            if method == 'PUT':
+                store.ilm_policies[name] = body.get('policy', {})
+                return 200, {"acknowledged": True}
+            if name not in store.ilm_policies:
+                raise FakeElasticsearchError(404, "resource_not_found_exception", f"Lifecycle policy not found: {name}")
+            return 200, {name: {"version": 1, "policy": store.ilm_policies[name]}}
+        if head == '_index_template':
+            name = segments[1]
+            if method == 'PUT':
+                store.templates[name] = body
+                return 200, {"acknowledged": True}
+            if method == 'DELETE':
+                store.templates.pop(name, None)
+                return 200, {"acknowledged": True}
+            if name not in store.templates:
+                return 404, {}
+            return 200, {"index_templates": [{"name": name, "index_template": store.templates[name]}]}
+        if head == '_cat' and len(segments) > 1 and segments[1] == 'indices':
+            return 200, store.cat_indices(segments[2] if len(segments) > 2 else None, params.get('h'))
+        if head == '_refresh' or head == '_forcemerge':
+            return self._refresh_or_merge(head, None, params)
+        if head == '_cluster':
+            return 200, {"cluster_name": "fake-elasticsearch", "status": "green", "number_of_nodes": 1}
+
+        index_name = head
+        action = segments[1] if len(segments) > 1 else None
+
+        if action is None:
+            if method == 'HEAD':
+                try:
+                    return (200 if store.resolve(index_name) else 404), {}
+                except FakeElasticsearchError:
+                    return 404, {}
+            if method == 'PUT':
+                return 200, store.create_index(index_name, body or {})
+            if method == 'DELETE':
+                return 200, store.delete_index(index_name, flag('ignore_unavailable'))
+            return 200, {
+                name: {
+                    "aliases": {
+                        alias: members[name] for alias, members in store.aliases.items() if name in members
+                    },
+                    "mappings": store.indices[name].mappings,
+                    "settings": {"index": store.indices[name].settings}
+                }
+                for name in store.resolve(index_name)
+            }
+
+        if action in ('_doc', '_create'):
+            doc_id = segments[2] if len(segments) > 2 else None
+            if method in ('PUT', 'POST'):
+                op_type = 'create' if action == '_create' or params.get('op_type') == 'create' else 'index'
+                result = store.write_document(index_name, doc_id, body, op_type=op_type)
+                return result.pop('status'), result
+            if method == 'DELETE':
+                result = store.delete_document(index_name, doc_id)
+                result.pop('status')
+                return result.pop('_status', 200), result
+            if method == 'HEAD':
+                try:
+                    store.get_document(index_name, doc_id)
+                    return 200, {}
+                except FakeElasticsearchError:
+                    return 404, {}
+            try:
+                includes = params.get('_source_includes')
+                return 200, store.get_document(index_name, doc_id, includes.split(',') if includes else None)
+            except FakeElasticsearchError as e:
+                if e.status == 404 and e.error_type == 'not_found':
+                    return 404, {"_index": index_name, "_id": doc_id, "found": False}
+                raise
+        if action == '_update':
+            result = store.update_document(index_name, segments[2], body)
+            return result.pop('status'), result
+        if action == '_delete_by_query':
+            return 200, store.delete_by_query(index_name, body)
+        if action == '_update_by_query':
+            return 200, store.update_by_query(index_name, body)
+        if action == '_bulk':
+            return 200, store.bulk(body, default_index=index_name)
+        if action == '_search':
+            return 200, store.search(index_name, body, params)
+        if action == '_msearch':
+            return 200, store.msearch(index_name, body)
+        if action == '_count':
+            return 200, store.count(index_name, body)
+        if action == '_pit':
+            return 200, store.open_point_in_time(index_name)
+        if action in ('_refresh', '_forcemerge', '_flush'):
+            return self._refresh_or_merge(action, index_name, params)
+        if action == '_settings':
+            names = store.resolve(index_name)
+            if method == 'PUT':
+                for name in names:
+                    store.indices[name].put_settings(body)
+                return 200, {"acknowledged": True}
+            return 200, {name: {"settings": {"index": store.indices[name].settings}} for name in names}
+        if action == '_mapping':
+            names = store.resolve(index_name)
+            if len(segments) > 3 and segments[2] == 'field':
+                result = {}
+                for name in names:
+                    field_mappings = {}
+                    for field in segments[3].split(','):
+                        mapping, _ = store.indices[name].field_mapping(field)
+                        if mapping is not None:
+                            field_mappings[field] = {"full_name": field, "mapping": {field.split('.')[-1]: mapping}}
+                    result[name] = {"mappings": field_mappings}
+                return 200, result
+            if method == 'PUT':
+                for name in names:
+                    store.indices[name].mappings.setdefault('properties', {}).update(body.get('properties', {}))
+                return 200, {"acknowledged": True}
+            return 200, {name: {"mappings": store.indices[name].mappings} for name in names}
+        if action == '_alias':
+            if method == 'PUT':
+                return 200, store.update_aliases([{"add": {"index": index_name, "alias": segments[2], **(body or {})}}])
+            if method == 'DELETE':
+                return 200, store.update_aliases([{"remove": {"index": index_name, "alias": segments[2]}}])
+            return 200, store.get_aliases(segments[2] if len(segments) > 2 else None, index_name)
+        if action == '_rollover':
+            return 200, store.rollover(index_name, body)
+        if action == '_stats':
+            return 200, store.stats(index_name)
+
+        raise FakeElasticsearchError(400, "illegal_argument_exception", f"unsupported endpoint [{method} /{'/'.join(segments)}]")
+
+
+class FakeElasticsearchServer(ThreadingHTTPServer):
+    """进程内ES替身服务
+
+    port 为0时由系统分配空闲端口，启动后通过 .port / .url 获取。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        super().__init__((host, port), FakeElasticsearchHandler)
+        self.store = FakeElasticsearchStore()
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.port}"
+
+    def client_config(self, base_config: Dict = None) -> Dict:
+        """在ES连接配置基础上替换为本服务的地址（HTTP、无认证）"""
+        config = dict(base_config or {})
+        config.update({
+            'host': self.server_address[0],
+            'port': self.port,
+            'use_ssl': False,
+            'scheme': 'http',
+            'username': None,
+            'password': None,
+            'max_retries': 0
+        })
+        config.setdefault('timeout', 10)
+        return config
+
+    def start(self) -> 'FakeElasticsearchServer':
+        """在后台线程中启动服务"""
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-elasticsearch', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
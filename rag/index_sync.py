@@ -0,0 +1,207 @@
+"""
+索引变更同步
+Products / ProductKnowledge 的保存与删除事件（见 signals.py）写入Redis Stream作为持久化的变更队列，
+由 run_index_sync 命令中的 IndexSyncConsumer 按商品合并后增量更新：
+当前使用的向量库（Elasticsearch知识索引或ChromaDB）、ES商品索引以及商品Redis缓存。
+"""
+import logging
+import os
+import socket
+import time
+from typing import Dict, List, Optional
+
+import redis
+from config import INDEX_SYNC_CONFIG, SYSTEM_CONFIG
+from .redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class IndexChangeOutbox:
+    """变更事件队列（Redis Stream）"""
+
+    STREAM_KEY = INDEX_SYNC_CONFIG['stream']
+    GROUP = INDEX_SYNC_CONFIG['group']
+
+    @classmethod
+    def publish(cls, model: str, action: str, product_id: str, product_pk: int) -> Optional[str]:
+        """写入一条变更事件
+
+        Args:
+            model: 'product' 或 'knowledge'
+            action: 'save' 或 'delete'
+            product_id: 商品业务ID，事件按它合并
+            product_pk: 商品主键（ES商品索引的文档ID）
+
+        Returns:
+            str: 事件ID，写入失败返回None
+        """
+        try:
+            return redis_client.xadd(
+                cls.STREAM_KEY,
+                {
+                    'model': model,
+                    'action': action,
+                    'product_id': product_id,
+                    'product_pk': str(product_pk),
+                    'ts': f"{time.time():.3f}"
+                },
+                maxlen=INDEX_SYNC_CONFIG['stream_maxlen'],
+                approximate=True
+            )
+        except Exception as e:
+            # 事件丢失时可通过 index_products 与 init_elasticsearch 补偿同步
+            logger.error(f"写入索引变更事件失败 ({model} {action} {product_id}): {e}")
+            return None
+
+    @classmethod
+    def ensure_group(cls):
+        """创建消费组（已存在时忽略），新消费组从Stream开头消费"""
+        try:
+            redis_client.xgroup_create(cls.STREAM_KEY, cls.GROUP, id='0', mkstream=True)
+        except redis.ResponseError as e:
+            if 'BUSYGROUP' not in str(e):
+                raise
+
+    @classmethod
+    def backlog(cls) -> Dict:
+        """队列积压情况：Stream长度与未确认事件数"""
+        try:
+            pending = redis_client.xpending(cls.STREAM_KEY, cls.GROUP)
+            return {'length': redis_client.xlen(cls.STREAM_KEY), 'pending': pending['pending']}
+        except redis.ResponseError:
+            return {'length': redis_client.xlen(cls.STREAM_KEY), 'pending': 0}
+
+
+class IndexSyncConsumer:
+    """变更事件消费者
+
+    读取到的事件先按 product_id 缓存在内存中，商品在 debounce_seconds 内没有新事件
+    （或距首个事件已超过 max_delay_seconds）时才执行一次同步，连续编辑只同步一次。
+    同步成功后确认（XACK）该商品的全部事件；失败的事件不确认，
+    超过 claim_idle_seconds 后由任一消费者重新领取，进程崩溃时也不会丢失。
+    """
+
+    def __init__(self, consumer_name: str = None, debounce_seconds: float = None,
+                 max_delay_seconds: float = None):
+        self.consumer_name = consumer_name or f"{socket.gethostname()}-{os.getpid()}"
+        self.debounce_seconds = (
+            INDEX_SYNC_CONFIG['debounce_seconds'] if debounce_seconds is None else debounce_seconds
+        )
+        self.max_delay_seconds = (
+            INDEX_SYNC_CONFIG['max_delay_seconds'] if max_delay_seconds is None else max_delay_seconds
+        )
+        # product_id -> {'first_seen', 'last_seen', 'message_ids', 'product_pks'}
+        self.pending = {}
+        self.stats = {'events': 0, 'synced': 0, 'failed': 0}
+        self._last_claim = 0.0
+
+    def _collect(self, messages: List):
+        """把读取到的事件按商品合并"""
+        now = time.time()
+        for message_id, fields in messages:
+            if not fields:
+                continue
+            self.stats['events'] += 1
+            entry = self.pending.setdefault(fields['product_id'], {
+                'first_seen': now, 'message_ids': [], 'product_pks': set()
+            })
+            entry['last_seen'] = now
+            entry['message_ids'].append(message_id)
+            entry['product_pks'].add(int(fields['product_pk']))
+
+    def poll(self, block_ms: int = 1000, count: int = 500) -> int:
+        """读取新事件（并定期领取超时未确认的事件），返回读取数量"""
+        now = time.time()
+        claimed = []
+        if now - self._last_claim >= INDEX_SYNC_CONFIG['claim_idle_seconds'] / 2:
+            self._last_claim = now
+            result = redis_client.xautoclaim(
+                IndexChangeOutbox.STREAM_KEY, IndexChangeOutbox.GROUP, self.consumer_name,
+                min_idle_time=INDEX_SYNC_CONFIG['claim_idle_seconds'] * 1000, count=count
+            )
+            claimed = result[1]
+            if claimed:
+                logger.info(f"重新领取 {len(claimed)} 条超时未确认的变更事件")
+
+        response = redis_client.xreadgroup(
+            IndexChangeOutbox.GROUP, self.consumer_name,
+            {IndexChangeOutbox.STREAM_KEY: '>'}, count=count, block=block_ms
+        )
+        messages = claimed + [message for _, stream_messages in response or [] for message in stream_messages]
+        self._collect(messages)
+        return len(messages)
+
+    def flush(self, force: bool = False) -> int:
+        """同步已到期的商品，force 时同步全部缓存的商品，返回同步成功的商品数"""
+        now = time.time()
+        synced = 0
+        for product_id, entry in list(self.pending.items()):
+            due = (
+                force
+                or now - entry['last_seen'] >= self.debounce_seconds
+                or now - entry['first_seen'] >= self.max_delay_seconds
+            )
+            if not due:
+                continue
+
+            del self.pending[product_id]
+            try:
+                self.apply(product_id, entry['product_pks'])
+            except Exception as e:
+                # 不确认，等待超时后重新领取重试
+                self.stats['failed'] += 1
+                logger.error(f"同步商品 {product_id} 失败，{len(entry['message_ids'])} 条事件待重试: {e}")
+                continue
+
+            redis_client.xack(IndexChangeOutbox.STREAM_KEY, IndexChangeOutbox.GROUP, *entry['message_ids'])
+            self.stats['synced'] += 1
+            synced += 1
+        return synced
+
+    def apply(self, product_id: str, product_pks):
+        """按数据库当前状态同步一个商品，失败时抛出异常"""
+        from product.models import Products
+        from product.redis import ProductCache
+        from product.search import ProductSearchIndex
+        from .elasticsearch_service import es_service
+
+        product = Products.objects.filter(product_id=product_id).first()
+        use_elasticsearch = SYSTEM_CONFIG.get('use_elasticsearch', True)
+        if use_elasticsearch and not es_service.is_available():
+            raise RuntimeError('Elasticsearch不可用')
+
+        # ES商品索引
+        if use_elasticsearch:
+            stale_pks = set(product_pks) - ({product.pk} if product else set())
+            if stale_pks and not ProductSearchIndex.delete_products(stale_pks):
+                raise RuntimeError('删除商品索引文档失败')
+            if product:
+                ProductSearchIndex.index_products([product.pk])
+
+        # 当前使用的向量库
+        if use_elasticsearch:
+            from .elasticsearch_rag import elasticsearch_rag_system
+            result = elasticsearch_rag_system.sync_product_knowledge(product_id)
+        else:
+            from .RAG封装 import rag_system
+            result = rag_system.sync_product_knowledge(product_id)
+        if not result['success']:
+            raise RuntimeError(f"同步知识失败: {result.get('error')}")
+
+        # 商品缓存
+        cache_ok = ProductCache.refresh_product(product) if product else ProductCache.remove_product(product_id)
+        if not cache_ok:
+            raise RuntimeError('刷新商品缓存失败')
+
+        logger.info(f"商品 {product_id} 已同步{'' if product else '（已删除）'}: {result}")
+
+    def run(self, once: bool = False, block_ms: int = 1000):
+        """持续消费；once 时处理完当前积压后退出"""
+        IndexChangeOutbox.ensure_group()
+        while True:
+            received = self.poll(block_ms=block_ms)
+            if once and not received:
+                self.flush(force=True)
+                return self.stats
+            self.flush()
@@ -0,0 +1,86 @@
+"""
+Django管理命令：对比知识库全文检索新旧查询方式的延迟
+用法: python manage.py bench_es_text_queries --queries 200
+
+旧方式：基础字段上的 multi_match + fuzziness AUTO
+新方式：n-gram子字段上的精确词项匹配（需先用 init_elasticsearch --rebuild 生成子字段）
+查询词取自知识索引中的属性值片段，两种方式在同一语料、同一组查询上执行。
+"""
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from elasticsearch.helpers import scan
+from rag.benchmark import summarize_latencies, time_call
+from rag.elasticsearch_rag import ElasticsearchRAGSystem
+from rag.elasticsearch_service import es_service
+from config import ELASTICSEARCH_CONFIG
+
+
+class Command(BaseCommand):
+    help = '对比 fuzziness AUTO 与 n-gram 子字段两种全文检索的 p50/p95 延迟'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200, help='查询次数（默认200）')
+        parser.add_argument('--size', type=int, default=10, help='每次返回条数（默认10）')
+        parser.add_argument('--warmup', type=int, default=20, help='预热查询次数（默认20）')
+
+    def handle(self, *args, **options):
+        if not es_service.is_available():
+            raise CommandError("❌ Elasticsearch服务不可用，请检查连接配置")
+        
+        index_name = ELASTICSEARCH_CONFIG['indices']['knowledge']
+        queries = self.sample_queries(index_name, options['queries'])
+        if not queries:
+            raise CommandError("❌ 知识索引中没有可用的属性值")
+        
+        base_fields = ElasticsearchRAGSystem.KNOWLEDGE_TEXT_FIELDS
+        shapes = {
+            'fuzzy(AUTO)': lambda q: es_service.multi_match_search(
+                index_name, q, base_fields, size=options['size'], min_score=None, fuzziness="AUTO"
+            ),
+            'ngram': lambda q: es_service.multi_match_search(
+                index_name, q,
+                es_service.ngram_fields(base_fields, prefix_fields=['product_name']),
+                size=options['size'], min_score=None, minimum_should_match="2<75%"
+            ),
+        }
+        
+        self.stdout.write(f"📊 索引 {index_name}，查询 {len(queries)} 次")
+        for name, run in shapes.items():
+            for query in queries[:options['warmup']]:
+                run(query)
+            
+            wall_ms, server_ms, hit_counts = [], [], []
+            for query in queries:
+                result, elapsed_ms = time_call(run, query)
+                wall_ms.append(elapsed_ms)
+                server_ms.append(result.get('took', 0))
+                hit_counts.append(len(result['hits']))
+            
+            wall = summarize_latencies(wall_ms)
+            server = summarize_latencies(server_ms)
+            self.stdout.write(
+                f"{name:<12} 客户端 p50={wall['p50']:.1f}ms p95={wall['p95']:.1f}ms | "
+                f"服务端took p50={server['p50']:.1f}ms p95={server['p95']:.1f}ms | "
+                f"平均命中 {sum(hit_counts) / len(hit_counts):.1f}"
+            )
+
+    def sample_queries(self, index_name, count):
+        """从属性值中截取2~8个字符的片段作为查询词"""
+        values = [
+            hit['_source']['value']
+            for hit in scan(es_service.client, index=index_name,
+                            query={"_source": ["value"], "query": {"exists": {"field": "value"}}})
+            if hit['_source'].get('value')
+        ]
+        if not values:
+            return []
+        
+        random.seed(42)
+        queries = []
+        for _ in range(count):
+            value = random.choice(values)
+            length = random.randint(2, min(8, max(2, len(value))))
+            start = random.randint(0, max(0, len(value) - length))
+            queries.append(value[start:start + length])
+        return queries
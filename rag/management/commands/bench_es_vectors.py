@@ -0,0 +1,162 @@
+"""
+Django管理命令：对比不同向量索引参数的召回率、延迟和索引大小
+用法: python manage.py bench_es_vectors --variant hnsw:16:100 --variant int8_hnsw:16:100 --num-candidates 50 100 200
+
+使用知识索引中已有的 content_vector，随机留出一部分作为查询、其余作为语料，每种参数组合写入一个临时索引；
+查询向量不写入索引，以 script_score 精确暴力检索结果为基准计算 recall@k。
+"""
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from elasticsearch.helpers import bulk, scan
+from rag.benchmark import summarize_latencies, time_call
+from rag.elasticsearch_service import es_service
+from config import ELASTICSEARCH_CONFIG
+
+
+class Command(BaseCommand):
+    help = '评测向量索引参数（量化类型、m、ef_construction、num_candidates）的recall@k、延迟和索引大小'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--variant',
+            action='append',
+            help='索引参数，格式 type[:m:ef_construction]，可重复（默认 hnsw:16:100, int8_hnsw:16:100, int8_hnsw:32:200）',
+        )
+        parser.add_argument(
+            '--num-candidates',
+            type=int,
+            nargs='+',
+            default=[50, 100, 200],
+            help='要评测的num_candidates取值（默认 50 100 200）',
+        )
+        parser.add_argument('--k', type=int, default=10, help='召回数量k（默认10）')
+        parser.add_argument('--queries', type=int, default=100, help='查询次数（默认100）')
+        parser.add_argument('--limit', type=int, default=10000, help='最多使用的语料向量数（默认10000）')
+        parser.add_argument('--keep', action='store_true', help='保留临时索引')
+
+    def handle(self, *args, **options):
+        if not es_service.is_available():
+            raise CommandError("❌ Elasticsearch服务不可用，请检查连接配置")
+        
+        k = options['k']
+        variants = [self.parse_variant(v) for v in (options['variant'] or
+                    ['hnsw:16:100', 'int8_hnsw:16:100', 'int8_hnsw:32:200'])]
+        
+        vectors = self.load_vectors(options['limit'])
+        if len(vectors) <= k:
+            raise CommandError(f"❌ 知识索引中只有 {len(vectors)} 条向量，不足以评测 k={k}")
+        
+        # 查询向量从语料中留出，不写入索引：查询自身就在索引里时最近邻总能命中，会抬高召回率
+        random.Random(42).shuffle(vectors)
+        num_queries = min(options['queries'], len(vectors) - k)
+        queries = [vector for _, vector in vectors[:num_queries]]
+        vectors = vectors[num_queries:]
+        self.stdout.write(f"📊 语料 {len(vectors)} 条，留出查询 {len(queries)} 次，k={k}")
+        
+        ground_truth = None
+        for vector_config in variants:
+            index_name = self.build_index(vector_config, vectors)
+            try:
+                if ground_truth is None:
+                    ground_truth = [self.exact_search(index_name, query, k) for query in queries]
+                
+                size_mb = self.index_size_bytes(index_name) / 1024 / 1024
+                label = self.variant_label(vector_config)
+                for num_candidates in options['num_candidates']:
+                    recalls, latencies = [], []
+                    for query, expected in zip(queries, ground_truth):
+                        result, elapsed_ms = time_call(
+                            es_service.semantic_search,
+                            index_name=index_name,
+                            vector=query,
+                            vector_field='vector',
+                            size=k,
+                            num_candidates=num_candidates
+                        )
+                        found = {hit['id'] for hit in result['hits']}
+                        recalls.append(len(found & expected) / k)
+                        latencies.append(elapsed_ms)
+                    
+                    stats = summarize_latencies(latencies)
+                    self.stdout.write(
+                        f"{label:<24} num_candidates={num_candidates:<5} "
+                        f"recall@{k}={sum(recalls) / len(recalls):.3f} "
+                        f"p50={stats['p50']:.1f}ms p95={stats['p95']:.1f}ms "
+                        f"index={size_mb:.2f}MB"
+                    )
+            finally:
+                if not options['keep']:
+                    es_service.delete_index(index_name)
+
+    def parse_variant(self, text):
+        """解析 type[:m:ef_construction] 为向量配置"""
+        parts = text.split(':')
+        index_options = {'type': parts[0]}
+        if len(parts) == 3:
+            index_options['m'] = int(parts[1])
+            index_options['ef_construction'] = int(parts[2])
+        elif len(parts) != 1:
+            raise CommandError(f"❌ 无法解析参数组合: {text}")
+        
+        return dict(ELASTICSEARCH_CONFIG['vector'], index_options=index_options)
+
+    def variant_label(self, vector_config):
+        options = vector_config['index_options']
+        if 'm' in options:
+            return f"{options['type']}(m={options['m']},ef={options['ef_construction']})"
+        return options['type']
+
+    def load_vectors(self, limit):
+        """从知识索引读取已有的内容向量"""
+        vectors = []
+        for hit in scan(
+            es_service.client,
+            index=ELASTICSEARCH_CONFIG['indices']['knowledge'],
+            query={"query": {"exists": {"field": "content_vector"}}, "_source": ["content_vector"]}
+        ):
+            vectors.append((hit['_id'], hit['_source']['content_vector']))
+            if len(vectors) >= limit:
+                break
+        return vectors
+
+    def build_index(self, vector_config, vectors):
+        """按参数组合创建临时索引并写入语料"""
+        options = vector_config['index_options']
+        index_name = f"bench_vectors_{options['type']}_{options.get('m', 0)}_{options.get('ef_construction', 0)}"
+        es_service.delete_index(index_name)
+        es_service.create_index(
+            index_name,
+            mapping={"properties": {"vector": es_service.vector_field_mapping(vector_config)}}
+        )
+        
+        with es_service.bulk_load(index_name):
+            bulk(
+                es_service.client,
+                ({'_index': index_name, '_id': doc_id, '_source': {'vector': vector}}
+                 for doc_id, vector in vectors),
+                chunk_size=500
+            )
+        return index_name
+
+    def exact_search(self, index_name, query, k):
+        """精确暴力检索，作为召回率基准"""
+        result = es_service.client.search(
+            index=index_name,
+            size=k,
+            query={
+                "script_score": {
+                    "query": {"match_all": {}},
+                    "script": {
+                        "source": "cosineSimilarity(params.query_vector, 'vector') + 1.0",
+                        "params": {"query_vector": query}
+                    }
+                }
+            },
+            source=False
+        )
+        return {hit['_id'] for hit in result['hits']['hits']}
+
+    def index_size_bytes(self, index_name):
+        stats = es_service.client.indices.stats(index=index_name, metric='store')
+        return stats['indices'][index_name]['total']['store']['size_in_bytes']
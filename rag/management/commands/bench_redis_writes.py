@@ -0,0 +1,137 @@
+"""
+Django管理命令：对比缓存写入逐条发送与MULTI事务一次发送的往返次数和延迟
+用法: python manage.py bench_redis_writes --ops 2000 [--db 15]
+
+覆盖 RAGConversationCache.save_conversation、RecommendationCache.save_recommendation、
+UserBehaviorCache.add_user_behavior。逐条方式把 pipeline() 替换为立即执行每条命令的客户端，
+与改造前的命令序列相同；往返次数按连接发送的数据包计数。
+数据写入 --db 指定的库（默认15），结束后删除本次写入的键。
+"""
+import contextlib
+import io
+
+import redis
+from django.core.management.base import BaseCommand, CommandError
+
+import Agents.redis as agents_redis
+import rag.redis as rag_redis
+import users.redis as users_redis
+from Agents.redis import RecommendationCache
+from config import REDIS_CONFIG
+from rag.benchmark import summarize_latencies, time_call
+from rag.redis import RAGConversationCache
+from users.redis import UserBehaviorCache
+
+
+class CountingConnection(redis.Connection):
+    """统计发送次数（即网络往返次数）的连接"""
+
+    round_trips = 0
+
+    def send_packed_command(self, command, check_health=True):
+        CountingConnection.round_trips += 1
+        return super().send_packed_command(command, check_health)
+
+
+class SequentialClient:
+    """pipeline() 返回自身、每条命令立即执行的客户端，复现改造前逐条发送的行为"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def pipeline(self, transaction=True):
+        return self
+
+    def execute(self):
+        return []
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class Command(BaseCommand):
+    help = '对比缓存写入逐条发送与MULTI事务的往返次数和p50/p99延迟'
+
+    MODULES = (rag_redis, agents_redis, users_redis)
+    KEY_PATTERNS = (
+        'user_conversations:bench_*', 'user_conversation_summaries:bench_*', 'user_conversation_stats:bench_*',
+        'conversation_detail:*', 'popular_questions:*', 'user_recommendations:bench_*',
+        'user_recommendation_summaries:bench_*', 'user_recommendation_stats:bench_*',
+        'user_conversation_tokens:bench_*', 'user_recommendation_tokens:bench_*',
+        'recommendation_detail:*', 'popular_requirements:*',
+        'recommendation_stats', 'user_recent_views:bench_*', 'user_behavior_stats:bench_*',
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ops', type=int, default=2000, help='每种写入执行次数（默认2000）')
+        parser.add_argument('--db', type=int, default=15, help='写入的Redis库（默认15，勿使用业务库）')
+
+    def handle(self, *args, **options):
+        if options['db'] in (REDIS_CONFIG['product_db'], REDIS_CONFIG['users_db'],
+                             REDIS_CONFIG['rag_db'], REDIS_CONFIG['agents_db']):
+            raise CommandError("❌ 请使用业务库以外的Redis库做基准测试")
+
+        client = redis.Redis(connection_pool=redis.ConnectionPool(
+            connection_class=CountingConnection,
+            host=REDIS_CONFIG['host'],
+            port=REDIS_CONFIG['port'],
+            password=REDIS_CONFIG.get('password'),
+            db=options['db'],
+            decode_responses=True
+        ))
+        try:
+            client.ping()
+        except redis.RedisError as e:
+            raise CommandError(f"❌ Redis不可用: {e}")
+
+        ops = options['ops']
+        writes = {
+            'save_conversation': lambda i: RAGConversationCache.save_conversation(
+                f"bench_{i % 50}", f"这款手机的续航怎么样{i % 200}", "续航约一天半", sources=[{'source': 'bench'}]
+            ),
+            'save_recommendation': lambda i: RecommendationCache.save_recommendation(
+                f"bench_{i % 50}", f"预算三千的拍照手机{i % 200}", "推荐以下机型", products=[{'id': i}]
+            ),
+            'add_user_behavior': lambda i: UserBehaviorCache.add_user_behavior(
+                f"bench_{i % 50}", f"P{i % 500:04d}", "测试商品"
+            ),
+        }
+
+        original_clients = [module.redis_client for module in self.MODULES]
+        try:
+            for name, write in writes.items():
+                for mode, mode_client in (('逐条发送', SequentialClient(client)), ('MULTI事务', client)):
+                    for module in self.MODULES:
+                        module.redis_client = mode_client
+                    latencies, round_trips = self.run(write, ops)
+                    summary = summarize_latencies(latencies)
+                    self.stdout.write(
+                        f"{name:<20} {mode:<8} 往返 {round_trips / ops:.1f}/次 | "
+                        f"p50={summary['p50']:.3f}ms p99={summary['p99']:.3f}ms | "
+                        f"{ops / (sum(latencies) / 1000):.0f} ops/s"
+                    )
+        finally:
+            for module, original in zip(self.MODULES, original_clients):
+                module.redis_client = original
+            self.cleanup(client)
+
+    def run(self, write, ops):
+        """执行 ops 次写入，返回 (延迟列表, 往返总次数)"""
+        # 缓存类在每次保存时打印日志，计时期间丢弃
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(min(50, ops)):
+                write(i)
+            CountingConnection.round_trips = 0
+            latencies = []
+            for i in range(ops):
+                _, elapsed_ms = time_call(write, i)
+                latencies.append(elapsed_ms)
+        return latencies, CountingConnection.round_trips
+
+    def cleanup(self, client):
+        deleted = 0
+        for pattern in self.KEY_PATTERNS:
+            keys = list(client.scan_iter(match=pattern, count=1000))
+            for start in range(0, len(keys), 500):
+                deleted += client.delete(*keys[start:start + 500])
+        self.stdout.write(f"已清理 {deleted} 个基准测试键")
@@ -0,0 +1,63 @@
+"""
+Django管理命令：根据对话索引中的问题向量离线重建相似问题聚类
+用法: python manage.py cluster_questions [--threshold 0.88] [--refine 2]
+
+日常由 index_conversation 增量更新聚类；定期（如每晚）离线重建可修正增量聚类的漂移，
+并合并历史上被拆开的相近聚类。
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from elasticsearch.helpers import scan
+from rag.elasticsearch_service import es_service
+from rag.question_clusters import QuestionClusters
+from config import ELASTICSEARCH_CONFIG
+
+
+class Command(BaseCommand):
+    help = '根据对话索引中的问题向量离线重建相似问题聚类中心表'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, help='并入聚类的相似度阈值（默认取配置）')
+        parser.add_argument('--refine', type=int, help='k-means细化轮数（默认取配置）')
+
+    def handle(self, *args, **options):
+        if not es_service.is_available():
+            raise CommandError("❌ Elasticsearch服务不可用，请检查连接配置")
+        
+        if options['threshold'] is not None:
+            QuestionClusters.CONFIG['assign_threshold'] = options['threshold']
+        if options['refine'] is not None:
+            QuestionClusters.CONFIG['refine_iterations'] = options['refine']
+        
+        start_time = time.time()
+        questions, vectors = self.load_question_vectors()
+        if not questions:
+            self.stdout.write("对话索引中没有带向量的问题")
+            return
+        self.stdout.write(f"已读取 {len(questions)} 个问题向量，耗时 {time.time() - start_time:.1f}s")
+        
+        cluster_start = time.time()
+        cluster_count = QuestionClusters.rebuild(questions, np.asarray(vectors, dtype=np.float32))
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ 聚类完成: {len(questions)} 个问题 -> {cluster_count} 个聚类，"
+            f"耗时 {time.time() - cluster_start:.1f}s"
+        ))
+
+    def load_question_vectors(self):
+        """滚动读取对话索引（全部分区）中的问题及其向量"""
+        questions, vectors = [], []
+        for hit in scan(
+            es_service.client,
+            index=ELASTICSEARCH_CONFIG['indices']['conversations'],
+            query={"query": {"exists": {"field": "question_vector"}}},
+            _source=["question", "question_vector"],
+            size=1000
+        ):
+            source = hit['_source']
+            question = (source.get('question') or '').strip()
+            if question and source.get('question_vector'):
+                questions.append(question)
+                vectors.append(source['question_vector'])
+        return questions, vectors
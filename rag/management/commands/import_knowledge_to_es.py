@@ -1,6 +1,9 @@
 """
 Django管理命令：将ProductKnowledge数据导入到Elasticsearch
-用法: python manage.py import_knowledge_to_es
+用法: python manage.py import_knowledge_to_es [--workers 4] [--resume] [--since-id 1000]
+
+按主键做keyset分页（id > last_id ORDER BY id LIMIT n），每批成功后把
+last_id 写入Redis检查点，中断后可用 --resume 从检查点继续。
 """
 import os
 import sys
@@ -10,12 +13,110 @@ import django
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'DAY12.settings')
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Max, Min
+from langchain_community.embeddings import DashScopeEmbeddings
 from rag.models import ProductKnowledge
 from product.models import Products
-from rag.elasticsearch_service import es_service
-from config import ELASTICSEARCH_CONFIG
+from rag.elasticsearch_rag import ElasticsearchRAGSystem
+from rag.elasticsearch_service import es_service, ElasticsearchService
+from rag.management.commands.init_elasticsearch import Command as InitElasticsearchCommand
+from rag.redis import redis_client
+from config import API_CONFIG, ELASTICSEARCH_CONFIG
+from elasticsearch.helpers import bulk
 import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# 检查点Hash：field为 "起始id:结束id"（工作进程负责的id区间），value为该区间已导入的最大id
+CHECKPOINT_KEY_PREFIX = "es_import_checkpoint:"
+
+
+def get_index_definition():
+    """知识索引的mapping和settings，与 init_elasticsearch 创建的索引一致（含向量字段和n-gram子字段）"""
+    return InitElasticsearchCommand()._get_index_configs()['knowledge']
+
+
+def build_document(item, index_name, vector):
+    """把一条ProductKnowledge转换为bulk动作，文档结构与RAG系统写入的知识文档一致"""
+    doc = ElasticsearchRAGSystem._knowledge_document(item, item.product)
+    doc['content_vector'] = vector
+    doc['indexed_at'] = django.utils.timezone.now().isoformat()
+    return {
+        '_index': index_name,
+        '_id': doc['id'],
+        '_source': doc
+    }
+
+
+def import_id_range(index_name, start_id, end_id, after_id, batch_size, checkpoint_key, in_subprocess=False,
+                    stdout=None, stderr=None):
+    """导入 (after_id, end_id] 区间内的知识记录
+    
+    start_id/end_id 标识该工作进程负责的区间（用作检查点field），after_id 为
+    已完成的位置。每批成功后写检查点；某批失败即停止，保证检查点之后的数据
+    在 --resume 时会被重新导入。
+    
+    进度输出到命令的 stdout/stderr；工作进程中未传入时写日志。
+    
+    Returns:
+        dict: success/error/last_id/completed
+    """
+    if in_subprocess:
+        django.setup()
+        client = ElasticsearchService().client
+    else:
+        client = es_service.client
+    embeddings_model = DashScopeEmbeddings(
+        model=API_CONFIG['embedding_model'],
+        dashscope_api_key=API_CONFIG['embedding_api_key']
+    )
+    
+    def report(message, error=False):
+        if stdout is None:
+            logger.log(logging.ERROR if error else logging.INFO, message)
+        else:
+            (stderr if error else stdout).write(message)
+    
+    field = f"{start_id}:{end_id}"
+    last_id = after_id
+    success_count = 0
+    error_count = 0
+    
+    while True:
+        batch_items = list(
+            ProductKnowledge.objects.select_related('product')
+            .filter(id__gt=last_id, id__lte=end_id)
+            .order_by('id')[:batch_size]
+        )
+        if not batch_items:
+            break
+        
+        try:
+            # 每批一次 embed_documents 调用生成向量
+            vectors = embeddings_model.embed_documents([
+                ElasticsearchRAGSystem._content_text(item.attribute, item.value, item.source_text)
+                for item in batch_items
+            ])
+            batch_docs = [build_document(item, index_name, vector) for item, vector in zip(batch_items, vectors)]
+            # 不在每批后refresh：重建时由bulk_load结束时统一刷新，增量导入按索引的刷新间隔可见
+            batch_success, _ = bulk(client, batch_docs)
+        except Exception as e:
+            error_count += len(batch_items)
+            report(f"❌ 区间 {field} 在 id>{last_id} 处批量索引失败: {e}", error=True)
+            return {'success': success_count, 'error': error_count, 'last_id': last_id, 'completed': False}
+        
+        success_count += batch_success
+        last_id = batch_items[-1].id
+        redis_client.hset(checkpoint_key, field, last_id)
+        report(f"✅ 区间 {field}: 已导入至 id={last_id} (累计成功: {success_count})")
+    
+    return {'success': success_count, 'error': error_count, 'last_id': last_id, 'completed': True}
+
 
 class Command(BaseCommand):
     help = '将ProductKnowledge数据导入到Elasticsearch'
@@ -24,7 +125,7 @@ class Command(BaseCommand):
         parser.add_argument(
             '--force',
             action='store_true',
-            help='强制重新索引，删除现有数据',
+            help='在新版本索引中全量重建，校验后原子切换别名',
         )
         parser.add_argument(
             '--batch-size',
@@ -32,6 +133,28 @@ class Command(BaseCommand):
             default=100,
             help='批量处理大小（默认100）',
         )
+        parser.add_argument(
+            '--no-bulk-tuning',
+            action='store_true',
+            help='--force 重建时不进入批量导入模式（保留refresh与副本），用于对比导入吞吐量',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='并行工作进程数，每个进程负责一段连续的id区间（默认1）',
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='从Redis检查点继续上次中断的导入',
+        )
+        parser.add_argument(
+            '--since-id',
+            type=int,
+            default=0,
+            help='只导入id大于该值的记录（默认0，即全部）',
+        )
 
     def handle(self, *args, **options):
         self.stdout.write("🚀 开始导入ProductKnowledge数据到Elasticsearch...")
@@ -46,151 +169,195 @@ class Command(BaseCommand):
         knowledge_index = ELASTICSEARCH_CONFIG['indices']['knowledge']
         batch_size = options['batch_size']
         force = options['force']
+        bulk_tuning = not options['no_bulk_tuning']
+        workers = max(1, options['workers'])
+        resume = options['resume']
+        since_id = options['since_id']
+        checkpoint_key = f"{CHECKPOINT_KEY_PREFIX}{knowledge_index}"
         
+        if force and resume:
+            raise CommandError("❌ --force 会写入新版本索引，不能与 --resume 同时使用")
+        if force and since_id:
+            # 新版本索引只包含 id > since_id 的记录，切换别名后会丢失其余数据
+            raise CommandError("❌ --force 会全量重建并替换现有索引，不能与 --since-id 同时使用")
+        
+        start_time = time.time()
         try:
-            # 如果强制重建，先删除索引
-            if force:
-                self.stdout.write("🗑️ 删除现有索引...")
-                if es_service.client.indices.exists(index=knowledge_index):
-                    es_service.client.indices.delete(index=knowledge_index)
-                    self.stdout.write("✅ 现有索引已删除")
-            
-            # 确保索引存在
-            self.ensure_index_exists(knowledge_index)
-            
-            # 查询所有ProductKnowledge数据
-            knowledge_items = ProductKnowledge.objects.select_related('product').all()
-            total_count = knowledge_items.count()
-            
-            if total_count == 0:
-                self.stdout.write(self.style.WARNING("⚠️ 没有找到ProductKnowledge数据"))
-                return
-            
-            self.stdout.write(f"📊 找到 {total_count} 条知识记录，开始导入...")
-            
-            # 分批处理
-            success_count = 0
-            error_count = 0
+            if resume:
+                # 导入范围以检查点中的区间为准，与本次传入的 --since-id 无关
+                ranges = self.load_checkpoint(checkpoint_key)
+                if not ranges:
+                    raise CommandError(f"❌ 没有找到检查点 {checkpoint_key}，无法继续")
+                total_count = self.count_in_ranges(ranges)
+                remaining_count = self.count_in_ranges(ranges, remaining=True)
+                self.stdout.write(
+                    f"⏯️ 从检查点继续，共 {len(ranges)} 个区间、{total_count} 条知识记录，"
+                    f"剩余 {remaining_count} 条，开始导入..."
+                )
+            else:
+                knowledge_items = ProductKnowledge.objects.filter(id__gt=since_id)
+                total_count = knowledge_items.count()
+                
+                if total_count == 0:
+                    self.stdout.write(self.style.WARNING("⚠️ 没有找到ProductKnowledge数据"))
+                    return
+                
+                redis_client.delete(checkpoint_key)
+                ranges = self.split_id_ranges(knowledge_items, workers)
+                self.stdout.write(
+                    f"📊 找到 {total_count} 条知识记录（id > {since_id}），"
+                    f"使用 {len(ranges)} 个工作进程开始导入..."
+                )
             
-            for i in range(0, total_count, batch_size):
-                batch_items = knowledge_items[i:i + batch_size]
-                batch_docs = []
+            if force:
+                # 强制重建：写入新版本索引，校验后原子切换别名，导入期间旧索引继续提供查询
+                self.stdout.write("🔁 在新版本索引中重建，完成后切换别名...")
+                counts = {}
                 
-                for item in batch_items:
-                    try:
-                        # 构建ES文档
-                        doc = {
-                            'knowledge_id': item.id,
-                            'product_id': item.product.product_id,
-                            'product_name': item.product.name,
-                            'brand': item.product.brand,
-                            'category': item.product.category,
-                            'attribute': item.attribute,
-                            'value': item.value,
-                            'source_text': item.source_text or '',
-                            'content': f"{item.attribute} {item.value} {item.source_text or ''}",
-                            'indexed_at': django.utils.timezone.now().isoformat()
-                        }
-                        
-                        batch_docs.append({
-                            '_index': knowledge_index,
-                            '_id': f"knowledge_{item.id}",
-                            '_source': doc
-                        })
-                        
-                    except Exception as e:
-                        self.stdout.write(
-                            self.style.ERROR(f"❌ 处理记录ID {item.id} 失败: {str(e)}")
-                        )
-                        error_count += 1
+                def populate(new_index):
+                    counts.update(self.run_ranges(new_index, ranges, batch_size, checkpoint_key))
+                    return total_count
                 
-                # 批量索引到ES
-                if batch_docs:
-                    try:
-                        from elasticsearch.helpers import bulk
-                        
-                        result = bulk(
-                            es_service.client, 
-                            batch_docs,
-                            refresh=True
-                        )
-                        
-                        batch_success = result[0]  # successful count
-                        success_count += batch_success
-                        
-                        # 显示进度
-                        progress = min(i + batch_size, total_count)
-                        self.stdout.write(
-                            f"✅ 批次完成: {progress}/{total_count} "
-                            f"(成功: {batch_success}, 累计成功: {success_count})"
-                        )
-                        
-                    except Exception as e:
-                        self.stdout.write(
-                            self.style.ERROR(f"❌ 批量索引失败: {str(e)}")
-                        )
-                        error_count += len(batch_docs)
+                definition = get_index_definition()
+                result = es_service.rebuild_index(
+                    alias=knowledge_index,
+                    populate=populate,
+                    mapping=definition['mapping'],
+                    settings=definition['settings'],
+                    bulk_tuning=bulk_tuning
+                )
+                if not result['success']:
+                    # 新版本索引已被丢弃，检查点随之失效
+                    redis_client.delete(checkpoint_key)
+                    raise CommandError(f"❌ 重建失败，别名未切换: {result.get('error')}")
+                
+                self.stdout.write(f"🔀 别名 {knowledge_index} 已切换到 {result['index']}")
+            else:
+                # 确保索引存在；写入正在提供查询的索引，不关闭刷新和副本、不强制合并
+                self.ensure_index_exists(knowledge_index)
+                counts = self.run_ranges(knowledge_index, ranges, batch_size, checkpoint_key)
+            
+            success_count = counts.get('success', 0)
+            error_count = counts.get('error', 0)
+            completed = counts.get('completed', False)
             
-            # 最终统计
+            # 全部区间完成后清除检查点，否则保留供 --resume 使用
+            if completed:
+                redis_client.delete(checkpoint_key)
+            
+            # 最终统计（总耗时包含恢复设置、段合并和刷新）
+            elapsed = time.time() - start_time
+            throughput = success_count / elapsed if elapsed > 0 else 0
             self.stdout.write(
                 self.style.SUCCESS(
-                    f"\n🎉 导入完成！\n"
+                    f"\n🎉 导入{'完成' if completed else '中断'}！\n"
                     f"   总记录数: {total_count}\n"
                     f"   成功导入: {success_count}\n"
                     f"   失败记录: {error_count}\n"
-                    f"   索引名称: {knowledge_index}"
+                    f"   索引名称: {knowledge_index}\n"
+                    f"   工作进程: {len(ranges)}\n"
+                    f"   批量调优: {'开启' if bulk_tuning and force else '关闭'}\n"
+                    f"   总耗时: {elapsed:.2f}s\n"
+                    f"   吞吐量: {throughput:.1f} 条/秒"
                 )
             )
             
+            if not completed:
+                raise CommandError("❌ 部分区间未完成，检查点已保存，可使用 --resume 继续")
+            
             # 验证导入结果
-            self.verify_import(knowledge_index, total_count)
+            if since_id == 0 and not resume:
+                self.verify_import(knowledge_index, total_count)
             
+        except CommandError:
+            raise
         except Exception as e:
             raise CommandError(f"❌ 导入过程发生错误: {str(e)}")
 
+    def split_id_ranges(self, queryset, workers):
+        """按主键范围把数据切分为 workers 段，返回 [(start_id, end_id, after_id), ...]
+        
+        区间为 (start_id - 1, end_id]，after_id 初始为 start_id - 1。
+        """
+        bounds = queryset.aggregate(min_id=Min('id'), max_id=Max('id'))
+        min_id, max_id = bounds['min_id'], bounds['max_id']
+        span = max_id - min_id + 1
+        step = max(1, -(-span // workers))
+        
+        ranges = []
+        for start_id in range(min_id, max_id + 1, step):
+            end_id = min(start_id + step - 1, max_id)
+            ranges.append((start_id, end_id, start_id - 1))
+        return ranges
+
+    def load_checkpoint(self, checkpoint_key):
+        """从Redis检查点恢复未完成的区间"""
+        ranges = []
+        for field, last_id in redis_client.hgetall(checkpoint_key).items():
+            start_id, end_id = (int(part) for part in field.split(':'))
+            ranges.append((start_id, end_id, int(last_id)))
+        return sorted(ranges)
+
+    def count_in_ranges(self, ranges, remaining=False):
+        """统计检查点区间内的知识记录数，remaining 为True时只统计尚未导入的部分"""
+        total = 0
+        for start_id, end_id, after_id in ranges:
+            lower = after_id if remaining else start_id - 1
+            total += ProductKnowledge.objects.filter(id__gt=lower, id__lte=end_id).count()
+        return total
+
+    def run_ranges(self, index_name, ranges, batch_size, checkpoint_key):
+        """导入各个区间；多于一个区间时使用独立进程并行执行"""
+        # 先登记所有区间，保证任一进程失败时 --resume 也能看到尚未开始的区间
+        for start_id, end_id, after_id in ranges:
+            redis_client.hsetnx(checkpoint_key, f"{start_id}:{end_id}", after_id)
+        
+        results = []
+        if len(ranges) == 1:
+            start_id, end_id, after_id = ranges[0]
+            results.append(import_id_range(
+                index_name, start_id, end_id, after_id, batch_size, checkpoint_key,
+                stdout=self.stdout, stderr=self.stderr
+            ))
+        else:
+            # 子进程需要各自的数据库连接
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+                futures = [
+                    executor.submit(
+                        import_id_range, index_name, start_id, end_id, after_id,
+                        batch_size, checkpoint_key, True
+                    )
+                    for start_id, end_id, after_id in ranges
+                ]
+                for future in as_completed(futures):
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        self.stdout.write(self.style.ERROR(f"❌ 工作进程异常: {str(e)}"))
+                        results.append({'success': 0, 'error': 0, 'completed': False})
+        
+        return {
+            'success': sum(r['success'] for r in results),
+            'error': sum(r['error'] for r in results),
+            'completed': all(r['completed'] for r in results)
+        }
+
     def ensure_index_exists(self, index_name):
-        """确保ES索引存在，如果不存在则创建"""
+        """确保ES索引（别名）存在，如果不存在则创建 {index_name}_v1 并建立别名"""
         if not es_service.client.indices.exists(index=index_name):
-            # 创建索引映射
-            mapping = {
-                "mappings": {
-                    "properties": {
-                        "knowledge_id": {"type": "integer"},
-                        "product_id": {"type": "keyword"},
-                        "product_name": {
-                            "type": "text",
-                            "analyzer": "standard"
-                        },
-                        "brand": {"type": "keyword"},
-                        "category": {"type": "keyword"},
-                        "attribute": {
-                            "type": "text",
-                            "analyzer": "standard"
-                        },
-                        "value": {
-                            "type": "text",
-                            "analyzer": "standard"
-                        },
-                        "source_text": {
-                            "type": "text",
-                            "analyzer": "standard"
-                        },
-                        "content": {
-                            "type": "text",
-                            "analyzer": "standard"
-                        },
-                        "indexed_at": {"type": "date"}
-                    }
-                }
-            }
-            
-            es_service.client.indices.create(index=index_name, body=mapping)
+            definition = get_index_definition()
+            es_service.ensure_aliased_index(
+                alias=index_name,
+                mapping=definition['mapping'],
+                settings=definition['settings']
+            )
             self.stdout.write(f"✅ 创建索引: {index_name}")
 
     def verify_import(self, index_name, expected_count):
         """验证导入结果"""
         try:
-            # 刷新索引确保数据可见
+            # 刷新索引确保数据可见（未开启批量调优时写入后尚未刷新）
             es_service.client.indices.refresh(index=index_name)
             
             # 获取索引中的文档数量
@@ -3,6 +3,7 @@
 """
 from django.core.management.base import BaseCommand, CommandError
 from rag.elasticsearch_service import es_service
+from rag.conversation_partitions import ConversationPartitions
 from config import ELASTICSEARCH_CONFIG
 import json
 
@@ -14,7 +15,7 @@ class Command(BaseCommand):
         parser.add_argument(
             '--rebuild', 
             action='store_true',
-            help='删除现有索引并重建'
+            help='在新版本索引中重建并原子切换别名（不中断查询）'
         )
         parser.add_argument(
             '--index',
@@ -50,12 +51,92 @@ class Command(BaseCommand):
         # 创建索引
         for index_key, config in indices_to_create.items():
             index_name = ELASTICSEARCH_CONFIG['indices'][index_key]
-            self._create_index(index_name, config, rebuild)
+            if index_key == 'conversations':
+                self._setup_conversation_partitions(config, rebuild)
+            else:
+                self._create_index(index_name, config, rebuild)
         
         self.stdout.write(
             self.style.SUCCESS('Elasticsearch索引初始化完成!')
         )
     
+    def _get_analysis_settings(self):
+        """分析器配置
+        
+        - chinese_analyzer: 标准分词（中文按单字切分）
+        - cjk_bigram_analyzer: 中文相邻两字组成二元组，查询时做精确词项匹配，
+          替代代价较高的 fuzziness 扩展
+        - prefix_analyzer: edge n-gram，用于商品名的前缀/输入联想匹配
+        """
+        return {
+            "tokenizer": {
+                "prefix_tokenizer": {
+                    "type": "edge_ngram",
+                    "min_gram": 1,
+                    "max_gram": 10,
+                    "token_chars": ["letter", "digit"]
+                }
+            },
+            "filter": {
+                "cjk_bigram_only": {
+                    "type": "cjk_bigram",
+                    "output_unigrams": False
+                }
+            },
+            "analyzer": {
+                "chinese_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": ["lowercase", "cjk_width"]
+                },
+                "cjk_bigram_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": ["cjk_width", "lowercase", "cjk_bigram_only"]
+                },
+                "prefix_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "prefix_tokenizer",
+                    "filter": ["cjk_width", "lowercase"]
+                },
+                "prefix_search_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "whitespace",
+                    "filter": ["cjk_width", "lowercase"]
+                }
+            }
+        }
+    
+    def _text_field(self, prefix=False, keyword=False):
+        """带n-gram子字段的文本字段映射
+        
+        子字段: bigram（cjk二元组）、prefix（可选，edge n-gram）、keyword（可选）、
+        jieba（ELASTICSEARCH_CONFIG['analysis_plugin'] 为 'jieba' 时启用）。
+        """
+        fields = {
+            "bigram": {"type": "text", "analyzer": "cjk_bigram_analyzer"}
+        }
+        if prefix:
+            fields["prefix"] = {
+                "type": "text",
+                "analyzer": "prefix_analyzer",
+                "search_analyzer": "prefix_search_analyzer"
+            }
+        if keyword:
+            fields["keyword"] = {"type": "keyword"}
+        if ELASTICSEARCH_CONFIG.get('analysis_plugin') == 'jieba':
+            fields["jieba"] = {
+                "type": "text",
+                "analyzer": "jieba_index",
+                "search_analyzer": "jieba_search"
+            }
+        
+        return {
+            "type": "text",
+            "analyzer": "chinese_analyzer",
+            "fields": fields
+        }
+    
     def _get_index_configs(self):
         """获取索引配置"""
         return {
@@ -63,38 +144,29 @@ class Command(BaseCommand):
                 'settings': {
                     "number_of_shards": 1,
                     "number_of_replicas": 0,
-                    "analysis": {
-                        "analyzer": {
-                            "chinese_analyzer": {
-                                "type": "custom",
-                                "tokenizer": "standard",
-                                "filter": ["lowercase", "cjk_width"]
-                            }
-                        }
-                    }
+                    # 常态刷新间隔；批量导入期间由 bulk_load 临时关闭
+                    "refresh_interval": "1s",
+                    "analysis": self._get_analysis_settings()
                 },
                 'mapping': {
                     "properties": {
+                        "id": {"type": "integer"},
                         "product_id": {"type": "keyword"},
-                        "name": {
-                            "type": "text",
-                            "analyzer": "chinese_analyzer",
-                            "fields": {
-                                "keyword": {"type": "keyword"}
-                            }
-                        },
+                        "name": self._text_field(prefix=True, keyword=True),
                         "brand": {"type": "keyword"},
                         "category": {"type": "keyword"},
                         "price": {"type": "float"},
-                        "description": {
-                            "type": "text",
-                            "analyzer": "chinese_analyzer"
-                        },
+                        "stock": {"type": "integer"},
+                        "is_hot": {"type": "boolean"},
+                        # 规格参数只随文档返回，不建索引，避免动态字段膨胀
+                        "specifications": {"type": "object", "enabled": False},
+                        "description": self._text_field(),
                         "attributes": {
                             "type": "nested",
                             "properties": {
                                 "name": {"type": "keyword"},
-                                "value": {"type": "text", "analyzer": "chinese_analyzer"}
+                                "value": self._text_field(),
+                                "source": {"type": "keyword"}
                             }
                         },
                         "tags": {"type": "keyword"},
@@ -108,37 +180,20 @@ class Command(BaseCommand):
                 'settings': {
                     "number_of_shards": 1,
                     "number_of_replicas": 0,
-                    "analysis": {
-                        "analyzer": {
-                            "chinese_analyzer": {
-                                "type": "custom",
-                                "tokenizer": "standard",
-                                "filter": ["lowercase", "cjk_width"]
-                            }
-                        }
-                    }
+                    # 常态刷新间隔；批量导入期间由 bulk_load 临时关闭
+                    "refresh_interval": "1s",
+                    "analysis": self._get_analysis_settings()
                 },
                 'mapping': {
                     "properties": {
                         "knowledge_id": {"type": "keyword"},
                         "product_id": {"type": "keyword"},
-                        "product_name": {
-                            "type": "text", 
-                            "analyzer": "chinese_analyzer"
-                        },
+                        "product_name": self._text_field(prefix=True),
                         "attribute": {"type": "keyword"},
-                        "value": {
-                            "type": "text",
-                            "analyzer": "chinese_analyzer"
-                        },
-                        "source_text": {
-                            "type": "text",
-                            "analyzer": "chinese_analyzer"
-                        },
-                        "content_vector": {
-                            "type": "dense_vector",
-                            "dims": 768
-                        },
+                        "value": self._text_field(),
+                        "source_text": self._text_field(),
+                        "content_vector": es_service.vector_field_mapping(),
+                        "content_hash": {"type": "keyword"},
                         "category": {"type": "keyword"},
                         "brand": {"type": "keyword"},
                         "confidence": {"type": "float"},
@@ -151,15 +206,9 @@ class Command(BaseCommand):
                 'settings': {
                     "number_of_shards": 1,
                     "number_of_replicas": 0,
-                    "analysis": {
-                        "analyzer": {
-                            "chinese_analyzer": {
-                                "type": "custom",
-                                "tokenizer": "standard",
-                                "filter": ["lowercase", "cjk_width"]
-                            }
-                        }
-                    }
+                    # 常态刷新间隔；批量导入期间由 bulk_load 临时关闭
+                    "refresh_interval": "1s",
+                    "analysis": self._get_analysis_settings()
                 },
                 'mapping': {
                     "properties": {
@@ -177,10 +226,7 @@ class Command(BaseCommand):
                             "type": "text",
                             "analyzer": "chinese_analyzer"
                         },
-                        "question_vector": {
-                            "type": "dense_vector",
-                            "dims": 768
-                        },
+                        "question_vector": es_service.vector_field_mapping(),
                         "sources": {
                             "type": "nested",
                             "properties": {
@@ -200,16 +246,36 @@ class Command(BaseCommand):
         }
     
     def _create_index(self, index_name, config, rebuild=False):
-        """创建单个索引"""
+        """创建单个索引
+        
+        index_name 作为读取别名，实际数据写入 {index_name}_v{N}。
+        重建时先在新版本索引中通过 _reindex 复制现有数据，校验数量后
+        原子切换别名，重建期间查询始终可用。
+        """
         try:
-            # 删除现有索引（如果需要重建）
-            if rebuild:
-                if es_service.delete_index(index_name):
-                    self.stdout.write(f'已删除索引: {index_name}')
+            if rebuild and es_service.client.indices.exists(index=index_name):
+                result = es_service.rebuild_index(
+                    alias=index_name,
+                    populate=lambda new_index: self._copy_documents(index_name, new_index),
+                    mapping=config['mapping'],
+                    settings=config['settings']
+                )
+                if result['success']:
+                    self.stdout.write(
+                        self.style.SUCCESS(
+                            f'索引重建成功: {index_name} -> {result["index"]} '
+                            f'(文档数: {result["actual_count"]})'
+                        )
+                    )
+                else:
+                    self.stdout.write(
+                        self.style.ERROR(f'索引重建失败: {index_name}: {result.get("error")}')
+                    )
+                return
             
-            # 创建索引
-            if es_service.create_index(
-                index_name=index_name,
+            # 创建索引（首次创建 {index_name}_v1 并建立别名）
+            if es_service.ensure_aliased_index(
+                alias=index_name,
                 mapping=config['mapping'],
                 settings=config['settings']
             ):
@@ -225,4 +291,38 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.ERROR(f'创建索引 {index_name} 时发生错误: {e}')
             )
-
+    
+    def _setup_conversation_partitions(self, config, rebuild=False):
+        """对话索引按时间分区：更新模板和ILM策略；重建时滚动出使用新映射的分区
+        
+        历史分区保持原映射，随保留期自然淘汰，无需整体重建。
+        """
+        alias = ConversationPartitions.ALIAS
+        if not ConversationPartitions.setup(config['mapping'], config['settings']):
+            self.stdout.write(self.style.ERROR(f'对话分区初始化失败: {alias}'))
+            return
+        
+        if rebuild:
+            result = ConversationPartitions.rollover(force=True)
+            if result['rolled_over']:
+                self.stdout.write(
+                    self.style.SUCCESS(f'对话分区已滚动: {result["old_index"]} -> {result["new_index"]}')
+                )
+            else:
+                self.stdout.write(self.style.ERROR(f'对话分区滚动失败: {result.get("error")}'))
+            return
+        
+        self.stdout.write(self.style.SUCCESS(f'对话分区初始化成功: {alias}'))
+    
+    def _copy_documents(self, source_index, dest_index):
+        """通过服务端 _reindex 把当前别名下的数据复制到新版本索引，返回源文档数"""
+        expected_count = es_service.client.count(index=source_index)['count']
+        if expected_count:
+            es_service.client.reindex(
+                source={"index": source_index},
+                dest={"index": dest_index},
+                wait_for_completion=True,
+                refresh=False
+            )
+        self.stdout.write(f'已复制 {expected_count} 条文档: {source_index} -> {dest_index}')
+        return expected_count
@@ -0,0 +1,68 @@
+"""
+Django管理命令：维护按时间分区的对话索引
+用法:
+    python manage.py manage_conversation_partitions --list
+    python manage.py manage_conversation_partitions --rollover [--force]
+    python manage.py manage_conversation_partitions --retention [--dry-run]
+
+集群已启用ILM时滚动和删除会自动执行；该命令用于未启用ILM的环境（可配合定时任务），
+或需要立即滚动/清理的场景。
+"""
+from django.core.management.base import BaseCommand, CommandError
+from rag.conversation_partitions import ConversationPartitions
+from rag.elasticsearch_service import es_service
+
+
+class Command(BaseCommand):
+    help = '查看、滚动、清理对话索引的时间分区'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--list', action='store_true', help='列出所有分区')
+        parser.add_argument('--rollover', action='store_true', help='满足大小/时间条件时滚动到新分区')
+        parser.add_argument('--force', action='store_true', help='与 --rollover 一起使用，无条件滚动')
+        parser.add_argument('--retention', action='store_true', help='删除超期分区并压缩较旧分区')
+        parser.add_argument('--retention-days', type=int, help='保留天数（默认取配置）')
+        parser.add_argument('--dry-run', action='store_true', help='与 --retention 一起使用，只输出将处理的分区')
+
+    def handle(self, *args, **options):
+        if not es_service.is_available():
+            raise CommandError("❌ Elasticsearch服务不可用，请检查连接配置")
+        
+        if not (options['list'] or options['rollover'] or options['retention']):
+            options['list'] = True
+        
+        if options['rollover']:
+            result = ConversationPartitions.rollover(force=options['force'])
+            if 'error' in result:
+                raise CommandError(f"❌ 滚动失败: {result['error']}")
+            if result['rolled_over']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"✅ 已滚动: {result['old_index']} -> {result['new_index']}"
+                ))
+            else:
+                self.stdout.write(f"未满足滚动条件，当前写入分区: {result['old_index']}")
+        
+        if options['retention']:
+            report = ConversationPartitions.apply_retention(
+                retention_days=options['retention_days'],
+                dry_run=options['dry_run']
+            )
+            prefix = "[dry-run] " if options['dry_run'] else ""
+            for index_name in report['deleted']:
+                self.stdout.write(f"{prefix}删除分区: {index_name}")
+            for index_name in report['compacted']:
+                self.stdout.write(f"{prefix}压缩分区: {index_name}")
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {prefix}删除 {len(report['deleted'])} 个，压缩 {len(report['compacted'])} 个分区"
+            ))
+        
+        if options['list']:
+            partitions = ConversationPartitions.list_partitions()
+            if not partitions:
+                self.stdout.write("没有对话分区，请先运行 init_elasticsearch --index conversations")
+                return
+            for partition in partitions:
+                self.stdout.write(
+                    f"{partition['index']:<40} {partition['created_at']:%Y-%m-%d %H:%M} "
+                    f"{partition['docs']:>10} 条 {partition['size_bytes'] / 1024 / 1024:>10.1f} MB"
+                )
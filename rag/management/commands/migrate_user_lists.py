@@ -0,0 +1,53 @@
+"""
+Django管理命令：把旧格式的用户对话/推荐列表迁移为 ID + 摘要HASH 结构
+用法: python manage.py migrate_user_lists [--dry-run]
+
+旧版本把摘要JSON直接作为ZSET成员，删除时需要遍历解码整个列表；
+迁移后成员为记录ID，摘要存入 user_*_summaries:{用户} HASH，可按ID直接删除；
+同时把问题/需求分词加入用户的倒排索引，迁移的记录可被搜索。
+命令可重复执行，已迁移的列表会被跳过。
+"""
+import Agents.redis as agents_redis
+import rag.redis as rag_redis
+import redis_indexed_list
+from config import REDIS_CONFIG
+from django.core.management.base import BaseCommand
+from Agents.redis import RecommendationCache
+from rag.redis import RAGConversationCache
+
+
+class Command(BaseCommand):
+    help = '把旧格式的用户对话/推荐列表迁移为按ID寻址的结构'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='只统计需要迁移的列表，不写入')
+
+    def handle(self, *args, **options):
+        targets = (
+            ('对话', rag_redis.redis_client, RAGConversationCache.USER_CONVERSATIONS_PREFIX,
+             RAGConversationCache.USER_CONVERSATION_SUMMARIES_PREFIX, 'conversation_id',
+             RAGConversationCache.USER_CONVERSATION_TOKENS_PREFIX, 'question', REDIS_CONFIG['max_conversations']),
+            ('推荐', agents_redis.redis_client, RecommendationCache.USER_RECOMMENDATIONS_PREFIX,
+             RecommendationCache.USER_RECOMMENDATION_SUMMARIES_PREFIX, 'recommendation_id',
+             RecommendationCache.USER_RECOMMENDATION_TOKENS_PREFIX, 'requirement', REDIS_CONFIG['max_recommendations']),
+        )
+
+        for label, client, list_prefix, summaries_prefix, id_field, tokens_prefix, text_field, max_items in targets:
+            lists = records = 0
+            for list_key in client.scan_iter(match=f"{list_prefix}*", count=500):
+                owner = list_key[len(list_prefix):]
+                if options['dry_run']:
+                    legacy = [m for m in client.zrange(list_key, 0, -1) if redis_indexed_list.is_legacy_member(m)]
+                    migrated = len(legacy)
+                else:
+                    migrated = redis_indexed_list.migrate(
+                        client, list_key, f"{summaries_prefix}{owner}", id_field,
+                        token_prefix=f"{tokens_prefix}{owner}", text_field=text_field,
+                        max_items=max_items, default_ttl=REDIS_CONFIG['default_expire']
+                    )
+                if migrated:
+                    lists += 1
+                    records += migrated
+
+            action = '需要迁移' if options['dry_run'] else '已迁移'
+            self.stdout.write(self.style.SUCCESS(f"✅ {label}: {action} {lists} 个列表，共 {records} 条记录"))
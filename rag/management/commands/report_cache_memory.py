@@ -0,0 +1,152 @@
+"""
+Django管理命令：对比不同序列化/压缩方式下缓存值在Redis中的内存占用
+用法: python manage.py report_cache_memory [--count 200] [--db 15]
+
+按缓存类型（对话详情、推荐详情、商品详情、热门商品列表）生成模拟数据，
+分别以旧版JSON文本和当前环境可用的各序列化/压缩组合写入 --db 指定的库，
+用 MEMORY USAGE 统计每个键的平均占用，结束后删除写入的键。
+"""
+import json
+import random
+import time
+
+import redis
+from django.core.management.base import BaseCommand, CommandError
+
+from cache_serializers import CacheSerializer, available_compressions, available_serializers, cache_serializer
+from config import REDIS_CONFIG
+
+KEY_PREFIX = "cache_memory_report:"
+
+_WORDS = ['续航', '拍照', '屏幕', '处理器', '快充', '散热', '系统', '信号', '游戏', '性价比',
+          '主摄', '长焦', '夜景', '防水', '重量', '手感', '音质', '降噪', '内存', '存储']
+
+
+def _text(rng, length):
+    return ''.join(rng.choice(_WORDS) for _ in range(length // 2))
+
+
+def _product(rng, index):
+    return {
+        'id': index,
+        'product_id': f"P{index:04d}",
+        'name': f"测试手机{index}",
+        'price': round(rng.uniform(999, 8999), 2),
+        'category': '手机',
+        'brand': rng.choice(['华为', '小米', 'Apple', 'OPPO', 'vivo']),
+        'specifications': {word: _text(rng, 12) for word in rng.sample(_WORDS, 8)},
+        'description': _text(rng, 200),
+        'stock': rng.randint(0, 500),
+        'is_hot': True,
+        'updated_at': '2025-09-01T12:00:00'
+    }
+
+
+def synthetic_payloads(rng, index):
+    """各缓存类型的一条模拟数据，结构与对应缓存模块写入的数据一致"""
+    question = _text(rng, 30)
+    answer = _text(rng, 600)
+    requirement = _text(rng, 40)
+    recommendation_text = _text(rng, 800)
+    products = [_product(rng, index * 10 + i) for i in range(5)]
+    timestamp = int(time.time())
+    return {
+        'conversation_detail': {
+            'conversation_id': f"conv_{timestamp}{index}",
+            'user_id': f"user_{index % 50}",
+            'session_id': '',
+            'question': question,
+            'answer': answer,
+            'sources': [{'source': f"P{i:04d}_说明书", 'content': _text(rng, 200)} for i in range(3)],
+            'timestamp': timestamp,
+            'created_at': '2025-09-01T12:00:00',
+            'question_length': len(question),
+            'answer_length': len(answer),
+            'source_count': 3
+        },
+        'recommendation_detail': {
+            'recommendation_id': f"rec_{timestamp}{index}",
+            'user_id': f"user_{index % 50}",
+            'session_id': '',
+            'requirement': requirement,
+            'recommendation_text': recommendation_text,
+            'products': products,
+            'timestamp': timestamp,
+            'created_at': '2025-09-01T12:00:00',
+            'requirement_length': len(requirement),
+            'recommendation_length': len(recommendation_text),
+            'product_count': len(products)
+        },
+        'product_detail': products[0],
+        'hot_products': [_product(rng, index * 20 + i) for i in range(20)],
+    }
+
+
+class Command(BaseCommand):
+    help = '对比缓存值在不同序列化/压缩方式下的Redis内存占用（MEMORY USAGE）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=200, help='每种缓存类型写入的键数（默认200）')
+        parser.add_argument('--db', type=int, default=15, help='写入的Redis库（默认15，勿使用业务库）')
+        parser.add_argument('--seed', type=int, default=42, help='模拟数据随机种子')
+
+    def handle(self, *args, **options):
+        if options['db'] in (REDIS_CONFIG['product_db'], REDIS_CONFIG['users_db'],
+                             REDIS_CONFIG['rag_db'], REDIS_CONFIG['agents_db']):
+            raise CommandError("❌ 请使用业务库以外的Redis库生成内存报告")
+
+        client = redis.Redis(
+            host=REDIS_CONFIG['host'],
+            port=REDIS_CONFIG['port'],
+            password=REDIS_CONFIG.get('password'),
+            db=options['db']
+        )
+        try:
+            client.ping()
+        except redis.RedisError as e:
+            raise CommandError(f"❌ Redis不可用: {e}")
+
+        rng = random.Random(options['seed'])
+        workload = [synthetic_payloads(rng, i) for i in range(options['count'])]
+
+        # 旧版JSON文本 + 当前环境可用的各序列化/压缩组合
+        encoders = {'json文本（旧）': lambda value: json.dumps(value, ensure_ascii=False)}
+        for serializer in available_serializers():
+            for compression in available_compressions():
+                encoder = CacheSerializer(serializer, compression, cache_serializer.compress_threshold,
+                                          cache_serializer.compress_level)
+                encoders[f"{serializer}+{compression}"] = encoder.dumps
+
+        configured = f"{cache_serializer.serializer}+{cache_serializer.compression}"
+        self.stdout.write(f"当前配置: {configured}（压缩阈值 {cache_serializer.compress_threshold} 字节）")
+
+        try:
+            for key_type in workload[0]:
+                baseline = None
+                self.stdout.write(f"\n{key_type}（{len(workload)} 个键）")
+                for name, encode in encoders.items():
+                    average = self.measure(client, key_type, [encode(item[key_type]) for item in workload])
+                    baseline = baseline or average
+                    marker = ' ←当前配置' if name == configured else ''
+                    self.stdout.write(
+                        f"  {name:<16} 平均 {average:>9.0f} 字节/键 | 相对旧格式 {average / baseline:>6.1%}{marker}"
+                    )
+        finally:
+            self.cleanup(client)
+
+    def measure(self, client, key_type, values):
+        """写入一组值，返回 MEMORY USAGE 的平均字节数"""
+        keys = [f"{KEY_PREFIX}{key_type}:{i}" for i in range(len(values))]
+        pipe = client.pipeline(transaction=False)
+        for key, value in zip(keys, values):
+            pipe.set(key, value)
+        for key in keys:
+            pipe.memory_usage(key, samples=0)
+        usages = pipe.execute()[len(keys):]
+        client.unlink(*keys)
+        return sum(usages) / len(usages)
+
+    def cleanup(self, client):
+        keys = list(client.scan_iter(match=f"{KEY_PREFIX}*", count=1000))
+        for start in range(0, len(keys), 500):
+            client.unlink(*keys[start:start + 500])
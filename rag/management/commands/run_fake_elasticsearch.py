@@ -0,0 +1,29 @@
+"""
+Django管理命令：启动内存版Elasticsearch替身
+用法: python manage.py run_fake_elasticsearch --port 9200
+
+在本机没有ES集群时，用它代替 localhost:9200 运行 init_elasticsearch、import_knowledge_to_es
+和RAG问答流程；ElasticsearchService 连接HTTPS失败后会回退到 http://localhost:9200。
+数据只保存在内存中，进程退出即丢失。
+"""
+from django.core.management.base import BaseCommand
+from rag.fake_elasticsearch import FakeElasticsearchServer
+
+
+class Command(BaseCommand):
+    help = '启动内存版Elasticsearch替身（用于本地集成测试和离线压测）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', type=str, default='127.0.0.1', help='监听地址（默认127.0.0.1）')
+        parser.add_argument('--port', type=int, default=9200, help='监听端口（默认9200）')
+
+    def handle(self, *args, **options):
+        server = FakeElasticsearchServer(host=options['host'], port=options['port'])
+        self.stdout.write(self.style.SUCCESS(f"✅ 内存版Elasticsearch已启动: {server.url}（Ctrl+C 退出）"))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write("已停止")
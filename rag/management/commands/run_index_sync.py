@@ -0,0 +1,39 @@
+"""
+Django管理命令：消费模型变更事件，增量同步向量库、ES商品/知识索引和商品缓存
+用法: python manage.py run_index_sync [--once] [--debounce 2] [--status]
+
+建议作为常驻进程运行（如supervisor）；可同时运行多个实例，事件在消费组内分配。
+"""
+from django.core.management.base import BaseCommand
+
+from rag.index_sync import IndexChangeOutbox, IndexSyncConsumer
+
+
+class Command(BaseCommand):
+    help = '消费Products/ProductKnowledge变更事件，增量同步索引与缓存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='处理完当前积压的事件后退出')
+        parser.add_argument('--debounce', type=float, help='同一商品的合并等待秒数（默认取配置）')
+        parser.add_argument('--consumer', help='消费者名称，默认 主机名-进程号')
+        parser.add_argument('--status', action='store_true', help='只显示队列积压情况')
+
+    def handle(self, *args, **options):
+        IndexChangeOutbox.ensure_group()
+        if options['status']:
+            backlog = IndexChangeOutbox.backlog()
+            self.stdout.write(f"事件数: {backlog['length']}，未确认: {backlog['pending']}")
+            return
+
+        consumer = IndexSyncConsumer(consumer_name=options['consumer'], debounce_seconds=options['debounce'])
+        self.stdout.write(f"开始消费索引变更事件 (消费者: {consumer.consumer_name})...")
+        try:
+            stats = consumer.run(once=options['once'])
+        except KeyboardInterrupt:
+            # 退出前同步已读取的事件，未完成的事件保持未确认，稍后重新领取
+            consumer.flush(force=True)
+            stats = consumer.stats
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ 事件 {stats['events']} 条，同步商品 {stats['synced']} 个，失败 {stats['failed']} 个"
+        ))
@@ -0,0 +1,56 @@
+"""
+Django管理命令：把商品的名称/品牌/分类同步到知识索引中的冗余字段
+用法: python manage.py sync_knowledge_metadata [--product-id P001 --product-id P002] [--since 2025-09-01]
+
+商品信息变化不影响知识向量，因此只在ES服务端执行 update_by_query 局部更新，不重新向量化。
+"""
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from product.models import Products
+from rag.elasticsearch_service import es_service
+
+
+class Command(BaseCommand):
+    help = '同步商品名称/品牌/分类到知识索引（局部更新，不重新生成向量）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product-id', action='append', dest='product_ids', help='只同步指定商品，可重复')
+        parser.add_argument('--since', help='只同步该时间之后更新过的商品，格式 YYYY-MM-DD[ HH:MM]')
+
+    def handle(self, *args, **options):
+        if not es_service.is_available():
+            raise CommandError("❌ Elasticsearch服务不可用，请检查连接配置")
+
+        products = Products.objects.all()
+        if options['product_ids']:
+            products = products.filter(product_id__in=options['product_ids'])
+        if options['since']:
+            products = products.filter(updated_at__gte=self.parse_since(options['since']))
+
+        from rag.elasticsearch_rag import elasticsearch_rag_system
+
+        updated = noops = conflicts = 0
+        for product in products:
+            result = elasticsearch_rag_system.sync_product_metadata(product)
+            if not result['success']:
+                self.stdout.write(self.style.ERROR(f"❌ {product.product_id} 同步失败: {result.get('error')}"))
+                continue
+            updated += result['updated']
+            noops += result['noops']
+            conflicts += result['version_conflicts']
+            if result['updated']:
+                self.stdout.write(f"  {product.product_id}: 更新 {result['updated']} 条知识文档")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ 同步完成: 更新 {updated} 条，无变化 {noops} 条，版本冲突跳过 {conflicts} 条"
+        ))
+
+    def parse_since(self, value):
+        for fmt in ('%Y-%m-%d %H:%M', '%Y-%m-%d'):
+            try:
+                return timezone.make_aware(datetime.strptime(value, fmt))
+            except ValueError:
+                continue
+        raise CommandError(f"无法解析时间: {value}")
@@ -0,0 +1,48 @@
+"""
+Django管理命令：按热门问题列表预热答案缓存
+用法: python manage.py warm_answer_cache [--limit 20] [--ttl 1800]
+
+热门问题按意图统计（见 RAGConversationCache.get_popular_questions），对每个热门问题的展示问法调用当前RAG系统生成答案，
+写入 RAGAnswerCache；问答接口收到规范化后相同的问题时直接返回缓存的答案。
+建议以不超过缓存过期时间的间隔定期执行（如每15分钟）。
+"""
+from django.core.management.base import BaseCommand
+
+from config import RAG_CONFIG
+from rag.redis import RAGAnswerCache, RAGConversationCache
+
+
+class Command(BaseCommand):
+    help = '按热门问题列表预热答案缓存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=RAG_CONFIG['answer_cache_warmup_size'],
+                            help='预热的热门问题数量')
+        parser.add_argument('--ttl', type=int, default=RAG_CONFIG['answer_cache_ttl'], help='答案缓存过期秒数')
+
+    def handle(self, *args, **options):
+        from rag.views import get_current_rag_system
+
+        popular_questions = RAGConversationCache.get_popular_questions(options['limit'])
+        if not popular_questions:
+            self.stdout.write("暂无热门问题，跳过预热")
+            return
+
+        rag_system, rag_type = get_current_rag_system()
+        questions = [entry['question'] for entry in popular_questions]
+        self.stdout.write(f"使用 {rag_type} 为 {len(questions)} 个热门问题生成答案...")
+
+        results = rag_system.ask_questions(
+            questions,
+            return_source=True,
+            max_concurrency=RAG_CONFIG['batch_max_concurrency']
+        )
+
+        cached = 0
+        for question, result in zip(questions, results):
+            if RAGAnswerCache.set_answer(question, rag_type, result, expire=options['ttl']):
+                cached += 1
+            else:
+                self.stdout.write(self.style.WARNING(f"⚠️ 未能缓存: {question}"))
+
+        self.stdout.write(self.style.SUCCESS(f"✅ 已预热 {cached}/{len(questions)} 个热门问题的答案"))
@@ -0,0 +1,342 @@
+"""
+相似问题聚类
+问题向量按余弦相似度做阈值在线聚类，每个聚类保存中心向量、热度计数和规范问法（最高频原始问法），
+相似问题查询只需与聚类中心表做一次矩阵乘法，返回的是互不重复的问题。
+"""
+import logging
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from config import REDIS_CONFIG, ELASTICSEARCH_CONFIG
+from redis_pool import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+# 中心向量以 float32 字节存储，使用不解码响应的连接
+redis_client = get_redis_client(REDIS_CONFIG['rag_db'], decode_responses=False)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """按行归一化为单位向量，零向量保持不变"""
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class QuestionClusters:
+    """问题聚类中心表
+
+    Redis 结构（rag_db）：
+    - question_clusters:vectors     HASH 聚类ID -> 中心向量（单位向量的均值，float32）
+    - question_clusters:counts      HASH 聚类ID -> 问题数量
+    - question_clusters:canonical   HASH 聚类ID -> 规范问法
+    - question_clusters:phrasings:{id} ZSET 原始问法 -> 出现次数（只保留高频的 max_phrasings 条）
+    - question_clusters:next_id     新聚类ID计数器（只增不减，ID不复用）
+
+    热门问题按 cluster:{ID} 统计，离线重建时新中心与旧中心一一匹配并沿用旧ID，
+    使重建前后同一意图的统计仍然落在同一个键上；未匹配的新聚类分配新ID。
+
+    进程内缓存一份归一化后的中心矩阵，CACHE_SECONDS 秒内复用；本进程的增量聚类直接更新该矩阵，
+    其他进程的变化在缓存过期重新加载后可见。聚类数量不超过 max_clusters：
+    达到上限后增量聚类只并入已有聚类，不再新建（返回None，热门问题按问题文本统计），
+    直到下一次离线重建按问题数重新选出聚类。不按问题数淘汰，否则上一个新建的单问题聚类
+    总是最先被替换，新意图之间互相挤占。
+    """
+
+    KEY_PREFIX = "question_clusters:"
+    VECTORS_KEY = f"{KEY_PREFIX}vectors"
+    COUNTS_KEY = f"{KEY_PREFIX}counts"
+    CANONICAL_KEY = f"{KEY_PREFIX}canonical"
+    PHRASINGS_PREFIX = f"{KEY_PREFIX}phrasings:"
+    NEXT_ID_KEY = f"{KEY_PREFIX}next_id"
+    CONFIG = ELASTICSEARCH_CONFIG['question_clusters']
+    CACHE_SECONDS = 30
+
+    _cache = {'expires_at': 0, 'ids': [], 'matrix': None, 'canonical': {}, 'counts': {}}
+
+    @classmethod
+    def _load_table(cls, force: bool = False) -> Dict:
+        """加载（或复用缓存的）聚类中心表"""
+        if not force and time.time() < cls._cache['expires_at']:
+            return cls._cache
+
+        vectors = redis_client.hgetall(cls.VECTORS_KEY)
+        canonical = redis_client.hgetall(cls.CANONICAL_KEY)
+        counts = redis_client.hgetall(cls.COUNTS_KEY)
+
+        ids = sorted(vectors.keys(), key=int)
+        matrix = None
+        if ids:
+            matrix = _normalize(np.vstack([np.frombuffer(vectors[cid], dtype=np.float32) for cid in ids]))
+
+        cls._cache = {
+            'expires_at': time.time() + cls.CACHE_SECONDS,
+            'ids': [int(cid) for cid in ids],
+            'matrix': matrix,
+            'canonical': {int(cid): text.decode('utf-8') for cid, text in canonical.items()},
+            'counts': {int(cid): int(count) for cid, count in counts.items()}
+        }
+        return cls._cache
+
+    @classmethod
+    def is_empty(cls) -> bool:
+        try:
+            return cls._load_table()['matrix'] is None
+        except Exception as e:
+            logger.warning(f"加载问题聚类失败: {e}")
+            return True
+
+    @classmethod
+    def similar(cls, vector: List[float], limit: int = 5, exclude: str = None,
+                min_similarity: Optional[float] = None) -> List[Dict]:
+        """查询与向量最相近的聚类
+
+        Returns:
+            List[Dict]: [{'cluster_id', 'question', 'count', 'similarity'}]，按相似度降序
+        """
+        if min_similarity is None:
+            min_similarity = cls.CONFIG['min_similarity']
+        table = cls._load_table()
+        matrix = table['matrix']
+        if matrix is None:
+            return []
+
+        query = _normalize(np.asarray(vector, dtype=np.float32))
+        if query.shape[0] != matrix.shape[1]:
+            logger.warning(f"问题向量维度 {query.shape[0]} 与聚类中心维度 {matrix.shape[1]} 不一致")
+            return []
+
+        similarities = matrix @ query
+        # 多取一个，给被排除的原问题留出位置
+        top = min(limit + 1, len(similarities))
+        candidates = np.argpartition(-similarities, top - 1)[:top]
+        candidates = candidates[np.argsort(-similarities[candidates])]
+
+        results = []
+        for row in candidates:
+            similarity = float(similarities[row])
+            if similarity < min_similarity:
+                break
+            cluster_id = table['ids'][row]
+            question = table['canonical'].get(cluster_id)
+            if not question or question == exclude:
+                continue
+            results.append({
+                'cluster_id': cluster_id,
+                'question': question,
+                'count': table['counts'].get(cluster_id, 0),
+                'similarity': similarity
+            })
+            if len(results) >= limit:
+                break
+        return results
+
+    @classmethod
+    def _update_table(cls, table: Dict, row: Optional[int], cluster_id: int, centroid: np.ndarray,
+                      count: int, canonical: Optional[str]):
+        """把一个聚类的变化写入进程内中心表；row 为 None 时追加一行"""
+        point = _normalize(centroid.astype(np.float32))
+        # 先更新ID列表再更新矩阵，并发查询看到的矩阵行数不会超过ID数
+        if table['matrix'] is None:
+            table['ids'] = [cluster_id]
+            table['matrix'] = point[None, :]
+        elif row is None:
+            table['ids'].append(cluster_id)
+            table['matrix'] = np.vstack([table['matrix'], point])
+        else:
+            table['matrix'][row] = point
+            table['ids'][row] = cluster_id
+        table['counts'][cluster_id] = count
+        if canonical:
+            table['canonical'][cluster_id] = canonical
+
+    @classmethod
+    def add_question(cls, question: str, vector: List[float]) -> Optional[int]:
+        """增量聚类：并入最相近的聚类（相似度达到阈值）或新建聚类，返回聚类ID
+
+        聚类数量已达 max_clusters 且没有足够相近的聚类时不新建，返回None。
+        最近中心基于进程内缓存的中心表查找；被更新的中心向量从 Redis 重新读取后再写回。
+        多进程同时更新同一聚类时可能丢失一次均值更新，下一次离线重建会修正。
+        """
+        try:
+            question = question.strip()
+            point = _normalize(np.asarray(vector, dtype=np.float32))
+            table = cls._load_table()
+            if table['matrix'] is not None and table['matrix'].shape[1] != point.shape[0]:
+                logger.warning(f"问题向量维度 {point.shape[0]} 与聚类中心维度 {table['matrix'].shape[1]} 不一致")
+                return None
+
+            cluster_id = row = None
+            if table['matrix'] is not None:
+                similarities = table['matrix'] @ point
+                best = int(np.argmax(similarities))
+                if similarities[best] >= cls.CONFIG['assign_threshold']:
+                    cluster_id, row = table['ids'][best], best
+
+            if cluster_id is None:
+                if len(table['ids']) >= cls.CONFIG['max_clusters']:
+                    logger.debug(f"问题聚类已达上限 {cls.CONFIG['max_clusters']}，等待离线重建: {question}")
+                    return None
+                cluster_id = int(redis_client.incr(cls.NEXT_ID_KEY)) - 1
+                centroid, count = point, 1
+            else:
+                stored = redis_client.hget(cls.VECTORS_KEY, cluster_id)
+                count = int(redis_client.hget(cls.COUNTS_KEY, cluster_id) or 0) + 1
+                centroid = point if stored is None else np.frombuffer(stored, dtype=np.float32)
+                # 增量均值
+                centroid = centroid + (point - centroid) / count
+
+            phrasings_key = f"{cls.PHRASINGS_PREFIX}{cluster_id}"
+            pipe = redis_client.pipeline()
+            pipe.hset(cls.VECTORS_KEY, cluster_id, centroid.astype(np.float32).tobytes())
+            pipe.hset(cls.COUNTS_KEY, cluster_id, count)
+            pipe.zincrby(phrasings_key, 1, question)
+            pipe.zremrangebyrank(phrasings_key, 0, -(cls.CONFIG['max_phrasings'] + 1))
+            pipe.zrevrange(phrasings_key, 0, 0)
+            canonical = pipe.execute()[-1]
+            canonical = canonical[0].decode('utf-8') if canonical else None
+            if canonical:
+                redis_client.hset(cls.CANONICAL_KEY, cluster_id, canonical)
+
+            cls._update_table(table, row, cluster_id, centroid, count, canonical)
+
+            return cluster_id
+
+        except Exception as e:
+            logger.error(f"问题增量聚类失败: {e}")
+            return None
+
+    @classmethod
+    def cluster(cls, vectors: np.ndarray, threshold: float, refine_iterations: int = 0,
+                batch_size: int = 1024) -> np.ndarray:
+        """离线聚类，返回每个向量的聚类标签
+
+        先做单遍阈值聚类（按批与已有中心比较，批内未命中的向量逐条处理），
+        再以得到的中心为初始值做 refine_iterations 轮 k-means 细化，去掉空聚类。
+        """
+        points = _normalize(np.asarray(vectors, dtype=np.float32))
+        labels = np.empty(len(points), dtype=np.int64)
+        sums = np.zeros((0, points.shape[1]), dtype=np.float32)
+        sizes = []
+
+        for start in range(0, len(points), batch_size):
+            batch = points[start:start + batch_size]
+            unassigned = range(len(batch))
+            if len(sizes):
+                similarities = batch @ _normalize(sums).T
+                best = similarities.argmax(axis=1)
+                hit = similarities[np.arange(len(batch)), best] >= threshold
+                for offset in np.nonzero(hit)[0]:
+                    labels[start + offset] = best[offset]
+                    sums[best[offset]] += batch[offset]
+                    sizes[best[offset]] += 1
+                unassigned = np.nonzero(~hit)[0]
+
+            for offset in unassigned:
+                point = batch[offset]
+                if len(sizes):
+                    similarities = _normalize(sums) @ point
+                    best = int(similarities.argmax())
+                    if similarities[best] >= threshold:
+                        labels[start + offset] = best
+                        sums[best] += point
+                        sizes[best] += 1
+                        continue
+                labels[start + offset] = len(sizes)
+                sums = np.vstack([sums, point])
+                sizes.append(1)
+
+        for _ in range(refine_iterations):
+            centroids = _normalize(sums)
+            labels = (points @ centroids.T).argmax(axis=1)
+            used, labels = np.unique(labels, return_inverse=True)
+            sums = np.zeros((len(used), points.shape[1]), dtype=np.float32)
+            np.add.at(sums, labels, points)
+
+        return labels
+
+    @classmethod
+    def _match_ids(cls, centroids: np.ndarray, batch_size: int = 1024):
+        """为重建得到的中心分配聚类ID，返回 (ID列表, 下一个新ID)
+
+        每个新中心找最相近的旧中心，相似度达到 assign_threshold 时沿用旧ID；
+        多个新中心对应同一旧中心时由相似度最高的沿用，其余分配新ID。
+        """
+        stored = redis_client.hgetall(cls.VECTORS_KEY)
+        next_id = int(redis_client.get(cls.NEXT_ID_KEY) or 0)
+        ids = [None] * len(centroids)
+
+        old_ids = [int(cid) for cid in stored]
+        if old_ids:
+            next_id = max(next_id, max(old_ids) + 1)
+            old_matrix = _normalize(np.vstack([np.frombuffer(vector, dtype=np.float32) for vector in stored.values()]))
+            if old_matrix.shape[1] == centroids.shape[1]:
+                points = _normalize(centroids)
+                best_rows = np.empty(len(points), dtype=np.int64)
+                best_similarities = np.empty(len(points), dtype=np.float32)
+                for start in range(0, len(points), batch_size):
+                    similarities = points[start:start + batch_size] @ old_matrix.T
+                    best_rows[start:start + batch_size] = similarities.argmax(axis=1)
+                    best_similarities[start:start + batch_size] = similarities.max(axis=1)
+
+                claimed = set()
+                for row in np.argsort(-best_similarities):
+                    if best_similarities[row] < cls.CONFIG['assign_threshold']:
+                        break
+                    old_row = int(best_rows[row])
+                    if old_row not in claimed:
+                        claimed.add(old_row)
+                        ids[row] = old_ids[old_row]
+
+        for row in range(len(ids)):
+            if ids[row] is None:
+                ids[row] = next_id
+                next_id += 1
+        return ids, next_id
+
+    @classmethod
+    def rebuild(cls, questions: List[str], vectors: np.ndarray) -> int:
+        """根据全部问题及其向量离线重建聚类中心表，返回聚类数量"""
+        if not questions:
+            return 0
+
+        points = _normalize(np.asarray(vectors, dtype=np.float32))
+        labels = cls.cluster(points, cls.CONFIG['assign_threshold'], cls.CONFIG['refine_iterations'])
+        cluster_count = int(labels.max()) + 1
+
+        centroids = np.zeros((cluster_count, points.shape[1]), dtype=np.float32)
+        np.add.at(centroids, labels, points)
+        counts = np.bincount(labels, minlength=cluster_count)
+        centroids /= counts[:, None]
+
+        phrasings = [Counter() for _ in range(cluster_count)]
+        for question, label in zip(questions, labels):
+            phrasings[label][question.strip()] += 1
+
+        if cluster_count > cls.CONFIG['max_clusters']:
+            # 只保留问题数最多的 max_clusters 个聚类
+            keep = np.argsort(-counts, kind='stable')[:cls.CONFIG['max_clusters']]
+            centroids, counts = centroids[keep], counts[keep]
+            phrasings = [phrasings[label] for label in keep]
+            cluster_count = len(keep)
+
+        cluster_ids, next_id = cls._match_ids(centroids)
+        old_ids = redis_client.hkeys(cls.COUNTS_KEY)
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(cls.VECTORS_KEY, cls.COUNTS_KEY, cls.CANONICAL_KEY,
+                    *[f"{cls.PHRASINGS_PREFIX}{cid.decode()}" for cid in old_ids])
+        for label, cluster_id in enumerate(cluster_ids):
+            top_phrasings = phrasings[label].most_common(cls.CONFIG['max_phrasings'])
+            pipe.hset(cls.VECTORS_KEY, cluster_id, centroids[label].tobytes())
+            pipe.hset(cls.COUNTS_KEY, cluster_id, int(counts[label]))
+            pipe.hset(cls.CANONICAL_KEY, cluster_id, top_phrasings[0][0])
+            pipe.zadd(f"{cls.PHRASINGS_PREFIX}{cluster_id}", dict(top_phrasings))
+        pipe.set(cls.NEXT_ID_KEY, next_id)
+        pipe.execute()
+
+        cls._load_table(force=True)
+        logger.info(f"问题聚类重建完成: {len(questions)} 个问题 -> {cluster_count} 个聚类")
+        return cluster_count
@@ -1,27 +1,47 @@
-import redis
-import json
 import time
 from datetime import datetime
-from config import REDIS_CONFIG
+import redis_indexed_list
+from cache_serializers import cache_serializer
+from config import RAG_CONFIG, REDIS_CONFIG
+from heavy_hitters import HeavyHitters
+from redis_pool import get_redis_client
+from text_normalizer import normalize_text, popularity_key, search_tokens
 
 # Redis连接 - 使用专门的数据库存储RAG对话
-redis_client = redis.Redis(
-    host=REDIS_CONFIG['host'], 
-    port=REDIS_CONFIG['port'], 
-    db=REDIS_CONFIG['rag_db'], 
-    decode_responses=True
-)
+redis_client = get_redis_client(REDIS_CONFIG['rag_db'])
+# 读取序列化后的二进制详情数据
+binary_redis_client = get_redis_client(REDIS_CONFIG['rag_db'], decode_responses=False)
 
 class RAGConversationCache:
     """RAG对话缓存管理类"""
     
     # Redis键前缀定义
-    USER_CONVERSATIONS_PREFIX = "user_conversations:"  # 用户对话列表键前缀
+    USER_CONVERSATIONS_PREFIX = "user_conversations:"  # 用户对话列表键前缀（ZSET，成员为对话ID）
+    USER_CONVERSATION_SUMMARIES_PREFIX = "user_conversation_summaries:"  # 用户对话摘要键前缀（HASH）
+    USER_CONVERSATION_STATS_PREFIX = "user_conversation_stats:"  # 用户对话统计键前缀（HASH）
+    USER_CONVERSATION_TOKENS_PREFIX = "user_conversation_tokens:"  # 用户对话倒排索引键前缀
+    STAT_FIELDS = ('question_length', 'answer_length')  # 摘要中累计到统计键的字段
     CONVERSATION_DETAIL_PREFIX = "conversation_detail:"  # 对话详情键前缀
-    POPULAR_QUESTIONS_KEY = "popular_questions"  # 热门问题键
+    POPULAR_QUESTIONS_KEY = "popular_questions"  # 热门问题键前缀
+    POPULAR_QUESTIONS = HeavyHitters(POPULAR_QUESTIONS_KEY, top_k=100)  # 热门问题统计（按小时衰减）
     
     @classmethod
-    def save_conversation(cls, user_id, question, answer, sources=None, session_id=None):
+    def _list_keys(cls, user_id=None, session_id=None):
+        """用户对话列表键、摘要键和统计键"""
+        owner = user_id or session_id or 'anonymous'
+        return (
+            f"{cls.USER_CONVERSATIONS_PREFIX}{owner}",
+            f"{cls.USER_CONVERSATION_SUMMARIES_PREFIX}{owner}",
+            f"{cls.USER_CONVERSATION_STATS_PREFIX}{owner}"
+        )
+    
+    @classmethod
+    def _token_prefix(cls, user_id=None, session_id=None):
+        """用户对话倒排索引键前缀"""
+        return f"{cls.USER_CONVERSATION_TOKENS_PREFIX}{user_id or session_id or 'anonymous'}"
+    
+    @classmethod
+    def save_conversation(cls, user_id, question, answer, sources=None, session_id=None, cluster_id=None):
         """
         保存RAG对话记录到Redis
         
@@ -31,13 +51,14 @@ class RAGConversationCache:
             answer: AI回答
             sources: 知识来源列表
             session_id: 会话ID（用于匿名用户）
+            cluster_id: 问题所属的聚类ID（可选），提供时热门问题按聚类统计
         
         Returns:
             str: 对话ID，如果保存失败则返回None
         """
         try:
             # 生成对话ID
-            conversation_id = f"conv_{int(time.time() * 1000)}"
+            conversation_id = redis_indexed_list.new_record_id('conv')
             current_time = datetime.now()
             timestamp = int(time.time())
             
@@ -56,43 +77,59 @@ class RAGConversationCache:
                 'source_count': len(sources) if sources else 0
             }
             
+            # 详情、对话列表和热门问题的写入放在一个MULTI事务中，一次往返原子执行
+            pipe = redis_client.pipeline(transaction=True)
+            
             # 保存对话详情
             detail_key = f"{cls.CONVERSATION_DETAIL_PREFIX}{conversation_id}"
-            redis_client.setex(
+            pipe.setex(
                 detail_key,
                 REDIS_CONFIG['default_expire'],
-                json.dumps(conversation_data,ensure_ascii= False)
+                cache_serializer.dumps(conversation_data)
             )
             
-            # 添加到用户对话列表（使用ZSET按时间排序）
-            list_key = f"{cls.USER_CONVERSATIONS_PREFIX}{user_id or session_id or 'anonymous'}"
+            # 添加到用户对话列表：ZSET保存对话ID（时间戳作为分数），摘要存入HASH
+            list_key, summaries_key, stats_key = cls._list_keys(user_id, session_id)
             
-            # 对话简要信息，用于列表显示
+            # 对话简要信息，用于列表显示；长度字段同时累计到用户对话统计
             conversation_summary = {
                 'conversation_id': conversation_id,
                 'question': question[:100] + "..." if len(question) > 100 else question,
                 'timestamp': timestamp,
-                'created_at': current_time.isoformat()
+                'created_at': current_time.isoformat(),
+                'question_length': len(question),
+                'answer_length': len(answer)
             }
             
-            # 使用ZADD添加到有序集合，时间戳作为分数
-            redis_client.zadd(
+            # 只保留最近的N条对话，并设置列表过期时间
+            redis_indexed_list.append(
+                pipe,
                 list_key,
-                {json.dumps(conversation_summary): timestamp}
+                summaries_key,
+                stats_key,
+                conversation_id,
+                conversation_summary,
+                timestamp,
+                REDIS_CONFIG['max_conversations'],
+                REDIS_CONFIG['default_expire'],
+                cls.STAT_FIELDS
             )
             
-            # 只保留最近的N条对话
-            redis_client.zremrangebyrank(
-                list_key, 
-                0, 
-                -(REDIS_CONFIG['max_conversations'] + 1)
+            # 问题分词后加入用户的倒排索引，用于搜索对话
+            redis_indexed_list.index_tokens(
+                pipe,
+                cls._token_prefix(user_id, session_id),
+                conversation_id,
+                timestamp,
+                search_tokens(question),
+                REDIS_CONFIG['max_conversations'],
+                REDIS_CONFIG['default_expire']
             )
             
-            # 设置用户对话列表过期时间
-            redis_client.expire(list_key, REDIS_CONFIG['default_expire'])
-            
             # 更新热门问题统计
-            cls._update_popular_questions(question)
+            cls._update_popular_questions(question, pipe=pipe, cluster_id=cluster_id)
+            
+            pipe.execute()
             
             print(f"RAG对话已保存: {conversation_id}")
             return conversation_id
@@ -114,10 +151,10 @@ class RAGConversationCache:
         """
         try:
             detail_key = f"{cls.CONVERSATION_DETAIL_PREFIX}{conversation_id}"
-            cached_data = redis_client.get(detail_key)
+            cached_data = binary_redis_client.get(detail_key)
             
             if cached_data:
-                return json.loads(cached_data)
+                return cache_serializer.loads(cached_data)
             return None
             
         except Exception as e:
@@ -138,45 +175,37 @@ class RAGConversationCache:
             list: 对话历史列表
         """
         try:
-            list_key = f"{cls.USER_CONVERSATIONS_PREFIX}{user_id or session_id or 'anonymous'}"
-            
-            # 按时间倒序获取对话列表
-            conversations = redis_client.zrevrange(list_key, 0, limit - 1)
-            
-            conversation_list = []
-            for conv_data in conversations:
-                try:
-                    conv_info = json.loads(conv_data)
-                    conversation_list.append(conv_info)
-                except json.JSONDecodeError:
-                    continue
+            list_key, summaries_key, stats_key = cls._list_keys(user_id, session_id)
             
-            return conversation_list
+            # 按时间倒序获取对话ID，再从摘要HASH中批量读取摘要
+            return redis_indexed_list.read(redis_client, list_key, summaries_key, limit)
             
         except Exception as e:
             print(f"获取用户对话历史失败: {str(e)}")
             return []
     
     @classmethod
-    def _update_popular_questions(cls, question):
+    def _update_popular_questions(cls, question, pipe=None, cluster_id=None):
         """
         更新热门问题统计（私有方法）
         
         Args:
             question: 用户问题
+            pipe: 调用方的pipeline，传入时只追加命令、由调用方执行
+            cluster_id: 问题所属的聚类ID，提供时按聚类统计
         """
         try:
-            # 简化问题（去除标点符号，转为小写）
-            simplified_question = question.lower().strip()[:50]
+            # 同一意图的不同问法计为同一个问题：优先按聚类，否则按规范化、去停用词后的问题键
+            question_key = f"cluster:{cluster_id}" if cluster_id is not None else popularity_key(question)
+            own_pipe = pipe is None
+            if own_pipe:
+                pipe = redis_client.pipeline(transaction=True)
             
-            # 使用ZSET存储热门问题，分数为出现次数
-            redis_client.zincrby(cls.POPULAR_QUESTIONS_KEY, 1, simplified_question)
+            # Count-Min Sketch计数并维护本小时的前100个热门问题
+            cls.POPULAR_QUESTIONS.track(pipe, question_key, label=question.strip()[:100])
             
-            # 只保留前100个热门问题
-            redis_client.zremrangebyrank(cls.POPULAR_QUESTIONS_KEY, 0, -101)
-            
-            # 设置过期时间（30天）
-            redis_client.expire(cls.POPULAR_QUESTIONS_KEY, 30 * 24 * 3600)
+            if own_pipe:
+                pipe.execute()
             
         except Exception as e:
             print(f"更新热门问题失败: {str(e)}")
@@ -190,22 +219,17 @@ class RAGConversationCache:
             limit: 返回数量限制
             
         Returns:
-            list: 热门问题列表，按热度排序
+            list: 热门问题列表，按最近24小时衰减加权后的次数排序
         """
         try:
-            # 按分数倒序获取热门问题
-            popular_questions = redis_client.zrevrange(
-                cls.POPULAR_QUESTIONS_KEY, 
-                0, 
-                limit - 1,
-                withscores=True
-            )
+            popular_questions = cls.POPULAR_QUESTIONS.top(redis_client, limit)
             
             questions_list = []
-            for question, score in popular_questions:
+            for entry in popular_questions:
                 questions_list.append({
-                    'question': question,
-                    'count': int(score)
+                    'question': entry['label'],
+                    'key': entry['item'],
+                    'count': entry['score']
                 })
             
             return questions_list
@@ -229,25 +253,19 @@ class RAGConversationCache:
             list: 匹配的对话记录
         """
         try:
-            # 获取用户所有对话
-            conversations = cls.get_user_conversations(user_id, session_id, 100)
-            
             if not keyword:
-                return conversations[:limit]
-            
-            # 简单的关键词匹配
-            matched_conversations = []
-            keyword_lower = keyword.lower()
+                return cls.get_user_conversations(user_id, session_id, limit)
             
-            for conv in conversations:
-                if (keyword_lower in conv.get('question', '').lower() or 
-                    (len(matched_conversations) < limit)):
-                    matched_conversations.append(conv)
-                
-                if len(matched_conversations) >= limit:
-                    break
-            
-            return matched_conversations
+            # 关键词分词后与倒排索引求交集，返回包含全部词的对话，按时间倒序
+            list_key, summaries_key, _ = cls._list_keys(user_id, session_id)
+            return redis_indexed_list.search(
+                redis_client,
+                list_key,
+                summaries_key,
+                cls._token_prefix(user_id, session_id),
+                search_tokens(keyword),
+                limit
+            )
             
         except Exception as e:
             print(f"搜索对话记录失败: {str(e)}")
@@ -267,22 +285,13 @@ class RAGConversationCache:
             bool: 删除是否成功
         """
         try:
-            # 删除对话详情
-            detail_key = f"{cls.CONVERSATION_DETAIL_PREFIX}{conversation_id}"
-            redis_client.delete(detail_key)
-            
-            # 从用户对话列表中移除（需要遍历找到匹配的记录）
-            list_key = f"{cls.USER_CONVERSATIONS_PREFIX}{user_id or session_id or 'anonymous'}"
-            conversations = redis_client.zrange(list_key, 0, -1)
+            list_key, summaries_key, stats_key = cls._list_keys(user_id, session_id)
             
-            for conv_data in conversations:
-                try:
-                    conv_info = json.loads(conv_data)
-                    if conv_info.get('conversation_id') == conversation_id:
-                        redis_client.zrem(list_key, conv_data)
-                        break
-                except json.JSONDecodeError:
-                    continue
+            # 删除对话详情，并按对话ID从列表和摘要中移除，一次往返
+            pipe = redis_client.pipeline(transaction=True)
+            pipe.unlink(f"{cls.CONVERSATION_DETAIL_PREFIX}{conversation_id}")
+            redis_indexed_list.remove(pipe, list_key, summaries_key, stats_key, conversation_id, cls.STAT_FIELDS)
+            pipe.execute()
             
             print(f"对话已删除: {conversation_id}")
             return True
@@ -304,22 +313,16 @@ class RAGConversationCache:
             bool: 清空是否成功
         """
         try:
-            list_key = f"{cls.USER_CONVERSATIONS_PREFIX}{user_id or session_id or 'anonymous'}"
-            
-            # 获取所有对话ID并删除详情
-            conversations = redis_client.zrange(list_key, 0, -1)
-            for conv_data in conversations:
-                try:
-                    conv_info = json.loads(conv_data)
-                    conversation_id = conv_info.get('conversation_id')
-                    if conversation_id:
-                        detail_key = f"{cls.CONVERSATION_DETAIL_PREFIX}{conversation_id}"
-                        redis_client.delete(detail_key)
-                except json.JSONDecodeError:
-                    continue
-            
-            # 删除对话列表
-            redis_client.delete(list_key)
+            list_key, summaries_key, stats_key = cls._list_keys(user_id, session_id)
+            
+            # 只读取对话ID和索引词，详情、列表、摘要、统计和倒排索引批量UNLINK
+            conversation_ids = redis_indexed_list.member_ids(redis_client, list_key)
+            detail_keys = [f"{cls.CONVERSATION_DETAIL_PREFIX}{conversation_id}" for conversation_id in conversation_ids]
+            token_keys = redis_indexed_list.token_index_keys(redis_client, cls._token_prefix(user_id, session_id))
+            
+            pipe = redis_client.pipeline(transaction=False)
+            redis_indexed_list.unlink(pipe, detail_keys + token_keys + [list_key, summaries_key, stats_key])
+            pipe.execute()
             
             print(f"用户对话记录已清空: {user_id or session_id or 'anonymous'}")
             return True
@@ -341,34 +344,17 @@ class RAGConversationCache:
             dict: 统计信息
         """
         try:
-            list_key = f"{cls.USER_CONVERSATIONS_PREFIX}{user_id or session_id or 'anonymous'}"
-            
-            # 获取对话数量
-            total_conversations = redis_client.zcard(list_key)
-            
-            # 获取最近的对话
-            recent_conversations = redis_client.zrevrange(list_key, 0, 9)
-            
-            # 统计总字数等信息
-            total_questions = 0
-            total_answers = 0
-            
-            for conv_data in recent_conversations:
-                try:
-                    conv_info = json.loads(conv_data)
-                    conversation_id = conv_info.get('conversation_id')
-                    if conversation_id:
-                        detail = cls.get_conversation_detail(conversation_id)
-                        if detail:
-                            total_questions += detail.get('question_length', 0)
-                            total_answers += detail.get('answer_length', 0)
-                except json.JSONDecodeError:
-                    continue
+            list_key, _, stats_key = cls._list_keys(user_id, session_id)
+            
+            # 对话数量和字数累计值在保存/删除时已更新，一次往返读取
+            total_conversations, totals = redis_indexed_list.stats(
+                redis_client, list_key, stats_key, cls.STAT_FIELDS
+            )
             
             return {
                 'total_conversations': total_conversations,
-                'total_question_chars': total_questions,
-                'total_answer_chars': total_answers,
+                'total_question_chars': totals['question_length'],
+                'total_answer_chars': totals['answer_length'],
                 'user_id': user_id or session_id or 'anonymous'
             }
             
@@ -381,6 +367,58 @@ class RAGConversationCache:
                 'user_id': user_id or session_id or 'anonymous'
             }
 
+
+class RAGAnswerCache:
+    """热门问题答案缓存
+
+    由 warm_answer_cache 命令按热门问题列表预热，问答接口先查缓存；
+    缓存键为 normalize_text 规范化后的问题（仅全半角、大小写、空白不同的问法共享答案），
+    不使用热门统计的有损问题键，避免不同问题取到彼此的答案。
+    """
+    
+    ANSWER_CACHE_PREFIX = "answer_cache:"  # 答案缓存键前缀
+    
+    @classmethod
+    def _key(cls, question, rag_type):
+        return f"{cls.ANSWER_CACHE_PREFIX}{rag_type}:{normalize_text(question)}"
+    
+    @classmethod
+    def get_answer(cls, question, rag_type):
+        """
+        获取缓存的答案
+        
+        Returns:
+            dict: 与 ask_question 返回格式相同的结果，未命中时返回None
+        """
+        try:
+            cached_data = binary_redis_client.get(cls._key(question, rag_type))
+            if cached_data:
+                return cache_serializer.loads(cached_data)
+            return None
+        except Exception as e:
+            print(f"获取缓存答案失败: {str(e)}")
+            return None
+    
+    @classmethod
+    def set_answer(cls, question, rag_type, result, expire=None):
+        """缓存问答成功的结果"""
+        try:
+            if not result.get('success'):
+                return False
+            redis_client.setex(
+                cls._key(question, rag_type),
+                expire or RAG_CONFIG['answer_cache_ttl'],
+                cache_serializer.dumps({
+                    'success': True,
+                    'answer': result['answer'],
+                    'sources': result.get('sources', [])
+                })
+            )
+            return True
+        except Exception as e:
+            print(f"缓存答案失败: {str(e)}")
+            return False
+
 # 导出主要的缓存管理类
-__all__ = ['RAGConversationCache']
+__all__ = ['RAGConversationCache', 'RAGAnswerCache']
 
@@ -0,0 +1,46 @@
+"""
+模型变更信号：Products / ProductKnowledge 保存或删除后写入索引变更事件
+
+事件在事务提交后才写入，消费者读取时数据库中已是最新数据。
+queryset.update() / bulk_create() 不触发信号，批量修改后需执行 index_products 等命令补偿同步。
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from config import INDEX_SYNC_CONFIG
+from product.models import Products
+from .index_sync import IndexChangeOutbox
+from .models import ProductKnowledge
+
+
+def _publish_on_commit(model, action, product_id, product_pk):
+    if not INDEX_SYNC_CONFIG.get('enabled', True) or not product_id:
+        return
+    transaction.on_commit(lambda: IndexChangeOutbox.publish(model, action, product_id, product_pk))
+
+
+@receiver(post_save, sender=Products, dispatch_uid='index_sync_product_saved')
+def product_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _publish_on_commit('product', 'save', instance.product_id, instance.pk)
+
+
+@receiver(post_delete, sender=Products, dispatch_uid='index_sync_product_deleted')
+def product_deleted(sender, instance, **kwargs):
+    _publish_on_commit('product', 'delete', instance.product_id, instance.pk)
+
+
+@receiver(post_save, sender=ProductKnowledge, dispatch_uid='index_sync_knowledge_saved')
+def knowledge_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _publish_on_commit('knowledge', 'save', instance.product.product_id, instance.product_id)
+
+
+@receiver(post_delete, sender=ProductKnowledge, dispatch_uid='index_sync_knowledge_deleted')
+def knowledge_deleted(sender, instance, **kwargs):
+    # 级联删除商品时也会逐条触发，此时商品行尚未删除（同一事务内先删子表）
+    product_id = Products.objects.filter(pk=instance.product_id).values_list('product_id', flat=True).first()
+    _publish_on_commit('knowledge', 'delete', product_id, instance.product_id)
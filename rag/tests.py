@@ -1,3 +1,1299 @@
-from django.test import TestCase
+import asyncio
+import json
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from config import ELASTICSEARCH_CONFIG
+from .elasticsearch_async_service import AsyncElasticsearchService
+
+
+class FakeElasticsearchIntegrationTests(SimpleTestCase):
+    """ElasticsearchService 针对内存版ES替身的集成测试"""
+
+    ALIAS = "test_knowledge"
+    MAPPING = {
+        "properties": {
+            "product_id": {"type": "keyword"},
+            "product_name": {
+                "type": "text",
+                "fields": {
+                    "bigram": {"type": "text", "analyzer": "cjk_bigram_analyzer"},
+                    "prefix": {"type": "text", "analyzer": "prefix_analyzer"}
+                }
+            },
+            "value": {"type": "text", "fields": {"bigram": {"type": "text", "analyzer": "cjk_bigram_analyzer"}}},
+            "brand": {"type": "keyword"},
+            "content_vector": {"type": "dense_vector", "dims": 2, "similarity": "cosine"}
+        }
+    }
+    DOCUMENTS = [
+        {'id': 'k1', 'product_id': 'p1', 'product_name': '华为手机', 'value': '续航持久', 'brand': '华为',
+         'content_vector': [1.0, 0.0]},
+        {'id': 'k2', 'product_id': 'p2', 'product_name': '小米手机', 'value': '拍照清晰', 'brand': '小米',
+         'content_vector': [0.0, 1.0]},
+        {'id': 'k3', 'product_id': 'p3', 'product_name': '华为平板', 'value': '屏幕大', 'brand': '华为',
+         'content_vector': [0.7, 0.7]},
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from .elasticsearch_service import ElasticsearchService
+        from .fake_elasticsearch import FakeElasticsearchServer
+
+        cls.server = FakeElasticsearchServer().start()
+        cls.service = ElasticsearchService(config=cls.server.client_config(ELASTICSEARCH_CONFIG))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.assertTrue(self.service.ensure_aliased_index(self.ALIAS, self.MAPPING))
+        result = self.service.bulk_index_documents(self.ALIAS, self.DOCUMENTS)
+        self.assertEqual(result['success_count'], len(self.DOCUMENTS))
+
+    def tearDown(self):
+        for index_name in self.service.get_alias_indices(self.ALIAS):
+            self.service.client.indices.delete(index=index_name)
+
+    def test_alias_points_to_versioned_index(self):
+        self.assertEqual(self.service.get_alias_indices(self.ALIAS), [f"{self.ALIAS}_v1"])
+        self.assertEqual(self.service.count_documents(self.ALIAS), 3)
+        self.assertEqual(self.service.get_document(self.ALIAS, 'k2')['product_name'], '小米手机')
+
+    def test_multi_match_on_ngram_fields(self):
+        fields = self.service.ngram_fields(['value^2', 'product_name'], prefix_fields=['product_name'])
+        result = self.service.multi_match_search(self.ALIAS, '华为手机', fields, minimum_should_match="2<75%")
+        self.assertEqual(result['hits'][0]['id'], 'k1')
+        self.assertNotIn('k2', [hit['id'] for hit in result['hits']])
+
+    def test_term_filter_and_count(self):
+        self.assertEqual(self.service.count_documents(self.ALIAS, {"term": {"brand": "华为"}}), 2)
+        result = self.service.search_documents(
+            self.ALIAS, {"bool": {"filter": [{"term": {"brand": "小米"}}]}}
+        )
+        self.assertEqual([hit['id'] for hit in result['hits']], ['k2'])
+
+    def test_knn_returns_nearest_vectors(self):
+        result = self.service.semantic_search(self.ALIAS, [0.9, 0.1], vector_field='content_vector', size=2)
+        self.assertEqual([hit['id'] for hit in result['hits']], ['k1', 'k3'])
+
+    def test_rebuild_index_switches_alias(self):
+        def populate(new_index):
+            self.service.client.reindex(source={"index": self.ALIAS}, dest={"index": new_index}, refresh=True)
+            return len(self.DOCUMENTS)
+
+        result = self.service.rebuild_index(self.ALIAS, populate)
+        self.assertTrue(result['success'])
+        self.assertEqual(self.service.get_alias_indices(self.ALIAS), [f"{self.ALIAS}_v2"])
+        self.assertFalse(self.service.client.indices.exists(index=f"{self.ALIAS}_v1"))
+        self.assertEqual(self.service.count_documents(self.ALIAS), 3)
+
+    def test_point_in_time_pagination_with_facets(self):
+        pit_id = self.service.open_point_in_time(self.ALIAS)
+        first_page = self.service.search_page(
+            pit_id, {"match_all": {}}, size=2,
+            aggs={"brand": {"terms": {"field": "brand"}}}
+        )
+        self.assertEqual(first_page['total'], 3)
+        self.assertEqual(
+            {bucket['key']: bucket['doc_count'] for bucket in first_page['aggregations']['brand']['buckets']},
+            {'华为': 2, '小米': 1}
+        )
+
+        second_page = self.service.search_page(
+            first_page['pit_id'], {"match_all": {}}, size=2, search_after=first_page['hits'][-1]['sort']
+        )
+        seen = [hit['id'] for hit in first_page['hits'] + second_page['hits']]
+        self.assertEqual(sorted(seen), ['k1', 'k2', 'k3'])
+        self.assertTrue(self.service.close_point_in_time(pit_id))
+
+    def test_first_page_without_point_in_time_continues_with_one(self):
+        sort = [{'_score': {'order': 'desc'}}, {'product_id': {'order': 'asc'}}]
+        first_page = self.service.search_page(
+            None, {"match_all": {}}, size=2, index_name=self.ALIAS, sort=sort,
+            aggs={"brand": {"terms": {"field": "brand"}}}
+        )
+        self.assertIsNone(first_page['pit_id'])
+        self.assertEqual(first_page['total'], 3)
+        self.assertEqual([hit['id'] for hit in first_page['hits']], ['k1', 'k2'])
+
+        # 翻页时才打开PIT，补上 _shard_doc 的最大值跳过上一页最后一条
+        pit_id = self.service.open_point_in_time(self.ALIAS)
+        second_page = self.service.search_page(
+            pit_id, {"match_all": {}}, size=2, sort=sort,
+            search_after=first_page['hits'][-1]['sort'] + [2 ** 63 - 1]
+        )
+        self.assertEqual([hit['id'] for hit in second_page['hits']], ['k3'])
+        self.assertTrue(self.service.close_point_in_time(pit_id))
+
+    def test_partial_update_keeps_vector(self):
+        self.assertTrue(self.service.update_document(self.ALIAS, 'k1', {'value': '续航持久，支持快充'}))
+        document = self.service.get_document(self.ALIAS, 'k1')
+        self.assertEqual(document['value'], '续航持久，支持快充')
+        self.assertEqual(document['content_vector'], [1.0, 0.0])
+        self.assertEqual(
+            self.service.get_document(self.ALIAS, 'k1', source_includes=['product_id']), {'product_id': 'p1'}
+        )
+
+        result = self.service.bulk_update_documents(self.ALIAS, {'k2': {'brand': 'Xiaomi'}, 'k3': {'brand': '华为'}})
+        self.assertEqual(result['success_count'], 2)
+        self.assertEqual(self.service.get_document(self.ALIAS, 'k2')['brand'], 'Xiaomi')
+
+    def test_update_by_query_propagates_denormalized_fields(self):
+        result = self.service.update_by_query(
+            self.ALIAS, {"term": {"brand": "华为"}}, {'brand': 'HUAWEI', 'product_name': '华为手机'}
+        )
+        self.assertTrue(result['success'])
+        self.assertEqual(result['updated'], 2)
+        self.assertEqual(self.service.count_documents(self.ALIAS, {"term": {"brand": "HUAWEI"}}), 2)
+
+        # 再次执行时值已一致，全部为noop
+        result = self.service.update_by_query(self.ALIAS, {"term": {"brand": "HUAWEI"}}, {'brand': 'HUAWEI'})
+        self.assertEqual((result['updated'], result['noops']), (0, 2))
+
+    def test_update_by_query_retries_version_conflicts(self):
+        conflicted = {'updated': 1, 'noops': 0, 'version_conflicts': 1, 'failures': []}
+        resolved = {'updated': 1, 'noops': 1, 'version_conflicts': 0, 'failures': []}
+        with mock.patch.object(self.service.client, 'update_by_query', side_effect=[conflicted, resolved]) as call:
+            result = self.service.update_by_query(self.ALIAS, {"match_all": {}}, {'brand': 'X'}, retry_delay=0)
+        self.assertEqual(call.call_count, 2)
+        self.assertTrue(result['success'])
+        self.assertEqual((result['updated'], result['noops'], result['version_conflicts']), (2, 1, 0))
+
+        with mock.patch.object(self.service.client, 'update_by_query', return_value=conflicted) as call:
+            result = self.service.update_by_query(self.ALIAS, {"match_all": {}}, {'brand': 'X'},
+                                                  conflict_retries=2, retry_delay=0)
+        self.assertEqual(call.call_count, 3)
+        self.assertFalse(result['success'])
+        self.assertEqual(result['version_conflicts'], 1)
+
+    def test_multi_search_returns_results_in_request_order(self):
+        responses = self.service.multi_search(self.ALIAS, [
+            {"knn": {"field": "content_vector", "query_vector": [0.0, 1.0], "k": 1, "num_candidates": 10}, "size": 1},
+            {"query": {"term": {"brand": "华为"}}, "size": 5},
+            {"query": {"term": {"brand": "不存在"}}, "size": 5},
+        ])
+        self.assertEqual([hit['id'] for hit in responses[0]['hits']], ['k2'])
+        self.assertEqual(sorted(hit['id'] for hit in responses[1]['hits']), ['k1', 'k3'])
+        self.assertEqual(responses[2]['total'], 0)
+
+    def create_legacy_conversations(self):
+        from .conversation_partitions import ConversationPartitions
+
+        alias = ConversationPartitions.ALIAS
+        self.assertTrue(self.service.create_index(alias, {"properties": {
+            "question": {"type": "text"},
+            "question_vector": {"type": "dense_vector", "dims": 3, "similarity": "cosine"}
+        }}))
+        self.service.bulk_index_documents(alias, [
+            {'id': 'c1', 'question': '续航', 'question_vector': [1.0, 0.0, 0.0]},
+            {'id': 'c2', 'question': '拍照', 'question_vector': [0.0, 1.0, 0.0]},
+        ])
+        self.service.client.indices.refresh(index=alias)
+
+        def cleanup():
+            self.service.client.indices.delete(index=ConversationPartitions._partition_pattern(), ignore_unavailable=True)
+            self.service.client.indices.delete(index=alias, ignore_unavailable=True)
+            self.service.client.indices.delete_index_template(name=ConversationPartitions.TEMPLATE_NAME)
+        self.addCleanup(cleanup)
+        return alias
+
+    def test_partition_setup_migrates_legacy_conversations_without_vectors(self):
+        from .conversation_partitions import ConversationPartitions
+
+        alias = self.create_legacy_conversations()
+        mapping = {"properties": {"question": {"type": "text"}}}
+        with mock.patch('rag.conversation_partitions.es_service', self.service):
+            self.assertTrue(ConversationPartitions.setup(mapping, {}))
+
+        [partition] = self.service.get_alias_indices(alias)
+        self.assertTrue(partition.startswith('rag_conversations-'))
+        self.assertEqual(self.service.count_documents(alias), 2)
+        self.assertNotIn('question_vector', self.service.get_document(alias, 'c1'))
+
+    def test_partition_setup_keeps_legacy_index_when_migration_fails(self):
+        from .conversation_partitions import ConversationPartitions
+
+        alias = self.create_legacy_conversations()
+        reindex = self.service.client.reindex
+        failure = {'created': 1, 'failures': [{'id': 'c2', 'cause': {'type': 'illegal_argument_exception'}}]}
+        with mock.patch('rag.conversation_partitions.es_service', self.service):
+            with mock.patch.object(self.service.client, 'reindex', return_value=failure):
+                self.assertFalse(ConversationPartitions.setup({"properties": {}}, {}))
+            self.assertEqual(self.service.count_documents(alias), 2)
+            self.assertEqual(
+                self.service.client.indices.get(index=ConversationPartitions._partition_pattern()), {}
+            )
+
+            # 数量不符同样不切换别名
+            with mock.patch.object(
+                self.service.client, 'reindex', side_effect=lambda **kwargs: {**reindex(**kwargs), 'created': 1}
+            ):
+                self.assertFalse(ConversationPartitions.setup({"properties": {}}, {}))
+            self.assertEqual(self.service.get_alias_indices(alias), [])
+
+            # 首个分区已删除，再次执行时可以重新创建
+            self.assertTrue(ConversationPartitions.setup({"properties": {}}, {}))
+        self.assertEqual(self.service.count_documents(alias), 2)
+
+    def test_apply_retention_skips_partitions_already_merged(self):
+        from datetime import datetime, timedelta, timezone
+        from .conversation_partitions import ConversationPartitions
+
+        for name in ('conv_test-000001', 'conv_test-000002'):
+            self.assertTrue(self.service.create_index(name, {"properties": {"question": {"type": "text"}}}))
+            self.addCleanup(self.service.client.indices.delete, index=name)
+        self.service.index_document('conv_test-000001', 'c1', {'question': '续航'})
+        self.service.client.indices.refresh(index='conv_test-000001')
+        self.service.index_document('conv_test-000001', 'c2', {'question': '拍照'})
+        self.service.index_document('conv_test-000002', 'c3', {'question': '屏幕'})
+        self.service.client.indices.forcemerge(index='conv_test-000002', max_num_segments=1)
+
+        created_at = datetime.now(tz=timezone.utc) - timedelta(days=10)
+        partitions = [{'index': name, 'created_at': created_at} for name in ('conv_test-000001', 'conv_test-000002')]
+        with mock.patch('rag.conversation_partitions.es_service', self.service), \
+                mock.patch.object(ConversationPartitions, 'list_partitions', return_value=partitions):
+            report = ConversationPartitions.apply_retention(retention_days=30, compact_after_days=7)
+            self.assertEqual(report, {'deleted': [], 'compacted': ['conv_test-000001']})
+            self.assertEqual(ConversationPartitions._segment_count('conv_test-000001'), 1)
+            self.assertEqual(ConversationPartitions.apply_retention(retention_days=30, compact_after_days=7)['compacted'], [])
+
+
+class AsyncElasticsearchServiceTests(SimpleTestCase):
+    """AsyncElasticsearchService 针对内存版ES替身的测试"""
+
+    ALIAS = FakeElasticsearchIntegrationTests.ALIAS
+    MAPPING = FakeElasticsearchIntegrationTests.MAPPING
+    DOCUMENTS = FakeElasticsearchIntegrationTests.DOCUMENTS
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from .elasticsearch_service import ElasticsearchService
+        from .fake_elasticsearch import FakeElasticsearchServer
+
+        cls.server = FakeElasticsearchServer().start()
+        cls.config = cls.server.client_config(ELASTICSEARCH_CONFIG)
+        cls.sync_service = ElasticsearchService(config=cls.config)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.assertTrue(self.sync_service.ensure_aliased_index(self.ALIAS, self.MAPPING))
+        self.assertEqual(self.sync_service.bulk_index_documents(self.ALIAS, self.DOCUMENTS)['success_count'], 3)
+        self.service = AsyncElasticsearchService(config=self.config)
+        self.service.enabled = True
+
+    def tearDown(self):
+        for index_name in self.sync_service.get_alias_indices(self.ALIAS):
+            self.sync_service.client.indices.delete(index=index_name)
+
+    def run_async(self, coroutine_function, *args, **kwargs):
+        async def runner():
+            try:
+                return await coroutine_function(*args, **kwargs)
+            finally:
+                await self.service.close()
+        return asyncio.run(runner())
+
+    def test_is_available(self):
+        self.assertTrue(self.run_async(self.service.is_available))
+
+    def test_search_documents_formats_hits(self):
+        result = self.run_async(self.service.search_documents, self.ALIAS, {"term": {"brand": "小米"}}, size=5)
+        self.assertEqual(result['total'], 1)
+        self.assertEqual(result['hits'][0]['id'], 'k2')
+        self.assertEqual(result['hits'][0]['source']['product_name'], '小米手机')
+
+    def test_semantic_search_returns_nearest_vectors(self):
+        result = self.run_async(
+            self.service.semantic_search, self.ALIAS, [0.9, 0.1], vector_field="content_vector", size=2
+        )
+        self.assertEqual([hit['id'] for hit in result['hits']], ['k1', 'k3'])
+
+    def test_hybrid_search_runs_both_searches_concurrently(self):
+        from .fake_elasticsearch import FakeElasticsearchHandler
+
+        dispatch = FakeElasticsearchHandler._dispatch
+        searches = []
+
+        def slow_dispatch(handler, method):
+            # 替身在处理请求时持有存储锁，延迟放在锁外才能体现并发
+            if handler.path.split('?')[0].endswith('/_search'):
+                searches.append(handler.path)
+                time.sleep(0.3)
+            return dispatch(handler, method)
+
+        start = time.perf_counter()
+        with mock.patch.object(FakeElasticsearchHandler, '_dispatch', slow_dispatch):
+            result = self.run_async(
+                self.service.hybrid_search, self.ALIAS, "续航", ["value.bigram"], [0.0, 1.0],
+                vector_field="content_vector", size=1
+            )
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(result['semantic']['hits'][0]['id'], 'k2')
+        self.assertEqual(result['text']['hits'][0]['id'], 'k1')
+        self.assertEqual(len(searches), 2)
+        # 两个各0.3秒的请求并发执行，总耗时应明显小于串行的0.6秒
+        self.assertLess(elapsed, 0.55)
+
+    def test_get_document(self):
+        self.assertEqual(self.run_async(self.service.get_document, self.ALIAS, "k2")['product_name'], '小米手机')
+        self.assertIsNone(self.run_async(self.service.get_document, self.ALIAS, "missing"))
+
+    def test_bulk_index_documents(self):
+        result = self.run_async(
+            self.service.bulk_index_documents, self.ALIAS,
+            [{'id': 'a', 'value': '充电快'}, {'id': 'b', 'value': '重量轻'}]
+        )
+        self.assertTrue(result['success'])
+        self.assertEqual(result['success_count'], 2)
+
+        document = self.sync_service.get_document(self.ALIAS, 'a')
+        self.assertEqual(document['value'], '充电快')
+        self.assertIn('indexed_at', document)
+
+    def test_count_documents(self):
+        self.assertEqual(self.run_async(self.service.count_documents, self.ALIAS), 3)
+        self.assertEqual(self.run_async(self.service.count_documents, self.ALIAS, {"term": {"brand": "华为"}}), 2)
+
+    def test_disabled_service_returns_empty_results(self):
+        from .fake_elasticsearch import FakeElasticsearchHandler
+
+        self.service.enabled = False
+        with mock.patch.object(FakeElasticsearchHandler, '_dispatch') as dispatch:
+            self.assertEqual(self.run_async(self.service.count_documents, self.ALIAS), 0)
+            self.assertEqual(self.run_async(self.service.search_documents, self.ALIAS, {"match_all": {}})['hits'], [])
+        dispatch.assert_not_called()
+
+
+class _StubSortedSetClient:
+    """只实现 zrevrange/zrange/zcard/hmget 的内存客户端，pipeline 立即执行并收集结果"""
+
+    def __init__(self, members, summaries, stats=None):
+        self.members = members  # 按分数升序
+        self.summaries = summaries
+        self.stats = stats or {}
+        self.results = []
+
+    def pipeline(self, transaction=True):
+        stub = self
+        results = self.results = []
+
+        class Pipeline:
+            def __getattr__(self, name):
+                return lambda *args: results.append(getattr(stub, name)(*args))
+
+            def execute(self):
+                return list(results)
+
+        return Pipeline()
+
+    def zcard(self, key):
+        return len(self.members)
+
+    def zrevrange(self, key, start, end):
+        return list(reversed(self.members))[start:end + 1]
+
+    def zrange(self, key, start, end):
+        return self.members[start:] if end == -1 else self.members[start:end + 1]
+
+    def hmget(self, key, fields):
+        source = self.stats if key == 'stats' else self.summaries
+        return [source.get(field) for field in fields]
+
+
+class IndexedListTests(SimpleTestCase):
+    def setUp(self):
+        import redis_indexed_list
+        self.indexed_list = redis_indexed_list
+        legacy = json.dumps({'conversation_id': 'conv_1', 'question': '旧格式'})
+        self.client = _StubSortedSetClient(
+            [legacy, 'conv_2', 'conv_3'],
+            {'conv_2': json.dumps({'conversation_id': 'conv_2'}), 'conv_3': json.dumps({'conversation_id': 'conv_3'})},
+            {'question_length': '42'}
+        )
+
+    def test_record_ids_are_unique_within_the_same_millisecond(self):
+        with mock.patch('redis_indexed_list.time.time', return_value=1700000000.123):
+            ids = {self.indexed_list.new_record_id('conv') for _ in range(100)}
+        self.assertEqual(len(ids), 100)
+        self.assertTrue(all(record_id.startswith('conv_1700000000123_') for record_id in ids))
+
+    def test_migrate_adds_migrated_records_to_token_index(self):
+        legacy = json.dumps({'conversation_id': 'conv_1', 'question': '华为续航'}, ensure_ascii=False)
+
+        class Client(_RecordingPipelineClient):
+            def zrange(self, key, start, end, withscores=False):
+                return [(legacy, 100.0), ('conv_2', 200.0)]
+
+            def ttl(self, key):
+                return -1
+
+        client = Client()
+        migrated = self.indexed_list.migrate(
+            client, 'list', 'summaries', 'conversation_id', token_prefix='tokens:u1', text_field='question',
+            max_items=50, default_ttl=3600
+        )
+        self.assertEqual(migrated, 1)
+        self.assertIn(('hset', ('summaries', 'conv_1', legacy)), client.commands)
+        token_adds = [args for name, args in client.commands if name == 'zadd' and args[0].startswith('tokens:u1:')]
+        self.assertEqual(token_adds, [
+            (f'tokens:u1:{token}', {'conv_1': 100.0}) for token in ('华为', '为续', '续航')
+        ])
+        self.assertIn(('sadd', ('tokens:u1', '华为', '为续', '续航')), client.commands)
+        self.assertIn(('expire', ('tokens:u1', 3600)), client.commands)
+
+    def test_read_mixes_new_and_legacy_members(self):
+        items = self.indexed_list.read(self.client, 'list', 'summaries', 10)
+        self.assertEqual([item['conversation_id'] for item in items], ['conv_3', 'conv_2', 'conv_1'])
+
+    def test_member_ids_skip_legacy_members_without_decoding(self):
+        self.assertEqual(self.indexed_list.member_ids(self.client, 'list'), ['conv_2', 'conv_3'])
+
+    def test_search_intersects_list_with_token_indexes(self):
+        calls = []
+
+        class Pipeline:
+            def zinterstore(self, dest, keys, aggregate=None):
+                calls.append(keys)
+
+            def zrevrange(self, key, start, end):
+                pass
+
+            def unlink(self, key):
+                pass
+
+            def execute(self):
+                return [1, ['conv_3'], 1]
+
+        self.client.pipeline = lambda transaction=True: Pipeline()
+        items = self.indexed_list.search(self.client, 'list', 'summaries', 'tokens:u1', ['续航', '手机'], 5)
+        self.assertEqual(items, [{'conversation_id': 'conv_3'}])
+        self.assertEqual(calls, [{'list': 1, 'tokens:u1:续航': 0, 'tokens:u1:手机': 0}])
+        self.assertEqual(self.indexed_list.search(self.client, 'list', 'summaries', 'tokens:u1', [], 5), [])
+
+    def test_stats_reads_count_and_counters_in_one_pipeline(self):
+        total, totals = self.indexed_list.stats(self.client, 'list', 'stats', ('question_length', 'answer_length'))
+        self.assertEqual(total, 3)
+        self.assertEqual(totals, {'question_length': 42, 'answer_length': 0})
+
+
+class CacheSerializerTests(SimpleTestCase):
+    def test_round_trip_with_compression_above_threshold(self):
+        from cache_serializers import CacheSerializer
+        serializer = CacheSerializer('json', 'zlib', compress_threshold=64)
+        value = {'answer': '续航约一天半' * 50, 'sources': [{'source': 'P0001'}]}
+        data = serializer.dumps(value)
+        self.assertEqual(data[1] & 0x0F, 1)
+        self.assertLess(len(data), len(json.dumps(value, ensure_ascii=False).encode('utf-8')))
+        self.assertEqual(serializer.loads(data), value)
+        self.assertEqual(serializer.loads(serializer.dumps({'a': 1})), {'a': 1})
+
+    def test_loads_legacy_json_text(self):
+        from cache_serializers import CacheSerializer
+        legacy = json.dumps({'conversation_id': 'conv_1'}, ensure_ascii=False)
+        self.assertEqual(CacheSerializer.loads(legacy), {'conversation_id': 'conv_1'})
+        self.assertEqual(CacheSerializer.loads(legacy.encode('utf-8')), {'conversation_id': 'conv_1'})
+
+
+class HeavyHittersTests(SimpleTestCase):
+    def setUp(self):
+        from heavy_hitters import HeavyHitters
+        self.tracker = HeavyHitters('popular_test', top_k=10, width=64, depth=4,
+                                    bucket_seconds=3600, window_buckets=3, half_life_buckets=1)
+
+    def test_positions_fall_in_their_rows(self):
+        positions = self.tracker._positions('这款手机续航怎么样')
+        self.assertEqual(positions, self.tracker._positions('这款手机续航怎么样'))
+        for row, position in enumerate(positions):
+            self.assertTrue(row * 64 <= position < (row + 1) * 64)
+
+    def test_top_merges_buckets_with_decayed_weights(self):
+        now = 10 * 3600 + 5
+        weights = self.tracker.weights(now)
+        self.assertEqual(weights, {'popular_test:top:10': 1.0, 'popular_test:top:9': 0.5, 'popular_test:top:8': 0.25})
+
+        class Client:
+            def zunion(self, keys, withscores=False):
+                self.keys = keys
+                return [('旧问题', 2.0), ('新 问题', 3.0)]
+
+            def pipeline(self, transaction=True):
+                labels = {'popular_test:labels:9': {'新 问题': '新问题？'}}
+
+                class Pipeline:
+                    calls = []
+
+                    def hmget(self, key, fields):
+                        self.calls.append([labels.get(key, {}).get(field) for field in fields])
+
+                    def execute(self):
+                        return self.calls
+
+                return Pipeline()
+
+        client = Client()
+        self.assertEqual(self.tracker.top(client, 1, now), [{'item': '新 问题', 'label': '新问题？', 'score': 3.0}])
+        self.assertEqual(client.keys, weights)
+
+
+class TextNormalizerTests(SimpleTestCase):
+    def test_popularity_key_ignores_punctuation_width_and_case(self):
+        from text_normalizer import popularity_key
+        self.assertEqual(popularity_key('iPhone 15 续航怎么样？'), popularity_key('ＩＰＨＯＮＥ15，续航怎么样?'))
+        self.assertNotIn('?', popularity_key('续航怎么样?'))
+        self.assertEqual(popularity_key('？？'), '')
+
+    def test_search_tokens_match_between_document_and_query(self):
+        from text_normalizer import search_tokens
+        document = set(search_tokens('这款手机的续航怎么样？'))
+        self.assertTrue(set(search_tokens('手机的续航')) <= document)
+        self.assertEqual(search_tokens('iPhone 15，续航'), ['iphone', '15', '续航'])
+
+    def test_answer_cache_key_keeps_interrogatives(self):
+        from text_normalizer import STOPWORDS
+        from .redis import RAGAnswerCache
+        self.assertFalse({'为什么', '多少', '什么', '如何', 'how'} & STOPWORDS)
+        self.assertNotEqual(RAGAnswerCache._key('为什么iPhone15发热？', 'es'), RAGAnswerCache._key('iPhone15发热吗', 'es'))
+        self.assertEqual(RAGAnswerCache._key('iPhone15 发热吗？', 'es'), RAGAnswerCache._key('ｉＰｈｏｎｅ15  发热吗?', 'es'))
+
+
+class _StubLockClient:
+    """支持 GET / SET NX / 释放锁脚本的内存Redis替身"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None, ex=None):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value
+        return True
+
+    def eval(self, script, numkeys, key, token):
+        if self.data.get(key) == token:
+            del self.data[key]
+            return 1
+        return 0
+
+
+class CacheAsideTests(SimpleTestCase):
+    def setUp(self):
+        from cache_aside import CacheAside
+        self.client = _StubLockClient()
+        self.cache = CacheAside(self.client, ttl=60, stale_ttl=30, beta=1.0, wait_seconds=0)
+
+    def test_miss_computes_once_and_releases_lock(self):
+        calls = []
+        self.assertEqual(self.cache.get('hot', lambda: calls.append(1) or ['P0001']), ['P0001'])
+        self.assertEqual(self.cache.get('hot', lambda: calls.append(1) or ['P0002']), ['P0001'])
+        self.assertEqual(len(calls), 1)
+        self.assertNotIn('hot:lock', self.client.data)
+
+    def test_stale_value_served_while_another_request_refreshes(self):
+        self.cache.set('hot', ['旧'], delta=0.5)
+        self.client.set('hot:lock', 'other', nx=True)
+        with mock.patch('cache_aside.time.time', return_value=time.time() + 61):
+            self.assertEqual(self.cache.get('hot', lambda: ['新']), ['旧'])
+        self.client.eval(None, 1, 'hot:lock', 'other')
+        with mock.patch('cache_aside.time.time', return_value=time.time() + 61):
+            self.assertEqual(self.cache.get('hot', lambda: ['新']), ['新'])
+
+    def test_xfetch_refreshes_early_for_slow_computations(self):
+        entry = {'value': 1, 'delta': 2.0, 'expires_at': 100.0}
+        with mock.patch('cache_aside.random.random', return_value=0.5):
+            # -2 × ln(0.5) ≈ 1.39 秒的提前量
+            self.assertFalse(self.cache._should_refresh(entry, 98.0))
+            self.assertTrue(self.cache._should_refresh(entry, 98.7))
+        self.assertTrue(self.cache._should_refresh(entry, 100.0))
+
+
+
+class _StubStreamClient:
+    """内存版Redis Stream，只实现消费组读取、领取与确认"""
+
+    def __init__(self):
+        self.messages = []
+        self.delivered = 0
+        self.pending = {}  # 事件ID -> 消费者
+        self.idle = set()  # 视为已超时未确认的事件ID
+        self.groups = set()
+
+    def xadd(self, key, fields, maxlen=None, approximate=True):
+        message_id = f"{len(self.messages) + 1}-0"
+        self.messages.append((message_id, dict(fields)))
+        return message_id
+
+    def xgroup_create(self, key, group, id='0', mkstream=False):
+        import redis
+        if group in self.groups:
+            raise redis.ResponseError('BUSYGROUP Consumer Group name already exists')
+        self.groups.add(group)
+
+    def xreadgroup(self, group, consumer, streams, count=None, block=None):
+        new = self.messages[self.delivered:self.delivered + count]
+        self.delivered += len(new)
+        for message_id, _ in new:
+            self.pending[message_id] = consumer
+        return [[next(iter(streams)), new]] if new else []
+
+    def xautoclaim(self, key, group, consumer, min_idle_time, count=None):
+        claimed = [
+            (message_id, fields) for message_id, fields in self.messages
+            if message_id in self.pending and message_id in self.idle
+        ][:count]
+        for message_id, _ in claimed:
+            self.pending[message_id] = consumer
+            self.idle.discard(message_id)
+        return ['0-0', claimed, []]
+
+    def xack(self, key, group, *message_ids):
+        return sum(self.pending.pop(message_id, None) is not None for message_id in message_ids)
+
+
+class IndexSyncConsumerTests(SimpleTestCase):
+    """IndexSyncConsumer 的合并、确认与重新领取"""
+
+    def setUp(self):
+        from .index_sync import IndexChangeOutbox, IndexSyncConsumer
+
+        self.client = _StubStreamClient()
+        patcher = mock.patch('rag.index_sync.redis_client', self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.outbox = IndexChangeOutbox
+        self.consumer = IndexSyncConsumer('worker-1', debounce_seconds=60, max_delay_seconds=600)
+        self.outbox.ensure_group()
+
+    def publish_edits(self):
+        self.outbox.publish('product', 'save', 'P001', 1)
+        self.outbox.publish('knowledge', 'save', 'P001', 1)
+        self.outbox.publish('knowledge', 'delete', 'P001', 1)
+        self.outbox.publish('product', 'save', 'P002', 2)
+
+    def test_ensure_group_ignores_existing_group(self):
+        self.outbox.ensure_group()
+        self.assertEqual(self.client.groups, {self.outbox.GROUP})
+
+    def test_edits_are_merged_per_product_and_debounced(self):
+        self.publish_edits()
+        with mock.patch.object(self.consumer, 'apply') as apply:
+            self.assertEqual(self.consumer.poll(block_ms=0), 4)
+            self.assertEqual(self.consumer.flush(), 0)
+            apply.assert_not_called()
+
+            # P001 已安静超过 debounce_seconds，P002 仍在等待
+            self.consumer.pending['P001']['last_seen'] -= 61
+            self.assertEqual(self.consumer.flush(), 1)
+            apply.assert_called_once_with('P001', {1})
+            self.assertEqual(sorted(self.client.pending), ['4-0'])
+
+            # 持续编辑超过 max_delay_seconds 时强制同步
+            self.consumer.pending['P002']['first_seen'] -= 601
+            self.assertEqual(self.consumer.flush(), 1)
+            apply.assert_called_with('P002', {2})
+        self.assertEqual(self.client.pending, {})
+        self.assertEqual(self.consumer.stats, {'events': 4, 'synced': 2, 'failed': 0})
+
+    def test_failed_sync_is_not_acked_and_reclaimed_later(self):
+        from .index_sync import IndexSyncConsumer
+
+        self.publish_edits()
+        self.consumer.poll(block_ms=0)
+        with mock.patch.object(self.consumer, 'apply', side_effect=RuntimeError('ES不可用')):
+            self.assertEqual(self.consumer.flush(force=True), 0)
+        self.assertEqual(sorted(self.client.pending), ['1-0', '2-0', '3-0', '4-0'])
+        self.assertEqual(self.consumer.stats['failed'], 2)
+
+        # 超时未确认的事件由其他消费者通过 XAUTOCLAIM 领取
+        self.client.idle.update(['1-0', '2-0', '3-0'])
+        other = IndexSyncConsumer('worker-2', debounce_seconds=60, max_delay_seconds=600)
+        with mock.patch.object(other, 'apply') as apply:
+            self.assertEqual(other.poll(block_ms=0), 3)
+            self.assertEqual(other.flush(force=True), 1)
+            apply.assert_called_once_with('P001', {1})
+        self.assertEqual(self.client.pending, {'4-0': 'worker-1'})
+
+    def test_run_once_drains_backlog(self):
+        self.publish_edits()
+        with mock.patch.object(self.consumer, 'apply') as apply:
+            stats = self.consumer.run(once=True, block_ms=0)
+        self.assertEqual(apply.call_count, 2)
+        self.assertEqual(stats['synced'], 2)
+        self.assertEqual(self.client.pending, {})
+
+
+class IndexSyncApplyTests(TestCase):
+    """变更信号与 IndexSyncConsumer.apply 针对数据库和内存版ES替身的测试"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from .elasticsearch_service import ElasticsearchService
+        from .fake_elasticsearch import FakeElasticsearchServer
+        from .management.commands.init_elasticsearch import Command as InitElasticsearchCommand
+
+        cls.server = FakeElasticsearchServer().start()
+        cls.service = ElasticsearchService(config=cls.server.client_config(ELASTICSEARCH_CONFIG))
+        cls.definition = InitElasticsearchCommand()._get_index_configs()['products']
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        from product.search import ProductSearchIndex
+
+        self.client = _StubStreamClient()
+        self.rag_system = mock.Mock()
+        self.rag_system.sync_product_knowledge.return_value = {'success': True}
+        # 知识同步依赖嵌入模型，这里只验证调用；按模块替换，不需要导入 langchain
+        rag_module = mock.Mock(elasticsearch_rag_system=self.rag_system)
+        for patcher in (
+            mock.patch('rag.index_sync.redis_client', self.client),
+            mock.patch('rag.elasticsearch_service.es_service', self.service),
+            mock.patch('product.search.es_service', self.service),
+            mock.patch.dict('sys.modules', {'rag.elasticsearch_rag': rag_module}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.index = ProductSearchIndex
+        self.assertTrue(self.service.ensure_aliased_index(
+            self.index.INDEX_NAME, self.definition['mapping'], self.definition['settings']
+        ))
+        self.addCleanup(lambda: [
+            self.service.client.indices.delete(index=name)
+            for name in self.service.get_alias_indices(self.index.INDEX_NAME)
+        ])
+
+    def create_product(self):
+        from product.models import Products
+        return Products.objects.create(
+            product_id='P001', name='华为Mate60', price=5999, category='手机', brand='华为', stock=10
+        )
+
+    def test_signals_publish_events_after_commit(self):
+        from .models import ProductKnowledge
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.create_product()
+            ProductKnowledge.objects.create(product=product, attribute='续航', value='一整天')
+        product_pk = product.pk
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+
+        events = [(fields['model'], fields['action'], fields['product_id']) for _, fields in self.client.messages]
+        self.assertEqual(events, [
+            ('product', 'save', 'P001'), ('knowledge', 'save', 'P001'),
+            ('knowledge', 'delete', 'P001'), ('product', 'delete', 'P001'),
+        ])
+        self.assertEqual({fields['product_pk'] for _, fields in self.client.messages}, {str(product_pk)})
+
+    def test_apply_indexes_saved_product(self):
+        from product.redis import ProductCache
+        from .index_sync import IndexSyncConsumer
+
+        product = self.create_product()
+        with mock.patch.object(ProductCache, 'refresh_product', return_value=True) as refresh:
+            IndexSyncConsumer('worker-1').apply('P001', {product.pk})
+        refresh.assert_called_once_with(product)
+        self.rag_system.sync_product_knowledge.assert_called_once_with('P001')
+        self.assertEqual(self.service.get_document(self.index.INDEX_NAME, str(product.pk))['name'], '华为Mate60')
+
+    def test_apply_deleted_product_removes_index_document_and_cache(self):
+        from product.redis import ProductCache
+        from .index_sync import IndexSyncConsumer
+
+        product = self.create_product()
+        product_pk = product.pk
+        self.index.index_products([product_pk])
+        product.delete()
+
+        with mock.patch.object(ProductCache, 'remove_product', return_value=True) as remove, \
+                mock.patch.object(ProductCache, 'refresh_product') as refresh:
+            IndexSyncConsumer('worker-1').apply('P001', {product_pk})
+        remove.assert_called_once_with('P001')
+        refresh.assert_not_called()
+        self.rag_system.sync_product_knowledge.assert_called_once_with('P001')
+        self.assertIsNone(self.service.get_document(self.index.INDEX_NAME, str(product_pk)))
+
+    def test_apply_raises_when_knowledge_sync_fails(self):
+        from .index_sync import IndexSyncConsumer
+
+        self.rag_system.sync_product_knowledge.return_value = {'success': False, 'error': '嵌入失败'}
+        with self.assertRaisesMessage(RuntimeError, '嵌入失败'):
+            IndexSyncConsumer('worker-1').apply('P404', set())
+
+
+class _StubBytesClient:
+    """只实现 mget/setex/hincrby/hgetall 的内存Redis，pipeline 立即执行"""
+
+    def __init__(self):
+        self.data = {}
+        self.hashes = {}
+
+    def pipeline(self, transaction=True):
+        stub = self
+
+        class Pipeline:
+            def __getattr__(self, name):
+                return getattr(stub, name)
+
+            def execute(self):
+                return []
+
+        return Pipeline()
+
+    def mget(self, keys):
+        return [self.data.get(key) for key in keys]
+
+    def setex(self, key, seconds, value):
+        self.data[key] = value
+
+    def hincrby(self, key, field, amount):
+        fields = self.hashes.setdefault(key, {})
+        fields[field.encode()] = fields.get(field.encode(), 0) + amount
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+
+class QueryEmbeddingCacheTests(SimpleTestCase):
+    """问题向量两级缓存"""
+
+    def setUp(self):
+        self.client = _StubBytesClient()
+        patcher = mock.patch('rag.embedding_cache.redis_client', self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.model = mock.Mock()
+        self.model.embed_query.side_effect = self.vector_for
+        self.model.embed_documents.side_effect = lambda texts: [self.vector_for(text) for text in texts]
+
+    @staticmethod
+    def vector_for(text):
+        return [len(text) / 10, 0.333, -0.5, 0.125]
+
+    def make_cache(self, **kwargs):
+        from .embedding_cache import QueryEmbeddingCache
+        return QueryEmbeddingCache(self.model, model_name='test-model', dims=4, **kwargs)
+
+    def test_single_miss_uses_embed_query(self):
+        cache = self.make_cache()
+        self.assertEqual(cache.embed_query('续航怎么样'), self.vector_for('续航怎么样'))
+        self.model.embed_query.assert_called_once_with('续航怎么样')
+        self.model.embed_documents.assert_not_called()
+
+        # 规范化后相同的问题命中进程内缓存
+        cache.embed_query(' 续航怎么样 ')
+        self.assertEqual(self.model.embed_query.call_count, 1)
+        self.assertEqual(cache.stats()['process']['local_hits'], 1)
+
+    def test_multiple_misses_are_batched_into_one_embed_documents_call(self):
+        cache = self.make_cache()
+        cache.embed_query('续航怎么样')
+        vectors = cache.embed_queries(['续航怎么样', '拍照好吗', '屏幕多大', '拍照好吗'])
+        self.assertEqual(vectors[1], vectors[3])
+        self.model.embed_documents.assert_called_once_with(['拍照好吗', '屏幕多大'])
+        self.assertEqual(self.model.embed_query.call_count, 1)
+
+    def test_redis_round_trip_stores_float16(self):
+        self.make_cache().embed_query('续航怎么样')
+        [data] = self.client.data.values()
+        self.assertEqual(len(data), 4 * 2)
+
+        # 另一个进程（空的进程内缓存）从Redis读取，float16 精度损失在千分之一以内
+        other = self.make_cache()
+        vector = other.embed_query('续航怎么样')
+        self.assertEqual(self.model.embed_query.call_count, 1)
+        for actual, expected in zip(vector, self.vector_for('续航怎么样')):
+            self.assertAlmostEqual(actual, expected, delta=1e-3)
+        self.assertEqual(other.stats()['process']['redis_hits'], 1)
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = self.make_cache(max_size=2)
+        cache.embed_query('问题一')
+        cache.embed_query('问题二')
+        cache.embed_query('问题一')
+        cache.embed_query('问题三')
+
+        from .embedding_cache import normalize_question
+
+        keys = [cache._key(normalize_question(question)) for question in ('问题一', '问题二', '问题三')]
+        self.assertEqual(list(cache._local), [keys[0], keys[2]])
+        self.assertEqual(cache.stats()['local_size'], 2)
+
+        # 被淘汰的问题从Redis读回，不重新调用嵌入接口
+        cache.embed_query('问题二')
+        self.assertEqual(self.model.embed_query.call_count, 3)
+        self.assertEqual(list(cache._local), [keys[2], keys[1]])
+
+    def test_async_path_keeps_redis_off_the_event_loop(self):
+        import threading
+
+        threads = []
+        for name in ('mget', 'setex'):
+            original = getattr(self.client, name)
+            patcher = mock.patch.object(
+                self.client, name,
+                side_effect=lambda *args, _original=original: threads.append(threading.get_ident()) or _original(*args)
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.model.aembed_query = mock.AsyncMock(side_effect=self.vector_for)
+        cache = self.make_cache()
+
+        async def ask():
+            loop_thread = threading.get_ident()
+            first = await cache.aembed_query('续航怎么样')
+            second = await cache.aembed_query(' 续航怎么样 ')
+            return loop_thread, first, second
+
+        loop_thread, first, second = asyncio.run(ask())
+        self.assertEqual(first, second)
+        self.model.aembed_query.assert_awaited_once_with('续航怎么样')
+        # 一次MGET、一次SETEX，都不在事件循环线程中执行；第二次命中进程内缓存，不访问Redis
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(loop_thread, threads)
+
+    def test_redis_failure_falls_back_to_model(self):
+        cache = self.make_cache()
+        with mock.patch.object(self.client, 'mget', side_effect=ConnectionError('Redis不可用')):
+            self.assertEqual(cache.embed_query('续航怎么样'), self.vector_for('续航怎么样'))
+        self.model.embed_query.assert_called_once_with('续航怎么样')
+
+
+class _StubConnection:
+    """不访问网络的Redis连接，fail 为真时建立连接失败"""
+
+    fail = False
+
+    def __init__(self, **kwargs):
+        import os
+        self.pid = os.getpid()
+        self.kwargs = kwargs
+
+    def connect(self):
+        if self.fail:
+            from redis.exceptions import ConnectionError
+            raise ConnectionError('Connection refused')
+
+    def can_read(self):
+        return False
+
+    def disconnect(self):
+        pass
+
+
+class RedisPoolTests(SimpleTestCase):
+    """共享连接池与取连接统计"""
+
+    def setUp(self):
+        import weakref
+        import redis_pool
+        self.redis_pool = redis_pool
+        for patcher in (
+            mock.patch.object(redis_pool, '_pools', {}),
+            mock.patch.object(redis_pool, '_clients', {}),
+            mock.patch.object(redis_pool, '_async_clients', weakref.WeakKeyDictionary()),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_pool(self, connection_class=_StubConnection):
+        return self.redis_pool.InstrumentedBlockingConnectionPool(
+            max_connections=1, timeout=0.05, connection_class=connection_class
+        )
+
+    def test_clients_share_pool_per_db_and_decoding(self):
+        from config import REDIS_CONFIG
+
+        client = self.redis_pool.get_redis_client(3)
+        self.assertIs(self.redis_pool.get_redis_client(3), client)
+        self.assertIsNot(self.redis_pool.get_redis_client(3, decode_responses=False), client)
+        self.assertEqual(sorted(self.redis_pool._pools), [(3, False), (3, True)])
+
+        pool = client.connection_pool
+        self.assertEqual(pool.max_connections, REDIS_CONFIG['pool']['max_connections'])
+        self.assertEqual(pool.timeout, REDIS_CONFIG['pool']['pool_timeout'])
+        self.assertEqual(pool.connection_kwargs['db'], 3)
+        self.assertEqual(pool.connection_kwargs['socket_timeout'], REDIS_CONFIG['pool']['socket_timeout'])
+        self.assertTrue(pool.connection_kwargs['decode_responses'])
+
+    def test_exhausted_pool_times_out_and_is_counted(self):
+        pool = self.make_pool()
+        connection = pool.get_connection('GET')
+        self.assertEqual(pool.usage(), {'created': 1, 'in_use': 1, 'idle': 0})
+
+        with self.assertRaisesMessage(Exception, self.redis_pool.POOL_EXHAUSTED_MESSAGE):
+            pool.get_connection('GET')
+        pool.release(connection)
+        self.assertEqual(pool.usage(), {'created': 1, 'in_use': 0, 'idle': 1})
+        self.assertIs(pool.get_connection('GET'), connection)
+
+        metrics = pool.metrics.snapshot()
+        self.assertEqual((metrics['acquired'], metrics['timeouts'], metrics['errors']), (2, 1, 0))
+        self.assertGreaterEqual(metrics['max_wait_ms'], 50)
+
+    def test_connection_errors_are_counted_separately(self):
+        class FailingConnection(_StubConnection):
+            fail = True
+
+        pool = self.make_pool(FailingConnection)
+        with self.assertRaisesMessage(Exception, 'Connection refused'):
+            pool.get_connection('GET')
+        metrics = pool.metrics.snapshot()
+        self.assertEqual((metrics['acquired'], metrics['timeouts'], metrics['errors']), (0, 0, 1))
+        # 失败的连接已放回连接池，不会占满连接数
+        self.assertEqual(pool.usage()['in_use'], 0)
+
+    def test_pool_stats_lists_sync_and_async_pools(self):
+        self.redis_pool.get_redis_client(5)
+
+        async def create_async_client():
+            client = self.redis_pool.get_async_redis_client(5)
+            self.assertIs(self.redis_pool.get_async_redis_client(5), client)
+            stats = self.redis_pool.pool_stats()
+            await client.aclose()
+            return client, stats
+
+        first, stats = asyncio.run(create_async_client())
+        second, _ = asyncio.run(create_async_client())
+        # 每个事件循环各自建池
+        self.assertIsNot(first, second)
+        self.assertEqual([(item['db'], item['async']) for item in stats], [(5, False), (5, True)])
+        self.assertEqual(stats[0]['acquired'], 0)
+        self.assertEqual(stats[0]['created'], 0)
+
+
+class _RecordingPipelineClient:
+    """记录pipeline中全部命令的Redis替身，execute 不返回结果"""
+
+    def __init__(self):
+        self.commands = []
+
+    def pipeline(self, transaction=True):
+        client = self
+
+        class Pipeline:
+            def __getattr__(self, name):
+                def command(*args, **kwargs):
+                    client.commands.append((name, args))
+                    return self
+                return command
+
+            def execute(self):
+                return []
+
+        return Pipeline()
+
+
+class RAGBatchQuestionViewTests(SimpleTestCase):
+    """批量问答：空问题、失败与成功混合，同一毫秒内保存的对话互不覆盖"""
+
+    def test_mixed_results_save_each_successful_conversation(self):
+        from rest_framework.test import APIRequestFactory
+        from .views import RAGBatchQuestionView
+
+        rag = mock.Mock()
+        rag.ask_questions.return_value = [
+            {'success': True, 'answer': '续航一整天', 'sources': [{'id': 'k1'}]},
+            {'success': False, 'answer': '生成回答失败', 'sources': [{'id': 'k2'}]},
+            {'success': True, 'answer': '6.7英寸', 'sources': []},
+        ]
+        client = _RecordingPipelineClient()
+        request = APIRequestFactory().post('/rag/batch/', {
+            'questions': ['续航怎么样', '  ', '拍照好吗', '屏幕多大'], 'session_id': 's1'
+        }, format='json')
+        with mock.patch('rag.views.get_current_rag_system', return_value=(rag, 'chromadb')), \
+                mock.patch('rag.redis.redis_client', client), \
+                mock.patch('redis_indexed_list.time.time', return_value=1700000000.123):
+            response = RAGBatchQuestionView.as_view()(request)
+
+        rag.ask_questions.assert_called_once()
+        self.assertEqual(rag.ask_questions.call_args[0][0], ['续航怎么样', '拍照好吗', '屏幕多大'])
+        data = response.data['data']
+        self.assertEqual(response.data['code'], 207)
+        self.assertEqual(data['success_count'], 2)
+        self.assertEqual([item['success'] for item in data['results']], [True, False, False, True])
+        self.assertEqual(data['results'][1]['answer'], '问题不能为空')
+        self.assertEqual(data['results'][2]['sources'], [])
+        self.assertNotIn('conversation_id', data['results'][2])
+
+        # 两条对话在同一毫秒内保存，ID和详情键各不相同
+        conversation_ids = [data['results'][0]['conversation_id'], data['results'][3]['conversation_id']]
+        self.assertEqual(len(set(conversation_ids)), 2)
+        detail_keys = [args[0] for name, args in client.commands if name == 'setex']
+        self.assertEqual(detail_keys, [f"conversation_detail:{cid}" for cid in conversation_ids])
+
+
+def _to_bytes(value):
+    return value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+
+class _StubBinaryRedis:
+    """decode_responses=False 的内存Redis，只实现问题聚类用到的 STRING/HASH/ZSET 命令"""
+
+    def __init__(self):
+        self.strings = {}
+        self.hashes = {}
+        self.zsets = {}
+
+    def pipeline(self, transaction=True):
+        stub = self
+        commands = []
+
+        class Pipeline:
+            def __getattr__(self, name):
+                return lambda *args, **kwargs: commands.append((getattr(stub, name), args, kwargs))
+
+            def execute(self):
+                return [command(*args, **kwargs) for command, args, kwargs in commands]
+
+        return Pipeline()
+
+    def get(self, key):
+        return self.strings.get(key)
+
+    def set(self, key, value):
+        self.strings[key] = _to_bytes(value)
+
+    def incr(self, key):
+        value = int(self.strings.get(key) or 0) + 1
+        self.strings[key] = _to_bytes(value)
+        return value
+
+    def delete(self, *keys):
+        return sum(
+            any(store.pop(key, None) is not None for store in (self.strings, self.hashes, self.zsets))
+            for key in keys
+        )
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(_to_bytes(field))
+
+    def hkeys(self, key):
+        return list(self.hashes.get(key, {}))
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[_to_bytes(field)] = _to_bytes(value)
+
+    def zadd(self, key, mapping):
+        for member, score in mapping.items():
+            self.zsets.setdefault(key, {})[_to_bytes(member)] = score
+
+    def zincrby(self, key, amount, member):
+        zset = self.zsets.setdefault(key, {})
+        zset[_to_bytes(member)] = zset.get(_to_bytes(member), 0) + amount
+
+    def _ordered(self, key):
+        return sorted(self.zsets.get(key, {}).items(), key=lambda item: (item[1], item[0]))
+
+    def zremrangebyrank(self, key, start, end):
+        ordered = self._ordered(key)
+        end = len(ordered) + end if end < 0 else end
+        if end < start:
+            return
+        for member, _ in ordered[start:end + 1]:
+            del self.zsets[key][member]
+
+    def zrevrange(self, key, start, end):
+        members = [member for member, _ in reversed(self._ordered(key))]
+        return members[start:] if end == -1 else members[start:end + 1]
+
+
+class QuestionClustersTests(SimpleTestCase):
+    """问题聚类：阈值聚类、重建前后ID稳定、数量上限"""
+
+    def setUp(self):
+        from .question_clusters import QuestionClusters
+
+        self.clusters = QuestionClusters
+        self.client = _StubBinaryRedis()
+        for patcher in (
+            mock.patch('rag.question_clusters.redis_client', self.client),
+            mock.patch.dict(QuestionClusters.CONFIG, {
+                'assign_threshold': 0.9, 'min_similarity': 0.5, 'refine_iterations': 1,
+                'max_phrasings': 5, 'max_clusters': 100
+            }),
+            mock.patch.object(QuestionClusters, '_cache', {
+                'expires_at': 0, 'ids': [], 'matrix': None, 'canonical': {}, 'counts': {}
+            }),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def canonical_ids(self):
+        table = self.clusters._load_table(force=True)
+        return {question: cluster_id for cluster_id, question in table['canonical'].items()}
+
+    def test_cluster_groups_vectors_by_threshold(self):
+        labels = self.clusters.cluster([[1.0, 0.0], [0.99, 0.05], [0.0, 1.0], [0.05, 0.99]], threshold=0.9)
+        self.assertEqual(labels[0], labels[1])
+        self.assertEqual(labels[2], labels[3])
+        self.assertNotEqual(labels[0], labels[2])
+
+    def test_rebuild_keeps_ids_for_the_same_intents(self):
+        questions = ['续航怎么样', '续航怎么样', '拍照好吗']
+        vectors = [[1.0, 0.0], [0.99, 0.05], [0.0, 1.0]]
+        self.assertEqual(self.clusters.rebuild(questions, vectors), 2)
+        before = self.canonical_ids()
+
+        # 输入顺序变化、新增意图后重建：原有意图沿用旧ID，新意图分配新ID，ID不复用
+        self.assertEqual(self.clusters.rebuild(
+            ['屏幕多大', '拍照好吗', '续航怎么样', '续航怎么样'],
+            [[-1.0, 0.0], [0.0, 1.0], [1.0, 0.0], [0.98, 0.1]]
+        ), 3)
+        after = self.canonical_ids()
+        self.assertEqual(after['续航怎么样'], before['续航怎么样'])
+        self.assertEqual(after['拍照好吗'], before['拍照好吗'])
+        self.assertEqual(after['屏幕多大'], max(before.values()) + 1)
+
+    def test_rebuild_keeps_largest_clusters_within_cap(self):
+        self.clusters.CONFIG['max_clusters'] = 2
+        self.clusters.rebuild(
+            ['续航怎么样', '续航怎么样', '续航怎么样', '拍照好吗', '拍照好吗', '屏幕多大'],
+            [[1.0, 0.0]] * 3 + [[0.0, 1.0]] * 2 + [[-1.0, 0.0]]
+        )
+        self.assertEqual(set(self.canonical_ids()), {'续航怎么样', '拍照好吗'})
+
+    def test_add_question_joins_nearest_cluster_and_updates_local_table(self):
+        first = self.clusters.add_question('续航怎么样', [1.0, 0.0])
+        self.assertEqual(self.clusters.add_question('续航如何', [0.99, 0.05]), first)
+        other = self.clusters.add_question('拍照好吗', [0.0, 1.0])
+        self.assertNotEqual(other, first)
+
+        table = self.clusters._cache
+        self.assertEqual(table['ids'], [first, other])
+        self.assertEqual(table['counts'][first], 2)
+        self.assertEqual(self.clusters.similar([1.0, 0.0], limit=1)[0]['cluster_id'], first)
+
+    def test_add_question_stops_creating_clusters_at_cap(self):
+        self.clusters.CONFIG['max_clusters'] = 2
+        first = self.clusters.add_question('续航怎么样', [1.0, 0.0])
+        second = self.clusters.add_question('拍照好吗', [0.0, 1.0])
+
+        # 达到上限后新意图不再新建聚类，也不挤掉已有聚类
+        self.assertIsNone(self.clusters.add_question('屏幕多大', [-1.0, 0.0]))
+        self.assertIsNone(self.clusters.add_question('重量多少', [0.0, -1.0]))
+        self.assertEqual(self.clusters._cache['ids'], [first, second])
+        self.assertEqual(sorted(int(cid) for cid in self.client.hkeys(self.clusters.VECTORS_KEY)), [first, second])
+        self.assertEqual(self.clusters.add_question('续航如何', [0.99, 0.05]), first)
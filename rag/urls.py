@@ -1,12 +1,16 @@
 from django.urls import path
 from .views import (
     RAGQuestionView,
+    RAGBatchQuestionView,
+    AsyncRAGQuestionView,
     RAGInitializeView,
     KnowledgeSearchView,
     ProductKnowledgeView,
     SimilarQuestionsView,
     ConversationHistoryView,
     PopularQuestionsView,
+    EmbeddingCacheStatsView,
+    RedisPoolStatsView,
     ElasticsearchIndexView
 )
 
@@ -15,6 +19,8 @@ app_name = 'rag'
 urlpatterns = [
     # RAG问答
     path('question/', RAGQuestionView.as_view(), name='rag_question'),
+    path('question/batch/', RAGBatchQuestionView.as_view(), name='rag_question_batch'),
+    path('question/async/', AsyncRAGQuestionView.as_view(), name='rag_question_async'),
     
     # RAG系统初始化
     path('initialize/', RAGInitializeView.as_view(), name='rag_initialize'),
@@ -35,6 +41,12 @@ urlpatterns = [
     # 热门问题
     path('popular-questions/', PopularQuestionsView.as_view(), name='popular_questions'),
     
+    # 问题向量缓存命中统计
+    path('embedding-cache/stats/', EmbeddingCacheStatsView.as_view(), name='embedding_cache_stats'),
+    
+    # Redis连接池统计
+    path('redis/pool-stats/', RedisPoolStatsView.as_view(), name='redis_pool_stats'),
+    
     # Elasticsearch索引管理
     path('elasticsearch/index/', ElasticsearchIndexView.as_view(), name='elasticsearch_index'),
 ]
\ No newline at end of file
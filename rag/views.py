@@ -1,13 +1,22 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from .RAG封装 import rag_system
 from .elasticsearch_rag import elasticsearch_rag_system
 from .elasticsearch_service import es_service
+from .elasticsearch_async_service import async_es_service
+from .conversation_partitions import ConversationPartitions
 from .models import ProductKnowledge
-from .redis import RAGConversationCache
+from .redis import RAGAnswerCache, RAGConversationCache
 from product.models import Products
-from config import SYSTEM_CONFIG
+from config import RAG_CONFIG, SYSTEM_CONFIG
+from redis_pool import pool_stats
 import json
 import uuid
 
@@ -44,20 +53,23 @@ class RAGQuestionView(APIView):
             # 获取当前RAG系统
             current_rag_system, rag_type = get_current_rag_system()
             
-            # 使用RAG系统获取答案
-            result = current_rag_system.ask_question(question, return_source=True)
+            # 热门问题优先使用预热的答案，否则使用RAG系统获取答案
+            result = RAGAnswerCache.get_answer(question, rag_type)
+            if result is None:
+                result = current_rag_system.ask_question(question, return_source=True)
             
             if result['success']:
                 # 生成对话ID
                 conversation_id = str(uuid.uuid4())
                 
-                # 保存对话记录到Redis
+                # 保存对话记录到Redis（ES后端下热门问题按问题聚类统计）
                 redis_conversation_id = RAGConversationCache.save_conversation(
                     user_id=user_id if user_id else None,
                     question=question,
                     answer=result['answer'],
                     sources=result['sources'],
-                    session_id=session_id if session_id else None
+                    session_id=session_id if session_id else None,
+                    cluster_id=elasticsearch_rag_system.question_cluster_id(question) if rag_type == 'elasticsearch' else None
                 )
                 
                 # 如果使用ES，同时保存到ES中
@@ -112,6 +124,210 @@ class RAGQuestionView(APIView):
                 'data': None
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class RAGBatchQuestionView(APIView):
+    """RAG批量问答API
+    
+    请求: {"questions": ["问题1", "问题2", ...], "user_id": "", "session_id": ""}
+    全部问题一次向量化、一次批量检索，大模型生成有限并发；每个问题单独返回 success。
+    提供 user_id 或 session_id 时才保存对话记录。
+    """
+    
+    def post(self, request):
+        """批量处理用户问题"""
+        try:
+            data = request.data
+            questions = data.get('questions') or []
+            user_id = data.get('user_id', '')
+            session_id = data.get('session_id', '')
+            
+            if not isinstance(questions, list) or not questions:
+                return Response({
+                    'code': 400,
+                    'message': 'questions 必须是非空列表',
+                    'data': None
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            max_questions = RAG_CONFIG['batch_max_questions']
+            if len(questions) > max_questions:
+                return Response({
+                    'code': 400,
+                    'message': f'单次最多 {max_questions} 个问题',
+                    'data': None
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            questions = [str(question).strip() for question in questions]
+            valid_questions = [question for question in questions if question]
+            
+            current_rag_system, rag_type = get_current_rag_system()
+            answers = current_rag_system.ask_questions(
+                valid_questions,
+                return_source=True,
+                max_concurrency=RAG_CONFIG['batch_max_concurrency']
+            ) if valid_questions else []
+            answer_iter = iter(answers)
+            
+            results = []
+            for question in questions:
+                if not question:
+                    results.append({
+                        'question': question,
+                        'success': False,
+                        'answer': '问题不能为空',
+                        'sources': []
+                    })
+                    continue
+                
+                result = next(answer_iter)
+                item = {
+                    'question': question,
+                    'success': result['success'],
+                    'answer': result['answer'],
+                    'sources': result['sources'] if result['success'] else []
+                }
+                
+                if result['success'] and (user_id or session_id):
+                    item['conversation_id'] = RAGConversationCache.save_conversation(
+                        user_id=user_id if user_id else None,
+                        question=question,
+                        answer=result['answer'],
+                        sources=result['sources'],
+                        session_id=session_id if session_id else None,
+                        cluster_id=elasticsearch_rag_system.question_cluster_id(question) if rag_type == 'elasticsearch' else None
+                    )
+                    if rag_type == 'elasticsearch':
+                        elasticsearch_rag_system.index_conversation(
+                            conversation_id=str(uuid.uuid4()),
+                            user_id=user_id or session_id,
+                            question=question,
+                            answer=result['answer'],
+                            sources=result['sources'],
+                            session_id=session_id
+                        )
+                results.append(item)
+            
+            success_count = sum(1 for item in results if item['success'])
+            return Response({
+                'code': 200 if success_count == len(results) else 207,
+                'message': f'批量问答完成: 成功 {success_count}/{len(results)}',
+                'data': {
+                    'results': results,
+                    'total': len(results),
+                    'success_count': success_count,
+                    'rag_type': rag_type
+                }
+            })
+            
+        except Exception as e:
+            return Response({
+                'code': 500,
+                'message': f'服务器错误: {str(e)}',
+                'data': None
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncRAGQuestionView(View):
+    """RAG问答API（异步）
+    
+    ES后端下问题向量化与全文检索并发执行，等待ES和大模型响应时不占用工作线程；
+    请求/响应格式与 RAGQuestionView 相同。需要在ASGI服务器下部署才能发挥作用。
+    """
+    
+    async def post(self, request):
+        """处理用户问题"""
+        try:
+            return await self.answer(request)
+        finally:
+            # WSGI下每个异步视图请求运行在新的事件循环中，请求结束时关闭该循环的客户端，避免连接泄漏；
+            # ASGI下事件循环长期存在，客户端在请求之间复用
+            if not isinstance(request, ASGIRequest):
+                await async_es_service.close()
+    
+    async def answer(self, request):
+        """问答处理，请求结束后的客户端清理由 post 负责"""
+        try:
+            data = json.loads(request.body or b'{}')
+            question = data.get('question', '').strip()
+            user_id = data.get('user_id', '')
+            session_id = data.get('session_id', '')
+            
+            if not question:
+                return JsonResponse({
+                    'code': 400,
+                    'message': '问题不能为空',
+                    'data': None
+                }, status=400)
+            
+            # 使用同步服务启动时探测的可用状态，不在每个请求上ping ES
+            use_elasticsearch = SYSTEM_CONFIG.get('use_elasticsearch', True)
+            if use_elasticsearch and es_service.enabled:
+                rag_type = 'elasticsearch'
+            else:
+                rag_type = 'chromadb'
+            
+            # 热门问题优先使用预热的答案
+            result = await sync_to_async(RAGAnswerCache.get_answer)(question, rag_type)
+            if result is None and rag_type == 'elasticsearch':
+                result = await elasticsearch_rag_system.aask_question(question, return_source=True)
+            elif result is None:
+                result = await sync_to_async(rag_system.ask_question)(question, return_source=True)
+            
+            cluster_id = None
+            if result['success'] and rag_type == 'elasticsearch':
+                cluster_id = await sync_to_async(elasticsearch_rag_system.question_cluster_id)(question)
+            
+            sources = result['sources'] if result['success'] else []
+            redis_conversation_id = await sync_to_async(RAGConversationCache.save_conversation)(
+                user_id=user_id if user_id else None,
+                question=question,
+                answer=result['answer'],
+                sources=sources,
+                session_id=session_id if session_id else None,
+                cluster_id=cluster_id
+            )
+            
+            if not result['success']:
+                return JsonResponse({
+                    'code': 500,
+                    'message': '问答处理失败',
+                    'data': {
+                        'conversation_id': redis_conversation_id,
+                        'question': question,
+                        'answer': result['answer'],
+                        'sources': [],
+                        'rag_type': rag_type
+                    }
+                }, json_dumps_params={'ensure_ascii': False})
+            
+            if rag_type == 'elasticsearch':
+                await sync_to_async(elasticsearch_rag_system.index_conversation)(
+                    conversation_id=str(uuid.uuid4()),
+                    user_id=user_id or session_id or 'anonymous',
+                    question=question,
+                    answer=result['answer'],
+                    sources=sources,
+                    session_id=session_id
+                )
+            
+            return JsonResponse({
+                'code': 200,
+                'message': '问答成功',
+                'data': {
+                    'conversation_id': redis_conversation_id,
+                    'question': question,
+                    'answer': result['answer'],
+                    'sources': sources,
+                    'total_sources': len(sources),
+                    'rag_type': rag_type
+                }
+            }, json_dumps_params={'ensure_ascii': False})
+            
+        except Exception as e:
+            return JsonResponse({
+                'code': 500,
+                'message': f'服务器错误: {str(e)}',
+                'data': None
+            }, status=500, json_dumps_params={'ensure_ascii': False})
+
 class RAGInitializeView(APIView):
     """RAG系统初始化API"""
     
@@ -167,11 +383,17 @@ class KnowledgeSearchView(APIView):
     """知识库搜索API"""
     
     def get(self, request):
-        """搜索知识库内容"""
+        """搜索知识库内容
+        
+        ES后端返回分面（category/brand/attribute）和 next_cursor，
+        把 next_cursor 作为 cursor 参数传回即可获取下一页。
+        """
         try:
             query = request.GET.get('query', '').strip()
             category = request.GET.get('category', '')
             brand = request.GET.get('brand', '')
+            attribute = request.GET.get('attribute', '')
+            cursor = request.GET.get('cursor', '')  # 上一页返回的 next_cursor
             size = int(request.GET.get('size', 10))
             
             if not query:
@@ -184,13 +406,31 @@ class KnowledgeSearchView(APIView):
             # 获取当前RAG系统
             current_rag_system, rag_type = get_current_rag_system()
             
-            # 使用RAG系统搜索
-            results = current_rag_system.search_knowledge(
-                query=query,
-                filter_by_category=category if category else None,
-                filter_by_brand=brand if brand else None,
-                size=size
-            )
+            if rag_type == 'elasticsearch':
+                # ES：一次请求返回命中、总数和分面，通过游标翻页
+                page = elasticsearch_rag_system.search_knowledge_page(
+                    query=query,
+                    filter_by_category=category if category else None,
+                    filter_by_brand=brand if brand else None,
+                    filter_by_attribute=attribute if attribute else None,
+                    size=size,
+                    cursor=cursor if cursor else None
+                )
+                results = page['results']
+                total_count = page['total']
+                facets = page['facets']
+                next_cursor = page['next_cursor']
+            else:
+                # 使用RAG系统搜索
+                results = current_rag_system.search_knowledge(
+                    query=query,
+                    filter_by_category=category if category else None,
+                    filter_by_brand=brand if brand else None,
+                    size=size
+                )
+                total_count = len(results)
+                facets = {}
+                next_cursor = None
             
             return Response({
                 'code': 200,
@@ -199,10 +439,13 @@ class KnowledgeSearchView(APIView):
                     'query': query,
                     'filters': {
                         'category': category,
-                        'brand': brand
+                        'brand': brand,
+                        'attribute': attribute
                     },
                     'results': results,
-                    'total_count': len(results),
+                    'total_count': total_count,
+                    'facets': facets,
+                    'next_cursor': next_cursor,
                     'rag_type': rag_type
                 }
             })
@@ -353,11 +596,32 @@ class SimilarQuestionsView(APIView):
                     'data': None
                 }, status=status.HTTP_400_BAD_REQUEST)
             
+            # ES后端可通过 partitions 指定检索最近几个对话分区，0 表示全部
+            recent_partitions = None
+            if request.GET.get('partitions'):
+                try:
+                    recent_partitions = int(request.GET['partitions'])
+                except ValueError:
+                    recent_partitions = -1
+                if recent_partitions < 0:
+                    return Response({
+                        'code': 400,
+                        'message': 'partitions 必须是非负整数',
+                        'data': None
+                    }, status=status.HTTP_400_BAD_REQUEST)
+            
             # 获取当前RAG系统
             current_rag_system, rag_type = get_current_rag_system()
             
-            # 获取相似问题
-            similar_questions = current_rag_system.get_similar_questions(question, limit)
+            if rag_type == 'elasticsearch' and recent_partitions is not None:
+                partition_count = ConversationPartitions.partition_count()
+                if recent_partitions and partition_count:
+                    recent_partitions = min(recent_partitions, partition_count)
+                similar_questions = current_rag_system.get_similar_questions(
+                    question, limit, recent_partitions=recent_partitions
+                )
+            else:
+                similar_questions = current_rag_system.get_similar_questions(question, limit)
             
             return Response({
                 'code': 200,
@@ -553,6 +817,50 @@ class ConversationHistoryView(APIView):
                 'data': None
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+class EmbeddingCacheStatsView(APIView):
+    """问题向量缓存命中统计API"""
+    
+    def get(self, request):
+        """获取问题向量缓存的命中率（当前进程与全部进程累计）"""
+        try:
+            return Response({
+                'code': 200,
+                'message': '获取成功',
+                'data': elasticsearch_rag_system.query_embeddings.stats()
+            })
+            
+        except Exception as e:
+            return Response({
+                'code': 500,
+                'message': f'获取缓存统计失败: {str(e)}',
+                'data': None
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class RedisPoolStatsView(APIView):
+    """Redis连接池统计API"""
+    
+    def get(self, request):
+        """获取当前进程各Redis连接池的使用中/空闲连接数与取连接等待时间"""
+        try:
+            pools = pool_stats()
+            return Response({
+                'code': 200,
+                'message': '获取成功',
+                'data': {
+                    'pools': pools,
+                    'total_count': len(pools)
+                }
+            })
+            
+        except Exception as e:
+            return Response({
+                'code': 500,
+                'message': f'获取连接池统计失败: {str(e)}',
+                'data': None
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 class PopularQuestionsView(APIView):
     """热门问题API"""
     
@@ -0,0 +1,255 @@
+"""
+按记录ID寻址的用户列表
+用户的对话/推荐历史由两个键组成：
+- ZSET  列表键    成员为记录ID，分数为时间戳（按时间排序、截断）
+- HASH  摘要键    记录ID -> 摘要JSON（列表展示用）
+- HASH  统计键    摘要中数值字段（如问题/回答长度）在列表内全部记录上的累计值
+- ZSET  {词索引前缀}:{词}  倒排索引，成员为记录ID，分数为时间戳（只保留最近 max_items 条）
+- SET   {词索引前缀}       用户出现过的全部词，清空列表时据此删除倒排索引
+
+删除单条记录只需 ZREM + HDEL，清空列表时只读取ID、批量 UNLINK 详情键，都不需要解码列表内容。
+统计值在追加、截断和删除时由Lua脚本原子地增减，读取统计只需一次往返。
+搜索时把列表键与各搜索词的倒排索引求交集，已删除或被截断的记录不在列表键中，自然被排除，
+倒排索引因此不需要随删除同步清理；开销与匹配数量相关，与历史记录总数无关。
+旧版本把摘要JSON直接作为ZSET成员，读取时仍兼容，可用 migrate_user_lists 命令一次性迁移。
+"""
+import json
+import time
+import uuid
+from typing import Dict, List, Sequence, Tuple
+
+from text_normalizer import search_tokens
+
+# 按摘要JSON中的数值字段增减统计值；旧格式成员没有摘要，不参与统计
+_ADJUST_STATS = """
+local function adjust_stats(stats_key, summary, fields, sign)
+    if not summary then
+        return
+    end
+    local ok, data = pcall(cjson.decode, summary)
+    if not ok or type(data) ~= 'table' then
+        return
+    end
+    for _, field in ipairs(fields) do
+        local value = tonumber(data[field])
+        if value and value ~= 0 then
+            redis.call('HINCRBY', stats_key, field, sign * math.floor(value))
+        end
+    end
+end
+"""
+
+# 追加记录并截断到 max_items 条，被截掉的记录同时从摘要HASH和统计中扣除
+APPEND_SCRIPT = _ADJUST_STATS + """
+local list_key, summaries_key, stats_key = KEYS[1], KEYS[2], KEYS[3]
+local record_id, score, summary = ARGV[1], ARGV[2], ARGV[3]
+local max_items, ttl = tonumber(ARGV[4]), tonumber(ARGV[5])
+local fields = {unpack(ARGV, 6)}
+adjust_stats(stats_key, redis.call('HGET', summaries_key, record_id), fields, -1)
+redis.call('ZADD', list_key, score, record_id)
+redis.call('HSET', summaries_key, record_id, summary)
+adjust_stats(stats_key, summary, fields, 1)
+local overflow = redis.call('ZCARD', list_key) - max_items
+if overflow > 0 then
+    local expired = redis.call('ZRANGE', list_key, 0, overflow - 1)
+    local expired_summaries = redis.call('HMGET', summaries_key, unpack(expired))
+    for i = 1, #expired do
+        adjust_stats(stats_key, expired_summaries[i] or nil, fields, -1)
+    end
+    redis.call('ZREMRANGEBYRANK', list_key, 0, overflow - 1)
+    redis.call('HDEL', summaries_key, unpack(expired))
+end
+redis.call('EXPIRE', list_key, ttl)
+redis.call('EXPIRE', summaries_key, ttl)
+redis.call('EXPIRE', stats_key, ttl)
+return overflow
+"""
+
+# 删除一条记录并扣除其统计值
+REMOVE_SCRIPT = _ADJUST_STATS + """
+local list_key, summaries_key, stats_key = KEYS[1], KEYS[2], KEYS[3]
+local record_id = ARGV[1]
+local fields = {unpack(ARGV, 2)}
+if redis.call('ZREM', list_key, record_id) == 0 then
+    return 0
+end
+adjust_stats(stats_key, redis.call('HGET', summaries_key, record_id), fields, -1)
+redis.call('HDEL', summaries_key, record_id)
+return 1
+"""
+
+# 每条 UNLINK 命令携带的键数
+UNLINK_BATCH_SIZE = 500
+
+
+def new_record_id(prefix: str) -> str:
+    """生成记录ID：{前缀}_{毫秒时间戳}_{随机后缀}
+
+    ID同时是ZSET成员、摘要HASH字段和详情键的一部分，同一毫秒内保存的多条记录
+    （如批量问答）靠随机后缀区分，不会互相覆盖；时间戳前缀使同分数的成员仍大致按时间排序。
+    """
+    return f"{prefix}_{int(time.time() * 1000)}_{uuid.uuid4().hex[:12]}"
+
+
+def is_legacy_member(member: str) -> bool:
+    """旧格式成员（摘要JSON）"""
+    return member.startswith('{')
+
+
+def append(pipe, list_key: str, summaries_key: str, stats_key: str, record_id: str, summary: Dict,
+           score: int, max_items: int, ttl: int, stat_fields: Sequence[str] = ()):
+    """
+    在pipeline中追加一条记录
+
+    使用 EVAL 而不是 EVALSHA：脚本随命令发送，MULTI事务中不会因脚本未加载而部分失败，
+    也不需要额外的 SCRIPT EXISTS 往返。
+
+    Args:
+        stat_fields: 摘要中需要累计到统计键的数值字段
+    """
+    pipe.eval(
+        APPEND_SCRIPT, 3, list_key, summaries_key, stats_key,
+        record_id, score, json.dumps(summary, ensure_ascii=False), max_items, ttl, *stat_fields
+    )
+
+
+def read(client, list_key: str, summaries_key: str, limit: int) -> List[Dict]:
+    """按时间倒序读取最近 limit 条记录的摘要"""
+    members = client.zrevrange(list_key, 0, limit - 1)
+    if not members:
+        return []
+    summaries = client.hmget(summaries_key, members)
+
+    items = []
+    for member, summary in zip(members, summaries):
+        if summary is None and is_legacy_member(member):
+            summary = member
+        if summary is None:
+            continue
+        try:
+            items.append(json.loads(summary))
+        except json.JSONDecodeError:
+            continue
+    return items
+
+
+def stats(client, list_key: str, stats_key: str, stat_fields: Sequence[str]) -> Tuple[int, Dict[str, int]]:
+    """一次往返读取记录总数和各统计字段的累计值"""
+    pipe = client.pipeline(transaction=False)
+    pipe.zcard(list_key)
+    pipe.hmget(stats_key, list(stat_fields))
+    total, values = pipe.execute()
+    return total, {field: int(value or 0) for field, value in zip(stat_fields, values)}
+
+
+def index_tokens(pipe, token_prefix: str, record_id: str, score: int, tokens: Sequence[str],
+                 max_items: int, ttl: int):
+    """在pipeline中把记录加入各搜索词的倒排索引"""
+    if not tokens:
+        return
+    for token in tokens:
+        token_key = f"{token_prefix}:{token}"
+        pipe.zadd(token_key, {record_id: score})
+        pipe.zremrangebyrank(token_key, 0, -(max_items + 1))
+        pipe.expire(token_key, ttl)
+    pipe.sadd(token_prefix, *tokens)
+    pipe.expire(token_prefix, ttl)
+
+
+def search(client, list_key: str, summaries_key: str, token_prefix: str, tokens: Sequence[str],
+           limit: int) -> List[Dict]:
+    """返回包含全部搜索词的记录摘要，按时间倒序
+
+    ZINTERSTORE 以列表键的分数（时间戳）为结果分数，搜索词索引权重为0。
+    """
+    if not tokens:
+        return []
+    result_key = f"{token_prefix}:__search__:{uuid.uuid4().hex}"
+    weights = {list_key: 1}
+    weights.update({f"{token_prefix}:{token}": 0 for token in tokens})
+
+    pipe = client.pipeline(transaction=True)
+    pipe.zinterstore(result_key, weights, aggregate='SUM')
+    pipe.zrevrange(result_key, 0, limit - 1)
+    pipe.unlink(result_key)
+    record_ids = pipe.execute()[1]
+    if not record_ids:
+        return []
+
+    items = []
+    for summary in client.hmget(summaries_key, record_ids):
+        if summary is None:
+            continue
+        try:
+            items.append(json.loads(summary))
+        except json.JSONDecodeError:
+            continue
+    return items
+
+
+def token_index_keys(client, token_prefix: str) -> List[str]:
+    """用户全部倒排索引键（含词集合键本身）"""
+    return [f"{token_prefix}:{token}" for token in client.smembers(token_prefix)] + [token_prefix]
+
+
+def remove(pipe, list_key: str, summaries_key: str, stats_key: str, record_id: str,
+           stat_fields: Sequence[str] = ()):
+    """在pipeline中删除一条记录，并扣除其统计值"""
+    pipe.eval(REMOVE_SCRIPT, 3, list_key, summaries_key, stats_key, record_id, *stat_fields)
+
+
+def unlink(pipe, keys: List[str]):
+    """在pipeline中批量 UNLINK 键，每条命令最多 UNLINK_BATCH_SIZE 个"""
+    for start in range(0, len(keys), UNLINK_BATCH_SIZE):
+        pipe.unlink(*keys[start:start + UNLINK_BATCH_SIZE])
+
+
+def member_ids(client, list_key: str) -> List[str]:
+    """列表中全部新格式记录的ID（旧格式成员不解码，随列表一起删除）"""
+    return [member for member in client.zrange(list_key, 0, -1) if not is_legacy_member(member)]
+
+
+def migrate(client, list_key: str, summaries_key: str, id_field: str, token_prefix: str = None,
+            text_field: str = None, max_items: int = None, default_ttl: int = None) -> int:
+    """把旧格式成员转换为 ID + 摘要HASH，返回迁移的条数
+
+    旧格式成员不在倒排索引中，迁移前搜索不到；提供 token_prefix 和 text_field 时，
+    迁移的记录按摘要中该字段的文本分词后加入倒排索引（分数沿用原时间戳）。
+
+    Args:
+        max_items: 每个词索引保留的记录数，与追加记录时一致
+        default_ttl: 列表键没有过期时间时，倒排索引使用的过期秒数
+    """
+    legacy = [
+        (member, score)
+        for member, score in client.zrange(list_key, 0, -1, withscores=True)
+        if is_legacy_member(member)
+    ]
+    if not legacy:
+        return 0
+
+    ttl = client.ttl(list_key)
+    pipe = client.pipeline(transaction=True)
+    migrated = 0
+    index_ttl = ttl if ttl > 0 else default_ttl
+    for member, score in legacy:
+        try:
+            summary = json.loads(member)
+        except json.JSONDecodeError:
+            summary = {}
+        record_id = summary.get(id_field) if isinstance(summary, dict) else None
+        pipe.zrem(list_key, member)
+        if record_id:
+            pipe.zadd(list_key, {record_id: score})
+            pipe.hset(summaries_key, record_id, member)
+            if token_prefix and text_field and index_ttl:
+                index_tokens(
+                    pipe, token_prefix, record_id, score, search_tokens(str(summary.get(text_field) or '')),
+                    max_items, index_ttl
+                )
+            migrated += 1
+    if ttl > 0:
+        pipe.expire(list_key, ttl)
+        pipe.expire(summaries_key, ttl)
+    pipe.execute()
+    return migrated
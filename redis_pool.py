@@ -0,0 +1,200 @@
+"""
+Redis连接池
+各缓存模块通过 get_redis_client(db) 获取客户端，同一逻辑库（及响应解码方式）共享一个连接池，
+统一使用 REDIS_CONFIG['pool'] 中的超时、健康检查、最大连接数和重试退避配置，
+Redis变慢或不可用时请求线程最多等待配置的超时时间，不会无限期挂起。
+
+异步代码使用 get_async_redis_client(db)，基于 redis.asyncio，按事件循环分别建池。
+"""
+import asyncio
+import threading
+import time
+import weakref
+from typing import Dict, List
+
+import redis
+import redis.asyncio as aioredis
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from redis.retry import Retry
+
+from config import REDIS_CONFIG
+
+# redis-py 在阻塞连接池等待超时时抛出的 ConnectionError 信息
+POOL_EXHAUSTED_MESSAGE = "No connection available."
+
+
+class _PoolMetrics:
+    """连接池取连接的等待统计"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.acquired = 0
+        self.timeouts = 0  # 连接池用尽、等待超时
+        self.errors = 0  # 建立连接失败
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait_seconds: float, error: Exception = None):
+        with self.lock:
+            if error is None:
+                self.acquired += 1
+            elif str(error) == POOL_EXHAUSTED_MESSAGE:
+                self.timeouts += 1
+            else:
+                self.errors += 1
+            self.total_wait += wait_seconds
+            self.max_wait = max(self.max_wait, wait_seconds)
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            attempts = self.acquired + self.timeouts + self.errors
+            return {
+                'acquired': self.acquired,
+                'timeouts': self.timeouts,
+                'errors': self.errors,
+                'avg_wait_ms': round(self.total_wait / attempts * 1000, 3) if attempts else 0.0,
+                'max_wait_ms': round(self.max_wait * 1000, 3)
+            }
+
+
+class InstrumentedBlockingConnectionPool(redis.BlockingConnectionPool):
+    """记录取连接等待时间的阻塞连接池
+
+    连接用尽时等待至多 timeout 秒，而不是立即报错或无限增长。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = _PoolMetrics()
+
+    def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+        except ConnectionError as e:
+            self.metrics.record(time.perf_counter() - start, error=e)
+            raise
+        self.metrics.record(time.perf_counter() - start)
+        return connection
+
+    def usage(self) -> Dict:
+        """已创建/使用中/空闲连接数"""
+        created = len(self._connections)
+        idle = sum(1 for connection in list(self.pool.queue) if connection is not None)
+        return {'created': created, 'in_use': created - idle, 'idle': idle}
+
+
+class InstrumentedAsyncBlockingConnectionPool(aioredis.BlockingConnectionPool):
+    """记录取连接等待时间的异步阻塞连接池"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = _PoolMetrics()
+
+    async def get_connection(self, command_name, *keys, **options):
+        start = time.perf_counter()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except ConnectionError as e:
+            self.metrics.record(time.perf_counter() - start, error=e)
+            raise
+        self.metrics.record(time.perf_counter() - start)
+        return connection
+
+    def usage(self) -> Dict:
+        in_use = len(self._in_use_connections)
+        idle = len(self._available_connections)
+        return {'created': in_use + idle, 'in_use': in_use, 'idle': idle}
+
+
+def _connection_kwargs(db: int, decode_responses: bool, retry_class) -> Dict:
+    pool_config = REDIS_CONFIG['pool']
+    return {
+        'host': REDIS_CONFIG['host'],
+        'port': REDIS_CONFIG['port'],
+        'password': REDIS_CONFIG.get('password'),
+        'db': db,
+        'decode_responses': decode_responses,
+        'socket_timeout': pool_config['socket_timeout'],
+        'socket_connect_timeout': pool_config['socket_connect_timeout'],
+        'socket_keepalive': True,
+        'health_check_interval': pool_config['health_check_interval'],
+        # 连接错误与超时按指数退避重试，重试耗尽后抛出异常，由调用方按各自方式降级
+        'retry': retry_class(
+            ExponentialBackoff(cap=pool_config['backoff_cap'], base=pool_config['backoff_base']),
+            pool_config['retries']
+        ),
+        'retry_on_error': [ConnectionError, TimeoutError],
+    }
+
+
+_pools = {}
+_clients = {}
+_lock = threading.Lock()
+
+# 事件循环 -> {(db, decode_responses): 客户端}；事件循环结束后对应条目自动释放
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis_client(db: int, decode_responses: bool = True) -> redis.Redis:
+    """获取指定逻辑库的客户端，同一 (db, decode_responses) 共享连接池"""
+    key = (db, decode_responses)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        if key not in _clients:
+            pool_config = REDIS_CONFIG['pool']
+            pool = InstrumentedBlockingConnectionPool(
+                max_connections=pool_config['max_connections'],
+                timeout=pool_config['pool_timeout'],
+                **_connection_kwargs(db, decode_responses, Retry)
+            )
+            _pools[key] = pool
+            _clients[key] = redis.Redis(connection_pool=pool)
+        return _clients[key]
+
+
+def get_async_redis_client(db: int, decode_responses: bool = True) -> aioredis.Redis:
+    """获取当前事件循环中指定逻辑库的异步客户端（须在协程中调用）"""
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    key = (db, decode_responses)
+    if key not in clients:
+        pool_config = REDIS_CONFIG['pool']
+        pool = InstrumentedAsyncBlockingConnectionPool(
+            max_connections=pool_config['max_connections'],
+            timeout=pool_config['pool_timeout'],
+            **_connection_kwargs(db, decode_responses, AsyncRetry)
+        )
+        clients[key] = aioredis.Redis(connection_pool=pool)
+    return clients[key]
+
+
+def pool_stats() -> List[Dict]:
+    """当前进程内各连接池的使用情况与取连接等待统计"""
+    stats = []
+    for (db, decode_responses), pool in list(_pools.items()):
+        stats.append({
+            'db': db,
+            'decode_responses': decode_responses,
+            'async': False,
+            'max_connections': pool.max_connections,
+            **pool.usage(),
+            **pool.metrics.snapshot()
+        })
+    for clients in list(_async_clients.values()):
+        for (db, decode_responses), client in list(clients.items()):
+            pool = client.connection_pool
+            stats.append({
+                'db': db,
+                'decode_responses': decode_responses,
+                'async': True,
+                'max_connections': pool.max_connections,
+                **pool.usage(),
+                **pool.metrics.snapshot()
+            })
+    return stats
@@ -0,0 +1,94 @@
+"""
+问题/需求文本规范化
+- normalize_text：全角转半角（NFKC）、小写、合并空白，用于缓存键等需要保留原意的场景
+- popularity_key：在 normalize_text 基础上去掉标点符号，jieba 分词后去掉停用词，
+  只用于热门统计，使仅在标点、全半角、语气词上不同的问法计为同一个问题；
+  该键有损且随是否安装 jieba 变化，不能用作答案等需要精确匹配的缓存键
+- search_tokens：搜索引擎模式分词后去掉停用词，用于对话/推荐记录的倒排索引
+
+jieba 未安装时，popularity_key 退化为去掉标点和空白后的整句文本，search_tokens 对中文使用二元组切分。
+"""
+import logging
+import re
+import unicodedata
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+try:
+    import jieba
+    jieba.setLogLevel(logging.WARNING)
+except ImportError:
+    jieba = None
+
+# 不影响问题意图的虚词、代词和语气词（为什么、多少、如何等疑问词决定问题意图，不在其中）
+STOPWORDS = frozenset({
+    '的', '了', '吗', '呢', '啊', '吧', '呀', '嘛', '哦', '么', '着', '过', '得', '地',
+    '是', '有', '在', '和', '与', '及', '或', '也', '都', '就', '还', '又', '很', '太', '更',
+    '我', '你', '您', '他', '她', '它', '我们', '你们', '他们', '这', '那', '这个', '那个',
+    '这款', '那款', '这种', '那种', '一个', '一款', '一下', '请问', '请', '想', '想要', '想问',
+    '能', '能不能', '可以', '可不可以', '会', '要', '需要', '呃', '嗯',
+    'a', 'an', 'the', 'is', 'are', 'of', 'to', 'and', 'or', 'please',
+})
+
+# 最长键长度，防止超长问题占用过多内存
+MAX_KEY_LENGTH = 100
+
+# 每条文本最多产生的搜索词数量
+MAX_SEARCH_TOKENS = 32
+
+_CJK_OR_WORD = re.compile(r'[\u4e00-\u9fff]+|[^\s\u4e00-\u9fff]+')
+
+
+def normalize_text(text: str) -> str:
+    """全角转半角、去首尾空白、合并空白、小写"""
+    text = unicodedata.normalize('NFKC', text or '')
+    return re.sub(r'\s+', ' ', text).strip().lower()
+
+
+def strip_punctuation(text: str) -> str:
+    """把标点和符号替换为空格"""
+    return ''.join(
+        ' ' if unicodedata.category(char)[0] in ('P', 'S') else char
+        for char in text
+    )
+
+
+def tokenize(text: str):
+    """分词（不含空白）；jieba 未安装时按空白切分"""
+    if jieba is None:
+        return text.split()
+    return [token for token in jieba.lcut(text) if token.strip()]
+
+
+def popularity_key(text: str) -> str:
+    """热门统计用的问题键：规范化、去标点、分词并去掉停用词"""
+    normalized = strip_punctuation(normalize_text(text))
+    if jieba is None:
+        key = re.sub(r'\s+', '', normalized)
+    else:
+        # 分词只用于去掉停用词，拼接时不加分隔符，避免分词差异（如 "iphone 15" / "iphone15"）产生不同的键
+        key = ''.join(token for token in tokenize(normalized) if token not in STOPWORDS)
+    # 全部是停用词时保留规范化后的原文
+    return (key or normalized.strip())[:MAX_KEY_LENGTH]
+
+
+def search_tokens(text: str) -> List[str]:
+    """倒排索引用的搜索词（去重、保持顺序），文档和查询使用同一切分方式"""
+    normalized = strip_punctuation(normalize_text(text))
+    if jieba is not None:
+        candidates = jieba.lcut_for_search(normalized)
+    else:
+        candidates = []
+        for run in _CJK_OR_WORD.findall(normalized):
+            if '\u4e00' <= run[0] <= '\u9fff' and len(run) > 1:
+                candidates.extend(run[i:i + 2] for i in range(len(run) - 1))
+            else:
+                candidates.append(run)
+
+    tokens = []
+    for token in candidates:
+        token = token.strip()
+        if token and token not in STOPWORDS and token not in tokens:
+            tokens.append(token)
+    return tokens[:MAX_SEARCH_TOKENS]
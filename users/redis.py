@@ -1,11 +1,12 @@
-import redis
 import json
 import time
 from django.conf import settings
 from datetime import datetime, timedelta
+from config import REDIS_CONFIG
+from redis_pool import get_redis_client
 
 # Redis连接
-redis_client = redis.Redis(host='localhost', port=6379, db=1, decode_responses=True)
+redis_client = get_redis_client(REDIS_CONFIG['users_db'])
 
 class UserBehaviorCache:
     """用户行为缓存管理类"""
@@ -30,21 +31,25 @@ class UserBehaviorCache:
                 'viewed_at': datetime.now().isoformat()
             }
             
+            # 浏览记录与行为统计的写入放在一个MULTI事务中，一次往返原子执行
+            pipe = redis_client.pipeline(transaction=True)
+            
             # 使用ZSET存储，时间戳作为分数，确保按时间排序
-            redis_client.zadd(
+            pipe.zadd(
                 key,
                 {json.dumps(behavior_data): behavior_data['timestamp']}
             )
             
             # 只保留最近的N条记录
-            redis_client.zremrangebyrank(key, 0, -(cls.MAX_RECENT_VIEWS + 1))
+            pipe.zremrangebyrank(key, 0, -(cls.MAX_RECENT_VIEWS + 1))
             
             # 设置过期时间：30天
-            redis_client.expire(key, 30 * 24 * 3600)
+            pipe.expire(key, 30 * 24 * 3600)
             
             # 更新用户行为统计
-            cls._update_behavior_stats(user_id, action_type)
+            cls._update_behavior_stats(user_id, action_type, pipe=pipe)
             
+            pipe.execute()
             return True
             
         except Exception as e:
@@ -75,21 +80,26 @@ class UserBehaviorCache:
             return []
     
     @classmethod
-    def _update_behavior_stats(cls, user_id, action_type):
-        """更新用户行为统计"""
+    def _update_behavior_stats(cls, user_id, action_type, pipe=None):
+        """更新用户行为统计，传入 pipe 时只追加命令、由调用方执行"""
         try:
             stats_key = f"{cls.USER_BEHAVIOR_STATS_PREFIX}{user_id}"
+            own_pipe = pipe is None
+            if own_pipe:
+                pipe = redis_client.pipeline(transaction=True)
             
             # 增加对应行为类型的计数
-            redis_client.hincrby(stats_key, f"total_{action_type}s", 1)
-            redis_client.hincrby(stats_key, "total_behaviors", 1)
+            pipe.hincrby(stats_key, f"total_{action_type}s", 1)
+            pipe.hincrby(stats_key, "total_behaviors", 1)
             
             # 更新最后活跃时间
-            redis_client.hset(stats_key, "last_active", datetime.now().isoformat())
+            pipe.hset(stats_key, "last_active", datetime.now().isoformat())
             
             # 设置过期时间：30天
-            redis_client.expire(stats_key, 30 * 24 * 3600)
+            pipe.expire(stats_key, 30 * 24 * 3600)
             
+            if own_pipe:
+                pipe.execute()
             return True
             
         except Exception as e: